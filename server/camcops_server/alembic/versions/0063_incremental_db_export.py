@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+
+"""
+camcops_server/alembic/versions/0063_incremental_db_export.py
+
+===============================================================================
+
+    Copyright (C) 2012-2020 Rudolf Cardinal (rudolf@pobox.com).
+
+    This file is part of CamCOPS.
+
+    CamCOPS is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    CamCOPS is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with CamCOPS. If not, see <http://www.gnu.org/licenses/>.
+
+===============================================================================
+
+DATABASE REVISION SCRIPT
+
+incremental_db_export
+
+Revision ID: 0063
+Revises: 0062
+Creation date: 2021-05-10 11:20:43.184027
+
+"""
+
+# =============================================================================
+# Imports
+# =============================================================================
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# =============================================================================
+# Revision identifiers, used by Alembic.
+# =============================================================================
+
+revision = '0063'
+down_revision = '0062'
+branch_labels = None
+depends_on = None
+
+
+# =============================================================================
+# The upgrade/downgrade steps
+# =============================================================================
+
+# noinspection PyPep8,PyTypeChecker
+def upgrade():
+    op.create_table(
+        '_export_db_watermarks',
+        sa.Column('id', sa.Integer(), autoincrement=True, nullable=False, comment='Arbitrary primary key'),  # noqa
+        sa.Column('recipient_name', sa.String(length=191), nullable=False, comment='Name of export recipient'),  # noqa
+        sa.Column('watermark_utc', sa.DateTime(), nullable=False, comment='Records removed from the server at or after this time (UTC) may not yet have been removed from the destination database'),  # noqa
+        sa.Column('updated_at_utc', sa.DateTime(), nullable=False, comment='Time the watermark was last updated (UTC)'),  # noqa
+        sa.PrimaryKeyConstraint('id', name=op.f('pk__export_db_watermarks')),
+        mysql_charset='utf8mb4 COLLATE utf8mb4_unicode_ci',
+        mysql_engine='InnoDB',
+        mysql_row_format='DYNAMIC'
+    )
+    with op.batch_alter_table('_export_db_watermarks', schema=None) as batch_op:  # noqa
+        batch_op.create_index(batch_op.f('ix__export_db_watermarks_recipient_name'), ['recipient_name'], unique=True)  # noqa
+
+    with op.batch_alter_table('_export_recipients', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('db_incremental', sa.Boolean(), nullable=False, server_default=sa.false(), comment='(DATABASE) Update the destination incrementally?'))  # noqa
+
+
+# noinspection PyPep8,PyTypeChecker
+def downgrade():
+    with op.batch_alter_table('_export_recipients', schema=None) as batch_op:
+        batch_op.drop_column('db_incremental')
+
+    with op.batch_alter_table('_export_db_watermarks', schema=None) as batch_op:  # noqa
+        batch_op.drop_index(batch_op.f('ix__export_db_watermarks_recipient_name'))  # noqa
+
+    op.drop_table('_export_db_watermarks')
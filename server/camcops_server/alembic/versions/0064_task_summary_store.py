@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+
+"""
+camcops_server/alembic/versions/0064_task_summary_store.py
+
+===============================================================================
+
+    Copyright (C) 2012-2020 Rudolf Cardinal (rudolf@pobox.com).
+
+    This file is part of CamCOPS.
+
+    CamCOPS is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    CamCOPS is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with CamCOPS. If not, see <http://www.gnu.org/licenses/>.
+
+===============================================================================
+
+DATABASE REVISION SCRIPT
+
+task_summary_store
+
+Revision ID: 0064
+Revises: 0063
+Creation date: 2021-05-17 10:42:19.514302
+
+"""
+
+# =============================================================================
+# Imports
+# =============================================================================
+
+from alembic import op
+import sqlalchemy as sa
+import camcops_server.cc_modules.cc_sqla_coltypes
+
+
+# =============================================================================
+# Revision identifiers, used by Alembic.
+# =============================================================================
+
+revision = '0064'
+down_revision = '0063'
+branch_labels = None
+depends_on = None
+
+
+# =============================================================================
+# The upgrade/downgrade steps
+# =============================================================================
+
+# noinspection PyPep8,PyTypeChecker
+def upgrade():
+    op.create_table(
+        '_task_summaries',
+        sa.Column('entry_pk', sa.Integer(), autoincrement=True, nullable=False, comment='Arbitrary primary key of this summary entry'),  # noqa
+        sa.Column('computed_at_utc', sa.DateTime(), nullable=False, comment='When these summary values were calculated'),  # noqa
+        sa.Column('task_table_name', sa.String(length=128), nullable=True, comment="Table name of the task's base table"),  # noqa
+        sa.Column('task_pk', sa.Integer(), nullable=True, comment='Server primary key of the task'),  # noqa
+        sa.Column('camcops_server_version', camcops_server.cc_modules.cc_sqla_coltypes.SemanticVersionColType(length=147), nullable=True, comment='CamCOPS server version that calculated the summary values'),  # noqa
+        sa.Column('summaries_json', sa.UnicodeText(), nullable=True, comment='Summary values, as a JSON list of [name, value] pairs'),  # noqa
+        sa.PrimaryKeyConstraint('entry_pk', name=op.f('pk__task_summaries')),
+        mysql_charset='utf8mb4 COLLATE utf8mb4_unicode_ci',
+        mysql_engine='InnoDB',
+        mysql_row_format='DYNAMIC'
+    )
+    with op.batch_alter_table('_task_summaries', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix__task_summaries_task_pk'), ['task_pk'], unique=False)  # noqa
+        batch_op.create_index(batch_op.f('ix__task_summaries_task_table_name'), ['task_table_name'], unique=False)  # noqa
+
+
+# noinspection PyPep8,PyTypeChecker
+def downgrade():
+    with op.batch_alter_table('_task_summaries', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix__task_summaries_task_table_name'))  # noqa
+        batch_op.drop_index(batch_op.f('ix__task_summaries_task_pk'))
+
+    op.drop_table('_task_summaries')
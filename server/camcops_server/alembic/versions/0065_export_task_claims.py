@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+
+"""
+camcops_server/alembic/versions/0065_export_task_claims.py
+
+===============================================================================
+
+    Copyright (C) 2012-2020 Rudolf Cardinal (rudolf@pobox.com).
+
+    This file is part of CamCOPS.
+
+    CamCOPS is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    CamCOPS is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with CamCOPS. If not, see <http://www.gnu.org/licenses/>.
+
+===============================================================================
+
+DATABASE REVISION SCRIPT
+
+export_task_claims
+
+Revision ID: 0065
+Revises: 0064
+Creation date: 2021-05-24 14:03:51.208846
+
+"""
+
+# =============================================================================
+# Imports
+# =============================================================================
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# =============================================================================
+# Revision identifiers, used by Alembic.
+# =============================================================================
+
+revision = '0065'
+down_revision = '0064'
+branch_labels = None
+depends_on = None
+
+
+# =============================================================================
+# The upgrade/downgrade steps
+# =============================================================================
+
+# noinspection PyPep8,PyTypeChecker
+def upgrade():
+    op.create_table(
+        '_export_task_claims',
+        sa.Column('recipient_name', sa.String(length=191), nullable=False, comment='Name of export recipient'),  # noqa
+        sa.Column('basetable', sa.String(length=128), nullable=False, comment='Base table of task being exported'),  # noqa
+        sa.Column('task_server_pk', sa.Integer(), autoincrement=False, nullable=False, comment='Server PK of task in basetable (_pk field)'),  # noqa
+        sa.Column('claimed_at_utc', sa.DateTime(), nullable=False, comment='Time the export was claimed (UTC)'),  # noqa
+        sa.PrimaryKeyConstraint('recipient_name', 'basetable', 'task_server_pk', name=op.f('pk__export_task_claims')),  # noqa
+        mysql_charset='utf8mb4 COLLATE utf8mb4_unicode_ci',
+        mysql_engine='InnoDB',
+        mysql_row_format='DYNAMIC'
+    )
+
+
+# noinspection PyPep8,PyTypeChecker
+def downgrade():
+    op.drop_table('_export_task_claims')
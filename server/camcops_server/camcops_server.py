@@ -252,14 +252,14 @@ def _merge_camcops_db(src: str,
 
 def _get_all_ddl(dialect_name: str = SqlaDialectName.MYSQL) -> str:
     # noinspection PyUnresolvedReferences
-    import camcops_server.camcops_server_core  # delayed import; import side effects  # noqa
+    import camcops_server.cc_modules.cc_all_models  # delayed import; import side effects (ensure all tasks registered)  # noqa
     from camcops_server.cc_modules.cc_sqlalchemy import get_all_ddl  # delayed import  # noqa
     return get_all_ddl(dialect_name=dialect_name)
 
 
-def _reindex(cfg: CamcopsConfig) -> None:
+def _reindex(cfg: CamcopsConfig, jobs: int = 1) -> None:
     import camcops_server.camcops_server_core as core  # delayed import; import side effects  # noqa
-    core.reindex(cfg=cfg)
+    core.reindex(cfg=cfg, jobs=jobs)
 
 
 def _check_index(cfg: CamcopsConfig,
@@ -403,7 +403,8 @@ def _serve_gunicorn() -> None:
         ssl_private_key=cfg.ssl_private_key,
         reload=cfg.gunicorn_debug_reload,
         timeout_s=cfg.gunicorn_timeout_s,
-        debug_show_gunicorn_options=cfg.debug_show_gunicorn_options)
+        debug_show_gunicorn_options=cfg.debug_show_gunicorn_options,
+        preload=cfg.gunicorn_preload)
 
 
 # -----------------------------------------------------------------------------
@@ -426,6 +427,20 @@ def _launch_celery_flower(address: str = DEFAULT_FLOWER_ADDRESS,
     core.launch_celery_flower(address=address, port=port)
 
 
+def _client_api_timing_summary(logfiles: List[str]) -> None:
+    from camcops_server.cc_modules.cc_client_api_timing import summarize_client_api_timing  # delayed import  # noqa
+    lines = []  # type: List[str]
+    for filename in logfiles:
+        with open(filename) as f:
+            lines.extend(f)
+    print(summarize_client_api_timing(lines))
+
+
+def _compile_snomed_xml(cfg: CamcopsConfig) -> None:
+    for store_filename in cfg.compile_snomed_stores():
+        print(store_filename)
+
+
 def _housekeeping() -> None:
     from camcops_server.cc_modules.celery import housekeeping  # delayed import
     housekeeping()
@@ -887,11 +902,16 @@ def camcops_main() -> int:
     # Rebuild server indexes
     reindex_parser = add_sub(
         subparsers, "reindex",
-        help="Recreate task index"
+        help="Recreate task index (and task summary store, if enabled)"
     )
+    reindex_parser.add_argument(
+        '--jobs', type=int, default=1,
+        help="Number of task tables to index concurrently, each using its "
+             "own database connection")
     reindex_parser.set_defaults(
         func=lambda args: _reindex(
-            cfg=get_default_config_from_os_env()
+            cfg=get_default_config_from_os_env(),
+            jobs=args.jobs
         )
     )
 
@@ -1053,6 +1073,18 @@ def camcops_main() -> int:
              "single-process, HTTP-only; for development use only)")
     serve_pyr_parser.set_defaults(func=lambda args: _test_serve_pyramid())
 
+    # Summarize client API timing
+    client_api_timing_parser = add_sub(
+        subparsers, "client_api_timing_summary",
+        help="Summarize client API timings from log files (see the "
+             "CLIENT_API_TIMING config option)",
+        config_mandatory=None)
+    client_api_timing_parser.add_argument(
+        'logfiles', nargs="+",
+        help="Log file(s) to read")
+    client_api_timing_parser.set_defaults(
+        func=lambda args: _client_api_timing_summary(logfiles=args.logfiles))
+
     # -------------------------------------------------------------------------
     # Preprocessing options
     # -------------------------------------------------------------------------
@@ -1088,6 +1120,18 @@ def camcops_main() -> int:
         )
     )
 
+    compile_snomed_xml_parser = add_sub(
+        subparsers, "compile_snomed_xml",
+        help="Compile the SNOMED-CT XML files named in the config file into "
+             "indexed stores, which the server then reads instead (for "
+             "faster startup and lower memory use)"
+    )
+    compile_snomed_xml_parser.set_defaults(
+        func=lambda args: _compile_snomed_xml(
+            cfg=get_default_config_from_os_env()
+        )
+    )
+
     # -------------------------------------------------------------------------
     # Celery options
     # -------------------------------------------------------------------------
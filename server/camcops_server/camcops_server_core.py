@@ -48,10 +48,12 @@ log.info("Imports starting")
 
 # Main imports
 
+import gc  # noqa: E402
 import os  # noqa: E402
 import platform  # noqa: E402
 import sys  # noqa: E402
 import subprocess  # noqa: E402
+import time  # noqa: E402
 from typing import Any, Dict, List, Optional, TYPE_CHECKING  # noqa: E402
 
 import cherrypy  # noqa: E402
@@ -69,17 +71,18 @@ from cardinal_pythonlib.wsgi.reverse_proxied_mw import (  # noqa: E402
     ReverseProxiedConfig,
     ReverseProxiedMiddleware,
 )
+import psutil  # noqa: E402
+from sqlalchemy.orm import configure_mappers  # noqa: E402
 
-# Import this one early:
+# Import this one early. Task modules are slow to import, so they are loaded
+# only when needed (see Task.gen_all_subclasses):
 # noinspection PyUnresolvedReferences
-import camcops_server.cc_modules.cc_all_models  # import side effects (ensure all models registered)  # noqa: E402,E501
+import camcops_server.cc_modules.cc_nontask_models  # import side effects (ensure all non-task models registered)  # noqa: E402,E501,F401
 
 from camcops_server.cc_modules.cc_anon import (  # noqa: E402
     write_crate_data_dictionary,
     write_cris_data_dictionary,
 )
-# noinspection PyUnresolvedReferences
-import camcops_server.cc_modules.client_api  # import side effects (register unit test)  # noqa: E402,E501,F401
 from camcops_server.cc_modules.cc_config import (  # noqa: E402
     CamcopsConfig,
     get_config_filename_from_os_env,
@@ -96,7 +99,10 @@ from camcops_server.cc_modules.cc_export import (  # noqa: E402
     print_export_queue,
     export,
 )
-from camcops_server.cc_modules.cc_pyramid import RouteCollection  # noqa: E402
+from camcops_server.cc_modules.cc_pyramid import (  # noqa: E402
+    precompile_mako_templates,
+    RouteCollection,
+)
 from camcops_server.cc_modules.cc_request import (  # noqa: E402
     CamcopsRequest,
     command_line_request_context,
@@ -107,6 +113,7 @@ from camcops_server.cc_modules.cc_task import Task  # noqa: E402
 from camcops_server.cc_modules.cc_taskindex import (  # noqa: E402
     check_indexes,
     reindex_everything,
+    TaskSummaryEntry,
 )
 # noinspection PyUnresolvedReferences
 from camcops_server.cc_modules.cc_user import (  # noqa: E402
@@ -120,7 +127,6 @@ from camcops_server.cc_modules.celery import (  # noqa: E402
     CELERY_SOFT_TIME_LIMIT_SEC,
 )
 log.info("Imports complete")
-log.info("Using {} tasks", len(Task.all_subclasses_by_tablename()))
 
 if TYPE_CHECKING:
     from pyramid.router import Router  # noqa: F401
@@ -187,6 +193,47 @@ def precache() -> None:
         _ = req.get_export_recipients(all_recipients=True)
 
 
+def describe_process_memory() -> str:
+    """
+    Describes the memory use of the current process. The "unique" figure is
+    memory not shared with any other process; pages inherited from a parent
+    process count as shared until they are written to.
+    """
+    mb = 1024 * 1024
+    mem = psutil.Process().memory_full_info()
+    return (
+        f"RSS {mem.rss / mb:.1f} MB, "
+        f"unique {getattr(mem, 'uss', 0) / mb:.1f} MB"
+    )
+
+
+def warm_up_before_fork() -> None:
+    """
+    For preforking web servers: does, once, in the parent process, the slow
+    work that every worker process would otherwise repeat, so that workers
+    start quickly and share the results (copy-on-write).
+
+    In addition to :func:`precache` (which has already been called, via
+    :func:`ensure_ok_for_webserver`), this configures all SQLAlchemy mappers
+    and compiles all Mako templates. It then closes the parent's database
+    connections, which must not be shared with the workers, and (Python
+    3.7+) moves everything created so far out of the garbage collector's
+    view, so that collections in the workers don't touch (and thereby copy)
+    the shared memory pages.
+    """
+    log.info("Warming up before starting worker processes")
+    t0 = time.perf_counter()
+    configure_mappers()
+    n_templates = precompile_mako_templates()
+    get_default_config_from_os_env().get_sqla_engine().dispose()
+    gc.collect()
+    if hasattr(gc, "freeze"):  # Python 3.7+
+        gc.freeze()
+    log.info("... compiled {} templates; warm-up took {:.3f} s; "
+             "memory: {}",
+             n_templates, time.perf_counter() - t0, describe_process_memory())
+
+
 # =============================================================================
 # WSGI entry point
 # =============================================================================
@@ -265,6 +312,7 @@ def make_wsgi_app(debug_toolbar: bool = False,
 
     """
     log.debug("Creating WSGI app")
+    log.info("Using {} tasks", len(Task.all_subclasses_by_tablename()))
 
     # Make Pyramid WSGI app
     # - camcops_pyramid_configurator_context() is our function; see that
@@ -405,7 +453,8 @@ def serve_gunicorn(application: "Router",
                    ssl_private_key: Optional[str],
                    reload: bool = False,
                    timeout_s: int = 30,
-                   debug_show_gunicorn_options: bool = False) -> None:
+                   debug_show_gunicorn_options: bool = False,
+                   preload: bool = False) -> None:
     """
     Start Gunicorn server
 
@@ -418,6 +467,9 @@ def serve_gunicorn(application: "Router",
 
     - The Pyramid debug toolbar detects a multiprocessing web server and says
       "shan't, because I use global state".
+
+    - With ``preload``, the parent process warms up fully before forking
+      (see :func:`warm_up_before_fork`). Not compatible with ``reload``.
     """  # noqa: E501
     if BaseApplication is None:
         raise_runtime_error("Gunicorn does not run under Windows. "
@@ -435,6 +487,20 @@ def serve_gunicorn(application: "Router",
         log.info("Starting Gunicorn server on host {}, port {}", host, port)
         bind = f"{host}:{port}"
     log.info("... using {} workers", num_workers)
+    if preload and reload:
+        log.warning("Gunicorn preloading is incompatible with reloading; "
+                    "not preloading")
+        preload = False
+    if preload:
+        warm_up_before_fork()
+    else:
+        # Don't let workers inherit database connections from the parent.
+        get_default_config_from_os_env().get_sqla_engine().dispose()
+
+    # noinspection PyUnusedLocal
+    def post_worker_init(worker: Any) -> None:
+        log.info("Gunicorn worker (process {}) ready; memory: {}",
+                 worker.pid, describe_process_memory())
 
     # We encapsulate this class definition in the function, since it inherits
     # from a class whose import will crash under Windows.
@@ -473,6 +539,8 @@ def serve_gunicorn(application: "Router",
         'bind': bind,
         'certfile': ssl_certificate,
         'keyfile': ssl_private_key,
+        'post_worker_init': post_worker_init,
+        'preload_app': preload,
         'reload': reload,
         'timeout': timeout_s,
         'workers': num_workers,
@@ -769,16 +837,21 @@ def show_database_schema(schemastem: str,
         subprocess.check_call(cmd)
 
 
-def reindex(cfg: CamcopsConfig) -> None:
+def reindex(cfg: CamcopsConfig, jobs: int = 1) -> None:
     """
-    Drops and regenerates the server task index.
+    Drops and regenerates the server task index, and the task summary store
+    if that is enabled.
 
     Args:
         cfg: a :class:`camcops_server.cc_modules.cc_config.CamcopsConfig`
+        jobs: number of task tables to index concurrently
     """
     ensure_database_is_ok()
     with cfg.get_dbsession_context() as dbsession:
-        reindex_everything(dbsession)
+        reindex_everything(dbsession, jobs=jobs)
+    if cfg.store_task_summaries:
+        with command_line_request_context() as req:
+            TaskSummaryEntry.rebuild_summary_store(req)
 
 
 def check_index(cfg: CamcopsConfig, show_all_bad: bool = False) -> bool:
@@ -43,56 +43,44 @@ from camcops_server.cc_modules.cc_db import GenericTabletRecordMixin
 from camcops_server.cc_modules.cc_sqlalchemy import Base
 
 # =============================================================================
-# Non-task model imports representing client-side tables
+# Non-task model imports
 # =============================================================================
-# How to suppress "Unused import statement"?
-# https://stackoverflow.com/questions/21139329/false-unused-import-statement-in-pycharm  # noqa
-# http://codeoptimism.com/blog/pycharm-suppress-inspections-list/
 
-# noinspection PyUnresolvedReferences
-from camcops_server.cc_modules.cc_blob import Blob  # noqa: F401
-# noinspection PyUnresolvedReferences
-from camcops_server.cc_modules.cc_patientidnum import PatientIdNum  # noqa: F401
-# noinspection PyUnresolvedReferences
-from camcops_server.cc_modules.cc_patient import Patient  # noqa: F401
-
-# =============================================================================
-# Other non-task model imports
-# =============================================================================
-
-from camcops_server.cc_modules.cc_audit import AuditEntry
-from camcops_server.cc_modules.cc_device import Device
-from camcops_server.cc_modules.cc_dirtytables import DirtyTable
-from camcops_server.cc_modules.cc_email import Email
-from camcops_server.cc_modules.cc_group import Group, group_group_table
-from camcops_server.cc_modules.cc_exportmodels import (
-    ExportedTaskEmail,
+from camcops_server.cc_modules.cc_nontask_models import (
+    AuditEntry,
+    CamcopsSession,
+    Device,
+    DirtyTable,
+    Email,
+    ExportedDatabaseWatermark,
     ExportedTask,
+    ExportedTaskEmail,
     ExportedTaskFileGroup,
     ExportedTaskHL7Message,
-)
-from camcops_server.cc_modules.cc_exportrecipient import ExportRecipient
-from camcops_server.cc_modules.cc_idnumdef import IdNumDefinition
-from camcops_server.cc_modules.cc_membership import UserGroupMembership
-from camcops_server.cc_modules.cc_session import CamcopsSession
-from camcops_server.cc_modules.cc_specialnote import SpecialNote
-from camcops_server.cc_modules.cc_serversettings import ServerSettings
-# noinspection PyUnresolvedReferences
-from camcops_server.cc_modules.cc_task import Task
-from camcops_server.cc_modules.cc_taskfilter import TaskFilter
-from camcops_server.cc_modules.cc_taskschedule import (
-    TaskSchedule,
-    TaskScheduleItem,
-)
-# noinspection PyUnresolvedReferences
-from camcops_server.cc_modules.cc_taskindex import (
+    ExportRecipient,
+    ExportTaskClaim,
+    Group,
+    group_group_table,
+    IdNumDefinition,
     PatientIdNumIndexEntry,
-    TaskIndexEntry,
-)
-from camcops_server.cc_modules.cc_user import (
     SecurityAccountLockout,
     SecurityLoginFailure,
+    ServerSettings,
+    SpecialNote,
+    Task,
+    TaskFilter,
+    TaskIndexEntry,
+    TaskSchedule,
+    TaskScheduleItem,
+    TaskSummaryEntry,
     User,
+    UserGroupMembership,
+)
+# noinspection PyUnresolvedReferences
+from camcops_server.cc_modules.cc_nontask_models import (  # noqa: F401
+    Blob,
+    Patient,
+    PatientIdNum,
 )
 
 # =============================================================================
@@ -143,11 +131,13 @@ RESERVED_TABLE_NAMES = [
     Device.__tablename__,
     DirtyTable.__tablename__,
     Email.__tablename__,
+    ExportedDatabaseWatermark.__tablename__,
     ExportedTask.__tablename__,
     ExportedTaskEmail.__tablename__,
     ExportedTaskFileGroup.__tablename__,
     ExportedTaskHL7Message.__tablename__,
     ExportRecipient.__tablename__,
+    ExportTaskClaim.__tablename__,
     Group.__tablename__,
     group_group_table.name,
     IdNumDefinition.__tablename__,
@@ -160,6 +150,7 @@ RESERVED_TABLE_NAMES = [
     TaskIndexEntry.__tablename__,
     TaskSchedule.__tablename__,
     TaskScheduleItem.__tablename__,
+    TaskSummaryEntry.__tablename__,
     User.__tablename__,
     UserGroupMembership.__tablename__,
 ]
@@ -80,6 +80,7 @@ class TabletParam(object):
     DATABASE_TITLE = "databaseTitle"  # S->C
     DATEVALUES = "datevalues"  # C->S
     DBDATA = "dbdata"  # C->S, v2.3.0
+    DBDATA_STREAM = "dbdata_stream"  # C->S, v2.4.7; compression of per-table data streamed as the request body  # noqa
     DEVICE = "device"  # C->S
     DEVICE_FRIENDLY_NAME = "devicefriendlyname"  # C->S
     DOB = "dob"  # C->S, in JSON, v2.3.0
@@ -115,6 +116,7 @@ class TabletParam(object):
     PKVALUES = "pkvalues"  # C->S
     RECORD_PREFIX = "record"  # B
     RESULT = "result"  # S->C
+    ROWS = "rows"  # C->S, in streamed dbdata, v2.4.7
     SERVER_CAMCOPS_VERSION = "serverCamcopsVersion"  # S->C
     SESSION_ID = "session_id"  # B
     SESSION_TOKEN = "session_token"  # B
@@ -923,3 +925,24 @@ def get_server_live_records(req: "CamcopsRequest",
             successor_pk=row[8],
         ))
     return recs
+
+
+def server_records_by_client_pk(
+        records: Iterable[ServerRecord]) -> Dict[Any, ServerRecord]:
+    """
+    Indexes server records by their client PK, for constant-time lookup
+    during upload.
+
+    Args:
+        records: :class:`ServerRecord` objects, e.g. from
+            :func:`get_server_live_records`
+
+    Returns:
+        a dictionary mapping client PK to :class:`ServerRecord`. If several
+        records share a client PK (which shouldn't happen for current
+        records), the first one wins, as for a linear search.
+    """
+    d = {}  # type: Dict[Any, ServerRecord]
+    for r in records:
+        d.setdefault(r.client_pk, r)
+    return d
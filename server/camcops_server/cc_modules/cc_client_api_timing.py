@@ -0,0 +1,334 @@
+#!/usr/bin/env python
+
+"""
+camcops_server/cc_modules/cc_client_api_timing.py
+
+===============================================================================
+
+    Copyright (C) 2012-2020 Rudolf Cardinal (rudolf@pobox.com).
+
+    This file is part of CamCOPS.
+
+    CamCOPS is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    CamCOPS is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with CamCOPS. If not, see <http://www.gnu.org/licenses/>.
+
+===============================================================================
+
+**Timing instrumentation for the client (tablet device) API.**
+
+If the ``CLIENT_API_TIMING`` config option is set, every client API operation
+is timed. For each one, we log a single line (with the prefix
+:data:`CLIENT_API_TIMING_LOG_PREFIX`, followed by JSON) giving:
+
+- the operation, device, and table (if the operation concerns a single table);
+- whether it succeeded;
+- the wall-clock time, the number of SQL statements executed, and the number
+  of rows affected by INSERT/UPDATE/DELETE statements;
+- the same figures for each table, for operations that deal with several
+  tables (``upload_entire_database``, ``end_upload``).
+
+The final database COMMIT happens after the operation, so is not included.
+
+The ``camcops_server client_api_timing_summary`` command summarizes these log
+lines; see :func:`summarize_client_api_timing`.
+
+"""
+
+from collections import OrderedDict
+from contextlib import contextmanager
+import json
+import logging
+import threading
+import time
+from typing import Any, Dict, Generator, Iterable, List, Optional, Tuple
+
+from cardinal_pythonlib.logs import BraceStyleAdapter
+from sqlalchemy.engine.base import Engine
+from sqlalchemy.event.api import listen
+
+log = BraceStyleAdapter(logging.getLogger(__name__))
+
+CLIENT_API_TIMING_LOG_PREFIX = "Client API timing: "
+
+
+# =============================================================================
+# Timing of a single operation
+# =============================================================================
+
+class ClientApiTimingStats(object):
+    """
+    Wall-clock time, SQL statement count, and rows affected, for an operation
+    or for one table within it.
+    """
+    def __init__(self) -> None:
+        self.wall_s = 0.0
+        self.sql_statements = 0
+        self.sql_rows = 0
+
+    def as_dict(self) -> Dict[str, Any]:
+        return OrderedDict([
+            ("wall_s", round(self.wall_s, 6)),
+            ("sql_statements", self.sql_statements),
+            ("sql_rows", self.sql_rows),
+        ])
+
+
+class ClientApiTimer(object):
+    """
+    Times a single client API operation.
+    """
+    def __init__(self, operation: str, device: str = "",
+                 table: str = "") -> None:
+        """
+        Args:
+            operation: the client API operation
+            device: name of the device making the request
+            table: name of the table, for single-table operations
+        """
+        self.operation = operation
+        self.device = device
+        self.table = table
+        self.success = False
+        self.total = ClientApiTimingStats()
+        self.tables = OrderedDict()  # type: Dict[str, ClientApiTimingStats]
+        self._current_table = None  # type: Optional[ClientApiTimingStats]
+
+    def record_sql(self, rows_affected: int) -> None:
+        """
+        Records the execution of an SQL statement.
+
+        Args:
+            rows_affected: number of rows it inserted, updated, or deleted
+        """
+        for stats in (self.total, self._current_table):
+            if stats is not None:
+                stats.sql_statements += 1
+                stats.sql_rows += rows_affected
+
+    @contextmanager
+    def timing_table(self, tablename: str) -> Generator[None, None, None]:
+        """
+        Context manager to attribute time and SQL statements to a table.
+        """
+        stats = self.tables.setdefault(tablename, ClientApiTimingStats())
+        previous = self._current_table
+        self._current_table = stats
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            stats.wall_s += time.perf_counter() - t0
+            self._current_table = previous
+
+    def as_dict(self) -> Dict[str, Any]:
+        d = OrderedDict([
+            ("operation", self.operation),
+            ("device", self.device),
+            ("table", self.table),
+            ("success", self.success),
+        ])  # type: Dict[str, Any]
+        d.update(self.total.as_dict())
+        if self.tables:
+            d["tables"] = OrderedDict(
+                (tablename, stats.as_dict())
+                for tablename, stats in self.tables.items()
+            )
+        return d
+
+    def log(self) -> None:
+        """
+        Writes our structured log line.
+        """
+        log.info("{}{}", CLIENT_API_TIMING_LOG_PREFIX,
+                 json.dumps(self.as_dict()))
+
+
+# =============================================================================
+# Tracking the current operation
+# =============================================================================
+
+# Each request is handled by a single thread, so SQL statements executed by a
+# thread belong to whichever operation that thread is currently timing.
+_THREAD_STATE = threading.local()
+_SQL_LISTENER_LOCK = threading.Lock()
+_sql_listener_installed = False
+
+
+def _get_current_timer() -> Optional[ClientApiTimer]:
+    return getattr(_THREAD_STATE, "timer", None)
+
+
+# noinspection PyUnusedLocal
+def _after_cursor_execute(conn, cursor, statement, parameters, context,
+                          executemany) -> None:
+    """
+    SQLAlchemy engine event handler; counts SQL statements for the current
+    thread's operation, if there is one.
+    """
+    timer = _get_current_timer()
+    if timer is None:
+        return
+    rows_affected = 0
+    if context is not None and (context.isinsert or context.isupdate or
+                                context.isdelete):
+        rows_affected = max(cursor.rowcount, 0)  # may be -1 if unknown
+    timer.record_sql(rows_affected)
+
+
+def _install_sql_listener() -> None:
+    """
+    Listens for SQL statements on all engines. Done only when timing is first
+    requested, so there is no cost otherwise.
+    """
+    global _sql_listener_installed
+    with _SQL_LISTENER_LOCK:
+        if not _sql_listener_installed:
+            listen(Engine, "after_cursor_execute", _after_cursor_execute)
+            _sql_listener_installed = True
+
+
+@contextmanager
+def client_api_timing(operation: str, device: str = "",
+                      table: str = "") -> Generator[ClientApiTimer, None, None]:
+    """
+    Context manager to time a client API operation, logging the results at
+    the end (whether or not the operation succeeded).
+
+    Args:
+        operation: the client API operation
+        device: name of the device making the request
+        table: name of the table, for single-table operations
+    """
+    _install_sql_listener()
+    timer = ClientApiTimer(operation=operation, device=device, table=table)
+    _THREAD_STATE.timer = timer
+    t0 = time.perf_counter()
+    try:
+        yield timer
+        timer.success = True
+    finally:
+        timer.total.wall_s = time.perf_counter() - t0
+        _THREAD_STATE.timer = None
+        timer.log()
+
+
+@contextmanager
+def client_api_timing_table(tablename: str) -> Generator[None, None, None]:
+    """
+    Context manager to attribute the time and SQL statements of part of the
+    current operation to a table. Does nothing if we are not timing.
+    """
+    timer = _get_current_timer()
+    if timer is None:
+        yield
+    else:
+        with timer.timing_table(tablename):
+            yield
+
+
+# =============================================================================
+# Summarizing the log
+# =============================================================================
+
+class ClientApiTimingSummaryRow(object):
+    """
+    Aggregated timings for an operation, or an operation/table combination.
+    """
+    def __init__(self) -> None:
+        self.n = 0
+        self.n_failed = 0
+        self.total_wall_s = 0.0
+        self.max_wall_s = 0.0
+        self.sql_statements = 0
+        self.sql_rows = 0
+
+    def add(self, d: Dict[str, Any], success: bool = True) -> None:
+        """
+        Adds a set of figures (as per :meth:`ClientApiTimingStats.as_dict`).
+        """
+        wall_s = d.get("wall_s", 0.0)
+        self.n += 1
+        if not success:
+            self.n_failed += 1
+        self.total_wall_s += wall_s
+        self.max_wall_s = max(self.max_wall_s, wall_s)
+        self.sql_statements += d.get("sql_statements", 0)
+        self.sql_rows += d.get("sql_rows", 0)
+
+
+def summarize_client_api_timing(lines: Iterable[str]) -> str:
+    """
+    Summarizes the log lines written by :func:`client_api_timing`, by
+    operation, and by operation and table. Other lines are ignored. Results
+    are sorted by total time, slowest first.
+
+    Args:
+        lines: lines from one or more log files
+
+    Returns:
+        a plain-text table
+    """
+    by_op = {}  # type: Dict[Tuple[str, str], ClientApiTimingSummaryRow]
+    by_table = {}  # type: Dict[Tuple[str, str], ClientApiTimingSummaryRow]
+    for line in lines:
+        idx = line.find(CLIENT_API_TIMING_LOG_PREFIX)
+        if idx < 0:
+            continue
+        try:
+            d = json.loads(line[idx + len(CLIENT_API_TIMING_LOG_PREFIX):])
+        except ValueError:
+            log.warning("Bad client API timing line: {!r}", line)
+            continue
+        operation = d.get("operation", "")
+        success = d.get("success", True)
+        by_op.setdefault((operation, ""), ClientApiTimingSummaryRow()).add(
+            d, success)
+        tables = d.get("tables") or {}
+        if d.get("table"):
+            tables = {d["table"]: d}
+        for tablename, tabledict in tables.items():
+            by_table.setdefault(
+                (operation, tablename), ClientApiTimingSummaryRow()
+            ).add(tabledict, success)
+
+    headings = ["Operation", "Table", "N", "Failed", "Total (s)", "Mean (s)",
+                "Max (s)", "SQL statements", "SQL rows"]
+
+    def rows_for(summary: Dict[Tuple[str, str], ClientApiTimingSummaryRow]) \
+            -> List[List[str]]:
+        ordered = sorted(summary.items(),
+                         key=lambda kv: kv[1].total_wall_s, reverse=True)
+        return [
+            [operation, tablename, str(s.n), str(s.n_failed),
+             f"{s.total_wall_s:.3f}", f"{s.total_wall_s / s.n:.3f}",
+             f"{s.max_wall_s:.3f}", str(s.sql_statements), str(s.sql_rows)]
+            for (operation, tablename), s in ordered
+        ]
+
+    sections = [
+        ("By operation", rows_for(by_op)),
+        ("By operation and table", rows_for(by_table)),
+    ]
+    output = []  # type: List[str]
+    for title, rows in sections:
+        widths = [max(len(x) for x in column)
+                  for column in zip(headings, *rows)]
+        output.append(title)
+        output.append("=" * len(title))
+        for row in [headings] + rows:
+            output.append("  ".join(
+                x.ljust(w) if i < 2 else x.rjust(w)
+                for i, (x, w) in enumerate(zip(row, widths))
+            ).rstrip())
+        output.append("")
+    return "\n".join(output)
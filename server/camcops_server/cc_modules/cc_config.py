@@ -75,7 +75,7 @@ import datetime
 import os
 import logging
 import re
-from typing import Any, Dict, Generator, List, Optional, Union
+from typing import Any, Dict, Generator, List, Mapping, Optional, Union
 
 from cardinal_pythonlib.configfiles import (
     get_config_parameter,
@@ -134,11 +134,11 @@ from camcops_server.cc_modules.cc_filename import (
 )
 from camcops_server.cc_modules.cc_language import POSSIBLE_LOCALES
 from camcops_server.cc_modules.cc_pyramid import MASTER_ROUTE_CLIENT_API
-from camcops_server.cc_modules.cc_snomed import (
-    get_all_task_snomed_concepts,
-    get_icd9_snomed_concepts_from_xml,
-    get_icd10_snomed_concepts_from_xml,
-    SnomedConcept,
+from camcops_server.cc_modules.cc_snomed import SnomedConcept
+from camcops_server.cc_modules.cc_snomed_store import (
+    compile_snomed_store,
+    get_snomed_concepts,
+    SnomedStoreKind,
 )
 from camcops_server.cc_modules.cc_validators import (
     validate_export_recipient_name,
@@ -312,6 +312,8 @@ def get_demo_config(for_docker: bool = False) -> str:
 
 {ConfigParamSite.DB_URL} = {cd.demo_db_url}
 {ConfigParamSite.DB_ECHO} = {cd.DB_ECHO}
+{ConfigParamSite.TASK_FETCH_THREADS} = {cd.TASK_FETCH_THREADS}
+{ConfigParamSite.STORE_TASK_SUMMARIES} = {cd.STORE_TASK_SUMMARIES}
 
 # -----------------------------------------------------------------------------
 # URLs and paths
@@ -337,6 +339,10 @@ def get_demo_config(for_docker: bool = False) -> str:
 
 {ConfigParamSite.SESSION_COOKIE_SECRET} = camcops_autogenerated_secret_{session_cookie_secret}
 {ConfigParamSite.SESSION_TIMEOUT_MINUTES} = {cd.SESSION_TIMEOUT_MINUTES}
+{ConfigParamSite.SESSION_ACTIVITY_WRITE_INTERVAL_S} = {cd.SESSION_ACTIVITY_WRITE_INTERVAL_S}
+{ConfigParamSite.CLIENT_API_LOGIN_CACHE_SIZE} = {cd.CLIENT_API_LOGIN_CACHE_SIZE}
+{ConfigParamSite.CLIENT_API_LOGIN_CACHE_TTL_S} = {cd.CLIENT_API_LOGIN_CACHE_TTL_S}
+{ConfigParamSite.CLIENT_API_MAX_UPLOAD_SIZE_MB} = {cd.CLIENT_API_MAX_UPLOAD_SIZE_MB}
 {ConfigParamSite.PASSWORD_CHANGE_FREQUENCY_DAYS} = {cd.PASSWORD_CHANGE_FREQUENCY_DAYS}
 {ConfigParamSite.LOCKOUT_THRESHOLD} = {cd.LOCKOUT_THRESHOLD}
 {ConfigParamSite.LOCKOUT_DURATION_INCREMENT_MINUTES} = {cd.LOCKOUT_DURATION_INCREMENT_MINUTES}
@@ -381,6 +387,7 @@ def get_demo_config(for_docker: bool = False) -> str:
 
 {ConfigParamSite.WEBVIEW_LOGLEVEL} = {cd.WEBVIEW_LOGLEVEL_TEXTFORMAT}
 {ConfigParamSite.CLIENT_API_LOGLEVEL} = {cd.CLIENT_API_LOGLEVEL_TEXTFORMAT}
+{ConfigParamSite.CLIENT_API_TIMING} = {cd.CLIENT_API_TIMING}
 {ConfigParamSite.ALLOW_INSECURE_COOKIES} = {cd.ALLOW_INSECURE_COOKIES}
 
 
@@ -447,6 +454,7 @@ def get_demo_config(for_docker: bool = False) -> str:
 {ConfigParamServer.GUNICORN_NUM_WORKERS} = {cd.GUNICORN_NUM_WORKERS}
 {ConfigParamServer.GUNICORN_DEBUG_RELOAD} = {cd.GUNICORN_DEBUG_RELOAD}
 {ConfigParamServer.GUNICORN_TIMEOUT_S} = {cd.GUNICORN_TIMEOUT_S}
+{ConfigParamServer.GUNICORN_PRELOAD} = {cd.GUNICORN_PRELOAD}
 {ConfigParamServer.DEBUG_SHOW_GUNICORN_OPTIONS} = {cd.DEBUG_SHOW_GUNICORN_OPTIONS}
 
 
@@ -462,6 +470,7 @@ def get_demo_config(for_docker: bool = False) -> str:
 {ConfigParamExportGeneral.CELERY_WORKER_EXTRA_ARGS} =
     --maxtasksperchild=1000
 {ConfigParamExportGeneral.CELERY_EXPORT_TASK_RATE_LIMIT} = 100/m
+{ConfigParamExportGeneral.CELERY_EXPORT_BATCH_SIZE} = {cd.CELERY_EXPORT_BATCH_SIZE}
 {ConfigParamExportGeneral.EXPORT_LOCKDIR} = {cd.EXPORT_LOCKDIR}
 
 {ConfigParamExportGeneral.RECIPIENTS} =
@@ -516,6 +525,8 @@ def get_demo_config(for_docker: bool = False) -> str:
 {ConfigParamExportRecipient.DB_INCLUDE_BLOBS} = {cd.DB_INCLUDE_BLOBS}
 {ConfigParamExportRecipient.DB_ADD_SUMMARIES} = {cd.DB_ADD_SUMMARIES}
 {ConfigParamExportRecipient.DB_PATIENT_ID_PER_ROW} = {cd.DB_PATIENT_ID_PER_ROW}
+{ConfigParamExportRecipient.DB_INCREMENTAL} = {cd.DB_INCREMENTAL}
+{ConfigParamExportRecipient.DB_INSERT_BATCH_SIZE} = {cd.DB_INSERT_BATCH_SIZE}
 
     # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
     # Options applicable to e-mail exports
@@ -1149,6 +1160,16 @@ class CamcopsConfig(object):
         logging.getLogger("camcops_server.cc_modules.client_api")\
             .setLevel(self.client_api_loglevel)
         # ... MUTABLE GLOBAL STATE (if relatively unimportant); todo: fix
+        self.client_api_login_cache_size = _get_int(
+            s, cs.CLIENT_API_LOGIN_CACHE_SIZE, cd.CLIENT_API_LOGIN_CACHE_SIZE)
+        self.client_api_login_cache_ttl_s = _get_int(
+            s, cs.CLIENT_API_LOGIN_CACHE_TTL_S,
+            cd.CLIENT_API_LOGIN_CACHE_TTL_S)
+        self.client_api_max_upload_size_mb = _get_int(
+            s, cs.CLIENT_API_MAX_UPLOAD_SIZE_MB,
+            cd.CLIENT_API_MAX_UPLOAD_SIZE_MB)
+        self.client_api_timing = _get_bool(
+            s, cs.CLIENT_API_TIMING, cd.CLIENT_API_TIMING)
 
         self.disable_password_autocomplete = _get_bool(
             s, cs.DISABLE_PASSWORD_AUTOCOMPLETE,
@@ -1223,6 +1244,9 @@ class CamcopsConfig(object):
         self.session_cookie_secret = _get_str(s, cs.SESSION_COOKIE_SECRET)
         self.session_timeout = datetime.timedelta(
             minutes=self.session_timeout_minutes)
+        self.session_activity_write_interval_s = _get_int(
+            s, cs.SESSION_ACTIVITY_WRITE_INTERVAL_S,
+            cd.SESSION_ACTIVITY_WRITE_INTERVAL_S)
         self.snomed_task_xml_filename = _get_str(
             s, cs.SNOMED_TASK_XML_FILENAME)
         self.snomed_icd9_xml_filename = _get_str(
@@ -1230,6 +1254,11 @@ class CamcopsConfig(object):
         self.snomed_icd10_xml_filename = _get_str(
             s, cs.SNOMED_ICD10_XML_FILENAME)
 
+        self.store_task_summaries = _get_bool(
+            s, cs.STORE_TASK_SUMMARIES, cd.STORE_TASK_SUMMARIES)
+
+        self.task_fetch_threads = _get_int(
+            s, cs.TASK_FETCH_THREADS, cd.TASK_FETCH_THREADS)
         self.task_filename_spec = _get_str(s, cs.TASK_FILENAME_SPEC)
         self.tracker_filename_spec = _get_str(s, cs.TRACKER_FILENAME_SPEC)
 
@@ -1290,6 +1319,8 @@ class CamcopsConfig(object):
             ws, cw.GUNICORN_DEBUG_RELOAD, cd.GUNICORN_DEBUG_RELOAD)
         self.gunicorn_num_workers = _get_int(
             ws, cw.GUNICORN_NUM_WORKERS, cd.GUNICORN_NUM_WORKERS)
+        self.gunicorn_preload = _get_bool(
+            ws, cw.GUNICORN_PRELOAD, cd.GUNICORN_PRELOAD)
         self.gunicorn_timeout_s = _get_int(
             ws, cw.GUNICORN_TIMEOUT_S, cd.GUNICORN_TIMEOUT_S)
         self.host = _get_str(ws, cw.HOST, cd.HOST)
@@ -1343,6 +1374,8 @@ class CamcopsConfig(object):
             es, ce.CELERY_WORKER_EXTRA_ARGS)
         self.celery_export_task_rate_limit = _get_str(
             es, ce.CELERY_EXPORT_TASK_RATE_LIMIT)
+        self.celery_export_batch_size = _get_int(
+            es, ce.CELERY_EXPORT_BATCH_SIZE, cd.CELERY_EXPORT_BATCH_SIZE)
 
         self.export_lockdir = _get_str(es, ce.EXPORT_LOCKDIR)
         if not self.export_lockdir:
@@ -1617,40 +1650,71 @@ class CamcopsConfig(object):
     # SNOMED-CT functions
     # -------------------------------------------------------------------------
 
-    def get_task_snomed_concepts(self) -> Dict[str, SnomedConcept]:
+    def get_task_snomed_concepts(self) -> Mapping[str, SnomedConcept]:
         """
         Returns all SNOMED-CT concepts for tasks.
 
+        Uses the precompiled store if there is an up-to-date one (see
+        :mod:`camcops_server.cc_modules.cc_snomed_store`); otherwise, reads
+        the XML.
+
         Returns:
-            dict: maps lookup strings to :class:`SnomedConcept` objects
+            mapping: maps lookup strings to :class:`SnomedConcept` objects
         """
         if not self.snomed_task_xml_filename:
             return {}
-        return get_all_task_snomed_concepts(self.snomed_task_xml_filename)
+        return get_snomed_concepts(self.snomed_task_xml_filename,
+                                   SnomedStoreKind.TASK)
 
-    def get_icd9cm_snomed_concepts(self) -> Dict[str, List[SnomedConcept]]:
+    def get_icd9cm_snomed_concepts(self) \
+            -> Mapping[str, List[SnomedConcept]]:
         """
         Returns all SNOMED-CT concepts for ICD-9-CM codes supported by CamCOPS.
 
+        Uses the precompiled store if there is an up-to-date one.
+
         Returns:
-            dict: maps ICD-9-CM codes to :class:`SnomedConcept` objects
+            mapping: maps ICD-9-CM codes to :class:`SnomedConcept` objects
         """
         if not self.snomed_icd9_xml_filename:
             return {}
-        return get_icd9_snomed_concepts_from_xml(self.snomed_icd9_xml_filename)
+        return get_snomed_concepts(self.snomed_icd9_xml_filename,
+                                   SnomedStoreKind.ICD9CM)
 
-    def get_icd10_snomed_concepts(self) -> Dict[str, List[SnomedConcept]]:
+    def get_icd10_snomed_concepts(self) -> Mapping[str, List[SnomedConcept]]:
         """
         Returns all SNOMED-CT concepts for ICD-10-CM codes supported by
         CamCOPS.
 
+        Uses the precompiled store if there is an up-to-date one.
+
         Returns:
-            dict: maps ICD-10 codes to :class:`SnomedConcept` objects
+            mapping: maps ICD-10 codes to :class:`SnomedConcept` objects
         """
         if not self.snomed_icd10_xml_filename:
             return {}
-        return get_icd10_snomed_concepts_from_xml(
-            self.snomed_icd10_xml_filename)
+        return get_snomed_concepts(self.snomed_icd10_xml_filename,
+                                   SnomedStoreKind.ICD10)
+
+    def compile_snomed_stores(self) -> List[str]:
+        """
+        Compiles each configured SNOMED-CT XML file into a store (see
+        :mod:`camcops_server.cc_modules.cc_snomed_store`).
+
+        Returns:
+            the filenames of the stores written
+        """
+        store_filenames = []  # type: List[str]
+        for xml_filename, kind in (
+                (self.snomed_task_xml_filename, SnomedStoreKind.TASK),
+                (self.snomed_icd9_xml_filename, SnomedStoreKind.ICD9CM),
+                (self.snomed_icd10_xml_filename, SnomedStoreKind.ICD10)):
+            if xml_filename:
+                store_filenames.append(
+                    compile_snomed_store(xml_filename, kind))
+        if not store_filenames:
+            log.warning("No SNOMED-CT XML files are configured")
+        return store_filenames
 
     # -------------------------------------------------------------------------
     # Export functions
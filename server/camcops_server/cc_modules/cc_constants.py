@@ -382,7 +382,11 @@ class ConfigParamSite(object):
     """
     ALLOW_INSECURE_COOKIES = "ALLOW_INSECURE_COOKIES"
     CAMCOPS_LOGO_FILE_ABSOLUTE = "CAMCOPS_LOGO_FILE_ABSOLUTE"
+    CLIENT_API_LOGIN_CACHE_SIZE = "CLIENT_API_LOGIN_CACHE_SIZE"
+    CLIENT_API_LOGIN_CACHE_TTL_S = "CLIENT_API_LOGIN_CACHE_TTL_S"
     CLIENT_API_LOGLEVEL = "CLIENT_API_LOGLEVEL"
+    CLIENT_API_MAX_UPLOAD_SIZE_MB = "CLIENT_API_MAX_UPLOAD_SIZE_MB"
+    CLIENT_API_TIMING = "CLIENT_API_TIMING"
     CTV_FILENAME_SPEC = "CTV_FILENAME_SPEC"
     DB_URL = "DB_URL"
     DB_ECHO = "DB_ECHO"
@@ -406,11 +410,14 @@ class ConfigParamSite(object):
     PATIENT_SPEC_IF_ANONYMOUS = "PATIENT_SPEC_IF_ANONYMOUS"
     PERMIT_IMMEDIATE_DOWNLOADS = "PERMIT_IMMEDIATE_DOWNLOADS"
     RESTRICTED_TASKS = "RESTRICTED_TASKS"
+    SESSION_ACTIVITY_WRITE_INTERVAL_S = "SESSION_ACTIVITY_WRITE_INTERVAL_S"
     SESSION_COOKIE_SECRET = "SESSION_COOKIE_SECRET"
     SESSION_TIMEOUT_MINUTES = "SESSION_TIMEOUT_MINUTES"
     SNOMED_TASK_XML_FILENAME = "SNOMED_TASK_XML_FILENAME"
     SNOMED_ICD9_XML_FILENAME = "SNOMED_ICD9_XML_FILENAME"
     SNOMED_ICD10_XML_FILENAME = "SNOMED_ICD10_XML_FILENAME"
+    STORE_TASK_SUMMARIES = "STORE_TASK_SUMMARIES"
+    TASK_FETCH_THREADS = "TASK_FETCH_THREADS"
     TASK_FILENAME_SPEC = "TASK_FILENAME_SPEC"
     TRACKER_FILENAME_SPEC = "TRACKER_FILENAME_SPEC"
     USER_DOWNLOAD_DIR = "USER_DOWNLOAD_DIR"
@@ -435,6 +442,7 @@ class ConfigParamServer(object):
     DEBUG_TOOLBAR = "DEBUG_TOOLBAR"
     GUNICORN_DEBUG_RELOAD = "GUNICORN_DEBUG_RELOAD"
     GUNICORN_NUM_WORKERS = "GUNICORN_NUM_WORKERS"
+    GUNICORN_PRELOAD = "GUNICORN_PRELOAD"
     GUNICORN_TIMEOUT_S = "GUNICORN_TIMEOUT_S"
     HOST = "HOST"
     PORT = "PORT"
@@ -464,6 +472,7 @@ class ConfigParamExportGeneral(object):
     CELERY_BEAT_SCHEDULE_DATABASE = "CELERY_BEAT_SCHEDULE_DATABASE"
     CELERY_BROKER_URL = "CELERY_BROKER_URL"
     CELERY_WORKER_EXTRA_ARGS = "CELERY_WORKER_EXTRA_ARGS"
+    CELERY_EXPORT_BATCH_SIZE = "CELERY_EXPORT_BATCH_SIZE"
     CELERY_EXPORT_TASK_RATE_LIMIT = "CELERY_EXPORT_TASK_RATE_LIMIT"
     EXPORT_LOCKDIR = "EXPORT_LOCKDIR"
     RECIPIENTS = "RECIPIENTS"
@@ -480,6 +489,8 @@ class ConfigParamExportRecipient(object):
     DB_ADD_SUMMARIES = "DB_ADD_SUMMARIES"
     DB_ECHO = "DB_ECHO"
     DB_INCLUDE_BLOBS = "DB_INCLUDE_BLOBS"
+    DB_INCREMENTAL = "DB_INCREMENTAL"
+    DB_INSERT_BATCH_SIZE = "DB_INSERT_BATCH_SIZE"
     DB_PATIENT_ID_PER_ROW = "DB_PATIENT_ID_PER_ROW"
     DB_URL = "DB_URL"
     EMAIL_BCC = "EMAIL_BCC"
@@ -583,8 +594,12 @@ class ConfigDefaults(object):
     ALLOW_INSECURE_COOKIES = False
     CAMCOPS_LOGO_FILE_ABSOLUTE = os.path.join(STATIC_ROOT_DIR,
                                               "logo_camcops.png")
+    CLIENT_API_LOGIN_CACHE_SIZE = 1000  # 0 to disable
+    CLIENT_API_LOGIN_CACHE_TTL_S = 60
     CLIENT_API_LOGLEVEL = logging.INFO
     CLIENT_API_LOGLEVEL_TEXTFORMAT = "info"  # should match CLIENT_API_LOGLEVEL
+    CLIENT_API_MAX_UPLOAD_SIZE_MB = 1000
+    CLIENT_API_TIMING = False
     DB_DATABASE = "camcops"  # for demo configs only
     DB_ECHO = False
     DB_PORT = StandardPorts.MYSQL  # for demo configs only
@@ -603,7 +618,10 @@ class ConfigDefaults(object):
     PASSWORD_CHANGE_FREQUENCY_DAYS = 0  # zero for never
     PATIENT_SPEC_IF_ANONYMOUS = "anonymous"
     PERMIT_IMMEDIATE_DOWNLOADS = False
+    SESSION_ACTIVITY_WRITE_INTERVAL_S = 60  # 0 to write on every request
     SESSION_TIMEOUT_MINUTES = 30
+    STORE_TASK_SUMMARIES = False
+    TASK_FETCH_THREADS = 1  # 1 for serial fetching
     USER_DOWNLOAD_DIR = LINUX_DEFAULT_USER_DOWNLOAD_DIR  # for demo configs only  # noqa
     USER_DOWNLOAD_FILE_LIFETIME_MIN = 60
     USER_DOWNLOAD_MAX_SPACE_MB = 100
@@ -624,6 +642,7 @@ class ConfigDefaults(object):
     DEBUG_TOOLBAR = False
     GUNICORN_DEBUG_RELOAD = False
     GUNICORN_NUM_WORKERS = 2 * multiprocessing.cpu_count()
+    GUNICORN_PRELOAD = False
     GUNICORN_TIMEOUT_S = 30
     HOST = "127.0.0.1"
     PORT = StandardPorts.ALTERNATIVE_HTTP
@@ -638,6 +657,7 @@ class ConfigDefaults(object):
     CELERY_BROKER_URL = "amqp://"
     CELERY_BEAT_SCHEDULE_DATABASE = os.path.join(
         LINUX_DEFAULT_LOCK_DIR, "camcops_celerybeat_schedule")  # for demo configs only  # noqa
+    CELERY_EXPORT_BATCH_SIZE = 100
     EXPORT_LOCKDIR = LINUX_DEFAULT_LOCK_DIR  # for demo configs only
     SCHEDULE_TIMEZONE = "UTC"
 
@@ -646,6 +666,8 @@ class ConfigDefaults(object):
     ALL_GROUPS = False
     DB_ADD_SUMMARIES = True
     DB_INCLUDE_BLOBS = True
+    DB_INCREMENTAL = False
+    DB_INSERT_BATCH_SIZE = 1000
     DB_PATIENT_ID_PER_ROW = False
     EMAIL_BODY_IS_HTML = False
     EMAIL_KEEP_MESSAGE = False
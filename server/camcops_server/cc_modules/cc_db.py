@@ -653,8 +653,8 @@ class GenericTabletRecordMixin(object):
         row = OrderedDict()
         for attrname, column in gen_columns(self):
             row[heading_prefix + attrname] = getattr(self, attrname)
-        for s in self.get_summaries(req):
-            row[heading_prefix + s.name] = s.value
+        for name, value in self.get_summary_values(req).items():
+            row[heading_prefix + name] = value
         return TsvPage(name=self.__tablename__, rows=[row])
 
     # -------------------------------------------------------------------------
@@ -965,6 +965,13 @@ class GenericTabletRecordMixin(object):
         """
         return []
 
+    def get_summary_values(self, req: "CamcopsRequest") -> Dict[str, Any]:
+        """
+        Returns an ordered dictionary mapping the names of this object's
+        summaries (see :meth:`get_summaries`) to their values.
+        """
+        return OrderedDict((s.name, s.value) for s in self.get_summaries(req))
+
     def get_summary_names(self, req: "CamcopsRequest") -> List[str]:
         """
         Returns a list of summary field names.
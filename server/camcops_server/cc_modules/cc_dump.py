@@ -28,12 +28,15 @@ camcops_server/cc_modules/cc_dump.py
 
 """
 
+import datetime
+from itertools import groupby
 import logging
 from typing import (
     Any, Dict, Generator, Iterable, List, Optional, Set, Tuple, Type,
     TYPE_CHECKING, Union,
 )
 
+from cardinal_pythonlib.lists import chunks
 from cardinal_pythonlib.logs import BraceStyleAdapter
 from cardinal_pythonlib.sqlalchemy.orm_inspect import (
     gen_columns,
@@ -43,16 +46,23 @@ from cardinal_pythonlib.sqlalchemy.orm_inspect import (
 from sqlalchemy.exc import CompileError
 from sqlalchemy.engine.base import Engine
 from sqlalchemy.orm import Session as SqlASession
+from sqlalchemy.sql.expression import and_, or_, select
 from sqlalchemy.sql.schema import Column, MetaData, Table
 
 from camcops_server.cc_modules.cc_blob import Blob
+from camcops_server.cc_modules.cc_constants import (
+    EXTRA_TASK_SERVER_PK_FIELD,
+    EXTRA_TASK_TABLENAME_FIELD,
+)
 from camcops_server.cc_modules.cc_db import (
+    FN_PK,
     GenericTabletRecordMixin,
     TaskDescendant,
 )
 from camcops_server.cc_modules.cc_device import Device
 from camcops_server.cc_modules.cc_email import Email
 from camcops_server.cc_modules.cc_exportmodels import (
+    ExportedDatabaseWatermark,
     ExportedTask,
     ExportedTaskEmail,
     ExportedTaskFileGroup,
@@ -67,7 +77,11 @@ from camcops_server.cc_modules.cc_patientidnum import (
     PatientIdNum,
 )
 from camcops_server.cc_modules.cc_sqla_coltypes import CamcopsColumn
-from camcops_server.cc_modules.cc_task import Task
+from camcops_server.cc_modules.cc_task import (
+    SNOMED_COLNAME_TASKPK,
+    SNOMED_COLNAME_TASKTABLE,
+    Task,
+)
 from camcops_server.cc_modules.cc_user import User
 
 if TYPE_CHECKING:
@@ -126,6 +140,7 @@ DUMP_SKIP_TABLES = [
     # feature. (The Email/ExportedTask* set don't, so this is just caution in
     # case we add a relationship later!)
     Email.__tablename__,
+    ExportedDatabaseWatermark.__tablename__,
     ExportedTask.__tablename__,
     ExportedTaskEmail.__tablename__,
     ExportedTaskFileGroup.__tablename__,
@@ -140,6 +155,15 @@ DUMP_SKIP_ALL_RELS_FOR_TABLES = [
 ]
 FOREIGN_KEY_CONSTRAINTS_IN_DUMP = False
 # ... the keys will be present, but should we try to enforce constraints?
+# Pairs of (task table name, task PK) columns by which rows of an extra
+# summary table can be traced back to their task:
+SUMMARY_TABLE_TASK_XREF_COLNAMES = [
+    (EXTRA_TASK_TABLENAME_FIELD, EXTRA_TASK_SERVER_PK_FIELD),
+    (SNOMED_COLNAME_TASKTABLE, SNOMED_COLNAME_TASKPK),
+]
+# Maximum number of values in an "IN (...)" clause, for incremental updates
+# (SQLite, for one, limits the number of parameters per statement):
+INCREMENTAL_IN_CLAUSE_MAX_VALUES = 500
 
 
 # =============================================================================
@@ -181,6 +205,8 @@ class DumpController(object):
         self.tablenames_seen = set()  # type: Set[str]
         # ORM objects we've visited:
         self.instances_seen = set()  # type: Set[object]
+        # Rows waiting to be inserted, by destination table name:
+        self.pending_rows = {}  # type: Dict[str, List[Dict[str, Any]]]
 
         if export_options.db_make_all_tables_even_empty:
             self._create_all_dest_tables()
@@ -449,7 +475,8 @@ class DumpController(object):
         #     "sqlalchemy.exc.OperationalError: (sqlite3.OperationalError)
         #     database is locked", since a session is also being used.
         self.dst_session.commit()
-        dst_table.create(self.dst_engine)
+        dst_table.create(self.dst_engine,
+                         checkfirst=self.export_options.db_incremental)
         self.tablenames_created.add(tablename)
 
     def _copy_object_to_dump(self, src_obj: object) -> None:
@@ -478,18 +505,13 @@ class DumpController(object):
         # Any other columns to add for this table?
         if isinstance(src_obj, GenericTabletRecordMixin):
             if self.export_options.db_include_summaries:
-                for summary_element in src_obj.get_summaries(self.req):
-                    row[summary_element.name] = summary_element.value
+                row.update(src_obj.get_summary_values(self.req))
             if adding_extra_ids:
                 if patient:
                     patient.add_extra_idnum_info_to_row(row)
                 if isinstance(src_obj, TaskDescendant):
                     src_obj.add_extra_task_xref_info_to_row(row)
-        try:
-            self.dst_session.execute(dst_table.insert(row))
-        except CompileError:
-            log.critical("\ndst_table:\n{}\nrow:\n{}", dst_table, row)
-            raise
+        self._queue_row(dst_table, row)
 
         # 2. If required, add extra tables/rows that this task wants to
         #    offer (usually tables whose rows don't have a 1:1 correspondence
@@ -505,12 +527,246 @@ class DumpController(object):
                         patient.add_extra_idnum_info_to_row(row)
                     if adding_extra_ids:
                         est.add_extra_task_xref_info_to_row(row)
-                    try:
-                        self.dst_session.execute(dst_summary_table.insert(row))
-                    except CompileError:
-                        log.critical("\ndst_summary_table:\n{}\nrow:\n{}",
-                                     dst_table, row)
-                        raise
+                    self._queue_row(dst_summary_table, row)
+
+    def _queue_row(self, dst_table: Table, row: Dict[str, Any]) -> None:
+        """
+        Adds a row to the buffer for its destination table, inserting the
+        buffered rows if there are enough of them.
+        """
+        tablename = dst_table.name
+        rows = self.pending_rows.setdefault(tablename, [])
+        rows.append(row)
+        if len(rows) >= self.export_options.db_insert_batch_size:
+            self._flush_table(tablename)
+
+    def _flush_table(self, tablename: str) -> None:
+        """
+        Inserts any buffered rows for a destination table.
+
+        Consecutive rows with the same columns are inserted with a single
+        "executemany" call. (Rows for a table may differ in their columns, e.g.
+        if patients have different ID numbers, and an "executemany" INSERT
+        needs every row to have the same columns.)
+        """
+        rows = self.pending_rows.pop(tablename, None)
+        if not rows:
+            return
+        dst_table = self.dst_tables[tablename]
+        if self.export_options.db_incremental:
+            self._delete_rows_being_replaced(dst_table, rows)
+        for _, group in groupby(rows, key=lambda r: frozenset(r.keys())):
+            batch = list(group)
+            try:
+                self.dst_session.execute(dst_table.insert(), batch)
+            except CompileError:
+                log.critical("\ndst_table:\n{}\nfirst row:\n{}",
+                             dst_table, batch[0])
+                raise
+
+    def flush(self) -> None:
+        """
+        Inserts all buffered rows. Call this when you have finished with the
+        controller, and before committing the destination session.
+        """
+        for tablename in list(self.pending_rows.keys()):
+            self._flush_table(tablename)
+
+    # -------------------------------------------------------------------------
+    # Incremental updates
+    # -------------------------------------------------------------------------
+
+    def _delete_rows_being_replaced(self, dst_table: Table,
+                                    rows: List[Dict[str, Any]]) -> None:
+        """
+        For incremental exports: deletes any destination rows with the same
+        primary key as rows we are about to insert, so those rows are replaced
+        rather than duplicated. (For example, a new task may refer to a patient
+        whose record was exported with an earlier task.)
+        """
+        pk_columns = list(dst_table.primary_key.columns)
+        if len(pk_columns) != 1:
+            return  # e.g. extra summary tables without a PK
+        pk_col = pk_columns[0]
+        pks = [row[pk_col.name] for row in rows
+               if row.get(pk_col.name) is not None]
+        self._delete_dst_rows(dst_table, pk_col, pks)
+
+    def _delete_dst_rows(self, dst_table: Table, column: Column,
+                         values: List[Any], *extra_criteria: Any) -> None:
+        """
+        Deletes destination rows where ``column`` takes one of ``values`` (and
+        any extra criteria are met).
+        """
+        for chunk in chunks(values, INCREMENTAL_IN_CLAUSE_MAX_VALUES):
+            self.dst_session.execute(
+                dst_table.delete().where(
+                    and_(column.in_(chunk), *extra_criteria)
+                )
+            )
+
+    def _dst_pks_present(self, dst_table: Table,
+                         pks: List[int]) -> Set[int]:
+        """
+        Returns those server PKs that are present in a destination table.
+        """
+        pk_col = dst_table.columns[FN_PK]
+        present = set()  # type: Set[int]
+        for chunk in chunks(pks, INCREMENTAL_IN_CLAUSE_MAX_VALUES):
+            query = select([pk_col]).where(pk_col.in_(chunk))
+            present.update(row[0] for row in self.dst_session.execute(query))
+        return present
+
+    def _gen_current_successors(
+            self,
+            cls: Type[GenericTabletRecordMixin],
+            successor_pks: List[int]) \
+            -> Generator[GenericTabletRecordMixin, None, None]:
+        """
+        Follows chains of successor records (e.g. a patient edited several
+        times since the last export) and generates the current versions.
+        """
+        dbsession = self.req.dbsession
+        pks_seen = set()  # type: Set[int]
+        pending = [pk for pk in successor_pks if pk is not None]
+        while pending:
+            pks_seen.update(pending)
+            next_pending = []  # type: List[int]
+            for chunk in chunks(pending, INCREMENTAL_IN_CLAUSE_MAX_VALUES):
+                # noinspection PyProtectedMember
+                q = dbsession.query(cls).filter(cls._pk.in_(chunk))
+                for obj in q:
+                    # noinspection PyProtectedMember
+                    if obj._current:
+                        yield obj
+                    elif (obj._successor_pk is not None and
+                            obj._successor_pk not in pks_seen):
+                        next_pending.append(obj._successor_pk)
+            pending = next_pending
+
+    def _delete_summary_rows_for_tasks(self, task_class: Type[Task],
+                                       task_pks: List[int]) -> None:
+        """
+        Deletes rows of extra summary tables (e.g. SNOMED codes) belonging to
+        the specified tasks, where those rows can be traced back to their task.
+        """
+        task_tablename = task_class.__tablename__
+        for est in task_class().get_all_summary_tables(self.req):
+            dst_table = self.dst_tables.get(est.tablename)
+            if dst_table is None:
+                continue
+            for tablename_colname, pk_colname in \
+                    SUMMARY_TABLE_TASK_XREF_COLNAMES:
+                if (tablename_colname in dst_table.columns and
+                        pk_colname in dst_table.columns):
+                    self._delete_dst_rows(
+                        dst_table,
+                        dst_table.columns[pk_colname],
+                        task_pks,
+                        dst_table.columns[tablename_colname] == task_tablename
+                    )
+                    break
+            else:
+                log.warning(
+                    "Can't identify rows of summary table {!r} belonging to "
+                    "removed {!r} tasks; they will remain until the "
+                    "destination database is rebuilt",
+                    est.tablename, task_tablename)
+
+    def _dst_pks_gone_from_src(self, cls: Type[GenericTabletRecordMixin],
+                               dst_table: Table) -> List[int]:
+        """
+        Returns the server PKs of destination rows whose source records no
+        longer exist (having been deleted entirely, e.g. by an administrator
+        erasing a task or deleting a patient), or have been manually erased.
+        These don't show up as non-current records, so we have to compare
+        the destination with the source.
+        """
+        dbsession = self.req.dbsession
+        pk_col = dst_table.columns[FN_PK]
+        dst_pks = [row[0] for row in
+                   self.dst_session.execute(select([pk_col]))]
+        gone = []  # type: List[int]
+        for chunk in chunks(dst_pks, INCREMENTAL_IN_CLAUSE_MAX_VALUES):
+            # noinspection PyProtectedMember
+            q = (
+                dbsession.query(cls._pk)
+                .filter(cls._pk.in_(chunk))
+                .filter(or_(cls._manually_erased == False,  # noqa: E712
+                            cls._manually_erased.is_(None)))
+            )
+            kept = set(pk for pk, in q)
+            gone.extend(pk for pk in chunk if pk not in kept)
+        return gone
+
+    def remove_records(self,
+                       removed_since: Optional[datetime.datetime]) -> None:
+        """
+        For incremental exports. Deletes destination rows whose source records
+        have stopped being current (by being deleted, or superseded by a
+        modified version), and copies the current versions of any non-task
+        records so replaced. (Modified tasks are new tasks, and will be found
+        by the caller's task collection, subject to the export recipient's
+        filters.)
+
+        Also deletes destination rows whose source records have been deleted
+        entirely or manually erased, whenever that happened (which means
+        reading all the destination's server PKs).
+
+        Call this before copying tasks.
+
+        Args:
+            removed_since:
+                consider records removed at or after this time (UTC); use
+                ``None`` to consider all non-current records
+        """
+        dbsession = self.req.dbsession
+        tablenames_done = set()  # type: Set[str]
+        for cls in gen_orm_classes_from_base(GenericTabletRecordMixin):  # type: Type[GenericTabletRecordMixin]  # noqa
+            tablename = cls.__tablename__
+            if tablename in tablenames_done:
+                continue
+            tablenames_done.add(tablename)
+            dst_table = self.dst_tables.get(tablename)
+            if dst_table is None or self._dump_skip_table(tablename):
+                continue
+            gone_pks = self._dst_pks_gone_from_src(cls, dst_table)
+            if gone_pks:
+                log.debug("Removing {} deleted/erased record(s) from {!r}",
+                          len(gone_pks), tablename)
+                if issubclass(cls, Task):
+                    self._delete_summary_rows_for_tasks(cls, gone_pks)
+                self._delete_dst_rows(dst_table, dst_table.columns[FN_PK],
+                                      gone_pks)
+            # noinspection PyProtectedMember
+            q = (
+                dbsession.query(cls._pk, cls._successor_pk)
+                .filter(cls._current == False)  # noqa: E712
+            )
+            if removed_since is not None:
+                # noinspection PyProtectedMember
+                q = q.filter(cls._when_removed_batch_utc >= removed_since)
+            removed = q.all()  # type: List[Tuple[int, Optional[int]]]
+            if not removed:
+                continue
+            removed_pks = [pk for pk, _ in removed]
+            log.debug("Removing up to {} record(s) from {!r}",
+                      len(removed_pks), tablename)
+            if issubclass(cls, Task):
+                self._delete_summary_rows_for_tasks(cls, removed_pks)
+                successor_pks = []  # type: List[int]
+            else:
+                present = self._dst_pks_present(dst_table, removed_pks)
+                successor_pks = [successor_pk
+                                 for pk, successor_pk in removed
+                                 if pk in present]
+            self._delete_dst_rows(dst_table, dst_table.columns[FN_PK],
+                                  removed_pks)
+            for successor in self._gen_current_successors(cls,
+                                                          successor_pks):
+                self.instances_seen.add(successor)
+                self.consider_object(successor)
+        self.flush()
 
     def _get_or_insert_summary_table(self, est: "ExtraSummaryTable",
                                      add_extra_id_cols: bool = False) -> Table:
@@ -563,11 +819,13 @@ class DumpController(object):
 # Copying stuff to a dump
 # =============================================================================
 
-def copy_tasks_and_summaries(tasks: Iterable[Task],
-                             dst_engine: Engine,
-                             dst_session: SqlASession,
-                             export_options: "TaskExportOptions",
-                             req: "CamcopsRequest") -> None:
+def copy_tasks_and_summaries(
+        tasks: Iterable[Task],
+        dst_engine: Engine,
+        dst_session: SqlASession,
+        export_options: "TaskExportOptions",
+        req: "CamcopsRequest",
+        removed_since: datetime.datetime = None) -> None:
     """
     Copy a set of tasks, and their associated related information (found by
     walking the SQLAlchemy ORM tree), to the dump.
@@ -578,6 +836,11 @@ def copy_tasks_and_summaries(tasks: Iterable[Task],
         dst_session:  destination SQLAlchemy Session
         export_options: :class:`camcops_server.cc_modules.cc_simpleobjects.TaskExportOptions`
         req: :class:`camcops_server.cc_modules.cc_request.CamcopsRequest`
+        removed_since:
+            for incremental exports (``export_options.db_incremental``):
+            records removed from the server at or after this time (UTC) are
+            first removed from the destination; if this is ``None``, all
+            non-current records are considered
     """  # noqa
     # How best to create the structure that's required?
     #
@@ -600,6 +863,10 @@ def copy_tasks_and_summaries(tasks: Iterable[Task],
                                 export_options=export_options,
                                 req=req)
 
+    if export_options.db_incremental:
+        log.debug("Removing deleted/modified records...")
+        controller.remove_records(removed_since)
+
     # We walk through all the objects.
     log.debug("Starting to copy tasks...")
     for startobj in tasks:
@@ -611,4 +878,5 @@ def copy_tasks_and_summaries(tasks: Iterable[Task],
                 skip_all_relationships_for_tablenames=DUMP_SKIP_ALL_RELS_FOR_TABLES,  # noqa
                 skip_all_objects_for_tablenames=DUMP_SKIP_TABLES):
             controller.consider_object(src_obj)
+    controller.flush()
     log.debug("... finished copying tasks.")
@@ -65,6 +65,10 @@ require careful multi-instance locking), but to have a "sent" log. That way:
   - On UNIX, ``lockfile`` uses ``LinkLockFile``:
     https://github.com/smontanaro/pylockfile/blob/master/lockfile/linklockfile.py
 
+- Individual tasks being exported are now claimed via a database table
+  instead (see :func:`export_task`); that works across servers and doesn't
+  need a file per task and recipient.
+
 *MESSAGE QUEUE AND BACKEND*
 
 Thoughts as of 2018-12-22.
@@ -149,23 +153,26 @@ Thoughts as of 2018-12-22.
 
 """  # noqa
 
+import datetime
 import logging
 import os
 import sqlite3
 import tempfile
-from typing import (Dict, List, Generator, Optional,
+from typing import (Dict, Iterable, List, Generator, Optional, Set,
                     Tuple, Type, TYPE_CHECKING, Union)
 
 from cardinal_pythonlib.classes import gen_all_subclasses
 from cardinal_pythonlib.datetimefunc import (
     format_datetime,
     get_now_localtz_pendulum,
+    get_now_utc_datetime,
     get_tz_local,
     get_tz_utc,
 )
 from cardinal_pythonlib.email.sendmail import CONTENT_TYPE_TEXT
 from cardinal_pythonlib.fileops import relative_filename_within_dir
 from cardinal_pythonlib.json.serialize import register_for_json
+from cardinal_pythonlib.lists import chunks
 from cardinal_pythonlib.logs import BraceStyleAdapter
 from cardinal_pythonlib.pyramid.responses import (
     OdsResponse,
@@ -176,25 +183,33 @@ from cardinal_pythonlib.pyramid.responses import (
 )
 from cardinal_pythonlib.sizeformatter import bytes2human
 from cardinal_pythonlib.sqlalchemy.session import get_safe_url_from_engine
+from celery.exceptions import SoftTimeLimitExceeded
 import lockfile
 from pendulum import DateTime as Pendulum, Duration, Period
 from pyramid.httpexceptions import HTTPBadRequest
 from pyramid.renderers import render_to_response
 from pyramid.response import Response
 from sqlalchemy.engine import create_engine
+from sqlalchemy.engine.base import Engine
 from sqlalchemy.engine.result import ResultProxy
+from sqlalchemy.event.api import listen
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session as SqlASession, sessionmaker
 from sqlalchemy.sql.expression import text
+from sqlalchemy.sql.functions import func
 from sqlalchemy.sql.schema import Column, MetaData, Table
 from sqlalchemy.sql.sqltypes import Text
 
 from camcops_server.cc_modules.cc_audit import audit
 from camcops_server.cc_modules.cc_constants import DateFormat
+from camcops_server.cc_modules.cc_device import Device
 from camcops_server.cc_modules.cc_dump import copy_tasks_and_summaries
 from camcops_server.cc_modules.cc_email import Email
 from camcops_server.cc_modules.cc_exportmodels import (
+    ExportedDatabaseWatermark,
     ExportedTask,
     ExportRecipient,
+    ExportTaskClaim,
     gen_tasks_having_exportedtasks,
     get_collection_for_export,
 )
@@ -203,11 +218,12 @@ from camcops_server.cc_modules.cc_pyramid import Routes, ViewArg, ViewParam
 from camcops_server.cc_modules.cc_simpleobjects import TaskExportOptions
 from camcops_server.cc_modules.cc_sqlalchemy import sql_from_sqlite_database
 from camcops_server.cc_modules.cc_task import Task
+from camcops_server.cc_modules.cc_taskindex import TaskSummaryEntry
 from camcops_server.cc_modules.cc_tsv import TsvCollection, TsvPage
 from camcops_server.cc_modules.celery import (
     create_user_download,
     email_basic_dump,
-    export_task_backend,
+    export_tasks_backend,
 )
 
 if TYPE_CHECKING:
@@ -222,6 +238,30 @@ log = BraceStyleAdapter(logging.getLogger(__name__))
 # =============================================================================
 
 INFOSCHEMA_PAGENAME = "_camcops_information_schema_columns"
+EXPORT_TASK_CLAIM_EXPIRY = datetime.timedelta(hours=1)
+# ... after which a claim on a task (see export_task) is assumed to have been
+# abandoned by a process that died, and another process may take it over.
+
+
+# =============================================================================
+# Exceptions
+# =============================================================================
+
+class ExportTimeLimitExceeded(SoftTimeLimitExceeded):
+    """
+    Raised by :func:`export_tasks_by_pk` when the (Celery) job exporting a
+    batch of tasks runs out of time, so that the job can resubmit the tasks
+    it hasn't finished.
+    """
+    def __init__(self, unfinished: List[Tuple[str, int]]) -> None:
+        """
+        Args:
+            unfinished: tuples ``basetable, task_pk`` for the tasks that were
+                not exported, including any that failed
+        """
+        super().__init__(f"Time limit exceeded with {len(unfinished)} "
+                         f"task(s) not exported")
+        self.unfinished = unfinished
 
 
 # =============================================================================
@@ -315,16 +355,33 @@ def export_whole_database(req: "CamcopsRequest",
 
     Holds a recipient-specific file lock in the process.
 
+    If the recipient is incremental (``DB_INCREMENTAL``), the destination
+    database is updated rather than rebuilt: records removed from the server
+    since the recipient's watermark (see
+    :class:`camcops_server.cc_modules.cc_exportmodels.ExportedDatabaseWatermark`)
+    are removed from the destination, and only tasks not yet exported to this
+    recipient are copied.
+
     Args:
         req: a :class:`camcops_server.cc_modules.cc_request.CamcopsRequest`
         recipient: an :class:`camcops_server.cc_modules.cc_exportmodels.ExportRecipient`
         via_index: use the task index (faster)?
     """  # noqa
     cfg = req.config
+    dbsession = req.dbsession
     lockfilename = cfg.get_export_lockfilename_db(
         recipient_name=recipient.recipient_name)
     try:
         with lockfile.FileLock(lockfilename, timeout=0):  # doesn't wait
+            incremental = recipient.db_incremental
+            removed_since = None  # type: Optional[datetime.datetime]
+            new_watermark = None  # type: Optional[datetime.datetime]
+            if incremental:
+                removed_since = ExportedDatabaseWatermark.get_watermark_utc(
+                    dbsession, recipient.recipient_name)
+                new_watermark = get_db_export_watermark_candidate(req)
+                log.info("Incremental export; removing records removed "
+                         "since {}", removed_since or "(ever)")
             collection = get_collection_for_export(req, recipient,
                                                    via_index=via_index)
             dst_engine = create_engine(recipient.db_url,
@@ -332,12 +389,17 @@ def export_whole_database(req: "CamcopsRequest",
             log.info("Exporting to database: {}",
                      get_safe_url_from_engine(dst_engine))
             dst_session = sessionmaker(bind=dst_engine)()  # type: SqlASession
+            if recipient.db_add_summaries:
+                TaskSummaryEntry.preload_for_tasks(
+                    req, collection.gen_tasks_by_class())
             task_generator = gen_tasks_having_exportedtasks(collection)
             export_options = TaskExportOptions(
                 include_blobs=recipient.db_include_blobs,
                 db_patient_id_per_row=recipient.db_patient_id_per_row,
                 db_make_all_tables_even_empty=True,
                 db_include_summaries=recipient.db_add_summaries,
+                db_incremental=incremental,
+                db_insert_batch_size=recipient.db_insert_batch_size,
             )
             copy_tasks_and_summaries(
                 tasks=task_generator,
@@ -345,13 +407,39 @@ def export_whole_database(req: "CamcopsRequest",
                 dst_session=dst_session,
                 export_options=export_options,
                 req=req,
+                removed_since=removed_since,
             )
             dst_session.commit()
+            if incremental:
+                ExportedDatabaseWatermark.set_watermark_utc(
+                    dbsession, recipient.recipient_name, new_watermark)
     except lockfile.AlreadyLocked:
         log.warning("Export logfile {!r} already locked by another process; "
                     "aborting", lockfilename)
 
 
+def get_db_export_watermark_candidate(
+        req: "CamcopsRequest") -> datetime.datetime:
+    """
+    Returns the watermark to record for an incremental database export that
+    is starting now, if it succeeds: the current time (UTC), or the start of
+    the earliest upload batch still in progress, if that is earlier. (Records
+    removed by an upload are stamped with the batch's start time, but only
+    become visible when the upload finishes.)
+
+    Args:
+        req: a :class:`camcops_server.cc_modules.cc_request.CamcopsRequest`
+    """
+    watermark = req.now_utc_no_tzinfo
+    earliest_ongoing_batch = (
+        req.dbsession.query(func.min(Device.ongoing_upload_batch_utc))
+        .scalar()
+    )  # type: Optional[datetime.datetime]
+    if earliest_ongoing_batch is not None:
+        watermark = min(watermark, earliest_ongoing_batch)
+    return watermark
+
+
 def export_tasks_individually(req: "CamcopsRequest",
                               recipient: ExportRecipient,
                               via_index: bool = True,
@@ -367,7 +455,7 @@ def export_tasks_individually(req: "CamcopsRequest",
     """  # noqa
     collection = get_collection_for_export(req, recipient, via_index=via_index)
     if schedule_via_backend:
-        recipient_name = recipient.recipient_name
+        basetable_pk_pairs = []  # type: List[Tuple[str, int]]
         for task_or_index in collection.gen_all_tasks_or_indexes():
             if isinstance(task_or_index, Task):
                 basetable = task_or_index.tablename
@@ -375,13 +463,9 @@ def export_tasks_individually(req: "CamcopsRequest",
             else:
                 basetable = task_or_index.task_table_name
                 task_pk = task_or_index.task_pk
-            log.info("Submitting background job to export task {}.{} to {}",
-                     basetable, task_pk, recipient_name)
-            export_task_backend.delay(
-                recipient_name=recipient_name,
-                basetable=basetable,
-                task_pk=task_pk
-            )
+            basetable_pk_pairs.append((basetable, task_pk))
+        schedule_export_tasks_via_backend(req, recipient.recipient_name,
+                                          basetable_pk_pairs)
     else:
         for task in collection.gen_tasks_by_class():
             # Do NOT use this to check the working of export_task_backend():
@@ -391,16 +475,183 @@ def export_tasks_individually(req: "CamcopsRequest",
             export_task(req, recipient, task)
 
 
+def schedule_export_tasks_via_backend(
+        req: "CamcopsRequest",
+        recipient_name: str,
+        basetable_pk_pairs: List[Tuple[str, int]]) -> None:
+    """
+    Submits background jobs to export tasks to a recipient, each job handling
+    up to ``CELERY_EXPORT_BATCH_SIZE`` tasks; see
+    :func:`camcops_server.cc_modules.celery.export_tasks_backend`.
+
+    Args:
+        req: a :class:`camcops_server.cc_modules.cc_request.CamcopsRequest`
+        recipient_name: export recipient name (as per the config file)
+        basetable_pk_pairs: list of tuples ``basetable, task_pk``
+    """
+    batch_size = max(1, req.config.celery_export_batch_size)
+    for batch in chunks(basetable_pk_pairs, batch_size):
+        log.info("Submitting background job to export {} task(s) to {}",
+                 len(batch), recipient_name)
+        export_tasks_backend.delay(
+            recipient_name=recipient_name,
+            basetable_pk_pairs=batch
+        )
+
+
+def export_tasks_by_pk(
+        req: "CamcopsRequest",
+        recipient: ExportRecipient,
+        basetable_pk_pairs: Iterable[Tuple[str, int]]) \
+        -> List[Tuple[str, int]]:
+    """
+    Exports a batch of tasks, specified by base table name and server PK,
+    within a single request. Tasks are fetched with one query per task table
+    (rather than one per task), and each is exported via :func:`export_task`.
+    Tasks already exported to this recipient are skipped, again with one query
+    per task table.
+
+    :func:`export_task` commits several times per task, so while it runs, the
+    session doesn't expire objects on commit; otherwise, each task we had
+    fetched would be fetched again, one by one. (If a task's export fails, we
+    roll back, which does expire them, and the remaining tasks are then
+    re-fetched as they are used.)
+
+    A task whose export raises an exception doesn't stop the others. However,
+    if the Celery soft time limit is reached, we stop, and raise
+    :exc:`ExportTimeLimitExceeded`.
+
+    Args:
+        req: a :class:`camcops_server.cc_modules.cc_request.CamcopsRequest`
+        recipient: an :class:`camcops_server.cc_modules.cc_exportmodels.ExportRecipient`
+        basetable_pk_pairs: tuples ``basetable, task_pk``
+
+    Returns:
+        list: tuples ``basetable, task_pk`` for the tasks whose export raised
+        an exception, or which another process was exporting; these may be
+        worth retrying
+
+    Raises:
+        :exc:`ExportTimeLimitExceeded`, listing the tasks not exported, if
+        the Celery soft time limit is reached
+    """  # noqa
+    dbsession = req.dbsession
+    pks_by_table = {}  # type: Dict[str, List[int]]
+    for basetable, task_pk in basetable_pk_pairs:
+        pks_by_table.setdefault(basetable, []).append(task_pk)
+    failed = []  # type: List[Tuple[str, int]]
+    finished = set()  # type: Set[Tuple[str, int]]
+    expire_on_commit = dbsession.expire_on_commit
+    dbsession.expire_on_commit = False
+    try:
+        _export_tasks_by_table(req, recipient, pks_by_table, failed, finished)
+    except SoftTimeLimitExceeded:
+        dbsession.rollback()
+        unfinished = failed + [
+            (basetable, task_pk)
+            for basetable, task_pks in pks_by_table.items()
+            for task_pk in task_pks
+            if (basetable, task_pk) not in finished
+        ]
+        log.warning("Export to recipient {!r}: time limit exceeded with {} "
+                    "task(s) not exported", recipient.recipient_name,
+                    len(unfinished))
+        raise ExportTimeLimitExceeded(unfinished)
+    finally:
+        dbsession.expire_on_commit = expire_on_commit
+    return failed
+
+
+def _export_tasks_by_table(req: "CamcopsRequest",
+                           recipient: ExportRecipient,
+                           pks_by_table: Dict[str, List[int]],
+                           failed: List[Tuple[str, int]],
+                           finished: Set[Tuple[str, int]]) -> None:
+    """
+    Does the work for :func:`export_tasks_by_pk`.
+
+    Args:
+        req: a :class:`camcops_server.cc_modules.cc_request.CamcopsRequest`
+        recipient: an :class:`camcops_server.cc_modules.cc_exportmodels.ExportRecipient`
+        pks_by_table: dictionary mapping base table names to task PKs
+        failed: list to which we add ``basetable, task_pk`` for tasks that
+            failed (or were claimed by another process) and are worth retrying
+        finished: set to which we add ``basetable, task_pk`` for each task
+            we have dealt with (successfully or not)
+    """  # noqa
+    from camcops_server.cc_modules.cc_taskfactory import (
+        task_factory_multiple_no_security_checks,
+    )  # delayed import
+
+    dbsession = req.dbsession
+    for basetable, task_pks in pks_by_table.items():
+        # Skip (without fetching) tasks that have been exported already, e.g.
+        # by another job.
+        already_exported = ExportedTask.task_pks_already_exported(
+            dbsession, recipient.recipient_name, basetable, task_pks)
+        if already_exported:
+            log.info("{} task(s) from {} already exported to recipient {!r}; "
+                     "ignoring", len(already_exported), basetable,
+                     recipient.recipient_name)
+            finished.update((basetable, pk) for pk in already_exported)
+            task_pks = [pk for pk in task_pks if pk not in already_exported]
+            if not task_pks:
+                continue
+        try:
+            tasks = task_factory_multiple_no_security_checks(
+                dbsession, basetable, task_pks)
+        except KeyError:
+            log.error("Export to recipient {!r}: no such task table {!r}",
+                      recipient.recipient_name, basetable)
+            finished.update((basetable, pk) for pk in task_pks)
+            continue
+        for task_pk in task_pks:
+            task = tasks.get(task_pk)
+            if task is None:
+                log.error("Export to recipient {!r}: No task found for {} {}",
+                          recipient.recipient_name, basetable, task_pk)
+                finished.add((basetable, task_pk))
+                continue
+            try:
+                exported = export_task(req, recipient, task)
+            except SoftTimeLimitExceeded:
+                raise
+            except Exception:
+                log.exception("Export of {} {} to recipient {!r} failed",
+                              basetable, task_pk, recipient.recipient_name)
+                dbsession.rollback()
+                failed.append((basetable, task_pk))
+                finished.add((basetable, task_pk))
+                continue
+            if not exported:
+                # Another process is exporting it to this recipient. If that
+                # fails, we'll try again.
+                failed.append((basetable, task_pk))
+            finished.add((basetable, task_pk))
+
+
 def export_task(req: "CamcopsRequest",
                 recipient: ExportRecipient,
-                task: Task) -> None:
+                task: Task) -> bool:
     """
     Exports a single task, checking that it remains valid to do so.
 
+    First, we claim the task for this recipient (see
+    :func:`claim_task_for_export`), so that competing jobs don't export it to
+    the same recipient twice. The claim is committed before we transmit
+    anything, so we hold no database locks (e.g. on the task itself) while
+    transmitting, and exports of the same task to other recipients proceed
+    independently.
+
     Args:
         req: a :class:`camcops_server.cc_modules.cc_request.CamcopsRequest`
         recipient: an :class:`camcops_server.cc_modules.cc_exportmodels.ExportRecipient`
         task: a :class:`camcops_server.cc_modules.cc_task.Task`
+
+    Returns:
+        ``False`` if we couldn't export the task because another process is
+        exporting it to the same recipient (so it may be worth trying again
+        later); otherwise ``True``
     """  # noqa
 
     # Double-check it's OK! Just in case, for example, an old backend task has
@@ -408,37 +659,151 @@ def export_task(req: "CamcopsRequest",
     # other way.
     if not recipient.is_task_suitable(task):
         # Warning will already have been emitted (by is_task_suitable).
-        return
+        return True
 
-    cfg = req.config
-    lockfilename = cfg.get_export_lockfilename_task(
-        recipient_name=recipient.recipient_name,
-        basetable=task.tablename,
-        pk=task.pk,
-    )
     dbsession = req.dbsession
+    recipient_name = recipient.recipient_name
+    basetable = task.tablename
+    task_pk = task.pk
+    claimed_at_utc = get_now_utc_datetime().replace(microsecond=0)
+    # ... whole seconds, so we can match it however the database stores it
+    claimed = None  # type: Optional[bool]  # None: don't know (yet)
     try:
-        with lockfile.FileLock(lockfilename, timeout=0):  # doesn't wait
-            # We recheck the export status once we hold the lock, in case
-            # multiple jobs are competing to export it.
-            if ExportedTask.task_already_exported(
-                    dbsession=dbsession,
-                    recipient_name=recipient.recipient_name,
-                    basetable=task.tablename,
-                    task_pk=task.pk):
-                log.info("Task {!r} already exported to recipient {!r}; "
-                         "ignoring", task, recipient)
-                # Not a warning; it's normal to see these because it allows the
-                # client API to skip some checks for speed.
-                return
-            # OK; safe to export now.
-            et = ExportedTask(recipient, task)
-            dbsession.add(et)
-            et.export(req)
-            dbsession.commit()  # so the ExportedTask is visible to others ASAP
-    except lockfile.AlreadyLocked:
-        log.warning("Export logfile {!r} already locked by another process; "
-                    "aborting", lockfilename)
+        claimed = claim_task_for_export(dbsession, recipient_name, basetable,
+                                        task_pk, claimed_at_utc)
+        if not claimed:
+            log.info("Task {!r} being exported to recipient {!r} by another "
+                     "process; not exporting", task, recipient)
+            return False
+        _export_task_unless_already_exported(req, recipient, task)
+    except BaseException:
+        # Discard whatever the export left in the session. (Not otherwise: a
+        # rollback expires every object in the session.)
+        dbsession.rollback()
+        raise
+    finally:
+        # Give up the claim, even if we ran out of time -- including while
+        # claiming, in which case we may or may not have the claim, so we
+        # delete it only if it's ours.
+        if claimed is not False:
+            release_task_export_claim(dbsession, recipient_name, basetable,
+                                      task_pk, claimed_at_utc)
+    return True
+
+
+def _export_task_unless_already_exported(req: "CamcopsRequest",
+                                         recipient: ExportRecipient,
+                                         task: Task) -> None:
+    """
+    Exports a single task, unless it has already been exported to this
+    recipient. The caller must hold a claim on the task (see
+    :func:`export_task`).
+
+    Args:
+        req: a :class:`camcops_server.cc_modules.cc_request.CamcopsRequest`
+        recipient: an :class:`camcops_server.cc_modules.cc_exportmodels.ExportRecipient`
+        task: a :class:`camcops_server.cc_modules.cc_task.Task`
+    """  # noqa
+    dbsession = req.dbsession
+    # We recheck the export status once we hold the claim, in case
+    # multiple jobs are competing to export it.
+    if ExportedTask.task_already_exported(
+            dbsession=dbsession,
+            recipient_name=recipient.recipient_name,
+            basetable=task.tablename,
+            task_pk=task.pk):
+        log.info("Task {!r} already exported to recipient {!r}; "
+                 "ignoring", task, recipient)
+        # Not a warning; it's normal to see these because it allows the
+        # client API to skip some checks for speed.
+        return
+    # OK; safe to export now.
+    et = ExportedTask(recipient, task)
+    dbsession.add(et)
+    et.export(req)
+    dbsession.commit()  # so the ExportedTask is visible to others ASAP
+
+
+def claim_task_for_export(dbsession: SqlASession,
+                          recipient_name: str,
+                          basetable: str,
+                          task_pk: int,
+                          claimed_at_utc: datetime.datetime = None) -> bool:
+    """
+    Claims a task for export to a recipient, unless another process has
+    already claimed it (and its claim hasn't expired; see
+    :data:`EXPORT_TASK_CLAIM_EXPIRY`). Commits, so that the claim is visible
+    to other processes immediately.
+
+    Args:
+        dbsession: a :class:`sqlalchemy.orm.session.Session`
+        recipient_name: name of the export recipient
+        basetable: name of the task's base table
+        task_pk: server PK of the task
+        claimed_at_utc: time to record for the claim (UTC); default now
+
+    Returns:
+        did we get the claim?
+    """
+    now = claimed_at_utc or get_now_utc_datetime()
+    claim = ExportTaskClaim()
+    claim.recipient_name = recipient_name
+    claim.basetable = basetable
+    claim.task_server_pk = task_pk
+    claim.claimed_at_utc = now
+    dbsession.add(claim)
+    try:
+        dbsession.commit()
+        return True
+    except IntegrityError:
+        # Someone else has claimed it.
+        dbsession.rollback()
+    # Take over the claim if it has expired. Only one process can do so, as
+    # the update rechecks the claim time.
+    n_taken_over = (
+        dbsession.query(ExportTaskClaim)
+        .filter(ExportTaskClaim.recipient_name == recipient_name)
+        .filter(ExportTaskClaim.basetable == basetable)
+        .filter(ExportTaskClaim.task_server_pk == task_pk)
+        .filter(ExportTaskClaim.claimed_at_utc <
+                now - EXPORT_TASK_CLAIM_EXPIRY)
+        .update({ExportTaskClaim.claimed_at_utc: now},
+                synchronize_session=False)
+    )
+    dbsession.commit()
+    if n_taken_over:
+        log.warning("Took over expired claim to export {} {} to recipient "
+                    "{!r}", basetable, task_pk, recipient_name)
+    return bool(n_taken_over)
+
+
+def release_task_export_claim(
+        dbsession: SqlASession,
+        recipient_name: str,
+        basetable: str,
+        task_pk: int,
+        claimed_at_utc: datetime.datetime = None) -> None:
+    """
+    Releases a claim made by :func:`claim_task_for_export`, and commits.
+
+    Args:
+        dbsession: a :class:`sqlalchemy.orm.session.Session`
+        recipient_name: name of the export recipient
+        basetable: name of the task's base table
+        task_pk: server PK of the task
+        claimed_at_utc: if specified, release the claim only if it was made
+            at this time (i.e. it's ours)
+    """
+    q = (
+        dbsession.query(ExportTaskClaim)
+        .filter(ExportTaskClaim.recipient_name == recipient_name)
+        .filter(ExportTaskClaim.basetable == basetable)
+        .filter(ExportTaskClaim.task_server_pk == task_pk)
+    )
+    if claimed_at_utc is not None:
+        q = q.filter(ExportTaskClaim.claimed_at_utc == claimed_at_utc)
+    q.delete(synchronize_session=False)
+    dbsession.commit()
 
 
 # =============================================================================
@@ -558,12 +923,35 @@ def write_information_schema_to_dst(
     # 3. Fetch data.
     query = get_information_schema_query(req)
     # 4. Write the data.
-    for row in query:
-        dst_session.execute(table.insert(row))
+    rows = [dict(row) for row in query]
+    if rows:
+        dst_session.execute(table.insert(), rows)  # one "executemany"
     # 5. COMMIT
     dst_session.commit()
 
 
+def create_scratch_sqlite_engine(db_filename: str) -> Engine:
+    """
+    Creates an SQLAlchemy :class:`Engine` for a temporary SQLite database file
+    that we are building (e.g. for download) and will then discard.
+
+    We don't need such a file to survive a crash, so we turn off the rollback
+    journal and don't wait for writes to reach the disk; that makes inserting
+    much faster.
+    """
+    engine = create_engine("sqlite:///" + db_filename, echo=False)
+
+    # noinspection PyUnusedLocal
+    def set_sqlite_pragmas(dbapi_connection, connection_record) -> None:
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=OFF")
+        cursor.execute("PRAGMA synchronous=OFF")
+        cursor.close()
+
+    listen(engine, "connect", set_sqlite_pragmas)
+    return engine
+
+
 # =============================================================================
 # Convert task collections to different export formats for user download
 # =============================================================================
@@ -825,6 +1213,8 @@ class TaskCollectionExporter(object):
         tsvcoll = TsvCollection()
         # Iterate through tasks, creating the TSV collection
         for cls in self.collection.task_classes():
+            TaskSummaryEntry.preload_for_tasks(
+                self.req, self.collection.tasks_for_task_class(cls))
             for task in gen_audited_tasks_for_task_class(self.collection, cls,
                                                          audit_descriptions):
                 tsv_pages = task.get_tsv_pages(self.req)
@@ -985,13 +1375,16 @@ class SqliteExporter(TaskCollectionExporter):
             # ---------------------------------------------------------------------
             # Make SQLAlchemy session
             # ---------------------------------------------------------------------
-            url = "sqlite:///" + db_filename
-            engine = create_engine(url, echo=False)
+            engine = create_scratch_sqlite_engine(db_filename)
             dst_session = sessionmaker(bind=engine)()  # type: SqlASession
             # ---------------------------------------------------------------------
             # Iterate through tasks, creating tables as we need them.
             # ---------------------------------------------------------------------
             audit_descriptions = []  # type: List[str]
+            export_options = self.get_export_options()
+            if export_options.db_include_summaries:
+                TaskSummaryEntry.preload_for_tasks(
+                    self.req, self.collection.gen_tasks_by_class())
             task_generator = gen_audited_tasks_by_task_class(self.collection,
                                                              audit_descriptions)
             # ---------------------------------------------------------------------
@@ -1006,7 +1399,7 @@ class SqliteExporter(TaskCollectionExporter):
             copy_tasks_and_summaries(tasks=task_generator,
                                      dst_engine=engine,
                                      dst_session=dst_session,
-                                     export_options=self.get_export_options(),
+                                     export_options=export_options,
                                      req=self.req)
             dst_session.commit()
             if self.options.include_information_schema_columns:
@@ -28,12 +28,16 @@ camcops_server/cc_modules/cc_exportmodels.py
 
 """
 
+import datetime
 import logging
 import os
 import socket
 import subprocess
 import sys
-from typing import Generator, List, Optional, Tuple, TYPE_CHECKING
+import tempfile
+from typing import (
+    Generator, Iterable, List, Optional, Set, Tuple, TYPE_CHECKING,
+)
 
 from cardinal_pythonlib.datetimefunc import (
     get_now_utc_datetime,
@@ -44,6 +48,7 @@ from cardinal_pythonlib.email.sendmail import (
     CONTENT_TYPE_TEXT,
 )
 from cardinal_pythonlib.fileops import mkdir_p
+from cardinal_pythonlib.lists import chunks
 from cardinal_pythonlib.logs import BraceStyleAdapter
 from cardinal_pythonlib.network import ping
 from cardinal_pythonlib.sqlalchemy.list_types import StringListType
@@ -51,6 +56,7 @@ from cardinal_pythonlib.sqlalchemy.orm_query import bool_from_exists_clause
 import hl7
 from pendulum import DateTime as Pendulum
 from sqlalchemy.orm import (
+    Query,
     reconstructor,
     relationship,
     Session as SqlASession,
@@ -81,15 +87,12 @@ from camcops_server.cc_modules.cc_filename import (
 )
 from camcops_server.cc_modules.cc_hl7 import (
     make_msh_segment,
-    MLLPTimeoutClient,
+    mllp_connection_pool,
     msg_is_successful_ack,
     SEGMENT_SEPARATOR,
 )
-from camcops_server.cc_modules.cc_redcap import (
-    RedcapExportException,
-    RedcapTaskExporter,
-)
 from camcops_server.cc_modules.cc_sqla_coltypes import (
+    ExportRecipientNameColType,
     LongText,
     TableNameColType,
 )
@@ -113,6 +116,7 @@ log = BraceStyleAdapter(logging.getLogger(__name__))
 
 DOS_NEWLINE = "\r\n"
 UTF8 = "utf8"
+MAX_PKS_PER_EXPORT_CHECK = 500  # keeps the IN clause a sensible size
 
 
 # =============================================================================
@@ -470,15 +474,63 @@ class ExportedTask(Base):
 
         """
         exists_q = (
+            cls._query_successful_exports(dbsession, recipient_name, basetable)
+            .filter(cls.task_server_pk == task_pk)
+            .exists()
+        )
+        return bool_from_exists_clause(dbsession, exists_q)
+
+    @classmethod
+    def task_pks_already_exported(cls,
+                                  dbsession: SqlASession,
+                                  recipient_name: str,
+                                  basetable: str,
+                                  task_pks: Iterable[int]) -> Set[int]:
+        """
+        Which of the specified tasks (all from the same base table) have
+        already been successfully exported? Equivalent to calling
+        :meth:`task_already_exported` for each, but with one query per
+        :data:`MAX_PKS_PER_EXPORT_CHECK` tasks.
+
+        Args:
+            dbsession: a :class:`sqlalchemy.orm.session.Session`
+            recipient_name:
+            basetable: name of the tasks' base table
+            task_pks: server PKs of the tasks
+
+        Returns:
+            the subset of ``task_pks`` for which a successful export record
+            exists
+
+        """
+        exported = set()  # type: Set[int]
+        for pk_chunk in chunks(list(set(task_pks)), MAX_PKS_PER_EXPORT_CHECK):
+            q = (
+                cls._query_successful_exports(dbsession, recipient_name,
+                                              basetable)
+                .with_entities(cls.task_server_pk)
+                .filter(cls.task_server_pk.in_(pk_chunk))
+                .distinct()
+            )
+            exported.update(pk for pk, in q)
+        return exported
+
+    @classmethod
+    def _query_successful_exports(cls,
+                                  dbsession: SqlASession,
+                                  recipient_name: str,
+                                  basetable: str) -> Query:
+        """
+        Returns a query for successful (and not cancelled) exports of tasks
+        from the specified base table to the specified recipient.
+        """
+        return (
             dbsession.query(cls).join(cls.recipient)
             .filter(ExportRecipient.recipient_name == recipient_name)
             .filter(cls.basetable == basetable)
-            .filter(cls.task_server_pk == task_pk)
             .filter(cls.success == True)  # noqa: E712
             .filter(cls.cancelled == False)  # noqa: E712
-            .exists()
         )
-        return bool_from_exists_clause(dbsession, exists_q)
 
 
 # =============================================================================
@@ -703,6 +755,9 @@ class ExportedTaskHL7Message(Base):
 
         - http://python-hl7.readthedocs.org/en/latest/api.html; however,
           we've modified that
+
+        - Connections are kept open and reused between messages; see
+          :class:`camcops_server.cc_modules.cc_hl7.MLLPConnectionPool`.
         """  # noqa
         recipient = self.exported_task.recipient
 
@@ -715,10 +770,12 @@ class ExportedTaskHL7Message(Base):
         try:
             log.info("Sending HL7 message to {}:{}",
                      recipient.hl7_host, recipient.hl7_port)
-            with MLLPTimeoutClient(recipient.hl7_host,
-                                   recipient.hl7_port,
-                                   recipient.hl7_network_timeout_ms) as client:
-                server_replied, reply = client.send_message(self._hl7_msg)
+            server_replied, reply = mllp_connection_pool.send_message(
+                recipient.hl7_host,
+                recipient.hl7_port,
+                self._hl7_msg,
+                timeout_ms=recipient.hl7_network_timeout_ms
+            )
         except socket.timeout:
             self.abort("Failed to send message via MLLP: timeout")
             return
@@ -837,20 +894,25 @@ class ExportedTaskFileGroup(Base):
                     filename: str,
                     text: str = None,
                     binary: bytes = None,
-                    text_encoding: str = UTF8) -> False:
+                    text_encoding: str = UTF8,
+                    text_chunks: Iterable[str] = None) -> False:
         """
         Exports the file.
 
         Args:
             filename:
-            text: text contents (specify this XOR ``binary``)
-            binary: binary contents (specify this XOR ``text``)
+            text: text contents (specify exactly one of ``text``, ``binary``,
+                ``text_chunks``)
+            binary: binary contents
             text_encoding: encoding to use when writing text
+            text_chunks: text contents, as chunks to be written in turn (e.g.
+                from :meth:`camcops_server.cc_modules.cc_task.Task.gen_xml`)
 
         Returns:
             bool: was it exported?
         """
-        assert bool(text) != bool(binary), "Specify text XOR binary"
+        assert [bool(text), bool(binary), text_chunks is not None].count(
+            True) == 1, "Specify one of text, binary, text_chunks"
         exported_task = self.exported_task
         filename = os.path.abspath(filename)
         directory = os.path.dirname(filename)
@@ -872,6 +934,20 @@ class ExportedTaskFileGroup(Base):
             if text:
                 with open(filename, mode="w", encoding=text_encoding) as f:
                     f.write(text)
+            elif text_chunks is not None:
+                # The chunks may be generated as we go, and generating them
+                # may fail; so write to a temporary file, and move it into
+                # place only when it's complete, rather than leave a
+                # truncated file.
+                fd, tmp_filename = tempfile.mkstemp(dir=directory)
+                try:
+                    with open(fd, mode="w", encoding=text_encoding) as f:
+                        f.writelines(text_chunks)
+                    os.chmod(tmp_filename, 0o644)  # mkstemp() makes it private
+                    os.replace(tmp_filename, filename)
+                except BaseException:
+                    os.remove(tmp_filename)
+                    raise
             else:
                 with open(filename, mode="wb") as f:
                     f.write(binary)
@@ -924,19 +1000,20 @@ class ExportedTaskFileGroup(Base):
                     return
 
         # Export task
+        binary = None
+        text = None
+        text_chunks = None
         if task_format == FileType.PDF:
             binary = task.get_pdf(req)
-            text = None
         elif task_format == FileType.HTML:
-            binary = None
             text = task.get_html(req)
         elif task_format == FileType.XML:
-            binary = None
-            text = task.get_xml(req)
+            text_chunks = task.gen_xml(req)
         else:
             raise AssertionError("Unknown task_format")
         written = self.export_file(task_filename, text=text, binary=binary,
-                                   text_encoding=UTF8)
+                                   text_encoding=UTF8,
+                                   text_chunks=text_chunks)
         if not written:
             return
 
@@ -1156,6 +1233,10 @@ class ExportedTaskRedcap(Base):
         Args:
             req: a :class:`camcops_server.cc_modules.cc_request.CamcopsRequest`
         """
+        from camcops_server.cc_modules.cc_redcap import (  # delayed import; slow (PyCap, pandas)  # noqa
+            RedcapExportException,
+            RedcapTaskExporter,
+        )
         exported_task = self.exported_task
         exporter = RedcapTaskExporter()
 
@@ -1164,3 +1245,102 @@ class ExportedTaskRedcap(Base):
             exported_task.succeed()
         except RedcapExportException as e:
             exported_task.abort(str(e))
+
+
+# =============================================================================
+# Incremental database export watermarks
+# =============================================================================
+
+class ExportedDatabaseWatermark(Base):
+    """
+    Records how far the destination database of an incremental database
+    export recipient (see ``DB_INCREMENTAL``) has caught up with records that
+    have been removed from the server (deleted, or superseded by a modified
+    version).
+
+    New tasks are tracked via :class:`ExportedTask` instead.
+    """
+    __tablename__ = "_export_db_watermarks"
+
+    id = Column(
+        "id", Integer, primary_key=True, autoincrement=True,
+        comment="Arbitrary primary key"
+    )
+    recipient_name = Column(
+        "recipient_name", ExportRecipientNameColType,
+        nullable=False, index=True, unique=True,
+        comment="Name of export recipient"
+    )
+    watermark_utc = Column(
+        "watermark_utc", DateTime, nullable=False,
+        comment="Records removed from the server at or after this time (UTC) "
+                "may not yet have been removed from the destination database"
+    )
+    updated_at_utc = Column(
+        "updated_at_utc", DateTime, nullable=False,
+        comment="Time the watermark was last updated (UTC)"
+    )
+
+    @classmethod
+    def get_watermark_utc(cls, dbsession: SqlASession,
+                          recipient_name: str) -> Optional[datetime.datetime]:
+        """
+        Returns the watermark for the named recipient, or ``None`` if there
+        isn't one (e.g. the recipient has never been exported incrementally).
+        """
+        return (
+            dbsession.query(cls.watermark_utc)
+            .filter(cls.recipient_name == recipient_name)
+            .scalar()
+        )
+
+    @classmethod
+    def set_watermark_utc(cls, dbsession: SqlASession,
+                          recipient_name: str,
+                          watermark_utc: datetime.datetime) -> None:
+        """
+        Creates or updates the watermark for the named recipient. Call this
+        only once the destination database has been committed.
+        """
+        wm = (
+            dbsession.query(cls)
+            .filter(cls.recipient_name == recipient_name)
+            .first()
+        )  # type: Optional[ExportedDatabaseWatermark]
+        if wm is None:
+            wm = cls()
+            wm.recipient_name = recipient_name
+            dbsession.add(wm)
+        wm.watermark_utc = watermark_utc
+        wm.updated_at_utc = get_now_utc_datetime()
+
+
+# =============================================================================
+# Claims on tasks being exported
+# =============================================================================
+
+class ExportTaskClaim(Base):
+    """
+    Records that a process is exporting a task to a recipient, so that
+    competing processes don't export it to that recipient too. Rows exist
+    only while an export is in progress (see
+    :func:`camcops_server.cc_modules.cc_export.export_task`).
+    """
+    __tablename__ = "_export_task_claims"
+
+    recipient_name = Column(
+        "recipient_name", ExportRecipientNameColType, primary_key=True,
+        comment="Name of export recipient"
+    )
+    basetable = Column(
+        "basetable", TableNameColType, primary_key=True,
+        comment="Base table of task being exported"
+    )
+    task_server_pk = Column(
+        "task_server_pk", Integer, primary_key=True, autoincrement=False,
+        comment="Server PK of task in basetable (_pk field)"
+    )
+    claimed_at_utc = Column(
+        "claimed_at_utc", DateTime, nullable=False,
+        comment="Time the export was claimed (UTC)"
+    )
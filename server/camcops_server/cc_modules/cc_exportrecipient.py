@@ -50,6 +50,7 @@ from sqlalchemy.sql.sqltypes import (
     Text,
 )
 
+from camcops_server.cc_modules.cc_constants import ConfigDefaults
 from camcops_server.cc_modules.cc_exportrecipientinfo import (
     ExportRecipientInfo,
 )
@@ -97,6 +98,7 @@ class ExportRecipient(ExportRecipientInfo, Base):
         "group_names",  # Python only
     ]
     NEEDS_RECOPYING_EACH_TIME_FROM_CONFIG_ATTRNAMES = [
+        "db_insert_batch_size",
         "email_host_password",
         "redcap_api_key",
     ]
@@ -206,6 +208,11 @@ class ExportRecipient(ExportRecipientInfo, Base):
         "db_patient_id_per_row", Boolean, default=True, nullable=False,
         comment="(DATABASE) Add patient ID information per row?"
     )
+    db_incremental = Column(
+        "db_incremental", Boolean, default=False, nullable=False,
+        comment="(DATABASE) Update the destination incrementally?"
+    )
+    # db_insert_batch_size: not stored in database (performance tuning only)
 
     # -------------------------------------------------------------------------
     # Email
@@ -397,6 +404,7 @@ class ExportRecipient(ExportRecipientInfo, Base):
         """
         # Python only:
         self.group_names = []  # type: List[str]
+        self.db_insert_batch_size = ConfigDefaults.DB_INSERT_BATCH_SIZE
         self.email_host_password = ""
         self.redcap_api_key = ""
 
@@ -138,6 +138,7 @@ class ExportRecipientInfo(object):
     """
     IGNORE_FOR_EQ_ATTRNAMES = [
         # Attribute names to ignore for equality comparison
+        "db_insert_batch_size",  # performance tuning only
         "email_host_password",
         "redcap_api_key",
     ]
@@ -177,6 +178,8 @@ class ExportRecipientInfo(object):
         self.db_include_blobs = cd.DB_INCLUDE_BLOBS
         self.db_add_summaries = cd.DB_ADD_SUMMARIES
         self.db_patient_id_per_row = cd.DB_PATIENT_ID_PER_ROW
+        self.db_incremental = cd.DB_INCREMENTAL
+        self.db_insert_batch_size = cd.DB_INSERT_BATCH_SIZE
 
         # Email
 
@@ -434,6 +437,10 @@ class ExportRecipientInfo(object):
                                            cd.DB_ADD_SUMMARIES)
             r.db_patient_id_per_row = _get_bool(cpr.DB_PATIENT_ID_PER_ROW,
                                                 cd.DB_PATIENT_ID_PER_ROW)
+            r.db_incremental = _get_bool(cpr.DB_INCREMENTAL,
+                                         cd.DB_INCREMENTAL)
+            r.db_insert_batch_size = _get_int(cpr.DB_INSERT_BATCH_SIZE,
+                                              cd.DB_INSERT_BATCH_SIZE)
 
         # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
         # Email
@@ -621,6 +628,9 @@ class ExportRecipientInfo(object):
         if self.transmission_method == ExportTransmissionMethod.DATABASE:
             if not self.db_url:
                 fail_missing(cpr.DB_URL)
+            if self.db_insert_batch_size < 1:
+                fail_invalid(f"Invalid {cpr.DB_INSERT_BATCH_SIZE}: "
+                             f"{self.db_insert_batch_size}")
 
         # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
         # Email
@@ -868,9 +878,9 @@ class ExportRecipientInfo(object):
     def is_incremental(self) -> bool:
         """
         Is this an incremental export? (That's the norm, except for database
-        exports.)
+        exports, which are incremental only if ``DB_INCREMENTAL`` is set.)
         """
-        return not self.using_db()
+        return not self.using_db() or self.db_incremental
 
     @staticmethod
     def get_hl7_id_type(req: "CamcopsRequest", which_idnum: int) -> str:
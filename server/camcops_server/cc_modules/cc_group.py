@@ -29,7 +29,7 @@ camcops_server/cc_modules/cc_group.py
 """
 
 import logging
-from typing import List, Optional, Set
+from typing import Dict, List, Optional, Set, Tuple
 
 from cardinal_pythonlib.logs import BraceStyleAdapter
 from cardinal_pythonlib.reprfunc import simple_repr
@@ -232,10 +232,28 @@ class Group(Base):
         """
         Returns the upload policy for a group.
         """
-        return TokenizedPolicy(self.upload_policy)
+        return self._get_tokenized_policy("upload_policy")
 
     def tokenized_finalize_policy(self) -> TokenizedPolicy:
         """
         Returns the finalize policy for a group.
         """
-        return TokenizedPolicy(self.finalize_policy)
+        return self._get_tokenized_policy("finalize_policy")
+
+    def _get_tokenized_policy(self, attrname: str) -> TokenizedPolicy:
+        """
+        Returns a :class:`camcops_server.cc_modules.cc_policy.TokenizedPolicy`
+        for the policy string in the attribute ``attrname``.
+
+        Policies are checked for every patient uploaded or edited, so the
+        tokenized (and, on first use, compiled) policy is cached on this
+        object, and rebuilt if the policy string changes.
+        """
+        policy = getattr(self, attrname)
+        cache = getattr(self, "_tokenized_policies", None)  # type: Optional[Dict[str, Tuple[Optional[str], TokenizedPolicy]]]  # noqa
+        if cache is None:
+            cache = self._tokenized_policies = {}
+        cached = cache.get(attrname)
+        if cached is None or cached[0] != policy:
+            cached = cache[attrname] = (policy, TokenizedPolicy(policy))
+        return cached[1]
@@ -63,8 +63,10 @@ We can then add an option for structure (XML), HTML, PDF export.
 
 import base64
 import logging
+import os
 import socket
-from typing import List, Optional, Tuple, TYPE_CHECKING, Union
+import threading
+from typing import Dict, List, Optional, Tuple, TYPE_CHECKING, Union
 
 from cardinal_pythonlib.datetimefunc import format_datetime
 from cardinal_pythonlib.logs import BraceStyleAdapter
@@ -812,6 +814,7 @@ class MLLPTimeoutClient(object):
         self.socket.settimeout(timeout_s)
         self.socket.connect((host, port))
         self.encoding = "utf-8"
+        self._recv_buffer = b""
 
     def __enter__(self):
         """
@@ -853,15 +856,175 @@ class MLLPTimeoutClient(object):
         """
         Low-level, direct access to the ``socket.send`` function (data must be
         already wrapped in an MLLP container). Blocks until the server
-        returns.
+        returns a complete (MLLP-wrapped) reply.
 
         Returns ``success, ack_msg``.
+
+        Raises :exc:`MLLPConnectionClosed` if the server closes the connection
+        without replying.
         """
         # upload the data
-        self.socket.send(data)
+        self.socket.sendall(data)
         # wait for the ACK/NACK
         try:
-            ack_msg = self.socket.recv(RECV_BUFFER).decode(self.encoding)
+            ack_msg = self._recv_mllp_message().decode(self.encoding)
             return True, ack_msg
         except socket.timeout:
             return False, None
+
+    def _recv_mllp_message(self) -> bytes:
+        """
+        Reads from the socket until we have a whole MLLP message, i.e. up to
+        and including the ``<EB><CR>`` trailer. Anything beyond that is kept
+        for next time, so that the connection can be reused.
+        """
+        eb = EB.encode(self.encoding)
+        cr = CR.encode(self.encoding)
+        received = self._recv_buffer
+        while eb not in received:
+            chunk = self.socket.recv(RECV_BUFFER)
+            if not chunk:
+                raise MLLPConnectionClosed(
+                    "Connection closed by server before a reply was received")
+            received += chunk
+        end = received.index(eb) + len(eb)
+        if received[end:end + len(cr)] == cr:
+            end += len(cr)
+        self._recv_buffer = received[end:]
+        return received[:end]
+
+
+class MLLPConnectionClosed(ConnectionError):
+    """
+    Exception raised when an MLLP server closes the connection without
+    replying (e.g. because it timed out an idle connection we were keeping).
+    """
+    pass
+
+
+# =============================================================================
+# MLLPConnectionPool
+# =============================================================================
+
+MLLP_POOL_MAX_IDLE_PER_DESTINATION = 4
+
+
+class MLLPConnectionPool(object):
+    """
+    Keeps MLLP connections open for reuse, so that sending a backlog of HL7
+    messages to an interface engine doesn't pay the connection cost for every
+    message.
+
+    Connections are shared per destination (host, port, timeout) within a
+    process. A connection is only returned to the pool after a complete reply
+    has been read from it; otherwise (e.g. after a timeout, when a late reply
+    might still arrive) it is closed.
+    """
+
+    def __init__(
+            self,
+            max_idle_per_destination: int = MLLP_POOL_MAX_IDLE_PER_DESTINATION
+    ) -> None:
+        """
+        Args:
+            max_idle_per_destination:
+                maximum number of idle connections to keep open for each
+                destination
+        """
+        self.max_idle_per_destination = max_idle_per_destination
+        self._lock = threading.Lock()
+        self._idle = {}  # type: Dict[Tuple[str, int, Optional[int]], List[MLLPTimeoutClient]]  # noqa
+        self._pid = os.getpid()
+
+    def send_message(self,
+                     host: str,
+                     port: int,
+                     message: Union[str, hl7.Message],
+                     timeout_ms: int = None) -> Tuple[bool, Optional[str]]:
+        """
+        Sends a message via a pooled connection (opening a new one if none is
+        idle), and waits for the reply.
+
+        If a reused connection turns out to have been closed by the server
+        (typically because it has dropped our idle connection), we reconnect
+        and resend, once. Other exceptions (e.g. failure to connect) are
+        passed on.
+
+        Args:
+            host: hostname
+            port: TCP port number
+            message: message to send
+            timeout_ms: network timeout, in ms
+
+        Returns:
+            ``success, ack_msg``, as for
+            :meth:`MLLPTimeoutClient.send_message`.
+        """
+        destination = (host, port, timeout_ms)
+        client = self._checkout(destination)
+        reused = client is not None
+        if not reused:
+            client = MLLPTimeoutClient(host, port, timeout_ms)
+        try:
+            try:
+                server_replied, reply = client.send_message(message)
+            except ConnectionError as e:
+                # includes MLLPConnectionClosed, BrokenPipeError,
+                # ConnectionResetError
+                if not reused:
+                    raise
+                log.info("Pooled MLLP connection to {}:{} failed ({}); "
+                         "reconnecting", host, port, e)
+                client.close()
+                client = MLLPTimeoutClient(host, port, timeout_ms)
+                server_replied, reply = client.send_message(message)
+        except Exception:
+            client.close()
+            raise
+        if server_replied:
+            self._checkin(destination, client)
+        else:
+            client.close()
+        return server_replied, reply
+
+    def close_all(self) -> None:
+        """
+        Closes all idle connections.
+        """
+        with self._lock:
+            for clients in self._idle.values():
+                for client in clients:
+                    client.close()
+            self._idle.clear()
+
+    def _checkout(self, destination: Tuple[str, int, Optional[int]]) \
+            -> Optional[MLLPTimeoutClient]:
+        """
+        Returns an idle connection to the destination, or ``None``.
+        """
+        with self._lock:
+            if self._pid != os.getpid():
+                # We've been forked; the idle connections belong to our
+                # parent. Closing our copies doesn't affect the parent's.
+                for clients in self._idle.values():
+                    for client in clients:
+                        client.close()
+                self._idle.clear()
+                self._pid = os.getpid()
+            clients = self._idle.get(destination)
+            return clients.pop() if clients else None
+
+    def _checkin(self, destination: Tuple[str, int, Optional[int]],
+                 client: MLLPTimeoutClient) -> None:
+        """
+        Returns a connection to the pool, or closes it if the pool is full.
+        """
+        with self._lock:
+            clients = self._idle.setdefault(destination, [])
+            if len(clients) < self.max_idle_per_destination:
+                clients.append(client)
+                return
+        client.close()
+
+
+mllp_connection_pool = MLLPConnectionPool()
@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+
+"""
+camcops_server/cc_modules/cc_nontask_models.py
+
+===============================================================================
+
+    Copyright (C) 2012-2020 Rudolf Cardinal (rudolf@pobox.com).
+
+    This file is part of CamCOPS.
+
+    CamCOPS is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    CamCOPS is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with CamCOPS. If not, see <http://www.gnu.org/licenses/>.
+
+===============================================================================
+
+**Imports every SQLAlchemy model that is not a task, so they're registered.**
+
+This is enough for the ORM to work with all the server's own tables (users,
+groups, sessions, the task index, export records, and so on), without paying
+the considerable cost of importing every task module. Task classes are
+imported on demand -- see
+:meth:`camcops_server.cc_modules.cc_task.Task.gen_all_subclasses` -- or all
+at once via :mod:`camcops_server.cc_modules.cc_all_models`.
+
+"""
+
+# =============================================================================
+# Non-task model imports representing client-side tables
+# =============================================================================
+# How to suppress "Unused import statement"?
+# https://stackoverflow.com/questions/21139329/false-unused-import-statement-in-pycharm  # noqa
+# http://codeoptimism.com/blog/pycharm-suppress-inspections-list/
+
+# noinspection PyUnresolvedReferences
+from camcops_server.cc_modules.cc_blob import Blob  # noqa: F401
+# noinspection PyUnresolvedReferences
+from camcops_server.cc_modules.cc_patientidnum import PatientIdNum  # noqa: F401
+# noinspection PyUnresolvedReferences
+from camcops_server.cc_modules.cc_patient import Patient  # noqa: F401
+
+# =============================================================================
+# Other non-task model imports
+# =============================================================================
+
+# noinspection PyUnresolvedReferences
+from camcops_server.cc_modules.cc_audit import AuditEntry  # noqa: F401
+# noinspection PyUnresolvedReferences
+from camcops_server.cc_modules.cc_device import Device  # noqa: F401
+# noinspection PyUnresolvedReferences
+from camcops_server.cc_modules.cc_dirtytables import DirtyTable  # noqa: F401
+# noinspection PyUnresolvedReferences
+from camcops_server.cc_modules.cc_email import Email  # noqa: F401
+# noinspection PyUnresolvedReferences
+from camcops_server.cc_modules.cc_group import Group, group_group_table  # noqa: F401,E501
+# noinspection PyUnresolvedReferences
+from camcops_server.cc_modules.cc_exportmodels import (  # noqa: F401
+    ExportedDatabaseWatermark,
+    ExportedTaskEmail,
+    ExportedTask,
+    ExportedTaskFileGroup,
+    ExportedTaskHL7Message,
+    ExportTaskClaim,
+)
+# noinspection PyUnresolvedReferences
+from camcops_server.cc_modules.cc_exportrecipient import ExportRecipient  # noqa: F401,E501
+# noinspection PyUnresolvedReferences
+from camcops_server.cc_modules.cc_idnumdef import IdNumDefinition  # noqa: F401
+# noinspection PyUnresolvedReferences
+from camcops_server.cc_modules.cc_membership import UserGroupMembership  # noqa: F401,E501
+# noinspection PyUnresolvedReferences
+from camcops_server.cc_modules.cc_session import CamcopsSession  # noqa: F401
+# noinspection PyUnresolvedReferences
+from camcops_server.cc_modules.cc_specialnote import SpecialNote  # noqa: F401
+# noinspection PyUnresolvedReferences
+from camcops_server.cc_modules.cc_serversettings import ServerSettings  # noqa: F401,E501
+# noinspection PyUnresolvedReferences
+from camcops_server.cc_modules.cc_task import Task  # noqa: F401
+# noinspection PyUnresolvedReferences
+from camcops_server.cc_modules.cc_taskfilter import TaskFilter  # noqa: F401
+# noinspection PyUnresolvedReferences
+from camcops_server.cc_modules.cc_taskschedule import (  # noqa: F401
+    TaskSchedule,
+    TaskScheduleItem,
+)
+# noinspection PyUnresolvedReferences
+from camcops_server.cc_modules.cc_taskindex import (  # noqa: F401
+    PatientIdNumIndexEntry,
+    TaskIndexEntry,
+    TaskSummaryEntry,
+)
+# noinspection PyUnresolvedReferences
+from camcops_server.cc_modules.cc_user import (  # noqa: F401
+    SecurityAccountLockout,
+    SecurityLoginFailure,
+    User,
+)
@@ -30,7 +30,8 @@ camcops_server/cc_modules/cc_patient.py
 
 import logging
 from typing import (
-    Any, Dict, Generator, List, Optional, Tuple, TYPE_CHECKING, Union,
+    Any, Callable, Dict, Generator, Hashable, Iterable, List, Optional, Tuple,
+    TYPE_CHECKING, TypeVar, Union,
 )
 import uuid
 
@@ -416,7 +417,9 @@ class Patient(GenericTabletRecordMixin, Base):
         IMPERFECT in that it doesn't use intermediate patients to link
         identity (e.g. P1 has RiO#=3, P2 has RiO#=3, NHS#=5, P3 has NHS#=5;
         they are all the same by inference but P1 and P3 will not compare
-        equal).
+        equal). To group patients (or their tasks), use
+        :class:`PatientIdentityResolver` or :func:`group_by_patient`, which do
+        link them, and in linear rather than quadratic time.
 
         """
         # Same object?
@@ -973,6 +976,130 @@ class Patient(GenericTabletRecordMixin, Base):
         return proquint_from_uuid(self.uuid)
 
 
+# =============================================================================
+# Patient identity
+# =============================================================================
+
+T = TypeVar("T")
+
+
+class PatientIdentityResolver(object):
+    """
+    Works out which patients are the same person, so that patients (or their
+    tasks) can be grouped using dictionaries, rather than by comparing every
+    patient with every other.
+
+    Patients are the same if they share a device/era/client PK combination or
+    any ID number (as for :meth:`Patient.__eq__`), or if they are linked
+    through other patients that do so. We derive hashable identity keys from
+    each patient, and join keys belonging to the same patient in a union-find
+    (disjoint-set) structure; two patients are the same if their keys have the
+    same canonical key.
+    """
+
+    def __init__(self) -> None:
+        self._parent = {}  # type: Dict[Hashable, Hashable]
+        self._size = {}  # type: Dict[Hashable, int]
+
+    @staticmethod
+    def identity_keys(patient: Patient) -> List[Hashable]:
+        """
+        Returns hashable keys, any one of which, if shared with another
+        patient, makes the two the same patient: the device/era/client PK
+        combination, and each ID number.
+        """
+        keys = []  # type: List[Hashable]
+        # noinspection PyProtectedMember
+        if (patient.id is not None and
+                patient._device_id is not None and
+                patient._era is not None):
+            # noinspection PyProtectedMember
+            keys.append(("client_pk", patient._device_id, patient._era,
+                         patient.id))
+        for idnum in patient.idnums:
+            if (idnum.which_idnum is not None and
+                    idnum.idnum_value is not None):
+                keys.append(("idnum", idnum.which_idnum, idnum.idnum_value))
+        return keys
+
+    def add(self, patient: Patient) -> Optional[Hashable]:
+        """
+        Registers a patient, linking all its identity keys (and thus any
+        patients already registered with any of them).
+
+        Returns:
+            one of the patient's identity keys, to pass to
+            :meth:`canonical_key` once all patients have been added; or
+            ``None`` if the patient has no identity keys
+        """
+        keys = self.identity_keys(patient)
+        if not keys:
+            return None
+        for key in keys:
+            if key not in self._parent:
+                self._parent[key] = key
+                self._size[key] = 1
+        first = keys[0]
+        for key in keys[1:]:
+            self._union(first, key)
+        return first
+
+    def canonical_key(self, key: Hashable) -> Hashable:
+        """
+        Returns the canonical identity key for a key returned by :meth:`add`.
+        Only stable once all the patients of interest have been added.
+        """
+        parent = self._parent
+        while parent[key] != key:
+            parent[key] = parent[parent[key]]  # path halving
+            key = parent[key]
+        return key
+
+    def _union(self, a: Hashable, b: Hashable) -> None:
+        """
+        Joins the sets containing keys ``a`` and ``b`` (union by size).
+        """
+        root_a = self.canonical_key(a)
+        root_b = self.canonical_key(b)
+        if root_a == root_b:
+            return
+        if self._size[root_a] < self._size[root_b]:
+            root_a, root_b = root_b, root_a
+        self._parent[root_b] = root_a
+        self._size[root_a] += self._size[root_b]
+
+
+def group_by_patient(items: Iterable[T],
+                     get_patient: Callable[[T], Optional[Patient]]) \
+        -> List[List[T]]:
+    """
+    Groups items (e.g. tasks) by patient, using a
+    :class:`PatientIdentityResolver`, in a single pass over the items.
+
+    Items with no patient, or a patient with no identity information, each
+    form a group of their own.
+
+    Args:
+        items: the things to group
+        get_patient: function returning the patient for an item
+
+    Returns:
+        a list of groups, each a list of items in their original order
+    """
+    resolver = PatientIdentityResolver()
+    item_keys = []  # type: List[Tuple[T, Optional[Hashable]]]
+    for item in items:
+        patient = get_patient(item)
+        key = resolver.add(patient) if patient is not None else None
+        item_keys.append((item, key))
+
+    groups = {}  # type: Dict[Hashable, List[T]]
+    for n, (item, key) in enumerate(item_keys):
+        group_key = ("item", n) if key is None else resolver.canonical_key(key)
+        groups.setdefault(group_key, []).append(item)
+    return list(groups.values())
+
+
 # =============================================================================
 # Validate candidate patient info for upload
 # =============================================================================
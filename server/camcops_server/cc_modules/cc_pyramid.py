@@ -28,6 +28,7 @@ camcops_server/cc_modules/cc_pyramid.py
 
 """
 
+import datetime
 from enum import Enum
 import logging
 import os
@@ -65,7 +66,11 @@ from pyramid_mako import (
     text_error_template,
 )
 from sqlalchemy.orm import Query
+from sqlalchemy.orm.attributes import InstrumentedAttribute
+from sqlalchemy.sql.expression import and_, or_
+from sqlalchemy.sql.functions import func
 from sqlalchemy.sql.selectable import Select
+from webob.multidict import MultiDict
 from zope.interface import implementer
 
 from camcops_server.cc_modules.cc_baseconstants import TEMPLATE_DIR
@@ -215,6 +220,8 @@ class ViewParam(object):
     OTHER = "other"
     COMPLETE_ONLY = "complete_only"
     PAGE = "page"
+    PAGE_AFTER = "page_after"
+    PAGE_BEFORE = "page_before"
     PASSWORD = "password"
     PATIENT_ID_PER_ROW = "patient_id_per_row"
     PATIENT_TASK_SCHEDULE_ID = "patient_task_schedule_id"
@@ -349,6 +356,28 @@ MAKO_LOOKUP = TemplateLookup(
 )
 
 
+def precompile_mako_templates() -> int:
+    """
+    Compiles every Mako template that :data:`MAKO_LOOKUP` can find, so that
+    they are held (compiled) in its in-memory collection. Used to warm up a
+    web server's parent process before it forks worker processes.
+
+    Returns:
+        the number of templates compiled
+    """
+    n = 0
+    for directory in MAKO_LOOKUP.directories:
+        for dirpath, _, filenames in os.walk(directory):
+            for filename in filenames:
+                if not filename.endswith(".mako"):
+                    continue
+                uri = os.path.relpath(os.path.join(dirpath, filename),
+                                      directory).replace(os.sep, "/")
+                MAKO_LOOKUP.get_template(uri)
+                n += 1
+    return n
+
+
 class CamcopsMakoLookupTemplateRenderer(MakoLookupTemplateRenderer):
     r"""
     A Mako template renderer that, when called:
@@ -1422,6 +1451,204 @@ class SqlalchemyOrmPage(CamcopsPage):
         )
 
 
+KeysetKey = Tuple[datetime.datetime, int]
+
+KEYSET_DATETIME_FORMAT = "%Y%m%d%H%M%S%f"
+
+
+def encode_keyset_key(key: KeysetKey) -> str:
+    """
+    Encodes a keyset pagination key (a date/time sort value and an integer
+    tiebreak value) as a URL-safe string.
+    """
+    sort_value, pk_value = key
+    return f"{sort_value.strftime(KEYSET_DATETIME_FORMAT)}_{pk_value}"
+
+
+def decode_keyset_key(token: Optional[str]) -> Optional[KeysetKey]:
+    """
+    Reverses :func:`encode_keyset_key`. Returns ``None`` for a missing or
+    malformed value (since keys are only a speed-up, not a requirement).
+    """
+    if not token:
+        return None
+    try:
+        sort_str, pk_str = token.split("_")
+        return (
+            datetime.datetime.strptime(sort_str, KEYSET_DATETIME_FORMAT),
+            int(pk_str)
+        )
+    except (TypeError, ValueError):
+        log.debug("Ignoring bad keyset pagination key: {!r}", token)
+        return None
+
+
+class SqlalchemyOrmKeysetQueryWrapper(object):
+    """
+    Wrapper class to access elements of an SQLAlchemy ORM query for
+    pagination, using "keyset" (a.k.a. "seek") pagination where possible.
+
+    The query is ordered by a sort column and then a unique tiebreak column.
+    If we know the key of the row just before the page we want (or just after
+    it), we ask for rows beyond that key with a plain ``LIMIT``, which the
+    database can answer from an index however deep into the results we are;
+    ``LIMIT/OFFSET`` has to read and discard all preceding rows. Without a key,
+    we fall back to ``LIMIT/OFFSET`` (which is cheap for the first page).
+
+    Counting uses ``COUNT(pk)`` over the query without its ``ORDER BY``.
+    """
+    def __init__(self,
+                 query: Query,
+                 sort_column: InstrumentedAttribute,
+                 pk_column: InstrumentedAttribute,
+                 descending: bool = False,
+                 after_key: KeysetKey = None,
+                 before_key: KeysetKey = None) -> None:
+        """
+        Args:
+            query:
+                the SQLAlchemy ORM query (any ordering will be replaced)
+            sort_column:
+                the column to sort by
+            pk_column:
+                a unique column, used as a tiebreak
+            descending:
+                sort in descending order?
+            after_key:
+                the key of the row immediately before the required page, if
+                known
+            before_key:
+                the key of the row immediately after the required page, if
+                known (ignored if ``after_key`` is specified)
+        """
+        self.query = query
+        self.sort_column = sort_column
+        self.pk_column = pk_column
+        self.descending = descending
+        self.after_key = after_key
+        self.before_key = before_key
+
+    def key_for(self, item: Any) -> KeysetKey:
+        """
+        Returns the keyset key of an item from our query.
+        """
+        return (getattr(item, self.sort_column.key),
+                getattr(item, self.pk_column.key))
+
+    def _ordered(self, q: Query, reverse: bool = False) -> Query:
+        """
+        Applies our ordering to a query (or the reverse of it).
+        """
+        q = q.order_by(None)
+        if self.descending != reverse:
+            return q.order_by(self.sort_column.desc(), self.pk_column.desc())
+        return q.order_by(self.sort_column.asc(), self.pk_column.asc())
+
+    def _beyond(self, q: Query, key: KeysetKey, later: bool) -> Query:
+        """
+        Restricts a query to rows that come after (``later=True``) or before
+        (``later=False``) the row with the given key, in our display order.
+        """
+        sort_value, pk_value = key
+        sc = self.sort_column
+        pkc = self.pk_column
+        if self.descending == later:
+            criterion = or_(sc < sort_value,
+                            and_(sc == sort_value, pkc < pk_value))
+        else:
+            criterion = or_(sc > sort_value,
+                            and_(sc == sort_value, pkc > pk_value))
+        return q.filter(criterion)
+
+    def __getitem__(self, cut: slice) -> List[Any]:
+        """
+        Return a range of objects of an :class:`sqlalchemy.orm.query.Query`
+        object.
+        """
+        n = cut.stop - cut.start
+        if self.after_key is not None:
+            q = self._beyond(self.query, self.after_key, later=True)
+            return self._ordered(q).limit(n).all()
+        if self.before_key is not None:
+            q = self._beyond(self.query, self.before_key, later=False)
+            items = self._ordered(q, reverse=True).limit(n).all()
+            items.reverse()
+            return items
+        return self._ordered(self.query)[cut]
+
+    def __len__(self) -> int:
+        """
+        Count the number of objects in an :class:`sqlalchemy.orm.query.Query``
+        object.
+        """
+        return (
+            self.query
+            .order_by(None)
+            .with_entities(func.count(self.pk_column))
+            .scalar()
+        )
+
+
+class SqlalchemyOrmKeysetPage(CamcopsPage):
+    """
+    A pagination page that paginates SQLAlchemy ORM queries using keyset
+    pagination (see :class:`SqlalchemyOrmKeysetQueryWrapper`).
+
+    Links to the next/previous pages carry the key of the last/first row of
+    this page (as the ``page_after``/``page_before`` URL parameters), so that
+    stepping through pages never needs ``OFFSET``. Links to other pages are
+    plain page numbers.
+    """
+    def __init__(self,
+                 query: Query,
+                 request: "CamcopsRequest",
+                 sort_column: InstrumentedAttribute,
+                 pk_column: InstrumentedAttribute,
+                 descending: bool = False,
+                 page: int = 1,
+                 items_per_page: int = DEFAULT_ROWS_PER_PAGE,
+                 **kwargs) -> None:
+        # Since views may accidentally throw strings our way:
+        assert isinstance(page, int)
+        assert isinstance(items_per_page, int)
+        self.keyset_wrapper = SqlalchemyOrmKeysetQueryWrapper(
+            query=query,
+            sort_column=sort_column,
+            pk_column=pk_column,
+            descending=descending,
+            after_key=decode_keyset_key(
+                request.GET.get(ViewParam.PAGE_AFTER)),
+            before_key=decode_keyset_key(
+                request.GET.get(ViewParam.PAGE_BEFORE)),
+        )
+        super().__init__(
+            collection=self.keyset_wrapper,
+            request=request,
+            page=page,
+            items_per_page=items_per_page,
+            url_maker=self.keyset_page_url,
+            **kwargs
+        )
+
+    def keyset_page_url(self, page: int) -> str:
+        """
+        Generate a URL for the specified page, with a keyset key if the page
+        is adjacent to this one.
+        """
+        params = MultiDict(
+            (k, v) for k, v in self.request.GET.items()
+            if k not in (ViewParam.PAGE_AFTER, ViewParam.PAGE_BEFORE)
+        )
+        if self.items:
+            if page == self.page + 1:
+                params[ViewParam.PAGE_AFTER] = encode_keyset_key(
+                    self.keyset_wrapper.key_for(self.items[-1]))
+            elif page == self.page - 1:
+                params[ViewParam.PAGE_BEFORE] = encode_keyset_key(
+                    self.keyset_wrapper.key_for(self.items[0]))
+        return make_page_url(self.request.path, params, page)
+
+
 # From webhelpers.paginate (which is broken on Python 3.5, but good),
 # modified a bit:
 
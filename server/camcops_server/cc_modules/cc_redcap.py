@@ -44,6 +44,12 @@ query the database in order to determine the next instance ID. It is possible
 to create a race condition if more than one client is trying to update the same
 record at the same time.
 
+To avoid downloading the whole project for every task, the existing records
+are fetched once per recipient per export batch (request) and then kept up to
+date locally as we upload; see :class:`RedcapRecordCache`. The cache is
+discarded whenever an export fails, so the next task starts from a fresh
+download.
+
 """
 
 from enum import Enum
@@ -55,6 +61,7 @@ from typing import (
     Iterable,
     List,
     Optional,
+    Tuple,
     TYPE_CHECKING,
     Union,
 )
@@ -63,7 +70,7 @@ import xml.etree.cElementTree as ElementTree
 from asteval import Interpreter, make_symbol_table
 from cardinal_pythonlib.datetimefunc import format_datetime
 from cardinal_pythonlib.logs import BraceStyleAdapter
-from pandas import DataFrame
+from pandas import DataFrame, isnull
 from pandas.errors import EmptyDataError
 import redcap
 
@@ -226,6 +233,162 @@ class RedcapFieldmap(object):
         return list(self.instruments.values())
 
 
+class RedcapRecordCache(object):
+    """
+    A local copy of the existing REDCap records that matter to one export
+    recipient. It is built from a single download of the project's records
+    (see :meth:`RedcapTaskExporter._get_existing_records`), indexed by CamCOPS
+    patient ID number, and updated as we upload. It lives for the duration of
+    a request (i.e. one export batch); see
+    :meth:`RedcapTaskExporter.get_record_cache`.
+    """
+    def __init__(self, records: "DataFrame",
+                 fieldmap: RedcapFieldmap) -> None:
+        """
+        Args:
+            records:
+                records retrieved from REDCap; Pandas data frame from
+                :meth:`RedcapTaskExporter._get_existing_records`
+            fieldmap:
+                a :class:`RedcapFieldmap`
+        """
+        self.records = records
+        self.patient_id_fieldname = fieldmap.patient["redcap_field"]
+        self.record_id_fieldname = fieldmap.record["redcap_field"]
+
+        # Built from the downloaded records, when first needed:
+        self._record_ids = None  # type: Optional[Dict[Any, str]]
+        self._max_instances = None  # type: Optional[Dict[Tuple[str, str], int]]  # noqa
+
+        # What we've uploaded since; takes precedence:
+        self._uploaded_record_ids = {}  # type: Dict[Any, str]
+        self._uploaded_max_instances = {}  # type: Dict[Tuple[str, str], int]
+
+    def get_existing_record_id(self, idnum_value: int) -> Optional[str]:
+        """
+        Returns the ID of an existing record that matches a specific
+        patient, if one can be found.
+
+        Args:
+            idnum_value:
+                CamCOPS patient ID number
+
+        Returns:
+            REDCap record ID or ``None``
+        """
+        try:
+            return self._uploaded_record_ids[idnum_value]
+        except KeyError:
+            pass
+        if self._record_ids is None:
+            self._record_ids = self._index_record_ids()
+        return self._record_ids.get(idnum_value)
+
+    def get_next_instance_id(self,
+                             instrument: str,
+                             existing_record_id: Optional[str]) -> int:
+        """
+        Returns the next REDCap instance ID to use for a particular instrument
+        within a record, for a repeating instrument (the previous highest ID
+        plus 1, or 1 if none can be found).
+
+        Args:
+            instrument:
+                instrument name
+            existing_record_id:
+                ID of existing record
+        """
+        if existing_record_id is None:
+            return 1
+
+        key = (existing_record_id, instrument)
+        try:
+            return self._uploaded_max_instances[key] + 1
+        except KeyError:
+            pass
+        if self._max_instances is None:
+            self._max_instances = self._index_max_instances()
+        return self._max_instances.get(key, 0) + 1
+
+    def add_upload(self,
+                   idnum_value: int,
+                   record_id: str,
+                   instrument: str,
+                   instance_id: int) -> None:
+        """
+        Records a successful upload, so that subsequent lookups see it without
+        going back to REDCap.
+
+        Args:
+            idnum_value:
+                CamCOPS patient ID number
+            record_id:
+                REDCap record ID that was created or updated
+            instrument:
+                instrument name
+            instance_id:
+                instance ID of the instrument that was uploaded
+        """
+        self._uploaded_record_ids[idnum_value] = record_id
+        key = (record_id, instrument)
+        self._uploaded_max_instances[key] = max(
+            self._uploaded_max_instances.get(key, 0), instance_id
+        )
+
+    def _index_record_ids(self) -> Dict[Any, str]:
+        """
+        Returns a dictionary mapping patient ID numbers to REDCap record IDs,
+        from the downloaded records. The first matching row wins; the record
+        ID is in the first column.
+        """
+        records = self.records
+        if records.empty:
+            return {}
+
+        if self.patient_id_fieldname not in records:
+            raise RedcapExportException(
+                (f"Field '{self.patient_id_fieldname}' does not exist in "
+                 f"REDCap. Is the 'patient' tag in the fieldmap correct?")
+            )
+
+        record_ids = {}  # type: Dict[Any, str]
+        for record_id, idnum_value in zip(records.iloc[:, 0],
+                                          records[self.patient_id_fieldname]):
+            if isnull(idnum_value):
+                continue
+            record_ids.setdefault(idnum_value, record_id)
+        return record_ids
+
+    def _index_max_instances(self) -> Dict[Tuple[str, str], int]:
+        """
+        Returns a dictionary mapping ``(record_id, instrument)`` tuples to the
+        highest existing instance ID, from the downloaded records.
+        """
+        records = self.records
+        record_id_fieldname = self.record_id_fieldname
+
+        if record_id_fieldname not in records:
+            if records.empty:
+                return {}
+            raise RedcapExportException(
+                (f"Field '{record_id_fieldname}' does not exist in REDCap. "
+                 f"Is the 'record' tag in the fieldmap correct?")
+            )
+
+        instrument_col = "redcap_repeat_instrument"
+        instance_col = "redcap_repeat_instance"
+        if instrument_col not in records or instance_col not in records:
+            return {}
+
+        repeats = records[
+            [record_id_fieldname, instrument_col, instance_col]
+        ].dropna()
+        maxima = repeats.groupby(
+            [record_id_fieldname, instrument_col]
+        )[instance_col].max()
+        return {key: int(value) for key, value in maxima.items()}
+
+
 class RedcapTaskExporter(object):
     """
     Main entry point for task export to REDCap. Works out which record needs
@@ -262,43 +425,94 @@ class RedcapTaskExporter(object):
             if not all(fieldmap.events.values()):
                 raise RedcapExportException(MISSING_EVENT_TAG_OR_ATTRIBUTE)
 
-        existing_records = self._get_existing_records(project, fieldmap)
-        existing_record_id = self._get_existing_record_id(
-            existing_records,
-            fieldmap,
-            idnum_object.idnum_value
-        )
-
-        if existing_record_id is None:
-            uploader_class = RedcapNewRecordUploader
-        else:
-            uploader_class = RedcapUpdatedRecordUploader
-
+        record_cache = self.get_record_cache(req, recipient, project,
+                                             fieldmap)
         try:
-            instrument_name = fieldmap.instruments[task.tablename]
-        except KeyError:
-            raise RedcapExportException(
-                (f"Instrument for task '{task.tablename}' is missing from the "
-                 f"fieldmap")
+            existing_record_id = record_cache.get_existing_record_id(
+                idnum_object.idnum_value
             )
 
-        record_id_fieldname = fieldmap.record["redcap_field"]
+            if existing_record_id is None:
+                uploader_class = RedcapNewRecordUploader
+            else:
+                uploader_class = RedcapUpdatedRecordUploader
 
-        next_instance_id = self._get_next_instance_id(existing_records,
-                                                      instrument_name,
-                                                      record_id_fieldname,
-                                                      existing_record_id)
+            try:
+                instrument_name = fieldmap.instruments[task.tablename]
+            except KeyError:
+                raise RedcapExportException(
+                    (f"Instrument for task '{task.tablename}' is missing "
+                     f"from the fieldmap")
+                )
 
-        uploader = uploader_class(req, project)
+            next_instance_id = record_cache.get_next_instance_id(
+                instrument_name,
+                existing_record_id
+            )
+
+            uploader = uploader_class(req, project)
+
+            new_record_id = uploader.upload(task, existing_record_id,
+                                            next_instance_id,
+                                            fieldmap, idnum_object.idnum_value)
+        except Exception:
+            # We may have half-written to REDCap, so we no longer know what's
+            # there. Start again from a fresh download next time.
+            self.forget_record_cache(req, recipient)
+            raise
 
-        new_record_id = uploader.upload(task, existing_record_id,
-                                        next_instance_id,
-                                        fieldmap, idnum_object.idnum_value)
+        record_cache.add_upload(idnum_object.idnum_value, new_record_id,
+                                instrument_name, next_instance_id)
 
         exported_task_redcap.redcap_record_id = new_record_id
         exported_task_redcap.redcap_instrument_name = instrument_name
         exported_task_redcap.redcap_instance_id = next_instance_id
 
+    def get_record_cache(self,
+                         req: "CamcopsRequest",
+                         recipient: ExportRecipient,
+                         project: redcap.project.Project,
+                         fieldmap: RedcapFieldmap) -> RedcapRecordCache:
+        """
+        Returns the :class:`RedcapRecordCache` for this recipient, downloading
+        the existing records from REDCap if this request doesn't have one yet.
+
+        Args:
+            req:
+                a :class:`camcops_server.cc_modules.cc_request.CamcopsRequest`
+            recipient:
+                an
+                :class:`camcops_server.cc_modules.cc_exportmodels.ExportRecipient`
+            project:
+                a :class:`redcap.project.Project`
+            fieldmap:
+                a :class:`RedcapFieldmap`
+        """  # noqa
+        caches = req.redcap_record_caches
+        try:
+            return caches[recipient.recipient_name]
+        except KeyError:
+            pass
+        records = self._get_existing_records(project, fieldmap)
+        record_cache = RedcapRecordCache(records, fieldmap)
+        caches[recipient.recipient_name] = record_cache
+        return record_cache
+
+    @staticmethod
+    def forget_record_cache(req: "CamcopsRequest",
+                            recipient: ExportRecipient) -> None:
+        """
+        Discards any :class:`RedcapRecordCache` held for this recipient.
+
+        Args:
+            req:
+                a :class:`camcops_server.cc_modules.cc_request.CamcopsRequest`
+            recipient:
+                an
+                :class:`camcops_server.cc_modules.cc_exportmodels.ExportRecipient`
+        """  # noqa
+        req.redcap_record_caches.pop(recipient.recipient_name, None)
+
     @staticmethod
     def _get_existing_records(project: redcap.project.Project,
                               fieldmap: RedcapFieldmap) -> "DataFrame":
@@ -339,83 +553,6 @@ class RedcapTaskExporter(object):
 
         return records
 
-    @staticmethod
-    def _get_existing_record_id(records: "DataFrame",
-                                fieldmap: RedcapFieldmap,
-                                idnum_value: int) -> Optional[str]:
-        """
-        Returns the ID of an existing record that matches a specific
-        patient, if one can be found.
-
-        Args:
-            records:
-                records retrieved from REDCap; Pandas data frame from
-                :meth:`_get_existing_records`
-            fieldmap:
-                :class:`RedcapFieldmap`
-            idnum_value:
-                CamCOPS patient ID number
-
-        Returns:
-            REDCap record ID or ``None``
-        """
-
-        if records.empty:
-            return None
-
-        patient_id_fieldname = fieldmap.patient["redcap_field"]
-
-        if patient_id_fieldname not in records:
-            raise RedcapExportException(
-                (f"Field '{patient_id_fieldname}' does not exist in REDCap. "
-                 f"Is the 'patient' tag in the fieldmap correct?")
-            )
-
-        with_identifier = records[patient_id_fieldname] == idnum_value
-
-        if len(records[with_identifier]) == 0:
-            return None
-
-        return records[with_identifier].iat[0, 0]
-
-    @staticmethod
-    def _get_next_instance_id(records: "DataFrame",
-                              instrument: str,
-                              record_id_fieldname: str,
-                              existing_record_id: Optional[str]) -> int:
-        """
-        Returns the next REDCap record ID to use for a particular instrument,
-        including for a repeating instrument (the previous highest ID plus 1,
-        or 1 if none can be found).
-
-        Args:
-            records:
-                records retrieved from REDCap; Pandas data frame from
-                :meth:`_get_existing_records`
-            instrument:
-                instrument name
-            existing_record_id:
-                ID of existing record
-        """
-        if existing_record_id is None:
-            return 1
-
-        if record_id_fieldname not in records:
-            raise RedcapExportException(
-                (f"Field '{record_id_fieldname}' does not exist in REDCap. "
-                 f"Is the 'record' tag in the fieldmap correct?")
-            )
-
-        previous_instances = records[
-            (records["redcap_repeat_instrument"] == instrument) &
-            (records[record_id_fieldname] == existing_record_id)
-        ]
-
-        if len(previous_instances) == 0:
-            return 1
-
-        return int(previous_instances.max()["redcap_repeat_instance"] + 1)
-
     def get_fieldmap(self, recipient: ExportRecipient) -> RedcapFieldmap:
         """
         Returns the relevant :class:`RedcapFieldmap`.
@@ -254,7 +254,12 @@ class Report(object):
         """
         Get all report subclasses, except those not implementing their
         ``report_id`` property. Optionally, sort by their title.
+
+        Some reports live in task modules, which are loaded on demand; we
+        make sure they are loaded first.
         """
+        # noinspection PyUnresolvedReferences
+        import camcops_server.cc_modules.cc_all_models  # delayed import; import side effects (ensure all reports registered)  # noqa
         # noinspection PyTypeChecker
         classes = all_subclasses(cls)  # type: List[Type["Report"]]
         instantiated_report_classes = []  # type: List[Type["Report"]]
@@ -687,11 +692,13 @@ class AverageScoreReport(DateTimeFilteredReportMixin, Report, ABC):
         We use an SQLAlchemy ORM, rather than Core, method. Why?
 
         - "Patient equality" is complex (e.g. same patient_id on same device,
-          or a shared ID number, etc.) -- simplicity via Patient.__eq__.
+          or a shared ID number, etc.) -- see
+          :func:`camcops_server.cc_modules.cc_patient.group_by_patient`.
         - Facilities "is task complete?" checks, and use of Python
           calculations.
         """
         _ = req.gettext
+        from camcops_server.cc_modules.cc_patient import group_by_patient  # delayed import  # noqa
         from camcops_server.cc_modules.cc_taskcollection import (
             TaskCollection,
             task_when_created_sorter,
@@ -714,10 +721,8 @@ class AverageScoreReport(DateTimeFilteredReportMixin, Report, ABC):
         )
         all_tasks = collection.all_tasks
 
-        # Get all distinct patients
-        patients = set(t.patient for t in all_tasks)
-        # log.critical("all_tasks: {}", all_tasks)
-        # log.critical("patients: {}", [str(p) for p in patients])
+        # Group tasks by patient (in one pass)
+        tasks_by_patient = group_by_patient(all_tasks, lambda t: t.patient)
 
         scoretypes = self.scoretypes(req)
         n_scoretypes = len(scoretypes)
@@ -728,11 +733,7 @@ class AverageScoreReport(DateTimeFilteredReportMixin, Report, ABC):
         sum_improvement_by_score = [0] * n_scoretypes
         n_first = 0
         n_last = 0  # also n_progress
-        for patient in patients:
-            # Find tasks for this patient
-            patient_tasks = [t for t in all_tasks if t.patient == patient]
-            assert patient_tasks, f"No tasks for patient {patient}"
-            # log.critical("For patient {}, tasks: {}", patient, patient_tasks)
+        for patient_tasks in tasks_by_patient:
             # Find first and last task (last may be absent)
             patient_tasks.sort(key=task_when_created_sorter)
             first = patient_tasks[0]
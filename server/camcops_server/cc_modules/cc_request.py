@@ -118,6 +118,9 @@ from camcops_server.cc_modules.cc_serversettings import (
     get_server_settings,
     ServerSettings,
 )
+from camcops_server.cc_modules.cc_sqlalchemy import (
+    session_has_uncommitted_changes,
+)
 from camcops_server.cc_modules.cc_string import (
     all_extra_strings_as_dicts,
     APPSTRING_TASKNAME,
@@ -139,6 +142,7 @@ if TYPE_CHECKING:
     from matplotlib.text import Text
     from camcops_server.cc_modules.cc_exportrecipient import ExportRecipient
     from camcops_server.cc_modules.cc_exportrecipientinfo import ExportRecipientInfo  # noqa
+    from camcops_server.cc_modules.cc_redcap import RedcapRecordCache
     from camcops_server.cc_modules.cc_session import CamcopsSession
     from camcops_server.cc_modules.cc_snomed import SnomedConcept
 
@@ -231,6 +235,8 @@ class CamcopsRequest(Request):
         self._debugging_user = None  # type: Optional[User]  # for unit testing only  # noqa
         self._pending_export_push_requests = []  # type: List[Tuple[str, str, int]]  # noqa
         self._cached_sstring = {}  # type: Dict[SS, str]
+        self._redcap_record_caches = {}  # type: Dict[str, RedcapRecordCache]
+        self._stored_task_summaries = {}  # type: Dict[Tuple[str, int], Dict[str, Any]]  # noqa
         # Don't make the _camcops_session yet; it will want a Registry, and
         # we may not have one yet; see command_line_request().
         if DEBUG_REQUEST_CREATION:
@@ -446,6 +452,21 @@ class CamcopsRequest(Request):
         session = maker()  # type: SqlASession
         return session
 
+    @property
+    def may_use_worker_dbsessions(self) -> bool:
+        """
+        May we open further, independent database sessions (e.g. for worker
+        threads) to read data on behalf of this request?
+
+        Other sessions cannot see the request's uncommitted changes, so not if
+        the request's session has any (pending or flushed), and not if the
+        request is using a single debugging session (as in unit tests), whose
+        data may never be committed.
+        """
+        if self._debugging_db_session is not None:
+            return False
+        return not session_has_uncommitted_changes(self.dbsession)
+
     # -------------------------------------------------------------------------
     # TabletSession
     # -------------------------------------------------------------------------
@@ -1704,18 +1725,38 @@ class CamcopsRequest(Request):
 
     def _process_pending_export_push_requests(self) -> None:
         """
-        Sends pending export push requests to the backend.
+        Sends pending export push requests to the backend, batched by
+        recipient (so an upload of many tasks creates few backend jobs).
 
         Called after the COMMIT.
         """
-        from camcops_server.cc_modules.celery import export_task_backend  # delayed import  # noqa
+        from camcops_server.cc_modules.cc_export import schedule_export_tasks_via_backend  # delayed import  # noqa
 
+        pairs_by_recipient = collections.OrderedDict()  # type: Dict[str, List[Tuple[str, int]]]  # noqa
         for recipient_name, basetable, task_pk in self._pending_export_push_requests:  # noqa
-            export_task_backend.delay(
-                recipient_name=recipient_name,
-                basetable=basetable,
-                task_pk=task_pk
-            )
+            pairs_by_recipient.setdefault(recipient_name, []).append(
+                (basetable, task_pk))
+        for recipient_name, pairs in pairs_by_recipient.items():
+            schedule_export_tasks_via_backend(self, recipient_name, pairs)
+
+    @property
+    def redcap_record_caches(self) -> Dict[str, "RedcapRecordCache"]:
+        """
+        Existing REDCap records, cached per export recipient name for the
+        lifetime of this request (so that exporting a batch of tasks needs
+        only one download); see
+        :class:`camcops_server.cc_modules.cc_redcap.RedcapRecordCache`.
+        """
+        return self._redcap_record_caches
+
+    @property
+    def stored_task_summaries(self) -> Dict[Tuple[str, int], Dict[str, Any]]:
+        """
+        Task summary values preloaded from the task summary store, keyed by
+        ``(task_table_name, task_pk)``; see
+        :meth:`camcops_server.cc_modules.cc_taskindex.TaskSummaryEntry.preload_for_tasks`.
+        """  # noqa
+        return self._stored_task_summaries
 
     # -------------------------------------------------------------------------
     # User downloads
@@ -28,8 +28,15 @@ camcops_server/cc_modules/cc_session.py
 
 """
 
+from collections import OrderedDict
+import datetime
+import hashlib
+import hmac
 import logging
-from typing import Optional, TYPE_CHECKING
+import os
+import threading
+import time
+from typing import Dict, Optional, Tuple, TYPE_CHECKING
 
 from cardinal_pythonlib.datetimefunc import (
     format_datetime,
@@ -96,6 +103,97 @@ def generate_token(num_bytes: int = 16) -> str:
     return create_base64encoded_randomness(num_bytes)
 
 
+# =============================================================================
+# Cache of verified client API credentials
+# =============================================================================
+
+class ClientApiLoginCache(object):
+    """
+    Process-wide cache of recently verified client API logins, so that a
+    client making many API calls in quick succession (e.g. during an upload)
+    doesn't cost a deliberately slow bcrypt password check per call.
+
+    - Entries are keyed by (username, IP address). They hold an HMAC of the
+      password, using a secret generated afresh by each server process, and
+      never the password itself.
+    - An entry only matches while the user's stored password hash is the one
+      that was verified, so a password change invalidates it.
+    - Entries expire after a configurable time, and the cache holds a
+      configurable number of entries, discarding the least recently used.
+    """
+    def __init__(self) -> None:
+        self._secret = os.urandom(32)
+        self._entries = OrderedDict()  # type: Dict[Tuple[str, str], Tuple[bytes, bytes, float]]  # noqa
+        self._lock = threading.Lock()
+
+    def _digest(self, password: Optional[str]) -> bytes:
+        """
+        Returns a keyed hash of the password.
+        """
+        return hmac.new(self._secret, (password or "").encode("utf-8"),
+                        hashlib.sha256).digest()
+
+    def is_verified(self,
+                    username: str,
+                    ip_address: str,
+                    password: Optional[str],
+                    hashedpw: Optional[str]) -> bool:
+        """
+        Has this password been verified recently for this user, from this IP
+        address, against the user's current password hash?
+        """
+        key = (username, ip_address)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return False
+            digest, verified_hashedpw, expires_at = entry
+            if expires_at <= now:
+                del self._entries[key]
+                return False
+            self._entries.move_to_end(key)
+        return (
+            hmac.compare_digest(digest, self._digest(password)) and
+            hmac.compare_digest(verified_hashedpw,
+                                (hashedpw or "").encode("utf-8"))
+        )
+
+    def add(self,
+            username: str,
+            ip_address: str,
+            password: Optional[str],
+            hashedpw: Optional[str],
+            ttl_s: float,
+            max_size: int) -> None:
+        """
+        Records a successful password check.
+        """
+        if max_size <= 0 or ttl_s <= 0:
+            return
+        key = (username, ip_address)
+        entry = (
+            self._digest(password),
+            (hashedpw or "").encode("utf-8"),
+            time.monotonic() + ttl_s,
+        )
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        """
+        Empties the cache.
+        """
+        with self._lock:
+            self._entries.clear()
+
+
+CLIENT_API_LOGIN_CACHE = ClientApiLoginCache()
+
+
 # =============================================================================
 # Session class
 # =============================================================================
@@ -241,8 +339,7 @@ class CamcopsSession(Base):
                       ts.username)
         self.is_api_session = True
         if ts.username:
-            user = User.get_user_from_username_password(
-                ts.req, ts.username, ts.password)
+            user = self._get_user_for_api_login(ts)
             if DEBUG_CAMCOPS_SESSION_CREATION:
                 log.debug("... looked up User: {!r}", user)
             if user:
@@ -254,6 +351,39 @@ class CamcopsSession(Base):
         if DEBUG_CAMCOPS_SESSION_CREATION:
             log.debug("... final session user: {!r}", self.user)
 
+    @staticmethod
+    def _get_user_for_api_login(ts: "TabletSession") -> Optional[User]:
+        """
+        Returns the :class:`camcops_server.cc_modules.cc_user.User` for the
+        username/password provided by a client, or ``None`` if the
+        credentials are wrong.
+
+        Behaves like
+        :meth:`camcops_server.cc_modules.cc_user.User.get_user_from_username_password`,
+        but skips the bcrypt check if the same credentials were verified
+        recently from the same IP address (see :class:`ClientApiLoginCache`).
+        """  # noqa
+        req = ts.req
+        cfg = req.config
+        if cfg.client_api_login_cache_size <= 0:
+            return User.get_user_from_username_password(
+                req, ts.username, ts.password)
+        user = User.get_user_by_name(req.dbsession, ts.username)
+        if user is None:
+            User.take_some_time_mimicking_password_encryption()
+            return None
+        ip_addr = req.remote_addr
+        if CLIENT_API_LOGIN_CACHE.is_verified(ts.username, ip_addr,
+                                              ts.password, user.hashedpw):
+            return user
+        if not user.is_password_correct(ts.password):
+            return None
+        CLIENT_API_LOGIN_CACHE.add(
+            ts.username, ip_addr, ts.password, user.hashedpw,
+            ttl_s=cfg.client_api_login_cache_ttl_s,
+            max_size=cfg.client_api_login_cache_size)
+        return user
+
     @classmethod
     def get_session(cls,
                     req: "CamcopsRequest",
@@ -299,10 +429,11 @@ class CamcopsSession(Base):
             candidate = None
         found = candidate is not None
         if found:
-            candidate.last_activity_utc = now
-            if DEBUG_CAMCOPS_SESSION_CREATION:
-                log.debug("Committing for last_activity_utc")
-            dbsession.commit()  # avoid holding a lock, 2019-03-21
+            if candidate.activity_needs_recording(req):
+                candidate.last_activity_utc = now
+                if DEBUG_CAMCOPS_SESSION_CREATION:
+                    log.debug("Committing for last_activity_utc")
+                dbsession.commit()  # avoid holding a lock, 2019-03-21
             ccsession = candidate
         else:
             new_http_session = cls(ip_addr=ip_addr, last_activity_utc=now)
@@ -316,6 +447,28 @@ class CamcopsSession(Base):
             ccsession = new_http_session
         return ccsession
 
+    def activity_needs_recording(self, req: "CamcopsRequest") -> bool:
+        """
+        Should this request update (and commit) our ``last_activity_utc``?
+
+        To save a database write for every request (e.g. during a
+        multi-request upload from a client), we only do so if at least
+        ``SESSION_ACTIVITY_WRITE_INTERVAL_S`` seconds have passed since the
+        last recorded activity. Sessions may therefore time out up to that
+        much earlier than ``SESSION_TIMEOUT_MINUTES`` suggests.
+        """
+        if self.last_activity_utc is None:
+            return True
+        interval_s = req.config.session_activity_write_interval_s
+        if interval_s <= 0:
+            return True
+        last_activity_utc = self.last_activity_utc
+        if last_activity_utc.tzinfo is None:  # as read from the database
+            last_activity_utc = last_activity_utc.replace(
+                tzinfo=datetime.timezone.utc)
+        elapsed = req.now_utc - last_activity_utc
+        return elapsed.total_seconds() >= interval_s
+
     @classmethod
     def get_oldest_last_activity_allowed(
             cls, req: "CamcopsRequest") -> Pendulum:
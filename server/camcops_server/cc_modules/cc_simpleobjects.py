@@ -37,7 +37,10 @@ from pendulum import Date
 from cardinal_pythonlib.datetimefunc import format_datetime
 from cardinal_pythonlib.reprfunc import auto_repr
 
-from camcops_server.cc_modules.cc_constants import DateFormat
+from camcops_server.cc_modules.cc_constants import (
+    ConfigDefaults,
+    DateFormat,
+)
 
 if TYPE_CHECKING:
     from camcops_server.cc_modules.cc_request import CamcopsRequest
@@ -220,6 +223,8 @@ class TaskExportOptions(object):
                  db_patient_id_per_row: bool = False,
                  db_make_all_tables_even_empty: bool = False,
                  db_include_summaries: bool = False,
+                 db_insert_batch_size: int = ConfigDefaults.DB_INSERT_BATCH_SIZE,  # noqa
+                 db_incremental: bool = False,
                  include_blobs: bool = False,
                  xml_include_ancillary: bool = False,
                  xml_include_calculated: bool = False,
@@ -239,6 +244,16 @@ class TaskExportOptions(object):
                 (https://doi.org/10.1186%2Fs12911-017-0437-1).
             db_make_all_tables_even_empty:
                 create all tables, even empty ones
+            db_include_summaries:
+                add summary information to each task's row, and add extra
+                summary tables
+            db_insert_batch_size:
+                number of rows to buffer for each destination table before
+                inserting them (via a single "executemany" call)
+            db_incremental:
+                the destination database already holds a previous export;
+                create tables only if they don't exist, and replace rows
+                (by primary key) rather than adding duplicates
 
             include_blobs:
                 include binary large objects (BLOBs) (applies to several export
@@ -266,6 +281,8 @@ class TaskExportOptions(object):
         self.db_patient_id_in_each_row = db_patient_id_per_row
         self.db_make_all_tables_even_empty = db_make_all_tables_even_empty
         self.db_include_summaries = db_include_summaries
+        self.db_insert_batch_size = db_insert_batch_size
+        self.db_incremental = db_incremental
 
         self.include_blobs = include_blobs
 
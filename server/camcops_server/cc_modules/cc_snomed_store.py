@@ -0,0 +1,334 @@
+#!/usr/bin/env python
+
+"""
+camcops_server/cc_modules/cc_snomed_store.py
+
+===============================================================================
+
+    Copyright (C) 2012-2020 Rudolf Cardinal (rudolf@pobox.com).
+
+    This file is part of CamCOPS.
+
+    CamCOPS is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    CamCOPS is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with CamCOPS. If not, see <http://www.gnu.org/licenses/>.
+
+===============================================================================
+
+**Precompiled stores of SNOMED-CT concepts.**
+
+Reading the SNOMED-CT XML files (for tasks, ICD-9-CM, and ICD-10) is slow, and
+every web server or Celery worker process that does so holds its own copy of
+the resulting dictionaries.
+
+Instead, the ``camcops_server compile_snomed_xml`` command can compile each XML
+file into an indexed SQLite database (a "store") alongside it, named by
+:func:`snomed_store_filename`. The XML is checked exactly as it would be when
+read directly. Thereafter, if the store is up to date (i.e. the XML file has
+not changed since it was compiled), :class:`SnomedConceptStore` is used
+instead of the XML. It is read-only, memory-mapped, and looks up concepts only
+as they are needed, so processes start faster, and the operating system's page
+cache is shared between them.
+
+If there is no store, or it is out of date, CamCOPS reads the XML as before.
+
+"""
+
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+from typing import Dict, Iterator, List, Mapping, Optional, Tuple, Union
+
+from cardinal_pythonlib.logs import BraceStyleAdapter
+
+from camcops_server.cc_modules.cc_cache import cache_region_static, fkg
+from camcops_server.cc_modules.cc_snomed import (
+    get_all_task_snomed_concepts,
+    get_icd10_snomed_concepts_from_xml,
+    get_icd9_snomed_concepts_from_xml,
+    SnomedConcept,
+)
+
+log = BraceStyleAdapter(logging.getLogger(__name__))
+
+
+# =============================================================================
+# Constants
+# =============================================================================
+
+SNOMED_STORE_EXTENSION = ".sqlite"
+SNOMED_STORE_FORMAT_VERSION = "1"
+SNOMED_STORE_MMAP_SIZE = 64 * 1024 * 1024  # bytes
+
+_TABLE_META = "meta"
+_TABLE_CONCEPTS = "concepts"
+
+_META_FORMAT_VERSION = "format_version"
+_META_KIND = "kind"
+_META_N_LOOKUPS = "n_lookups"
+_META_SOURCE_MTIME_NS = "source_mtime_ns"
+_META_SOURCE_SIZE = "source_size"
+
+
+class SnomedStoreKind(object):
+    """
+    The kinds of SNOMED-CT XML file, and so of store.
+    """
+    TASK = "task"
+    ICD9CM = "icd9cm"
+    ICD10 = "icd10"
+
+
+# =============================================================================
+# Helper functions
+# =============================================================================
+
+def snomed_store_filename(xml_filename: str) -> str:
+    """
+    Returns the filename of the store compiled from a SNOMED-CT XML file.
+    """
+    return xml_filename + SNOMED_STORE_EXTENSION
+
+
+def _source_signature(xml_filename: str) -> Tuple[str, str]:
+    """
+    Returns ``size, mtime_ns`` (as strings) for a SNOMED-CT XML file, used to
+    tell whether a store is out of date.
+    """
+    st = os.stat(xml_filename)
+    return str(st.st_size), str(st.st_mtime_ns)
+
+
+def _read_validated_xml(xml_filename: str, kind: str) \
+        -> Dict[str, Union[SnomedConcept, List[SnomedConcept]]]:
+    """
+    Reads (and checks) a SNOMED-CT XML file, exactly as CamCOPS does without
+    a store.
+    """
+    if kind == SnomedStoreKind.TASK:
+        return get_all_task_snomed_concepts(xml_filename)
+    elif kind == SnomedStoreKind.ICD9CM:
+        return get_icd9_snomed_concepts_from_xml(xml_filename)
+    elif kind == SnomedStoreKind.ICD10:
+        return get_icd10_snomed_concepts_from_xml(xml_filename)
+    raise ValueError(f"Bad SNOMED-CT store kind: {kind!r}")
+
+
+# =============================================================================
+# Compiling a store
+# =============================================================================
+
+def compile_snomed_store(xml_filename: str, kind: str) -> str:
+    """
+    Compiles a SNOMED-CT XML file into a store. The store is written to a
+    temporary file and then moved into place, so processes that are reading
+    an older version of it are unaffected.
+
+    Args:
+        xml_filename: the XML file
+        kind: the kind of file; one of the values in :class:`SnomedStoreKind`
+
+    Returns:
+        the filename of the store
+    """
+    size, mtime_ns = _source_signature(xml_filename)
+    concepts = _read_validated_xml(xml_filename, kind)
+    store_filename = snomed_store_filename(xml_filename)
+    log.info("Compiling SNOMED-CT XML file {!r} to {!r}",
+             xml_filename, store_filename)
+    fd, tmp_filename = tempfile.mkstemp(
+        suffix=SNOMED_STORE_EXTENSION,
+        dir=os.path.dirname(os.path.abspath(store_filename)))
+    os.close(fd)
+    try:
+        conn = sqlite3.connect(tmp_filename)
+        try:
+            conn.execute(f"CREATE TABLE {_TABLE_META} ("
+                         f"key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+            conn.execute(f"CREATE TABLE {_TABLE_CONCEPTS} ("
+                         f"lookup TEXT NOT NULL, "
+                         f"seq INTEGER NOT NULL, "
+                         f"identifier INTEGER NOT NULL, "
+                         f"term TEXT NOT NULL, "
+                         f"PRIMARY KEY (lookup, seq)) WITHOUT ROWID")
+            rows = []  # type: List[Tuple[str, int, int, str]]
+            for lookup, value in concepts.items():
+                concepts_for_lookup = (
+                    value if isinstance(value, list) else [value]
+                )
+                for seq, concept in enumerate(concepts_for_lookup):
+                    rows.append((lookup, seq, concept.identifier,
+                                 concept.term))
+            conn.executemany(
+                f"INSERT INTO {_TABLE_CONCEPTS} "
+                f"(lookup, seq, identifier, term) VALUES (?, ?, ?, ?)",
+                rows)
+            conn.executemany(
+                f"INSERT INTO {_TABLE_META} (key, value) VALUES (?, ?)",
+                [
+                    (_META_FORMAT_VERSION, SNOMED_STORE_FORMAT_VERSION),
+                    (_META_KIND, kind),
+                    (_META_N_LOOKUPS, str(len(concepts))),
+                    (_META_SOURCE_SIZE, size),
+                    (_META_SOURCE_MTIME_NS, mtime_ns),
+                ])
+            conn.commit()
+            conn.execute("VACUUM")
+        finally:
+            conn.close()
+        os.chmod(tmp_filename, 0o644)  # mkstemp() makes it private
+        os.replace(tmp_filename, store_filename)
+    except Exception:
+        os.remove(tmp_filename)
+        raise
+    log.info("... {} lookups written", len(concepts))
+    return store_filename
+
+
+# =============================================================================
+# Reading a store
+# =============================================================================
+
+class SnomedConceptStore(Mapping):
+    """
+    A read-only mapping from lookup codes (CamCOPS task lookups, or ICD codes)
+    to SNOMED-CT concepts, backed by a compiled store.
+
+    Each thread of each process uses its own SQLite connection, opened when
+    first needed (so an object created before a process forks is safe to use
+    afterwards).
+    """
+    def __init__(self, store_filename: str, kind: str,
+                 n_lookups: int) -> None:
+        """
+        Args:
+            store_filename: the store to read
+            kind: one of the values in :class:`SnomedStoreKind`
+            n_lookups: the number of lookup codes in the store
+        """
+        self.store_filename = store_filename
+        self.kind = kind
+        self.n_lookups = n_lookups
+        # Task lookups map to a single concept; ICD codes to a list.
+        self.single = kind == SnomedStoreKind.TASK
+        self._local = threading.local()
+
+    def __repr__(self) -> str:
+        return (
+            f"{self.__class__.__name__}("
+            f"store_filename={self.store_filename!r}, kind={self.kind!r})"
+        )
+
+    def _connection(self) -> sqlite3.Connection:
+        """
+        Returns the SQLite connection for the current thread and process.
+        """
+        pid = os.getpid()
+        if getattr(self._local, "pid", None) != pid:
+            uri = "file:{}?mode=ro".format(
+                os.path.abspath(self.store_filename))
+            conn = sqlite3.connect(uri, uri=True)
+            conn.execute(f"PRAGMA mmap_size = {SNOMED_STORE_MMAP_SIZE}")
+            self._local.conn = conn
+            self._local.pid = pid
+        return self._local.conn
+
+    def __getitem__(self, lookup: str) \
+            -> Union[SnomedConcept, List[SnomedConcept]]:
+        rows = self._connection().execute(
+            f"SELECT identifier, term FROM {_TABLE_CONCEPTS} "
+            f"WHERE lookup = ? ORDER BY seq",
+            (lookup, )
+        ).fetchall()
+        if not rows:
+            raise KeyError(lookup)
+        concepts = [SnomedConcept(identifier, term)
+                    for identifier, term in rows]
+        return concepts[0] if self.single else concepts
+
+    def __iter__(self) -> Iterator[str]:
+        cursor = self._connection().execute(
+            f"SELECT DISTINCT lookup FROM {_TABLE_CONCEPTS} ORDER BY lookup")
+        for (lookup, ) in cursor:
+            yield lookup
+
+    def __len__(self) -> int:
+        return self.n_lookups
+
+
+def open_snomed_store(xml_filename: str,
+                      kind: str) -> Optional[SnomedConceptStore]:
+    """
+    Opens the store compiled from a SNOMED-CT XML file.
+
+    Args:
+        xml_filename: the XML file
+        kind: the kind of file; one of the values in :class:`SnomedStoreKind`
+
+    Returns:
+        a :class:`SnomedConceptStore`, or ``None`` if there is no store, or
+        it is out of date or unreadable (in which case the caller should read
+        the XML)
+    """
+    store_filename = snomed_store_filename(xml_filename)
+    if not os.path.isfile(store_filename):
+        return None
+    try:
+        uri = "file:{}?mode=ro".format(os.path.abspath(store_filename))
+        conn = sqlite3.connect(uri, uri=True)
+        try:
+            meta = dict(conn.execute(
+                f"SELECT key, value FROM {_TABLE_META}").fetchall())
+        finally:
+            conn.close()
+        size, mtime_ns = _source_signature(xml_filename)
+    except (OSError, sqlite3.Error) as e:
+        log.warning("Unable to read SNOMED-CT store {!r}: {}",
+                    store_filename, e)
+        return None
+    expected = {
+        _META_FORMAT_VERSION: SNOMED_STORE_FORMAT_VERSION,
+        _META_KIND: kind,
+        _META_SOURCE_SIZE: size,
+        _META_SOURCE_MTIME_NS: mtime_ns,
+    }
+    if any(meta.get(k) != v for k, v in expected.items()):
+        log.warning("SNOMED-CT store {!r} is out of date; reading XML "
+                    "instead (recompile with 'camcops_server "
+                    "compile_snomed_xml')", store_filename)
+        return None
+    log.info("Using SNOMED-CT store {!r}", store_filename)
+    return SnomedConceptStore(store_filename, kind,
+                              n_lookups=int(meta[_META_N_LOOKUPS]))
+
+
+@cache_region_static.cache_on_arguments(function_key_generator=fkg)
+def get_snomed_concepts(xml_filename: str, kind: str) \
+        -> Mapping[str, Union[SnomedConcept, List[SnomedConcept]]]:
+    """
+    Returns SNOMED-CT concepts for a SNOMED-CT XML file, from its store if
+    that is up to date, or otherwise from the XML itself.
+
+    Args:
+        xml_filename: the XML file
+        kind: the kind of file; one of the values in :class:`SnomedStoreKind`
+
+    Returns:
+        a mapping from lookup codes to a :class:`SnomedConcept` (for tasks)
+        or a list of them (for ICD codes)
+    """
+    store = open_snomed_store(xml_filename, kind)
+    if store is not None:
+        return store
+    return _read_validated_xml(xml_filename, kind)
@@ -69,7 +69,10 @@ from pendulum import DateTime as Pendulum
 
 from sqlalchemy.engine import create_engine
 from sqlalchemy.engine.base import Engine
+from sqlalchemy.event.api import listens_for
 from sqlalchemy.ext.declarative import declarative_base, DeclarativeMeta
+from sqlalchemy.orm.session import Session
+from sqlalchemy.orm.unitofwork import UOWTransaction
 from sqlalchemy.sql.schema import MetaData
 
 from camcops_server.cc_modules.cc_cache import cache_region_static, fkg
@@ -316,6 +319,40 @@ def assert_constraint_name_ok(table_name: str, column_name: str) -> None:
             f"of length {len(anticipated_name)}")
 
 
+# =============================================================================
+# Tracking uncommitted changes in a session
+# =============================================================================
+# Other sessions (e.g. those used by worker threads) cannot see a session's
+# uncommitted changes, and once they have been flushed, the session itself no
+# longer shows them as new/dirty/deleted. So we note flushes until the next
+# COMMIT or ROLLBACK.
+
+SESSION_INFO_FLUSHED_UNCOMMITTED = "camcops_flushed_uncommitted"
+
+
+# noinspection PyUnusedLocal
+@listens_for(Session, "after_flush")
+def _note_flush(session: Session, flush_context: UOWTransaction) -> None:
+    session.info[SESSION_INFO_FLUSHED_UNCOMMITTED] = True
+
+
+@listens_for(Session, "after_commit")
+@listens_for(Session, "after_rollback")
+def _note_commit_or_rollback(session: Session) -> None:
+    session.info.pop(SESSION_INFO_FLUSHED_UNCOMMITTED, None)
+
+
+def session_has_uncommitted_changes(session: Session) -> bool:
+    """
+    Does the session have changes that other database sessions cannot see,
+    either pending (not yet flushed) or flushed but not yet committed?
+    """
+    return bool(
+        session.new or session.dirty or session.deleted or
+        session.info.get(SESSION_INFO_FLUSHED_UNCOMMITTED)
+    )
+
+
 # =============================================================================
 # Database engine hacks
 # =============================================================================
@@ -44,9 +44,10 @@ SQL     As part of an SQL or SQLite download.
 
 from collections import OrderedDict
 import datetime
+from functools import wraps
 import logging
 import statistics
-from typing import (Any, Dict, Iterable, Generator, List, Optional,
+from typing import (Any, Callable, Dict, Iterable, Generator, List, Optional,
                     Tuple, Type, TYPE_CHECKING, Union)
 
 from cardinal_pythonlib.classes import classproperty
@@ -66,6 +67,7 @@ import hl7
 from pendulum import Date, DateTime as Pendulum
 from pyramid.renderers import render
 from semantic_version import Version
+from sqlalchemy.event.api import listen, listens_for
 from sqlalchemy.ext.declarative import declared_attr
 from sqlalchemy.orm import relationship
 from sqlalchemy.orm.relationships import RelationshipProperty
@@ -127,7 +129,7 @@ from camcops_server.cc_modules.cc_version import (
     MINIMUM_TABLET_VERSION,
 )
 from camcops_server.cc_modules.cc_xml import (
-    get_xml_document,
+    gen_xml_document,
     XML_COMMENT_ANCILLARY,
     XML_COMMENT_ANONYMOUS,
     XML_COMMENT_BLOBS,
@@ -141,6 +143,7 @@ from camcops_server.cc_modules.cc_xml import (
 )
 
 if TYPE_CHECKING:
+    from sqlalchemy.orm.mapper import Mapper  # noqa: F401
     from camcops_server.cc_modules.cc_ctvinfo import CtvInfo  # noqa: F401
     from camcops_server.cc_modules.cc_exportrecipient import ExportRecipient  # noqa: E501,F401
     from camcops_server.cc_modules.cc_patient import Patient  # noqa: F401
@@ -155,6 +158,9 @@ log = BraceStyleAdapter(logging.getLogger(__name__))
 ANCILLARY_FWD_REF = "Ancillary"
 TASK_FWD_REF = "Task"
 
+TASK_MEMO_ATTR = "_camcops_memoized_results"
+TASK_MEMO_FLAG = "_camcops_memoized"
+
 SNOMED_TABLENAME = "_snomed_ct"
 SNOMED_COLNAME_TASKTABLE = "task_tablename"
 SNOMED_COLNAME_TASKPK = "task_pk"
@@ -375,6 +381,80 @@ class TaskHasRespondentMixin(object):
         return all([self.respondent_name, self.respondent_relationship])
 
 
+# =============================================================================
+# Memoized derived results
+# =============================================================================
+
+def memoize_task_result(method: Callable) -> Callable:
+    """
+    Decorator for task methods that derive a result (a score, completeness,
+    a diagnosis...) from the task's fields and are expensive to recompute.
+    The result is cached on the task instance, keyed by the method and its
+    arguments, so e.g. ``is_complete()``, ``get_summaries()`` and
+    ``get_clinical_text()`` can share one computation.
+
+    The cache is discarded whenever a mapped column attribute of the task is
+    set, or the instance is expired or refreshed by its session (see
+    :func:`_enable_task_memo_invalidation`). It is NOT discarded when
+    ancillary objects (e.g. trials) are added, removed, or edited: a
+    memoized method may use the task's ancillary objects, but they are then
+    treated as immutable for the lifetime of the task instance. If you change
+    them, call :func:`clear_memoized_task_results`. (Tasks are not normally
+    edited on the server, so this is rarely an issue.)
+
+    Opt-in: use it only for methods whose result depends solely on the
+    task's own data (its columns and ancillary objects, as above) and the
+    (hashable) arguments, and whose result is not modified by callers. Calls
+    with unhashable arguments are not cached.
+
+    Usage:
+
+    .. code-block:: python
+
+        class MyTask(TaskHasPatientMixin, Task):
+            @memoize_task_result
+            def get_result(self) -> MyResult:
+                ...
+    """
+    name = method.__name__
+
+    @wraps(method)
+    def wrapper(self: "Task", *args, **kwargs) -> Any:
+        key = (name, args, tuple(sorted(kwargs.items())))
+        cache = self.__dict__.setdefault(TASK_MEMO_ATTR, {})
+        try:
+            return cache[key]
+        except KeyError:
+            pass
+        except TypeError:  # unhashable arguments
+            return method(self, *args, **kwargs)
+        result = method(self, *args, **kwargs)
+        cache[key] = result
+        return result
+
+    setattr(wrapper, TASK_MEMO_FLAG, True)
+    return wrapper
+
+
+def clear_memoized_task_results(task: "Task") -> None:
+    """
+    Discards any results cached on the task by :func:`memoize_task_result`.
+    """
+    task.__dict__.pop(TASK_MEMO_ATTR, None)
+
+
+def uses_memoized_results(cls: Type["Task"]) -> bool:
+    """
+    Does this task class have any methods decorated with
+    :func:`memoize_task_result`?
+    """
+    for klass in cls.__mro__:
+        for value in vars(klass).values():
+            if getattr(value, TASK_MEMO_FLAG, False):
+                return True
+    return False
+
+
 # =============================================================================
 # Task base class
 # =============================================================================
@@ -691,7 +771,13 @@ class Task(GenericTabletRecordMixin, Base):
         being actual tasks; we discriminate using ``__abstract__`` and/or
         ``__tablename__``. See
         https://docs.sqlalchemy.org/en/latest/orm/inheritance.html#abstract-concrete-classes
+
+        Task modules are slow to import, so command-line tools that don't need
+        them import only :mod:`camcops_server.cc_modules.cc_nontask_models`.
+        The task modules are therefore imported here, on first use.
         """  # noqa
+        # noinspection PyUnresolvedReferences
+        import camcops_server.cc_modules.cc_all_models  # delayed import; import side effects (ensure all tasks registered)  # noqa
         # noinspection PyTypeChecker
         return gen_orm_classes_from_base(cls)
 
@@ -965,6 +1051,19 @@ class Task(GenericTabletRecordMixin, Base):
             ),
         ]
 
+    def get_summary_values(self, req: "CamcopsRequest") -> Dict[str, Any]:
+        """
+        As for
+        :meth:`camcops_server.cc_modules.cc_db.GenericTabletRecordMixin.get_summary_values`,
+        but uses values from the task summary store if they have been
+        preloaded for this request (see
+        :meth:`camcops_server.cc_modules.cc_taskindex.TaskSummaryEntry.preload_for_tasks`).
+        """  # noqa
+        stored = req.stored_task_summaries.get((self.tablename, self.pk))
+        if stored is not None:
+            return stored
+        return super().get_summary_values(req)
+
     def get_all_summary_tables(self, req: "CamcopsRequest") \
             -> List[ExtraSummaryTable]:
         """
@@ -1454,10 +1553,36 @@ class Task(GenericTabletRecordMixin, Base):
         Returns:
             an XML UTF-8 document representing the task.
 
+        """  # noqa
+        return "".join(self.gen_xml(req=req, options=options,
+                                    indent_spaces=indent_spaces, eol=eol))
+
+    def gen_xml(self,
+                req: "CamcopsRequest",
+                options: TaskExportOptions = None,
+                indent_spaces: int = 4,
+                eol: str = '\n') -> Generator[str, None, None]:
+        """
+        As for :meth:`get_xml`, but returns the XML in chunks, for writing
+        to a file or HTTP response without assembling one large string.
+
+        The XML tree is built (from the database) when this is called; only
+        the conversion to text is deferred.
+
+        Args:
+            req: a :class:`camcops_server.cc_modules.cc_request.CamcopsRequest`
+            options: a :class:`camcops_server.cc_modules.cc_simpleobjects.TaskExportOptions`
+
+            indent_spaces: number of spaces to indent formatted XML
+            eol: end-of-line string
+
+        Yields:
+            chunks of an XML UTF-8 document representing the task
+
         """  # noqa
         options = options or TaskExportOptions()
         tree = self.get_xml_root(req=req, options=options)
-        return get_xml_document(
+        return gen_xml_document(
             tree,
             indent_spaces=indent_spaces,
             eol=eol,
@@ -2329,6 +2454,39 @@ class Task(GenericTabletRecordMixin, Base):
         return d
 
 
+# =============================================================================
+# Invalidating memoized results
+# =============================================================================
+
+# noinspection PyUnusedLocal
+def _clear_memo_on_set(target: Task, value: Any, oldvalue: Any,
+                       initiator: Any) -> None:
+    clear_memoized_task_results(target)
+
+
+# noinspection PyUnusedLocal
+def _clear_memo_on_expire_or_refresh(target: Task, *args) -> None:
+    clear_memoized_task_results(target)
+
+
+# noinspection PyUnusedLocal
+@listens_for(Task, "mapper_configured", propagate=True)
+def _enable_task_memo_invalidation(mapper: "Mapper",
+                                   cls: Type[Task]) -> None:
+    """
+    For task classes that use :func:`memoize_task_result`, discards the
+    cached results when a column attribute is set or the instance is
+    expired/refreshed. Other task classes pay nothing.
+    """
+    if not uses_memoized_results(cls):
+        return
+    for attr in mapper.column_attrs:
+        listen(attr.class_attribute, "set", _clear_memo_on_set)
+    listen(cls, "expire", _clear_memo_on_expire_or_refresh)
+    listen(cls, "refresh", _clear_memo_on_expire_or_refresh)
+    listen(cls, "refresh_flush", _clear_memo_on_expire_or_refresh)
+
+
 # =============================================================================
 # Collating all task tables for specific purposes
 # =============================================================================
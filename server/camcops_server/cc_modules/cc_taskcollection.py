@@ -29,10 +29,10 @@ camcops_server/cc_modules/cc_taskcollection.py
 """
 
 from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
 import datetime
 from enum import Enum
 import logging
-from threading import Thread
 from typing import (Dict, Generator, List, Optional, Tuple, Type,
                     TYPE_CHECKING, Union)
 
@@ -45,7 +45,8 @@ from cardinal_pythonlib.reprfunc import auto_repr, auto_str
 from cardinal_pythonlib.sort import MINTYPE_SINGLETON, MinType
 from kombu.serialization import dumps, loads
 from pendulum import DateTime as Pendulum
-from sqlalchemy.orm import Query
+from sqlalchemy.engine.base import Engine
+from sqlalchemy.orm import Query, sessionmaker
 from sqlalchemy.orm.session import Session as SqlASession
 from sqlalchemy.sql.functions import func
 from sqlalchemy.sql.expression import and_, exists, or_
@@ -134,7 +135,8 @@ def sort_tasks_in_place(tasklist: List[Task],
 #   reached", in the parallel code, a great many queries are launched, but then
 #   something goes wrong and others are started but then block -- for ages --
 #   waiting for a spare database connection, or something.
-# - Fixed that: I was not explicitly closing the sessions.
+# - Fixed that: I was not explicitly closing the sessions, and we now use a
+#   bounded pool of worker threads (the TASK_FETCH_THREADS config option).
 # - But then a major conceptual problem: anything to be lazy-loaded (e.g.
 #   patient, but also patient ID, special note, BLOB...) will give this sort of
 #   error: "DetachedInstanceError: Parent instance <Phq9 at 0x7fe6cce2d278> is
@@ -142,48 +144,36 @@ def sort_tasks_in_place(tasklist: List[Task],
 #   proceed" -- for obvious reasons. And some of those operations are only
 #   required on the final paginated task set, which requires aggregation across
 #   all tasks.
+# - Fixed that too: each worker returns its (detached) objects, and the
+#   request's thread then merges them into the request's session with
+#   Session.merge(..., load=False), which emits no SQL. Lazy loading then
+#   proceeds as normal, via the request's session.
+# - The queries themselves are built in the request's thread, since checking
+#   permissions may touch the request's session (e.g. to load the user's
+#   group memberships), and sessions are not thread-safe. Only the execution
+#   of each query happens in a worker thread.
 #
 # HOWEVER, the query time per table drops from ~27ms to 4-8ms if we disable
 # eager loading (lazy="joined") of patients from tasks.
 
-class FetchThread(Thread):
+def fetch_tasks_detached(engine: Engine, q: Query) -> List[Task]:
     """
-    Thread to fetch tasks in parallel.
+    Executes a task query using a new database session of its own, for use
+    from a worker thread. Closes that session and returns the resulting tasks,
+    which are therefore detached from any session.
 
-    CURRENTLY UNUSED.
+    Args:
+        engine: the SQLAlchemy :class:`Engine` (connection pool) to use
+        q: an SQLAlchemy ORM query (associated with any session)
+
+    Returns:
+        a list of detached :class:`camcops_server.cc_modules.cc_task.Task`
+        objects
     """
-    def __init__(self,
-                 req: "CamcopsRequest",
-                 task_class: Type[Task],
-                 factory: "TaskCollection",
-                 **kwargs) -> None:
-        self.req = req
-        self.task_class = task_class
-        self.factory = factory
-        self.error = False
-        name = task_class.__tablename__
-        super().__init__(name=name, target=None, **kwargs)
-
-    def run(self) -> None:
-        log.debug("Thread starting")
-        dbsession = self.req.get_bare_dbsession()
-        # noinspection PyBroadException
-        try:
-            # noinspection PyProtectedMember
-            q = self.factory._make_query(dbsession, self.task_class)
-            if q:
-                tasks = q.all()  # type: List[Task]
-                # https://stackoverflow.com/questions/6319207/are-lists-thread-safe  # noqa
-                # https://stackoverflow.com/questions/6953351/thread-safety-in-pythons-dictionary  # noqa
-                # http://effbot.org/pyfaq/what-kinds-of-global-value-mutation-are-thread-safe.htm  # noqa
-                # noinspection PyProtectedMember
-                self.factory._tasks_by_class[self.task_class] = tasks
-                log.debug("Thread finishing with results")
-            else:
-                log.debug("Thread finishing without results")
-        except Exception:
-            self.error = True
-            log.error("Thread error")
+    dbsession = sessionmaker(bind=engine)()  # type: SqlASession
+    try:
+        return q.with_session(dbsession).all()
+    finally:
         dbsession.close()
 
 
@@ -403,27 +393,24 @@ class TaskCollection(object):
     # Internals: fetching Task objects
     # =========================================================================
 
-    def _fetch_all_tasks_without_index(self, parallel: bool = False) -> None:
+    def _fetch_all_tasks_without_index(self) -> None:
         """
         Fetch all tasks from the database.
-        """
 
-        # AVOID parallel=True; see notes above.
+        If the config option ``TASK_FETCH_THREADS`` is more than 1, the
+        per-class queries are run in parallel; see
+        :meth:`_fetch_task_classes_in_parallel`. That uses other database
+        sessions, which cannot see the request's uncommitted changes, so if
+        there are any, we fetch serially instead (see
+        ``CamcopsRequest.may_use_worker_dbsessions``).
+        """
         if DEBUG_QUERY_TIMING:
             start_time = Pendulum.now()
 
-        if parallel:
-            # Deprecated parallel fetch
-            threads = []  # type: List[FetchThread]
-            for task_class in self._filter.task_classes:
-                thread = FetchThread(self.req, task_class, self)
-                thread.start()
-                threads.append(thread)
-            for thread in threads:
-                thread.join()
-                if thread.error:
-                    raise ValueError("Multithreaded fetch failed")
-
+        n_threads = self.req.config.task_fetch_threads
+        if n_threads > 1 and self.req.may_use_worker_dbsessions:
+            self._fetch_task_classes_in_parallel(self._filter.task_classes,
+                                                 n_threads)
         else:
             # Fetch all tasks, classwise.
             for task_class in self._filter.task_classes:
@@ -441,6 +428,54 @@ class TaskCollection(object):
             self._all_tasks += single_task_list
         sort_tasks_in_place(self._all_tasks, self._sort_method_global)
 
+    def _fetch_task_classes_in_parallel(self,
+                                        task_classes: List[Type[Task]],
+                                        n_threads: int) -> None:
+        """
+        Fetch tasks from the database for several task types, running the
+        queries concurrently (each on its own pooled database session), so
+        that the overall time taken is bounded by the slowest table rather
+        than by the sum across all tables.
+
+        The results are merged into the request's session and then processed
+        exactly as by :meth:`_fetch_task_class`.
+
+        Args:
+            task_classes: the task classes to fetch
+            n_threads: the maximum number of worker threads
+        """
+        # Build queries in this thread (see notes above).
+        queries = OrderedDict()  # type: Dict[Type[Task], Optional[Query]]
+        for task_class in task_classes:
+            if task_class in self._tasks_by_class:
+                continue  # already fetched
+            queries[task_class] = self._serial_query(task_class)
+
+        # Run them in worker threads.
+        engine = self.req.engine
+        futures = {}  # type: Dict[Type[Task], Future]
+        with ThreadPoolExecutor(max_workers=n_threads) as executor:
+            for task_class, q in queries.items():
+                if q is not None:
+                    futures[task_class] = executor.submit(
+                        fetch_tasks_detached, engine, q)
+        # ... leaving the "with" block waits for all threads to finish.
+
+        # Bring the results back into the request's session.
+        dbsession = self.dbsession
+        for task_class, q in queries.items():
+            if q is None:
+                newtasks = []  # type: List[Task]
+            else:
+                # Re-raises any exception from the worker thread:
+                detached_tasks = futures[task_class].result()
+                newtasks = [dbsession.merge(task, load=False)
+                            for task in detached_tasks]
+                # Apply Python-side filters?
+                newtasks = self._filter_through_python(newtasks)
+                sort_tasks_in_place(newtasks, self._sort_method_by_class)
+            self._tasks_by_class[task_class] = newtasks
+
     def _fetch_task_class(self, task_class: Type[Task]) -> None:
         """
         Fetch tasks from the database for one task type.
@@ -29,8 +29,9 @@ camcops_server/cc_modules/cc_taskfactory.py
 """
 
 import logging
-from typing import Optional, Type, TYPE_CHECKING, Union
+from typing import Dict, List, Optional, Type, TYPE_CHECKING, Union
 
+from cardinal_pythonlib.lists import chunks
 from cardinal_pythonlib.logs import BraceStyleAdapter
 import pyramid.httpexceptions as exc
 from sqlalchemy.orm import Query, Session as SqlASession
@@ -46,6 +47,8 @@ if TYPE_CHECKING:
 
 log = BraceStyleAdapter(logging.getLogger(__name__))
 
+MAX_TASKS_PER_QUERY = 500  # keeps the IN clause a sensible size
+
 
 # =============================================================================
 # Task query helpers
@@ -157,6 +160,36 @@ def task_factory_no_security_checks(dbsession: SqlASession, basetable: str,
     return q.first()
 
 
+def task_factory_multiple_no_security_checks(
+        dbsession: SqlASession,
+        basetable: str,
+        serverpks: List[int]) -> Dict[int, Task]:
+    """
+    Load several tasks of the same type from the database, with one query per
+    :data:`MAX_TASKS_PER_QUERY` tasks. No security checks.
+
+    Args:
+        dbsession: a :class:`sqlalchemy.orm.session.Session`
+        basetable: name of the tasks' base table
+        serverpks: server PKs of the tasks
+
+    Returns:
+        dict: mapping server PK to task, for those PKs that exist
+
+    Raises:
+        :exc:`KeyError` if the table doesn't exist
+    """
+    d = tablename_to_task_class_dict()
+    cls = d[basetable]  # may raise KeyError
+    tasks = {}  # type: Dict[int, Task]
+    for pk_chunk in chunks(serverpks, MAX_TASKS_PER_QUERY):
+        # noinspection PyProtectedMember
+        q = dbsession.query(cls).filter(cls._pk.in_(pk_chunk))
+        for task in q:
+            tasks[task.pk] = task
+    return tasks
+
+
 # =============================================================================
 # Make a single task given its base table name and server PK
 # =============================================================================
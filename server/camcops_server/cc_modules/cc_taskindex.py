@@ -30,10 +30,23 @@ Note in particular that if you, as a developer, change the ``is_complete()``
 criteria for a task, you should cause the server index to be rebuilt (because
 it caches ``is_complete()`` information).
 
+Also the optional task summary store (:class:`TaskSummaryEntry`), which holds
+precomputed values from each current task's ``get_summaries()``.
+
 """
 
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import json
 import logging
-from typing import List, Optional, Type, TYPE_CHECKING
+from numbers import Integral, Real
+from queue import Empty, Full, Queue
+import threading
+from typing import (
+    Any, Dict, Generator, Iterable, List, Optional, Set, Type, TYPE_CHECKING,
+)
+
+from cardinal_pythonlib.lists import chunks
 
 from cardinal_pythonlib.logs import BraceStyleAdapter
 from cardinal_pythonlib.reprfunc import simple_repr
@@ -44,10 +57,23 @@ from cardinal_pythonlib.sqlalchemy.sqlserver import (
 )
 from pendulum import DateTime as Pendulum
 import pyramid.httpexceptions as exc
-from sqlalchemy.orm import relationship, Session as SqlASession
-from sqlalchemy.sql.expression import and_, exists, join, literal, select
+from semantic_version import Version
+from sqlalchemy.engine.base import Engine
+from sqlalchemy.orm import (
+    configure_mappers,
+    relationship,
+    Session as SqlASession,
+    sessionmaker,
+)
+from sqlalchemy.sql.expression import and_, exists, join, literal, or_, select
 from sqlalchemy.sql.schema import Column, ForeignKey, Table
-from sqlalchemy.sql.sqltypes import BigInteger, Boolean, DateTime, Integer
+from sqlalchemy.sql.sqltypes import (
+    BigInteger,
+    Boolean,
+    DateTime,
+    Integer,
+    UnicodeText,
+)
 
 from camcops_server.cc_modules.cc_client_api_core import (
     BatchDetails,
@@ -60,8 +86,9 @@ from camcops_server.cc_modules.cc_patient import Patient
 from camcops_server.cc_modules.cc_patientidnum import PatientIdNum
 from camcops_server.cc_modules.cc_sqla_coltypes import (
     EraColType,
-    isotzdatetime_to_utcdatetime,
+    LanguageCodeColType,
     PendulumDateTimeAsIsoTextColType,
+    SemanticVersionColType,
     TableNameColType,
 )
 from camcops_server.cc_modules.cc_sqlalchemy import Base
@@ -71,12 +98,20 @@ from camcops_server.cc_modules.cc_task import (
     Task,
 )
 from camcops_server.cc_modules.cc_user import User
+from camcops_server.cc_modules.cc_version import CAMCOPS_SERVER_VERSION
 
 if TYPE_CHECKING:
     from camcops_server.cc_modules.cc_request import CamcopsRequest
 
 log = BraceStyleAdapter(logging.getLogger(__name__))
 
+REINDEX_BATCH_SIZE = 1000  # tasks per INSERT when rebuilding the task index
+REINDEX_QUEUE_SIZE_PER_JOB = 2  # batches waiting to be inserted, per worker
+REINDEX_QUEUE_POLL_INTERVAL_S = 0.1
+SUMMARY_FETCH_BATCH_SIZE = 1000  # max task PKs per SELECT from summary store
+
+SUMMARY_JSON_VERSION_KEY = "__version__"
+
 
 # =============================================================================
 # Helper functions
@@ -111,6 +146,47 @@ def task_factory_unfiltered(dbsession: SqlASession,
     return q.first()
 
 
+def gen_current_task_batches(
+        session: SqlASession,
+        taskclass: Type[Task]) -> Generator[List[Task], None, None]:
+    """
+    Generates lists of current tasks of a given type, in PK order, each list
+    no longer than ``REINDEX_BATCH_SIZE``. Uses keyset pagination on the PK,
+    so we never hold a whole task table in memory.
+    """
+    last_pk = None  # type: Optional[int]
+    while True:
+        # noinspection PyProtectedMember
+        q = (
+            session.query(taskclass)
+            .filter(taskclass._current == True)  # noqa: E712
+        )
+        if last_pk is not None:
+            # noinspection PyProtectedMember
+            q = q.filter(taskclass._pk > last_pk)
+        # noinspection PyProtectedMember
+        tasks = q.order_by(taskclass._pk).limit(REINDEX_BATCH_SIZE).all()
+        if not tasks:
+            return
+        yield tasks
+        last_pk = tasks[-1].pk
+
+
+def _put_unless_abandoned(q: Queue, item: Any,
+                          abandon: threading.Event) -> bool:
+    """
+    Puts ``item`` on ``q``, waiting for space if necessary, unless
+    ``abandon`` is set first. Returns whether the item was put.
+    """
+    while not abandon.is_set():
+        try:
+            q.put(item, timeout=REINDEX_QUEUE_POLL_INTERVAL_S)
+            return True
+        except Full:
+            pass
+    return False
+
+
 # =============================================================================
 # PatientIdNumIndexEntry
 # =============================================================================
@@ -663,29 +739,39 @@ class TaskIndexEntry(Base):
             indexed_at_utc:
                 current time in UTC
         """
-        assert indexed_at_utc is not None, "Missing indexed_at_utc"
+        return cls(**cls.index_values_from_task(task, indexed_at_utc))
 
-        index = cls()
-
-        index.indexed_at_utc = indexed_at_utc
-
-        index.task_table_name = task.tablename
-        index.task_pk = task.pk
+    @staticmethod
+    def index_values_from_task(task: Task,
+                               indexed_at_utc: Pendulum) -> Dict[str, Any]:
+        """
+        Returns the column values of a task index entry for the specified
+        :class:`camcops_server.cc_modules.cc_task.Task`, as a dictionary
+        suitable for an SQLAlchemy Core ``INSERT``.
 
+        Args:
+            task:
+                a :class:`camcops_server.cc_modules.cc_task.Task`
+            indexed_at_utc:
+                current time in UTC
+        """
+        assert indexed_at_utc is not None, "Missing indexed_at_utc"
         patient = task.patient
-        index.patient_pk = patient.pk if patient else None
-
-        index.device_id = task.device_id
-        index.era = task.era
-        index.when_created_utc = task.get_creation_datetime_utc()
-        index.when_created_iso = task.when_created
         # noinspection PyProtectedMember
-        index.when_added_batch_utc = task._when_added_batch_utc
-        index.adding_user_id = task.get_adding_user_id()
-        index.group_id = task.group_id
-        index.task_is_complete = task.is_complete()
-
-        return index
+        return dict(
+            indexed_at_utc=indexed_at_utc,
+            task_table_name=task.tablename,
+            task_pk=task.pk,
+            patient_pk=patient.pk if patient else None,
+            device_id=task.device_id,
+            era=task.era,
+            when_created_utc=task.get_creation_datetime_utc(),
+            when_created_iso=task.when_created,
+            when_added_batch_utc=task._when_added_batch_utc,
+            adding_user_id=task.get_adding_user_id(),
+            group_id=task.group_id,
+            task_is_complete=task.is_complete(),
+        )
 
     @classmethod
     def index_task(cls, task: Task, session: SqlASession,
@@ -735,10 +821,15 @@ class TaskIndexEntry(Base):
     def rebuild_index_for_task_type(cls, session: SqlASession,
                                     taskclass: Type[Task],
                                     indexed_at_utc: Pendulum,
-                                    delete_first: bool = True) -> None:
+                                    delete_first: bool = True) -> int:
         """
         Rebuilds the index for a particular task type.
 
+        Tasks are read in batches (in PK order), and their index entries
+        inserted with one multi-row ``INSERT`` per batch, via SQLAlchemy Core.
+        (Each task is still loaded as an ORM object, since whether it's
+        complete is decided by Python code.)
+
         Args:
             session: an SQLAlchemy Session
             taskclass: a subclass of
@@ -747,6 +838,9 @@ class TaskIndexEntry(Base):
             delete_first: delete old index entries first? Should always be True
                 unless called as part of a master rebuild that deletes
                 everything first.
+
+        Returns:
+            the number of tasks indexed
         """
         # noinspection PyUnresolvedReferences
         idxtable = cls.__table__  # type: Table
@@ -757,23 +851,53 @@ class TaskIndexEntry(Base):
         if delete_first:
             session.execute(
                 idxtable.delete()
-                .where(idxcols.table_name == tasktablename)
+                .where(idxcols.task_table_name == tasktablename)
             )
         # Create new entries
-        # noinspection PyPep8,PyUnresolvedReferences,PyProtectedMember
-        q = (
-            session.query(taskclass)
-            .filter(taskclass._current == True)  # noqa: E712
-            .order_by(isotzdatetime_to_utcdatetime(taskclass.when_created))
-        )
-        for task in q:
-            cls.index_task(task, session, indexed_at_utc)
+        n_indexed = 0
+        for tasks in gen_current_task_batches(session, taskclass):
+            session.execute(
+                idxtable.insert(),
+                [cls.index_values_from_task(task, indexed_at_utc)
+                 for task in tasks]
+            )
+            n_indexed += len(tasks)
+        return n_indexed
+
+    @classmethod
+    def _queue_index_values_for_task_type(
+            cls, engine: Engine,
+            taskclass: Type[Task],
+            indexed_at_utc: Pendulum,
+            results: Queue,
+            abandon: threading.Event) -> None:
+        """
+        Reads the current tasks of a particular type, using a (read-only)
+        database session of its own, and puts their index values on
+        ``results`` as ``taskclass, values`` tuples (one per batch of tasks),
+        followed by ``taskclass, None`` when finished. For use from a worker
+        thread; see :meth:`rebuild_entire_task_index`.
+
+        Gives up (without the final ``None``) if ``abandon`` is set.
+        """
+        session = sessionmaker(bind=engine)()  # type: SqlASession
+        try:
+            for tasks in gen_current_task_batches(session, taskclass):
+                values = [cls.index_values_from_task(task, indexed_at_utc)
+                          for task in tasks]
+                if not _put_unless_abandoned(results, (taskclass, values),
+                                             abandon):
+                    return
+            _put_unless_abandoned(results, (taskclass, None), abandon)
+        finally:
+            session.close()
 
     @classmethod
     def rebuild_entire_task_index(
             cls, session: SqlASession,
             indexed_at_utc: Pendulum,
-            skip_tasks_with_missing_tables: bool = False) -> None:
+            skip_tasks_with_missing_tables: bool = False,
+            jobs: int = 1) -> None:
         """
         Rebuilds the entire index.
 
@@ -784,6 +908,13 @@ class TaskIndexEntry(Base):
                 tables are not in the database? (This is so we can rebuild an
                 index from a database upgrade, but not crash because newer
                 tasks haven't had their tables created yet.)
+            jobs: number of task tables to process concurrently. If this is
+                more than 1, tasks are read (and their index entries
+                calculated) in worker threads, each with its own database
+                connection. The index itself is still written only via
+                ``session``, so the rebuild remains a single transaction:
+                other sessions see the old index until it is committed, and
+                it is left untouched if anything fails.
         """
         log.info("Rebuilding entire task index")
         # noinspection PyUnresolvedReferences
@@ -796,16 +927,61 @@ class TaskIndexEntry(Base):
                 idxtable.delete()
             )
 
-        # Now rebuild:
+        # Which tables?
+        taskclasses = []  # type: List[Type[Task]]
         for taskclass in Task.all_subclasses_by_tablename():
             if skip_tasks_with_missing_tables:
                 basetable = taskclass.tablename
                 engine = get_engine_from_session(session)
                 if not table_exists(engine, basetable):
                     continue
-            cls.rebuild_index_for_task_type(session, taskclass,
-                                            indexed_at_utc,
-                                            delete_first=False)
+            taskclasses.append(taskclass)
+        n_tables = len(taskclasses)
+
+        # Now rebuild:
+        if jobs <= 1:
+            for i, taskclass in enumerate(taskclasses, start=1):
+                n_indexed = cls.rebuild_index_for_task_type(
+                    session, taskclass, indexed_at_utc, delete_first=False)
+                log.info("Indexed {} {} task(s) [{}/{} task tables]",
+                         n_indexed, taskclass.tablename, i, n_tables)
+            return
+
+        engine = get_engine_from_session(session)
+        configure_mappers()  # before the worker threads use them
+        results = Queue(maxsize=REINDEX_QUEUE_SIZE_PER_JOB * jobs)
+        abandon = threading.Event()
+        n_indexed = Counter()  # type: Dict[Type[Task], int]
+        n_done = 0
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            futures = [
+                executor.submit(
+                    cls._queue_index_values_for_task_type,
+                    engine, taskclass, indexed_at_utc, results, abandon)
+                for taskclass in taskclasses
+            ]
+            try:
+                while n_done < n_tables:
+                    try:
+                        taskclass, values = results.get(
+                            timeout=REINDEX_QUEUE_POLL_INTERVAL_S)
+                    except Empty:
+                        for future in futures:
+                            if future.done():
+                                # Re-raises any exception from the worker:
+                                future.result()
+                        continue
+                    if values is None:
+                        n_done += 1
+                        log.info("Indexed {} {} task(s) [{}/{} task tables]",
+                                 n_indexed[taskclass], taskclass.tablename,
+                                 n_done, n_tables)
+                        continue
+                    session.execute(idxtable.insert(), values)
+                    n_indexed[taskclass] += len(values)
+            except BaseException:
+                abandon.set()  # so the workers stop, and we can exit
+                raise
 
     # -------------------------------------------------------------------------
     # Update index at the point of upload from a device
@@ -933,12 +1109,344 @@ class TaskIndexEntry(Base):
         return ok
 
 
+# =============================================================================
+# TaskSummaryEntry
+# =============================================================================
+
+def _summary_value_to_json(value: Any) -> Any:
+    """
+    Converts a summary value (from a
+    :class:`camcops_server.cc_modules.cc_summaryelement.SummaryElement`) to
+    something we can store as JSON.
+
+    Raises:
+        :exc:`TypeError` for values we can't store
+    """
+    if value is None or isinstance(value, (bool, str)):
+        return value
+    if isinstance(value, Integral):  # including numpy integers
+        return int(value)
+    if isinstance(value, Real):  # including numpy floats
+        return float(value)
+    if isinstance(value, Version):
+        return {SUMMARY_JSON_VERSION_KEY: str(value)}
+    raise TypeError(f"Can't store summary value of type {type(value)}")
+
+
+def _summary_value_from_json(value: Any) -> Any:
+    """
+    Reverses :func:`_summary_value_to_json`.
+    """
+    if isinstance(value, dict):
+        return Version(value[SUMMARY_JSON_VERSION_KEY])
+    return value
+
+
+class TaskSummaryEntry(Base):
+    """
+    Represents precomputed summary values for a
+    :class:`camcops_server.cc_modules.cc_task.Task`; that is, the names and
+    values from its ``get_summaries()``. Optional; see the
+    ``STORE_TASK_SUMMARIES`` config setting.
+
+    - Like the task index, only current tasks have entries. They are created
+      when tasks are uploaded, and can be rebuilt with ``camcops_server
+      reindex``.
+    - Entries made by a different server version are ignored (since the
+      summary calculations may have changed).
+    - Exports that include summary values (spreadsheets, SQLite and database
+      exports) use stored values if they have been preloaded via
+      :meth:`preload_for_tasks`, and calculate them otherwise.
+    - Text values are in the language in use when they were calculated, and
+      that language is recorded; they are only used for requests in the same
+      language (others calculate them afresh). Entries without text values
+      are used for any language.
+    - Values may depend on the task's patient, so editing a patient's details
+      on the server recalculates them; see :func:`reindex_patient`.
+    """
+    __tablename__ = "_task_summaries"
+
+    entry_pk = Column(
+        "entry_pk", Integer,
+        primary_key=True, autoincrement=True,
+        comment="Arbitrary primary key of this summary entry"
+    )
+    computed_at_utc = Column(
+        "computed_at_utc", DateTime, nullable=False,
+        comment="When these summary values were calculated"
+    )
+    task_table_name = Column(
+        "task_table_name", TableNameColType,
+        index=True,
+        comment="Table name of the task's base table"
+    )
+    task_pk = Column(
+        "task_pk", Integer,
+        index=True,
+        comment="Server primary key of the task"
+    )
+    camcops_server_version = Column(
+        "camcops_server_version", SemanticVersionColType,
+        comment="CamCOPS server version that calculated the summary values"
+    )
+    language = Column(
+        "language", LanguageCodeColType,
+        comment="Language of any text summary values (NULL if there are none)"
+    )
+    summaries_json = Column(
+        "summaries_json", UnicodeText,
+        comment="Summary values, as a JSON list of [name, value] pairs"
+    )
+
+    def __repr__(self) -> str:
+        return simple_repr(self, [
+            "entry_pk", "computed_at_utc", "task_table_name", "task_pk",
+            "camcops_server_version", "language",
+        ])
+
+    # -------------------------------------------------------------------------
+    # Create
+    # -------------------------------------------------------------------------
+
+    @classmethod
+    def values_from_task(cls, req: "CamcopsRequest", task: Task,
+                         computed_at_utc: Pendulum) -> Optional[Dict[str, Any]]:
+        """
+        Returns a dictionary of column values for the summary entry for a task
+        (suitable for an SQLAlchemy Core ``INSERT``), or ``None`` if the task's
+        summary values can't be stored.
+
+        Any error in calculating the summaries is logged, not raised: the
+        summary store is only a cache (summaries not stored are calculated
+        when needed), and must never cause an upload to fail.
+
+        Args:
+            req: the :class:`camcops_server.cc_modules.cc_request.CamcopsRequest`
+            task: a :class:`camcops_server.cc_modules.cc_task.Task`
+            computed_at_utc: current time in UTC
+        """  # noqa
+        try:
+            summaries = [
+                [s.name, _summary_value_to_json(s.value)]
+                for s in task.get_summaries(req)
+            ]
+        except Exception:
+            log.exception("Not storing summaries for {!r}", task)
+            return None
+        has_text = any(isinstance(value, str) for _, value in summaries)
+        return dict(
+            computed_at_utc=computed_at_utc,
+            task_table_name=task.tablename,
+            task_pk=task.pk,
+            camcops_server_version=CAMCOPS_SERVER_VERSION,
+            language=req.language if has_text else None,
+            summaries_json=json.dumps(summaries),
+        )
+
+    @classmethod
+    def store_summaries_for_tasks(cls, req: "CamcopsRequest",
+                                  tasks: Iterable[Task],
+                                  computed_at_utc: Pendulum) -> int:
+        """
+        Calculates summary values for tasks (of any types) and inserts them,
+        with one multi-row ``INSERT``. Does not delete old entries.
+
+        Returns:
+            the number of entries inserted
+        """
+        rows = []  # type: List[Dict[str, Any]]
+        for task in tasks:
+            values = cls.values_from_task(req, task, computed_at_utc)
+            if values is not None:
+                rows.append(values)
+        if rows:
+            # noinspection PyUnresolvedReferences
+            req.dbsession.execute(cls.__table__.insert(), rows)
+        return len(rows)
+
+    # -------------------------------------------------------------------------
+    # Delete
+    # -------------------------------------------------------------------------
+
+    @classmethod
+    def delete_summaries_for_task_pks(cls, session: SqlASession,
+                                      task_table_name: str,
+                                      task_pks: Iterable[int]) -> None:
+        """
+        Deletes summary entries for some tasks of one type.
+        """
+        # noinspection PyUnresolvedReferences
+        table = cls.__table__  # type: Table
+        cols = table.columns
+        for pk_chunk in chunks(list(task_pks), SUMMARY_FETCH_BATCH_SIZE):
+            session.execute(
+                table.delete()
+                .where(cols.task_table_name == task_table_name)
+                .where(cols.task_pk.in_(pk_chunk))
+            )
+
+    @classmethod
+    def delete_summaries_for_task(cls, task: Task,
+                                  session: SqlASession) -> None:
+        """
+        Deletes the summary entry for a task (e.g. when it is erased).
+        """
+        cls.delete_summaries_for_task_pks(session, task.tablename, [task.pk])
+
+    # -------------------------------------------------------------------------
+    # Read
+    # -------------------------------------------------------------------------
+
+    @classmethod
+    def get_stored_summaries(
+            cls, session: SqlASession,
+            task_table_name: str,
+            task_pks: Iterable[int],
+            language: str = None) -> Dict[int, Dict[str, Any]]:
+        """
+        Fetches stored summary values for some tasks of one type, ignoring any
+        calculated by a different server version, and any whose text values
+        are not in the specified language (e.g. ``en-GB``; if ``None``, only
+        entries without text values are fetched).
+
+        Returns:
+            a dictionary mapping task PK to an ordered dictionary of summary
+            name to value, for those tasks with (valid) stored summaries
+        """
+        # noinspection PyUnresolvedReferences
+        table = cls.__table__  # type: Table
+        cols = table.columns
+        result = {}  # type: Dict[int, Dict[str, Any]]
+        for pk_chunk in chunks(list(task_pks), SUMMARY_FETCH_BATCH_SIZE):
+            rows = session.execute(
+                select([cols.task_pk, cols.summaries_json])
+                .where(cols.task_table_name == task_table_name)
+                .where(cols.task_pk.in_(pk_chunk))
+                .where(cols.camcops_server_version == CAMCOPS_SERVER_VERSION)
+                .where(or_(cols.language.is_(None),
+                           cols.language == language))
+            )
+            for task_pk, summaries_json in rows:
+                result[task_pk] = OrderedDict(
+                    (name, _summary_value_from_json(value))
+                    for name, value in json.loads(summaries_json)
+                )
+        return result
+
+    @classmethod
+    def preload_for_tasks(cls, req: "CamcopsRequest",
+                          tasks: Iterable[Task]) -> None:
+        """
+        If the summary store is enabled, fetches stored summary values for
+        the tasks (with one query per task type, per
+        ``SUMMARY_FETCH_BATCH_SIZE`` tasks) into
+        :attr:`camcops_server.cc_modules.cc_request.CamcopsRequest.stored_task_summaries`,
+        where :meth:`camcops_server.cc_modules.cc_task.Task.get_summary_values`
+        will find them.
+
+        Erased tasks are skipped, as are stored text values in a language other
+        than that of the request.
+        """  # noqa
+        if not req.config.store_task_summaries:
+            return
+        stored = req.stored_task_summaries
+        pks_by_table = {}  # type: Dict[str, Set[int]]
+        for task in tasks:
+            if task.is_erased():
+                continue
+            key = (task.tablename, task.pk)
+            if key not in stored:
+                pks_by_table.setdefault(task.tablename, set()).add(task.pk)
+        for tablename, pks in pks_by_table.items():
+            for task_pk, values in cls.get_stored_summaries(
+                    req.dbsession, tablename, pks,
+                    language=req.language).items():
+                stored[(tablename, task_pk)] = values
+
+    # -------------------------------------------------------------------------
+    # Rebuild
+    # -------------------------------------------------------------------------
+
+    @classmethod
+    def rebuild_summary_store(cls, req: "CamcopsRequest",
+                              skip_tasks_with_missing_tables: bool = False) \
+            -> None:
+        """
+        Deletes and recalculates all stored task summaries.
+
+        Args:
+            req: the :class:`camcops_server.cc_modules.cc_request.CamcopsRequest`
+            skip_tasks_with_missing_tables: as for
+                :meth:`TaskIndexEntry.rebuild_entire_task_index`
+        """  # noqa
+        session = req.dbsession
+        computed_at_utc = Pendulum.utcnow()
+        log.info("Rebuilding task summary store; computed_at_utc = {}",
+                 computed_at_utc)
+        # noinspection PyUnresolvedReferences
+        session.execute(cls.__table__.delete())
+        taskclasses = Task.all_subclasses_by_tablename()
+        n_tables = len(taskclasses)
+        for i, taskclass in enumerate(taskclasses, start=1):
+            if skip_tasks_with_missing_tables:
+                engine = get_engine_from_session(session)
+                if not table_exists(engine, taskclass.tablename):
+                    continue
+            n_stored = 0
+            for tasks in gen_current_task_batches(session, taskclass):
+                n_stored += cls.store_summaries_for_tasks(
+                    req, tasks, computed_at_utc)
+            log.info("Stored summaries for {} {} task(s) "
+                     "[{}/{} task tables]",
+                     n_stored, taskclass.tablename, i, n_tables)
+
+    # -------------------------------------------------------------------------
+    # Update at the point of upload from a device
+    # -------------------------------------------------------------------------
+
+    @classmethod
+    def update_summaries_for_upload(cls,
+                                    req: "CamcopsRequest",
+                                    tablechanges: UploadTableChanges,
+                                    computed_at_utc: Pendulum) -> None:
+        """
+        Updates the summary store for a device's upload, for the same tasks
+        as :meth:`TaskIndexEntry.update_task_index_for_upload`.
+
+        Args:
+            req: the :class:`camcops_server.cc_modules.cc_request.CamcopsRequest`
+            tablechanges:
+                a :class:`camcops_server.cc_modules.cc_client_api_core.UploadTableChanges`
+                object describing the changes to a table
+            computed_at_utc:
+                current time in UTC
+        """  # noqa
+        tasktablename = tablechanges.tablename
+        taskclass = tablename_to_task_class_dict()[tasktablename]
+        session = req.dbsession
+        delete_pks = set(tablechanges.task_delete_index_pks)
+        reindex_pks = tablechanges.task_reindex_pks
+        delete_pks.update(reindex_pks)
+        if delete_pks:
+            cls.delete_summaries_for_task_pks(session, tasktablename,
+                                              delete_pks)
+        if reindex_pks:
+            # noinspection PyProtectedMember
+            tasks = (
+                session.query(taskclass)
+                .filter(taskclass._pk.in_(reindex_pks))
+                .all()
+            )
+            cls.store_summaries_for_tasks(req, tasks, computed_at_utc)
+
+
 # =============================================================================
 # Wide-ranging index update functions
 # =============================================================================
 
 def reindex_everything(session: SqlASession,
-                       skip_tasks_with_missing_tables: bool = False) -> None:
+                       skip_tasks_with_missing_tables: bool = False,
+                       jobs: int = 1) -> None:
     """
     Deletes from and rebuilds all server index tables.
 
@@ -948,20 +1456,24 @@ def reindex_everything(session: SqlASession,
             tables are not in the database? (This is so we can rebuild an index
             from a database upgrade, but not crash because newer tasks haven't
             had their tables created yet.)
+        jobs: number of task tables to index concurrently; see
+            :meth:`TaskIndexEntry.rebuild_entire_task_index`
     """
     now = Pendulum.utcnow()
     log.info("Reindexing database; indexed_at_utc = {}", now)
     PatientIdNumIndexEntry.rebuild_idnum_index(session, now)
     TaskIndexEntry.rebuild_entire_task_index(
         session, now,
-        skip_tasks_with_missing_tables=skip_tasks_with_missing_tables)
+        skip_tasks_with_missing_tables=skip_tasks_with_missing_tables,
+        jobs=jobs)
 
 
 def update_indexes_and_push_exports(req: "CamcopsRequest",
                                     batchdetails: BatchDetails,
                                     tablechanges: UploadTableChanges) -> None:
     """
-    Update server indexes, if required.
+    Update server indexes (and the task summary store, if enabled), if
+    required.
 
     Also triggers background jobs to export "new arrivals", if required.
 
@@ -987,6 +1499,13 @@ def update_indexes_and_push_exports(req: "CamcopsRequest",
             tablechanges=tablechanges,
             indexed_at_utc=batchdetails.batchtime
         )
+        # Update task summary store
+        if req.config.store_task_summaries:
+            TaskSummaryEntry.update_summaries_for_upload(
+                req=req,
+                tablechanges=tablechanges,
+                computed_at_utc=batchdetails.batchtime
+            )
         # Push exports
         recipients = req.all_push_recipients
         uploading_group_id = req.user.upload_group_id
@@ -999,6 +1518,50 @@ def update_indexes_and_push_exports(req: "CamcopsRequest",
                 # ... will be transmitted *after* the request performs COMMIT
 
 
+def reindex_patient(req: "CamcopsRequest",
+                    patient: Patient,
+                    tasks: Iterable[Task]) -> None:
+    """
+    Updates server indexes (and the task summary store, if enabled) after a
+    patient's details have been edited on the server: re-indexes the
+    patient's current ID numbers, and the patient's tasks (whose summary
+    values may depend on the patient's details).
+
+    Args:
+        req: the :class:`camcops_server.cc_modules.cc_request.CamcopsRequest`
+        patient: the :class:`camcops_server.cc_modules.cc_patient.Patient`
+        tasks: the patient's tasks; any that are not current are ignored
+    """  # noqa
+    session = req.dbsession
+    indexed_at_utc = req.now_utc
+    session.flush()  # so that any new ID numbers have PKs
+    # The patient's "idnums" relationship may be out of date:
+    session.expire(patient, ["idnums"])
+
+    PatientIdNumIndexEntry.unindex_patient(patient, session)
+    # noinspection PyProtectedMember
+    idnums = (
+        session.query(PatientIdNum)
+        .filter(PatientIdNum.patient_id == patient.id)
+        .filter(PatientIdNum._device_id == patient.device_id)
+        .filter(PatientIdNum._era == patient.era)
+        .filter(PatientIdNum._current == True)  # noqa: E712
+    )
+    for idnum in idnums:
+        PatientIdNumIndexEntry.index_idnum(idnum, session)
+
+    # noinspection PyProtectedMember
+    current_tasks = [task for task in tasks if task._current]
+    for task in current_tasks:
+        TaskIndexEntry.unindex_task(task, session)
+        TaskIndexEntry.index_task(task, session, indexed_at_utc)
+        if req.config.store_task_summaries:
+            TaskSummaryEntry.delete_summaries_for_task(task, session)
+    if req.config.store_task_summaries:
+        TaskSummaryEntry.store_summaries_for_tasks(req, current_tasks,
+                                                   indexed_at_utc)
+
+
 def check_indexes(session: SqlASession, show_all_bad: bool = False) -> bool:
     """
     Checks all server index tables.
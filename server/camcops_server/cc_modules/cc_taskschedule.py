@@ -26,8 +26,9 @@ camcops_server/cc_modules/cc_taskschedule.py
 
 """
 
+from collections import OrderedDict
 import logging
-from typing import List, Iterable, Optional, Tuple, TYPE_CHECKING
+from typing import Dict, List, Iterable, Optional, Tuple, TYPE_CHECKING
 from urllib.parse import quote, urlencode
 
 from pendulum import DateTime as Pendulum, Duration
@@ -59,10 +60,15 @@ from camcops_server.cc_modules.cc_taskcollection import (
 
 if TYPE_CHECKING:
     from sqlalchemy.sql.elements import Cast
+    from camcops_server.cc_modules.cc_patient import Patient
     from camcops_server.cc_modules.cc_request import CamcopsRequest
 
 log = logging.getLogger(__name__)
 
+# A scheduled task and its timeframe (start, end), if it has one.
+_ScheduleWindow = Tuple["TaskScheduleItem", Optional[Pendulum],
+                        Optional[Pendulum]]
+
 
 # =============================================================================
 # ScheduledTaskInfo
@@ -124,85 +130,12 @@ class PatientTaskSchedule(Base):
 
     def get_list_of_scheduled_tasks(self, req: "CamcopsRequest") \
             -> List[ScheduledTaskInfo]:
-
-        task_list = []
-
-        task_class_lookup = tablename_to_task_class_dict()
-
-        for tsi in self.task_schedule.items:
-            start_datetime = None
-            end_datetime = None
-            task = None
-
-            if self.start_datetime is not None:
-                start_datetime = self.start_datetime.add(
-                    days=tsi.due_from.days
-                )
-                end_datetime = self.start_datetime.add(
-                    days=tsi.due_by.days
-                )
-
-                task = self.find_scheduled_task(
-                    req, tsi, start_datetime, end_datetime
-                )
-
-            task_class = task_class_lookup[tsi.task_table_name]
-
-            task_list.append(
-                ScheduledTaskInfo(
-                    task_class.shortname,
-                    tsi.task_table_name,
-                    is_anonymous=task_class.is_anonymous,
-                    task=task,
-                    start_datetime=start_datetime,
-                    end_datetime=end_datetime,
-                )
-            )
-
-        return task_list
-
-    def find_scheduled_task(self,
-                            req: "CamcopsRequest",
-                            tsi: "TaskScheduleItem",
-                            start_datetime: Pendulum,
-                            end_datetime: Pendulum) -> Optional[Task]:
         """
-        Returns the most recently uploaded task that matches the patient (by
-        any ID number, i.e. via OR), task type and timeframe
+        Returns information about each task in this schedule, including the
+        most recently uploaded matching task, if there is one. See
+        :func:`get_scheduled_tasks_for_patient_task_schedules`.
         """
-        taskfilter = TaskFilter()
-        for idnum in self.patient.idnums:
-            idnum_ref = IdNumReference(which_idnum=idnum.which_idnum,
-                                       idnum_value=idnum.idnum_value)
-            taskfilter.idnum_criteria.append(idnum_ref)
-
-        taskfilter.task_types = [tsi.task_table_name]
-
-        taskfilter.start_datetime = start_datetime
-        taskfilter.end_datetime = end_datetime
-
-        # TODO: Improve error reporting
-        # Shouldn't happen in normal operation as the task schedule item form
-        # validation will ensure the dates are correct.
-        # However, it's quite easy to write tests with unintentionally
-        # inconsistent dates.
-        # If we don't assert this here, we get a more cryptic assertion
-        # failure later:
-        #
-        # cc_taskcollection.py _fetch_tasks_from_indexes()
-        # assert self._all_indexes is not None
-        assert not taskfilter.dates_inconsistent()
-
-        collection = TaskCollection(
-            req=req,
-            taskfilter=taskfilter,
-            sort_method_global=TaskSortMethod.CREATION_DATE_DESC
-        )
-
-        if len(collection.all_tasks) > 0:
-            return collection.all_tasks[0]
-
-        return None
+        return get_scheduled_tasks_for_patient_task_schedules(req, [self])[0]
 
     def mailto_url(self, req: "CamcopsRequest") -> str:
         template_dict = dict(
@@ -224,6 +157,141 @@ class PatientTaskSchedule(Base):
         return mailto_url
 
 
+def get_scheduled_tasks_for_patient_task_schedules(
+        req: "CamcopsRequest",
+        patient_task_schedules: Iterable[PatientTaskSchedule]) \
+        -> List[List[ScheduledTaskInfo]]:
+    """
+    Returns information about each task in each of the specified patient task
+    schedules. For each scheduled task, this includes the most recently
+    uploaded task that matches the patient (by any ID number, i.e. via OR),
+    task type and timeframe, if there is one.
+
+    Rather than querying for each scheduled task separately, we fetch all
+    candidate tasks for each patient (of any scheduled type, within any of the
+    timeframes) with a single task collection, and assign them to scheduled
+    tasks in memory. So this is much faster for long schedules, or for several
+    schedules at once.
+
+    Args:
+        req: a :class:`camcops_server.cc_modules.cc_request.CamcopsRequest`
+        patient_task_schedules: :class:`PatientTaskSchedule` objects
+
+    Returns:
+        a list of :class:`ScheduledTaskInfo` objects for each schedule, in the
+        same order as ``patient_task_schedules``
+    """
+    task_class_lookup = tablename_to_task_class_dict()
+
+    # Work out the timeframe of each scheduled task.
+    schedules = []  # type: List[Tuple[PatientTaskSchedule, List[_ScheduleWindow]]]  # noqa
+    windows_by_patient = OrderedDict()  # type: Dict[int, List[_ScheduleWindow]]  # noqa
+    for pts in patient_task_schedules:
+        windows = []  # type: List[_ScheduleWindow]
+        for tsi in pts.task_schedule.items:
+            start_datetime = None
+            end_datetime = None
+            if pts.start_datetime is not None:
+                start_datetime = pts.start_datetime.add(days=tsi.due_from.days)
+                end_datetime = pts.start_datetime.add(days=tsi.due_by.days)
+            windows.append((tsi, start_datetime, end_datetime))
+        schedules.append((pts, windows))
+        windows_by_patient.setdefault(pts.patient_pk, []).extend(windows)
+
+    # Fetch candidate tasks, once per patient.
+    candidates_by_patient = {}  # type: Dict[int, List[Task]]
+    for pts, _ in schedules:
+        if pts.patient_pk not in candidates_by_patient:
+            candidates_by_patient[pts.patient_pk] = _get_candidate_tasks(
+                req, pts.patient, windows_by_patient[pts.patient_pk])
+
+    # Assign them.
+    results = []  # type: List[List[ScheduledTaskInfo]]
+    for pts, windows in schedules:
+        candidates = candidates_by_patient[pts.patient_pk]
+        task_list = []  # type: List[ScheduledTaskInfo]
+        for tsi, start_datetime, end_datetime in windows:
+            task = None
+            if start_datetime is not None:
+                task = _find_scheduled_task(candidates, tsi.task_table_name,
+                                            start_datetime, end_datetime)
+            task_class = task_class_lookup[tsi.task_table_name]
+            task_list.append(
+                ScheduledTaskInfo(
+                    task_class.shortname,
+                    tsi.task_table_name,
+                    is_anonymous=task_class.is_anonymous,
+                    task=task,
+                    start_datetime=start_datetime,
+                    end_datetime=end_datetime,
+                )
+            )
+        results.append(task_list)
+    return results
+
+
+def _get_candidate_tasks(req: "CamcopsRequest",
+                         patient: "Patient",
+                         windows: List[_ScheduleWindow]) -> List[Task]:
+    """
+    Returns all tasks that match the patient (by any ID number, i.e. via OR),
+    that are of any of the scheduled task types, and that were created within
+    the overall timeframe of the scheduled tasks. Newest first.
+    """
+    windows = [w for w in windows if w[1] is not None]
+    if not windows:
+        return []
+
+    # TODO: Improve error reporting
+    # Shouldn't happen in normal operation as the task schedule item form
+    # validation will ensure the dates are correct.
+    # However, it's quite easy to write tests with unintentionally
+    # inconsistent dates.
+    # If we don't assert this here, we get a more cryptic assertion
+    # failure later:
+    #
+    # cc_taskcollection.py _fetch_tasks_from_indexes()
+    # assert self._all_indexes is not None
+    for _, start_datetime, end_datetime in windows:
+        assert end_datetime >= start_datetime
+
+    taskfilter = TaskFilter()
+    for idnum in patient.idnums:
+        idnum_ref = IdNumReference(which_idnum=idnum.which_idnum,
+                                   idnum_value=idnum.idnum_value)
+        taskfilter.idnum_criteria.append(idnum_ref)
+
+    taskfilter.task_types = sorted(set(tsi.task_table_name
+                                       for tsi, _, _ in windows))
+
+    taskfilter.start_datetime = min(w[1] for w in windows)
+    taskfilter.end_datetime = max(w[2] for w in windows)
+
+    collection = TaskCollection(
+        req=req,
+        taskfilter=taskfilter,
+        sort_method_global=TaskSortMethod.CREATION_DATE_DESC
+    )
+    return collection.all_tasks
+
+
+def _find_scheduled_task(candidates: List[Task],
+                         tablename: str,
+                         start_datetime: Pendulum,
+                         end_datetime: Pendulum) -> Optional[Task]:
+    """
+    Returns the first (i.e. most recent) of the candidate tasks that is of
+    the right type and was created within the timeframe, or ``None``. (The
+    timeframe is applied as per
+    :class:`camcops_server.cc_modules.cc_taskcollection.TaskCollection`.)
+    """
+    for task in candidates:
+        if (task.tablename == tablename and
+                start_datetime <= task.when_created < end_datetime):
+            return task
+    return None
+
+
 def task_schedule_item_sort_order() -> Tuple["Cast", "Cast"]:
     """
     Returns a tuple of sorting functions for use with SQLAlchemy ORM queries,
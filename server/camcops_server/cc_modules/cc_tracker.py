@@ -30,7 +30,9 @@ showing text that a clinician might care about.**
 """
 
 import logging
-from typing import Any, Dict, List, Optional, Set, Tuple, TYPE_CHECKING
+from typing import (
+    Any, Dict, Generator, List, Optional, Set, Tuple, TYPE_CHECKING,
+)
 
 from cardinal_pythonlib.datetimefunc import format_datetime
 from cardinal_pythonlib.logs import BraceStyleAdapter
@@ -57,7 +59,7 @@ from camcops_server.cc_modules.cc_taskcollection import (
     TaskSortMethod,
 )
 from camcops_server.cc_modules.cc_xml import (
-    get_xml_document,
+    gen_xml_document,
     XmlDataTypes,
     XmlElement,
 )
@@ -394,6 +396,21 @@ class TrackerCtvCommon(object):
         Returns:
             an XML UTF-8 document representing our object.
         """
+        return "".join(self.gen_xml(indent_spaces=indent_spaces, eol=eol,
+                                    include_comments=include_comments))
+
+    def gen_xml(self,
+                indent_spaces: int = 4,
+                eol: str = '\n',
+                include_comments: bool = False) -> Generator[str, None, None]:
+        """
+        As for :meth:`get_xml`, but returns the XML in chunks.
+
+        Args:
+            indent_spaces: number of spaces to indent formatted XML
+            eol: end-of-line string
+            include_comments: include comments describing each field?
+        """
         raise NotImplementedError("implement in subclass")
 
     def _get_html(self) -> str:
@@ -412,14 +429,16 @@ class TrackerCtvCommon(object):
     # XML view
     # -------------------------------------------------------------------------
 
-    def _get_xml(self,
+    def _gen_xml(self,
                  audit_string: str,
                  xml_name: str,
                  indent_spaces: int = 4,
                  eol: str = '\n',
-                 include_comments: bool = False) -> str:
+                 include_comments: bool = False) \
+            -> Generator[str, None, None]:
         """
-        Returns an XML document representing this object.
+        Returns an XML document representing this object, in chunks. (The XML
+        tree is built, and access audited, when this is called.)
 
         Args:
             audit_string: description used to audit access to this information
@@ -429,7 +448,7 @@ class TrackerCtvCommon(object):
             include_comments: include comments describing each field?
 
         Returns:
-            an XML UTF-8 document representing the task.
+            chunks of an XML UTF-8 document representing the task.
         """
         iddef = self.taskfilter.get_only_iddef()
         if not iddef:
@@ -482,7 +501,7 @@ class TrackerCtvCommon(object):
                 patient_server_pk=t.get_patient_server_pk()
             )
         tree = XmlElement(name=xml_name, value=branches)
-        return get_xml_document(
+        return gen_xml_document(
             tree,
             indent_spaces=indent_spaces,
             eol=eol,
@@ -585,11 +604,11 @@ class Tracker(TrackerCtvCommon):
             via_index=via_index
         )
 
-    def get_xml(self,
+    def gen_xml(self,
                 indent_spaces: int = 4,
                 eol: str = '\n',
-                include_comments: bool = False) -> str:
-        return self._get_xml(
+                include_comments: bool = False) -> Generator[str, None, None]:
+        return self._gen_xml(
             audit_string="Tracker XML accessed",
             xml_name="tracker",
             indent_spaces=indent_spaces,
@@ -816,11 +835,11 @@ class ClinicalTextView(TrackerCtvCommon):
             via_index=via_index
         )
 
-    def get_xml(self,
+    def gen_xml(self,
                 indent_spaces: int = 4,
                 eol: str = '\n',
-                include_comments: bool = False) -> str:
-        return self._get_xml(
+                include_comments: bool = False) -> Generator[str, None, None]:
+        return self._gen_xml(
             audit_string="Clinical text view XML accessed",
             xml_name="ctv",
             indent_spaces=indent_spaces,
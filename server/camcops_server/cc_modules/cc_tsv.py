@@ -44,10 +44,6 @@ from cardinal_pythonlib.datetimefunc import (
     format_datetime,
     get_now_localtz_pendulum,
 )
-from cardinal_pythonlib.excel import (
-    convert_for_openpyxl,
-    convert_for_pyexcel_ods3,
-)
 from cardinal_pythonlib.logs import BraceStyleAdapter
 from sqlalchemy.engine.result import ResultProxy
 
@@ -275,6 +271,7 @@ class TsvPage(object):
         """
         Writes data from this page to an existing ``openpyxl`` XLSX worksheet.
         """
+        from cardinal_pythonlib.excel import convert_for_openpyxl  # delayed import; slow (openpyxl, pandas)  # noqa
         ws.append(self.headings)
         for row in self.rows:
             ws.append([convert_for_openpyxl(row.get(h))
@@ -460,6 +457,7 @@ class TsvCollection(object):
         Args:
             file: filename or file-like object
         """
+        from cardinal_pythonlib.excel import convert_for_openpyxl  # delayed import; slow (openpyxl, pandas)  # noqa
         if XLSX_VIA_PYEXCEL:  # use pyexcel_xlsx
             data = self._get_pyexcel_data(convert_for_openpyxl)
             pyexcel_xlsx.save_data(file, data)
@@ -519,6 +517,7 @@ class TsvCollection(object):
         Args:
             file: filename or file-like object
         """
+        from cardinal_pythonlib.excel import convert_for_pyexcel_ods3  # delayed import; slow (openpyxl, pandas)  # noqa
         if ODS_VIA_PYEXCEL:  # use pyexcel_ods3
             data = self._get_pyexcel_data(convert_for_pyexcel_ods3)
             pyexcel_ods3.save_data(file, data)
@@ -34,6 +34,7 @@ from io import StringIO
 import logging
 import os
 import sqlite3
+import tempfile
 from typing import Any, List, Type, TYPE_CHECKING
 import unittest
 
@@ -42,11 +43,14 @@ from cardinal_pythonlib.httpconst import MimeType
 from cardinal_pythonlib.logs import BraceStyleAdapter
 import pendulum
 import pytest
+from sqlalchemy.event.api import listen
 
 from camcops_server.cc_modules.cc_constants import ERA_NOW
 from camcops_server.cc_modules.cc_idnumdef import IdNumDefinition
 from camcops_server.cc_modules.cc_ipuse import IpUse
 from camcops_server.cc_modules.cc_sqlalchemy import (
+    Base,
+    make_file_sqlite_engine,
     sql_from_sqlite_database,
 )
 from camcops_server.cc_modules.cc_version import CAMCOPS_SERVER_VERSION
@@ -436,3 +440,48 @@ class DemoDatabaseTestCase(DemoRequestTestCase):
 
     def tearDown(self) -> None:
         pass
+
+
+# noinspection PyUnusedLocal
+def _fast_unsafe_sqlite_pragmas(dbapi_connection, connection_record) -> None:
+    """
+    Speeds up a throwaway SQLite test database by not waiting for the disk.
+    """
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA synchronous = OFF")
+    cursor.close()
+
+
+class DemoFileDatabaseTestCase(DemoDatabaseTestCase):
+    """
+    Test case that sets up a demonstration CamCOPS database in a temporary
+    SQLite file, and commits it. The request then uses that database via an
+    ordinary session, not a debugging session, so code that opens further
+    sessions of its own (e.g. in worker threads) sees the same data.
+
+    Slower than :class:`DemoDatabaseTestCase` (it creates the whole schema for
+    each test), so use it only for tests that need this.
+    """
+    def setUp(self) -> None:
+        from sqlalchemy.orm import sessionmaker
+
+        fd, self.file_db_filename = tempfile.mkstemp(
+            suffix=".sqlite", dir=self.tmpdir_obj.name)
+        os.close(fd)
+        self.file_engine = make_file_sqlite_engine(self.file_db_filename)
+        listen(self.file_engine, "connect", _fast_unsafe_sqlite_pragmas)
+        Base.metadata.create_all(self.file_engine)
+        # Our session, rather than the one provided by the fixtures:
+        self.dbsession = sessionmaker(bind=self.file_engine)()
+        super().setUp()
+        self.dbsession.commit()
+
+        self.req.engine = self.file_engine
+        self.req.dbsession = self.dbsession
+        self.req._debugging_db_session = None
+
+    def tearDown(self) -> None:
+        self.dbsession.close()
+        self.file_engine.dispose()
+        os.remove(self.file_db_filename)
+        super().tearDown()
@@ -31,7 +31,9 @@ camcops_server/cc_modules/cc_xml.py
 import base64
 import datetime
 import logging
-from typing import Any, List, Optional, TYPE_CHECKING, Union
+from typing import (
+    Any, Generator, Iterable, List, Optional, TYPE_CHECKING, Union,
+)
 import xml.sax.saxutils
 
 from cardinal_pythonlib.logs import BraceStyleAdapter
@@ -59,6 +61,8 @@ log = BraceStyleAdapter(logging.getLogger(__name__))
 
 XML_NAME_SNOMED_CODES = "snomed_ct_codes"
 
+XML_STREAM_CHUNK_SIZE = 65536  # characters; see gen_encoded_chunks()
+
 XML_NAMESPACES = [
     ' xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance"'
     # ' xmlns:dt="http://www.w3.org/2001/XMLSchema-datatypes"'
@@ -345,6 +349,35 @@ def get_xml_tree(element: Union[XmlElement, XmlSimpleValue,
                  include_comments: bool = False) -> str:
     """
     Returns an :class:`camcops_server.cc_modules.cc_xml.XmlElement` as text.
+    See :func:`gen_xml_tree`, which this joins together.
+
+    Args:
+        element: root :class:`camcops_server.cc_modules.cc_xml.XmlElement`
+        level: starting level/depth (used for recursion)
+        indent_spaces: number of spaces to indent formatted XML
+        eol: end-of-line string
+        include_comments: include comments describing each field?
+    """
+    return "".join(gen_xml_tree(
+        element,
+        level=level,
+        indent_spaces=indent_spaces,
+        eol=eol,
+        include_comments=include_comments
+    ))
+
+
+def gen_xml_tree(element: Union[XmlElement, XmlSimpleValue,
+                                List[Union[XmlElement, XmlSimpleValue]]],
+                 level: int = 0,
+                 indent_spaces: int = 4,
+                 eol: str = '\n',
+                 include_comments: bool = False) \
+        -> Generator[str, None, None]:
+    """
+    Generates an :class:`camcops_server.cc_modules.cc_xml.XmlElement` as text,
+    in chunks (so that large trees can be written to a file or HTTP response
+    without first assembling them into one string).
 
     Args:
         element: root :class:`camcops_server.cc_modules.cc_xml.XmlElement`
@@ -375,14 +408,13 @@ def get_xml_tree(element: Union[XmlElement, XmlSimpleValue,
       too).
 
     """  # noqa
-    xmltext = ""
     prefix = ' ' * level * indent_spaces
 
     if isinstance(element, XmlElement):
 
         if element.literal:
             # A user-inserted piece of XML. Insert, but indent.
-            xmltext += prefix + element.literal + eol
+            yield prefix + element.literal + eol
 
         else:
 
@@ -407,35 +439,33 @@ def get_xml_tree(element: Union[XmlElement, XmlSimpleValue,
             # Assemble
             if element.value is None:
                 # NULL handling
-                xmltext += (
+                yield (
                     f'{prefix}<{element.name}{attributes} '
                     f'xsi:nil="true"/>{eol}'
                 )
-            else:
-                complex_value = isinstance(element.value, XmlElement) \
-                    or isinstance(element.value, list)
-                value_to_recurse = element.value if complex_value else \
-                    XmlSimpleValue(element.value)
-                # ... XmlSimpleValue is a marker that subsequently
-                # distinguishes things that were part of an XmlElement from
-                # user-inserted raw XML.
-                nl = eol if complex_value else ""
-                pr2 = prefix if complex_value else ""
-                v = get_xml_tree(
-                    value_to_recurse,
+            elif isinstance(element.value, (XmlElement, list)):
+                # Complex value: recurse
+                yield f'{prefix}<{element.name}{attributes}>{eol}'
+                yield from gen_xml_tree(
+                    element.value,
                     level=level + 1,
                     indent_spaces=indent_spaces,
                     eol=eol,
                     include_comments=include_comments
                 )
-                xmltext += (
-                    f'{prefix}<{element.name}{attributes}>{nl}'
-                    f'{v}{pr2}</{element.name}>{eol}'
+                yield f'{prefix}</{element.name}>{eol}'
+            else:
+                # Simple value. (It's escaped, unlike a user-inserted piece of
+                # raw XML.)
+                v = xml_escape_value(str(element.value))
+                yield (
+                    f'{prefix}<{element.name}{attributes}>'
+                    f'{v}</{element.name}>{eol}'
                 )
 
     elif isinstance(element, list):
         for subelement in element:
-            xmltext += get_xml_tree(subelement, level,
+            yield from gen_xml_tree(subelement, level,
                                     indent_spaces=indent_spaces,
                                     eol=eol,
                                     include_comments=include_comments)
@@ -443,12 +473,10 @@ def get_xml_tree(element: Union[XmlElement, XmlSimpleValue,
 
     elif isinstance(element, XmlSimpleValue):
         # The lowest-level thing a value. No extra indent.
-        xmltext += xml_escape_value(str(element.value))
+        yield xml_escape_value(str(element.value))
 
     else:
-        raise ValueError(f"Bad value to get_xml_tree: {element!r}")
-
-    return xmltext
+        raise ValueError(f"Bad value to gen_xml_tree: {element!r}")
 
 
 def get_xml_document(root: XmlElement,
@@ -459,6 +487,30 @@ def get_xml_document(root: XmlElement,
     Returns an entire XML document as text, given the root
     :class:`camcops_server.cc_modules.cc_xml.XmlElement`.
 
+    Args:
+        root: root :class:`camcops_server.cc_modules.cc_xml.XmlElement`
+        indent_spaces: number of spaces to indent formatted XML
+        eol: end-of-line string
+        include_comments: include comments describing each field?
+    """
+    return "".join(gen_xml_document(
+        root,
+        indent_spaces=indent_spaces,
+        eol=eol,
+        include_comments=include_comments
+    ))
+
+
+def gen_xml_document(root: XmlElement,
+                     indent_spaces: int = 4,
+                     eol: str = '\n',
+                     include_comments: bool = False) \
+        -> Generator[str, None, None]:
+    """
+    Generates an entire XML document as text, in chunks, given the root
+    :class:`camcops_server.cc_modules.cc_xml.XmlElement`. See
+    :func:`gen_xml_tree`.
+
     Args:
         root: root :class:`camcops_server.cc_modules.cc_xml.XmlElement`
         indent_spaces: number of spaces to indent formatted XML
@@ -466,11 +518,39 @@ def get_xml_document(root: XmlElement,
         include_comments: include comments describing each field?
     """
     if not isinstance(root, XmlElement):
-        raise AssertionError("get_xml_document: root not an XmlElement; "
+        raise AssertionError("gen_xml_document: root not an XmlElement; "
                              "XML requires a single root")
-    return xml_header(eol) + get_xml_tree(
+    yield xml_header(eol)
+    yield from gen_xml_tree(
         root,
         indent_spaces=indent_spaces,
         eol=eol,
         include_comments=include_comments
     )
+
+
+def gen_encoded_chunks(chunks: Iterable[str],
+                       encoding: str = "utf-8",
+                       min_chunk_size: int = XML_STREAM_CHUNK_SIZE) \
+        -> Generator[bytes, None, None]:
+    """
+    Encodes text chunks (e.g. from :func:`gen_xml_document`), combining small
+    ones, for writing to a binary stream such as an HTTP response.
+
+    Args:
+        chunks: text chunks
+        encoding: encoding to use
+        min_chunk_size: combine text chunks until they reach this many
+            characters (except for the last)
+    """
+    pending = []  # type: List[str]
+    pending_size = 0
+    for chunk in chunks:
+        pending.append(chunk)
+        pending_size += len(chunk)
+        if pending_size >= min_chunk_size:
+            yield "".join(pending).encode(encoding)
+            pending = []
+            pending_size = 0
+    if pending:
+        yield "".join(pending).encode(encoding)
@@ -111,7 +111,7 @@ Task decorator options:
 
 import logging
 import os
-from typing import Any, Dict, TYPE_CHECKING
+from typing import Any, Dict, List, Optional, Tuple, TYPE_CHECKING
 
 from cardinal_pythonlib.json.serialize import json_encode, json_decode
 from cardinal_pythonlib.logs import BraceStyleAdapter
@@ -119,7 +119,7 @@ from celery import Celery, current_task
 from kombu.serialization import register
 
 # noinspection PyUnresolvedReferences
-import camcops_server.cc_modules.cc_all_models  # import side effects (ensure all models registered)  # noqa
+import camcops_server.cc_modules.cc_nontask_models  # import side effects (ensure all non-task models registered; tasks are loaded on demand)  # noqa
 
 if TYPE_CHECKING:
     from celery.app.task import Task as CeleryTask
@@ -142,6 +142,9 @@ CELERY_TASK_MODULE_NAME = CELERY_APP_NAME + ".celery"
 
 MAX_RETRIES = 10
 CELERY_SOFT_TIME_LIMIT_SEC = 300
+CELERY_EXPORT_BATCH_SOFT_TIME_LIMIT_SEC = 1800
+# ... a batch of exports takes longer than one; if it runs out of time, the
+# tasks it didn't export are resubmitted (see export_tasks_backend).
 
 
 # =============================================================================
@@ -153,6 +156,28 @@ register("json", json_encode, json_decode,
          content_encoding='utf-8')
 
 
+def scale_rate_limit(rate_limit: Optional[str],
+                     items_per_job: int) -> Optional[str]:
+    """
+    Converts a Celery rate limit for individual items (e.g. ``"100/m"``) into
+    one for jobs that each process up to ``items_per_job`` items (e.g.
+    ``"1/m"`` for 100 items per job), so that items are processed no faster
+    than before.
+
+    Args:
+        rate_limit: a Celery rate limit, or ``None``/empty for no limit
+        items_per_job: the maximum number of items processed by each job
+
+    Returns:
+        a Celery rate limit, or ``None`` for no limit
+    """
+    if not rate_limit:
+        return None
+    ops, _, unit = rate_limit.partition("/")
+    scaled = float(ops) / max(1, items_per_job)
+    return f"{scaled:g}/{unit}" if unit else f"{scaled:g}"
+
+
 def get_celery_settings_dict() -> Dict[str, Any]:
     log.debug("Configuring Celery")
     from camcops_server.cc_modules.cc_config import (
@@ -199,7 +224,13 @@ def get_celery_settings_dict() -> Dict[str, Any]:
         "task_annotations": {
             "camcops_server.cc_modules.celery.export_task_backend": {
                 "rate_limit": config.celery_export_task_rate_limit,
-            }
+            },
+            "camcops_server.cc_modules.celery.export_tasks_backend": {
+                # The configured limit is per task exported:
+                "rate_limit": scale_rate_limit(
+                    config.celery_export_task_rate_limit,
+                    config.celery_export_batch_size),
+            },
         },
     }
 
@@ -321,6 +352,9 @@ def export_task_backend(self: "CeleryTask",
     This function exports a single task but does so with only simple (string,
     integer) information, so it can be called via the Celery task queue.
 
+    CamCOPS now submits :func:`export_tasks_backend` jobs instead; this one
+    remains so that jobs queued by older versions still run.
+
     Args:
         self: the Celery task, :class:`celery.app.task.Task`
         recipient_name: export recipient name (as per the config file)
@@ -343,9 +377,73 @@ def export_task_backend(self: "CeleryTask",
                     "export_task_backend for recipient {!r}: No task found "
                     "for {} {}", recipient_name, basetable, task_pk)
                 return
-            export_task(req, recipient, task)
+            exported = export_task(req, recipient, task)
+    except Exception as exc:
+        self.retry(countdown=backoff(self.request.retries), exc=exc)
+        return  # not reached; retry() raises
+    if not exported:
+        # Being exported by another process; try again later.
+        self.retry(countdown=backoff(self.request.retries))
+
+
+@celery_app.task(bind=True,
+                 ignore_result=True,
+                 max_retries=MAX_RETRIES,
+                 soft_time_limit=CELERY_EXPORT_BATCH_SOFT_TIME_LIMIT_SEC)
+def export_tasks_backend(self: "CeleryTask",
+                         recipient_name: str,
+                         basetable_pk_pairs: List[Tuple[str, int]]) -> None:
+    """
+    Exports a batch of tasks to a single recipient. Like
+    :func:`export_task_backend`, but much cheaper per task: the request,
+    database session, and recipient are set up once for the whole batch,
+    tasks are fetched with one query per task table, and any per-recipient
+    caches (e.g. of REDCap records) are shared across the batch.
+
+    If some tasks fail, only those are retried. If the job runs out of time,
+    the tasks it hasn't exported are resubmitted as a new job (or, if it
+    exported none, retried).
+
+    Args:
+        self: the Celery task, :class:`celery.app.task.Task`
+        recipient_name: export recipient name (as per the config file)
+        basetable_pk_pairs: list of ``basetable, task_pk`` pairs (each pair
+            may arrive as a list, courtesy of JSON)
+    """
+    from camcops_server.cc_modules.cc_export import (
+        export_tasks_by_pk,
+        ExportTimeLimitExceeded,
+    )  # delayed import
+    from camcops_server.cc_modules.cc_request import command_line_request_context  # delayed import  # noqa
+
+    pairs = [(basetable, task_pk) for basetable, task_pk in basetable_pk_pairs]
+    try:
+        with command_line_request_context() as req:
+            recipient = req.get_export_recipient(recipient_name)
+            failed = export_tasks_by_pk(req, recipient, pairs)
+    except ExportTimeLimitExceeded as exc:
+        if len(exc.unfinished) < len(pairs):
+            # We made progress, so this is not a failure; carry on with the
+            # rest in a new job.
+            export_tasks_backend.delay(recipient_name=recipient_name,
+                                       basetable_pk_pairs=exc.unfinished)
+            return
+        self.retry(
+            kwargs=dict(recipient_name=recipient_name,
+                        basetable_pk_pairs=exc.unfinished),
+            countdown=backoff(self.request.retries), exc=exc)
+        return  # not reached; retry() raises
     except Exception as exc:
         self.retry(countdown=backoff(self.request.retries), exc=exc)
+        return  # not reached; retry() raises
+    if failed:
+        log.warning("export_tasks_backend for recipient {!r}: {} of {} "
+                    "task(s) failed; retrying those",
+                    recipient_name, len(failed), len(pairs))
+        self.retry(
+            kwargs=dict(recipient_name=recipient_name,
+                        basetable_pk_pairs=failed),
+            countdown=backoff(self.request.retries))
 
 
 @celery_app.task(bind=True,
@@ -114,6 +114,13 @@ step (faster; for use if the network packets are not excessively large).
 
 - Code relating to this uses ``batchdetails.onestep``.
 
+- Optionally (from v2.4.7), instead of sending the whole database as one JSON
+  POST variable, the client can stream it as the request body, one table per
+  line of JSON, optionally gzip-compressed; see
+  :func:`gen_onestep_upload_tables_from_stream`. The server then decodes and
+  processes one table at a time, so its memory use is bounded by the largest
+  table rather than the whole client database.
+
 **Setup for the upload code**
 
 - Fire up a CamCOPS client with an empty database, e.g. from the build
@@ -338,9 +345,11 @@ import json
 import secrets
 import string
 import time
+import zlib
 from typing import (
     Any,
     Dict,
+    Generator,
     Iterable,
     List,
     Optional,
@@ -354,6 +363,7 @@ from cardinal_pythonlib.datetimefunc import (
     coerce_to_pendulum_date,
     format_datetime,
 )
+from cardinal_pythonlib.lists import chunks
 from cardinal_pythonlib.logs import (
     BraceStyleAdapter,
 )
@@ -363,6 +373,7 @@ from cardinal_pythonlib.sqlalchemy.core_query import (
     fetch_all_first_values,
 )
 from cardinal_pythonlib.text import escape_newlines
+from pendulum import DateTime as Pendulum
 from pyramid.httpexceptions import HTTPBadRequest
 from pyramid.view import view_config
 from pyramid.response import Response
@@ -371,7 +382,7 @@ from semantic_version import Version
 from sqlalchemy.engine.result import ResultProxy
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import joinedload
-from sqlalchemy.sql.expression import exists, select, update
+from sqlalchemy.sql.expression import bindparam, exists, select, update
 from sqlalchemy.sql.schema import Table
 
 from camcops_server.cc_modules import cc_audit  # avoids "audit" name clash
@@ -392,6 +403,7 @@ from camcops_server.cc_modules.cc_client_api_core import (
     get_server_live_records,
     IgnoringAntiqueTableException,
     require_keys,
+    server_records_by_client_pk,
     ServerErrorException,
     ServerRecord,
     TabletParam,
@@ -406,6 +418,10 @@ from camcops_server.cc_modules.cc_client_api_core import (
 from camcops_server.cc_modules.cc_client_api_helpers import (
     upload_commit_order_sorter,
 )
+from camcops_server.cc_modules.cc_client_api_timing import (
+    client_api_timing,
+    client_api_timing_table,
+)
 from camcops_server.cc_modules.cc_constants import (
     CLIENT_DATE_FIELD,
     DateFormat,
@@ -469,6 +485,9 @@ from camcops_server.cc_modules.cc_task import (
     all_task_tables_with_min_client_version,
 )
 from camcops_server.cc_modules.cc_taskindex import update_indexes_and_push_exports  # noqa
+from camcops_server.cc_modules.cc_taskschedule import (
+    get_scheduled_tasks_for_patient_task_schedules,
+)
 from camcops_server.cc_modules.cc_user import User
 from camcops_server.cc_modules.cc_validators import (
     STRING_VALIDATOR_TYPE,
@@ -521,12 +540,24 @@ FAILURE_CODE = "0"
 
 DEBUG_UPLOAD = False
 
+MAX_PKS_PER_IN_CLAUSE = 1000  # keeps "WHERE pk IN (...)" a sensible size
+
+# Bind parameter names for UPDATE statements executed with many parameter sets
+# (these must not clash with column names):
+BINDPARAM_PK = "b_pk"
+BINDPARAM_SUCCESSOR_PK = "b_successor_pk"
+
 
 # =============================================================================
 # Quasi-constants
 # =============================================================================
 
 DB_JSON_DECODER = json.JSONDecoder()  # just a plain one
+
+# Streamed one-step upload (the TabletParam.DBDATA_STREAM value says which):
+DBDATA_STREAM_GZIP = "gzip"
+DBDATA_STREAM_UNCOMPRESSED = "none"
+DBDATA_STREAM_CHUNK_SIZE = 64 * 1024  # bytes read from the request at a time
 PATIENT_INFO_JSON_DECODER = json.JSONDecoder()  # just a plain one
 
 
@@ -1043,6 +1074,170 @@ def get_json_from_post_var(req: "CamcopsRequest", key: str,
             return None
 
 
+def decode_onestep_upload_frame(frame: bytes) \
+        -> Tuple[str, str, List[Dict[str, Any]]]:
+    """
+    Decodes one table's data from a streamed one-step upload. See
+    :func:`gen_onestep_upload_tables_from_stream`.
+
+    Args:
+        frame: UTF-8-encoded JSON for one table
+
+    Returns:
+        tuple: ``tablename, clientpk_name, rows``
+
+    Raises:
+        :exc:`UserErrorException` if the data is invalid
+    """
+    try:
+        d = DB_JSON_DECODER.decode(frame.decode("utf-8"))
+    except (UnicodeDecodeError, json.JSONDecodeError):
+        fail_user_error(f"Bad JSON in {TabletParam.DBDATA_STREAM} data")
+    if not isinstance(d, dict):
+        fail_user_error("Streamed table data is not a dict")
+    require_keys(d, [TabletParam.TABLE, TabletParam.PKNAME, TabletParam.ROWS])
+    tablename = d[TabletParam.TABLE]
+    clientpk_name = d[TabletParam.PKNAME]
+    rows = d[TabletParam.ROWS]
+    if not isinstance(tablename, str) or not isinstance(clientpk_name, str):
+        fail_user_error("Streamed table/PK names are not strings")
+    if not isinstance(rows, list):
+        fail_user_error(f"Streamed rows for table {tablename!r} are not a list")
+    return tablename, clientpk_name, rows
+
+
+def gen_onestep_upload_tables_from_stream(
+        req: "CamcopsRequest",
+        compression: str) \
+        -> Generator[Tuple[str, str, List[Dict[str, Any]]], None, None]:
+    """
+    Reads a streamed one-step upload from the request body, yielding one
+    table at a time.
+
+    The body (which must not be form-encoded; the other parameters go in the
+    URL) is a series of lines, one per table, each a JSON object like this:
+
+    .. code-block:: none
+
+        {"table": "phq9", "pkname": "id", "rows": [{"id": "1", ...}, ...]}
+
+    where each row is as for :data:`TabletParam.DBDATA`. The whole body may be
+    gzip-compressed. We decompress and decode it incrementally, so we never
+    hold more than one table's data in memory. The (decompressed) data may
+    not exceed the ``CLIENT_API_MAX_UPLOAD_SIZE_MB`` config setting; we never
+    decompress more than that.
+
+    Args:
+        req: the :class:`camcops_server.cc_modules.cc_request.CamcopsRequest`
+        compression: the :data:`TabletParam.DBDATA_STREAM` value; one of
+            :data:`DBDATA_STREAM_GZIP` or :data:`DBDATA_STREAM_UNCOMPRESSED`
+
+    Yields:
+        tuple: ``tablename, clientpk_name, rows``
+
+    Raises:
+        :exc:`UserErrorException` if the data is invalid
+    """
+    if compression == DBDATA_STREAM_GZIP:
+        decompressor = zlib.decompressobj(wbits=16 + zlib.MAX_WBITS)
+    elif compression == DBDATA_STREAM_UNCOMPRESSED:
+        decompressor = None
+    else:
+        fail_user_error(
+            f"Unknown {TabletParam.DBDATA_STREAM} value: {compression!r}")
+    max_size = req.config.client_api_max_upload_size_mb * 1024 * 1024
+    too_big_msg = (
+        f"{TabletParam.DBDATA_STREAM} data exceeds the maximum upload size "
+        f"({req.config.client_api_max_upload_size_mb} MB)"
+    )
+    body = req.body_file
+    buffer = bytearray()
+    search_from = 0
+    size = 0
+    finished = False
+    while not finished:
+        chunk = body.read(DBDATA_STREAM_CHUNK_SIZE)
+        if chunk:
+            if decompressor:
+                try:
+                    # Decompress no more than one byte beyond the limit
+                    # (a max_length of 0 would mean "unlimited").
+                    chunk = decompressor.decompress(chunk,
+                                                    max_size - size + 1)
+                except zlib.error as e:
+                    fail_user_error(
+                        f"Bad compressed {TabletParam.DBDATA_STREAM} data: "
+                        f"{e}")
+        else:
+            finished = True
+            if decompressor:
+                chunk = decompressor.flush()
+                if not decompressor.eof:
+                    fail_user_error(
+                        f"Truncated compressed {TabletParam.DBDATA_STREAM} "
+                        f"data")
+        size += len(chunk)
+        if size > max_size:
+            fail_user_error(too_big_msg)
+        if finished:
+            chunk += b"\n"  # terminate any final line
+        buffer.extend(chunk)
+        while True:
+            newline_pos = buffer.find(b"\n", search_from)
+            if newline_pos == -1:
+                search_from = len(buffer)
+                break
+            frame = bytes(buffer[:newline_pos])
+            del buffer[:newline_pos + 1]
+            search_from = 0
+            if frame.strip():
+                yield decode_onestep_upload_frame(frame)
+
+
+def gen_onestep_upload_tables_from_post_vars(
+        req: "CamcopsRequest") \
+        -> Generator[Tuple[str, str, List[Dict[str, Any]]], None, None]:
+    """
+    Reads a (non-streamed) one-step upload from the
+    :data:`TabletParam.PKNAMEINFO` and :data:`TabletParam.DBDATA` POST
+    variables, and yields one table at a time (in upload commit order; see
+    :func:`camcops_server.cc_modules.cc_client_api_helpers.upload_commit_order_sorter`).
+
+    Args:
+        req: the :class:`camcops_server.cc_modules.cc_request.CamcopsRequest`
+
+    Yields:
+        tuple: ``tablename, clientpk_name, rows``
+
+    Raises:
+        :exc:`UserErrorException` if the data is invalid
+    """  # noqa
+    pknameinfo = get_json_from_post_var(
+        req, TabletParam.PKNAMEINFO, decoder=DB_JSON_DECODER, mandatory=True)
+    if not isinstance(pknameinfo, dict):
+        fail_user_error("PK name info JSON is not a dict")
+    dbdata = get_json_from_post_var(
+        req, TabletParam.DBDATA, decoder=DB_JSON_DECODER, mandatory=True)
+    if not isinstance(dbdata, dict):
+        fail_user_error("Database data JSON is not a dict")
+
+    # Sanity checks
+    dbdata_tablenames = sorted(dbdata.keys())
+    pkinfo_tablenames = sorted(pknameinfo.keys())
+    if pkinfo_tablenames != dbdata_tablenames:
+        fail_user_error("Table names don't match from (1) DB data (2) PK info")
+    duff_tablenames = sorted(list(set(dbdata_tablenames) -
+                                  set(CLIENT_TABLE_MAP.keys())))
+    if duff_tablenames:
+        fail_user_error(
+            f"Attempt to upload nonexistent tables: {duff_tablenames!r}")
+
+    tables = sorted((CLIENT_TABLE_MAP[tn] for tn in dbdata_tablenames),
+                    key=upload_commit_order_sorter)
+    for table in tables:
+        yield table.name, pknameinfo[table.name], dbdata[table.name]
+
+
 # =============================================================================
 # Sending stuff to the client
 # =============================================================================
@@ -1215,25 +1410,86 @@ def get_all_predecessor_pks(req: "CamcopsRequest",
         the PKs
 
     """
-    dbsession = req.dbsession
-    pks = []  # type: List[int]
-    if include_last:
-        pks.append(last_pk)
-    current_pk = last_pk
-    finished = False
-    while not finished:
-        next_pk = dbsession.execute(
-            select([table.c[FN_PREDECESSOR_PK]])
-            .where(table.c[FN_PK] == current_pk)
-        ).scalar()  # type: Optional[int]
-        if next_pk is None:
-            finished = True
-        else:
-            pks.append(next_pk)
-            current_pk = next_pk
+    return get_all_predecessor_pks_multiple(req, table, [last_pk],
+                                            include_last=include_last)
+
+
+def get_all_predecessor_pks_multiple(req: "CamcopsRequest",
+                                     table: Table,
+                                     last_pks: Iterable[int],
+                                     include_last: bool = True) -> List[int]:
+    """
+    Retrieves the PKs of all records that are predecessors of any of the
+    specified ones. Works back through the predecessor chains one generation
+    at a time, so it takes one query per generation (per
+    ``MAX_PKS_PER_IN_CLAUSE`` records), however many records there are.
+
+    Args:
+        req: the :class:`camcops_server.cc_modules.cc_request.CamcopsRequest`
+        table: an SQLAlchemy :class:`Table`
+        last_pks: the PKs to start with, and work backwards
+        include_last: include ``last_pks`` in the list
+
+    Returns:
+        the PKs, sorted
+
+    """
+    pks = set()  # type: Set[int]
+    for chain in get_predecessor_pks_by_last_pk(
+            req, table, last_pks, include_last=include_last).values():
+        pks.update(chain)
     return sorted(pks)
 
 
+def get_predecessor_pks_by_last_pk(
+        req: "CamcopsRequest",
+        table: Table,
+        last_pks: Iterable[int],
+        include_last: bool = True) -> Dict[int, List[int]]:
+    """
+    Retrieves the PKs of the predecessors of each of the specified records,
+    working back through the predecessor chains one generation at a time, so
+    it takes one query per generation (per ``MAX_PKS_PER_IN_CLAUSE``
+    records), however many records there are.
+
+    Args:
+        req: the :class:`camcops_server.cc_modules.cc_request.CamcopsRequest`
+        table: an SQLAlchemy :class:`Table`
+        last_pks: the PKs to start with, and work backwards
+        include_last: include each of ``last_pks`` in its own list
+
+    Returns:
+        dict: maps each of ``last_pks`` to a sorted list of its predecessors'
+        PKs
+
+    """
+    dbsession = req.dbsession
+    # For each PK that we've reached, which of last_pks did we reach it from?
+    reached_from = {pk: {pk} for pk in last_pks}  # type: Dict[int, Set[int]]
+    chains = {
+        pk: {pk} if include_last else set() for pk in reached_from
+    }  # type: Dict[int, Set[int]]
+    generation = list(reached_from)
+    while generation:
+        next_generation = []  # type: List[int]
+        for pk_chunk in chunks(generation, MAX_PKS_PER_IN_CLAUSE):
+            for pk, pred_pk in dbsession.execute(
+                    select([table.c[FN_PK], table.c[FN_PREDECESSOR_PK]])
+                    .where(table.c[FN_PK].in_(pk_chunk))
+                    .where(table.c[FN_PREDECESSOR_PK].isnot(None))):
+                new_origins = (
+                    reached_from[pk] - reached_from.get(pred_pk, set())
+                )
+                if not new_origins:
+                    continue  # been here already
+                reached_from.setdefault(pred_pk, set()).update(new_origins)
+                for last_pk in new_origins:
+                    chains[last_pk].add(pred_pk)
+                next_generation.append(pred_pk)
+        generation = next_generation
+    return {last_pk: sorted(chain) for last_pk, chain in chains.items()}
+
+
 # =============================================================================
 # Record modification functions
 # =============================================================================
@@ -1315,28 +1571,50 @@ def flag_modified(req: "CamcopsRequest",
         pk: server PK of the record to mark as old
         successor_pk: server PK of its successor
     """
+    flag_multiple_modified(req, batchdetails, table, [(pk, successor_pk)])
+
+
+def flag_multiple_modified(req: "CamcopsRequest",
+                           batchdetails: BatchDetails,
+                           table: Table,
+                           pk_successor_pairs: List[Tuple[int, int]]) -> None:
+    """
+    Marks records as old, storing their successors' details. Uses a single
+    UPDATE statement, executed for each record (``executemany``).
+
+    Args:
+        req: the :class:`camcops_server.cc_modules.cc_request.CamcopsRequest`
+        batchdetails: the :class:`BatchDetails`
+        table: SQLAlchemy :class:`Table`
+        pk_successor_pairs: list of tuples ``pk, successor_pk``, giving the
+            server PK of each record to mark as old and the server PK of its
+            successor
+    """
+    if not pk_successor_pairs:
+        return
     if batchdetails.onestep:
-        req.dbsession.execute(
-            update(table)
-            .where(table.c[FN_PK] == pk)
-            .values({
-                FN_CURRENT: 0,
-                FN_REMOVAL_PENDING: 0,
-                FN_SUCCESSOR_PK: successor_pk,
-                FN_REMOVING_USER_ID: req.user_id,
-                FN_WHEN_REMOVED_EXACT: req.now,
-                FN_WHEN_REMOVED_BATCH_UTC: batchdetails.batchtime,
-            })
-        )
+        values = {
+            FN_CURRENT: 0,
+            FN_REMOVAL_PENDING: 0,
+            FN_SUCCESSOR_PK: bindparam(BINDPARAM_SUCCESSOR_PK),
+            FN_REMOVING_USER_ID: req.user_id,
+            FN_WHEN_REMOVED_EXACT: req.now,
+            FN_WHEN_REMOVED_BATCH_UTC: batchdetails.batchtime,
+        }
     else:
-        req.dbsession.execute(
-            update(table)
-            .where(table.c[FN_PK] == pk)
-            .values({
-                FN_REMOVAL_PENDING: 1,
-                FN_SUCCESSOR_PK: successor_pk
-            })
-        )
+        values = {
+            FN_REMOVAL_PENDING: 1,
+            FN_SUCCESSOR_PK: bindparam(BINDPARAM_SUCCESSOR_PK),
+        }
+    req.dbsession.execute(
+        update(table)
+        .where(table.c[FN_PK] == bindparam(BINDPARAM_PK))
+        .values(values),
+        [
+            {BINDPARAM_PK: pk, BINDPARAM_SUCCESSOR_PK: successor_pk}
+            for pk, successor_pk in pk_successor_pairs
+        ]
+    )
 
 
 def flag_multiple_records_for_preservation(
@@ -1347,7 +1625,8 @@ def flag_multiple_records_for_preservation(
     """
     Low-level function to mark records for preservation by server PK.
     Does not concern itself with the predecessor chain (for which, see
-    :func:`flag_record_for_preservation`).
+    :func:`flag_record_for_preservation`). Uses one UPDATE per
+    ``MAX_PKS_PER_IN_CLAUSE`` records.
 
     Args:
         req: the :class:`camcops_server.cc_modules.cc_request.CamcopsRequest`
@@ -1355,12 +1634,14 @@ def flag_multiple_records_for_preservation(
         table: SQLAlchemy :class:`Table`
         pks_to_preserve: server PK of the records to mark as preserved
     """
+    pk_chunks = list(chunks(pks_to_preserve, MAX_PKS_PER_IN_CLAUSE))
     if batchdetails.onestep:
-        req.dbsession.execute(
-            update(table)
-            .where(table.c[FN_PK].in_(pks_to_preserve))
-            .values(values_preserve_now(req, batchdetails))
-        )
+        for pk_chunk in pk_chunks:
+            req.dbsession.execute(
+                update(table)
+                .where(table.c[FN_PK].in_(pk_chunk))
+                .values(values_preserve_now(req, batchdetails))
+            )
         # Also any associated special notes:
         new_era = batchdetails.new_era
         # noinspection PyUnresolvedReferences
@@ -1378,13 +1659,14 @@ def flag_multiple_records_for_preservation(
             .values(era=new_era)
         )
     else:
-        req.dbsession.execute(
-            update(table)
-            .where(table.c[FN_PK].in_(pks_to_preserve))
-            .values({
-                MOVE_OFF_TABLET_FIELD: 1
-            })
-        )
+        for pk_chunk in pk_chunks:
+            req.dbsession.execute(
+                update(table)
+                .where(table.c[FN_PK].in_(pk_chunk))
+                .values({
+                    MOVE_OFF_TABLET_FIELD: 1
+                })
+            )
 
 
 def flag_record_for_preservation(req: "CamcopsRequest",
@@ -1407,10 +1689,36 @@ def flag_record_for_preservation(req: "CamcopsRequest",
     Returns:
         list: all PKs being preserved
     """
-    pks_to_preserve = get_all_predecessor_pks(req, table, pk)
-    flag_multiple_records_for_preservation(req, batchdetails, table,
-                                           pks_to_preserve)
-    return pks_to_preserve
+    return flag_records_for_preservation(req, batchdetails, table, [pk])[pk]
+
+
+def flag_records_for_preservation(req: "CamcopsRequest",
+                                  batchdetails: BatchDetails,
+                                  table: Table,
+                                  pks: Iterable[int]) -> List[int]:
+    """
+    Marks several records for preservation, along with their predecessors; see
+    :func:`flag_record_for_preservation`. Uses one UPDATE per
+    ``MAX_PKS_PER_IN_CLAUSE`` records.
+
+    Args:
+        req: the :class:`camcops_server.cc_modules.cc_request.CamcopsRequest`
+        batchdetails: the :class:`BatchDetails`
+        table: SQLAlchemy :class:`Table`
+        pks: server PKs of the records to mark
+
+    Returns:
+        dict: maps each of ``pks`` to a list of the PKs being preserved
+        because of it (itself and its predecessors)
+    """
+    pks_by_record = get_predecessor_pks_by_last_pk(req, table, pks)
+    pks_to_preserve = set()  # type: Set[int]
+    for chain in pks_by_record.values():
+        pks_to_preserve.update(chain)
+    if pks_to_preserve:
+        flag_multiple_records_for_preservation(req, batchdetails, table,
+                                               sorted(pks_to_preserve))
+    return pks_by_record
 
 
 def preserve_all(req: "CamcopsRequest",
@@ -1537,7 +1845,7 @@ def upload_record_core(
         table: Table,
         clientpk_name: str,
         valuedict: Dict[str, Any],
-        server_live_current_records: List[ServerRecord] = None) \
+        server_live_current_records: Dict[Any, ServerRecord] = None) \
         -> UploadRecordResult:
     """
     Uploads a record. Deals with IDENTICAL, NEW, and MODIFIED records.
@@ -1550,8 +1858,12 @@ def upload_record_core(
         table: an SQLAlchemy :class:`Table`
         clientpk_name: the column name of the client's PK
         valuedict: a dictionary of {colname: value} pairs from the client
-        server_live_current_records: list of :class:`ServerRecord` objects for
-            the active records on the server for this client, in this table
+        server_live_current_records: dictionary mapping client PK to
+            :class:`ServerRecord` objects for the active records on the server
+            for this client, in this table (see
+            :func:`camcops_server.cc_modules.cc_client_api_core.
+            server_records_by_client_pk`); if ``None``, the record is looked
+            up individually
 
     Returns:
         a :class:`UploadRecordResult` object
@@ -1560,10 +1872,9 @@ def upload_record_core(
                              MOVE_OFF_TABLET_FIELD])
     clientpk_value = valuedict[clientpk_name]
 
-    if server_live_current_records:
+    if server_live_current_records is not None:
         # All server records for this table/device/era have been prefetched.
-        serverrec = next((r for r in server_live_current_records
-                          if r.client_pk == clientpk_value), None)
+        serverrec = server_live_current_records.get(clientpk_value)
         if serverrec is None:
             serverrec = ServerRecord(clientpk_value, False)
     else:
@@ -1610,23 +1921,108 @@ def upload_record_core(
     return urr
 
 
-def insert_record(req: "CamcopsRequest",
-                  batchdetails: BatchDetails,
-                  table: Table,
-                  valuedict: Dict[str, Any],
-                  predecessor_pk: Optional[int]) -> int:
+def upload_multiple_records_core(
+        req: "CamcopsRequest",
+        batchdetails: BatchDetails,
+        table: Table,
+        clientpk_name: str,
+        valuedicts: List[Dict[str, Any]],
+        server_live_records: List[ServerRecord]) -> List[UploadRecordResult]:
     """
-    Inserts a record, or raises an exception if that fails.
+    Uploads many records to one table. Deals with IDENTICAL, NEW, and MODIFIED
+    records. The bulk equivalent of calling :func:`upload_record_core` for each
+    record: new and modified records are inserted in bulk, and superseded
+    records are flagged as modified in bulk, rather than with several
+    statements per record.
+
+    Used by :func:`process_table_for_onestep_upload`.
 
     Args:
         req: the :class:`camcops_server.cc_modules.cc_request.CamcopsRequest`
         batchdetails: the :class:`BatchDetails`
         table: an SQLAlchemy :class:`Table`
-        valuedict: a dictionary of {colname: value} pairs from the client
-        predecessor_pk: an optional server PK of the record's predecessor
+        clientpk_name: the column name of the client's PK
+        valuedicts: dictionaries of {colname: value} pairs from the client,
+            one per record
+        server_live_records: list of :class:`ServerRecord` objects for all
+            records (current or not) on the server for this client, in this
+            table, in the ``NOW`` era
 
     Returns:
-        the server PK of the new record
+        a list of :class:`UploadRecordResult` objects, one per record
+    """
+    server_live_current_records = server_records_by_client_pk(
+        r for r in server_live_records if r.current)
+    urrs = []  # type: List[UploadRecordResult]
+    to_insert = []  # type: List[Tuple[UploadRecordResult, Dict[str, Any]]]
+    for valuedict in valuedicts:
+        require_keys(valuedict, [clientpk_name, CLIENT_DATE_FIELD,
+                                 MOVE_OFF_TABLET_FIELD])
+        clientpk_value = valuedict[clientpk_name]
+        serverrec = server_live_current_records.get(clientpk_value)
+        if serverrec is None:
+            serverrec = ServerRecord(clientpk_value, False)
+        urr = UploadRecordResult(
+            oldserverpk=serverrec.server_pk,
+            specifically_marked_for_preservation=bool(valuedict[MOVE_OFF_TABLET_FIELD]),  # noqa
+            dirty=True
+        )
+        urrs.append(urr)
+        if serverrec.exists:
+            client_date_value = coerce_to_pendulum(valuedict[CLIENT_DATE_FIELD])
+            if serverrec.server_when == client_date_value:
+                # Identical; no action needed unless MOVE_OFF_TABLET_FIELDNAME
+                # is set.
+                if not urr.specifically_marked_for_preservation:
+                    urr.dirty = False
+                continue
+        # New or modified: needs an INSERT.
+        process_upload_record_special(req, batchdetails, table, valuedict)
+        to_insert.append((urr, valuedict))
+
+    if to_insert:
+        new_pks = insert_multiple_records(
+            req, batchdetails, table, clientpk_name,
+            valuedicts=[valuedict for _, valuedict in to_insert],
+            predecessor_pks=[urr.oldserverpk for urr, _ in to_insert],
+            existing_server_pks=set(r.server_pk for r in server_live_records)
+        )
+        for (urr, _), new_pk in zip(to_insert, new_pks):
+            urr.newserverpk = new_pk
+        flag_multiple_modified(req, batchdetails, table, [
+            (urr.oldserverpk, urr.newserverpk)
+            for urr, _ in to_insert
+            if urr.oldserverpk is not None
+        ])
+
+    urrs_to_preserve = [urr for urr in urrs
+                        if urr.specifically_marked_for_preservation]
+    if urrs_to_preserve:
+        preservation_pks = flag_records_for_preservation(
+            req, batchdetails, table,
+            [urr.latest_pk for urr in urrs_to_preserve])
+        for urr in urrs_to_preserve:
+            urr.note_specifically_marked_preservation_pks(
+                preservation_pks[urr.latest_pk])
+
+    if DEBUG_UPLOAD:
+        log.debug("upload_multiple_records_core: {}, {!r}", table.name, urrs)
+    return urrs
+
+
+def add_server_fields_for_insert(req: "CamcopsRequest",
+                                 batchdetails: BatchDetails,
+                                 valuedict: Dict[str, Any],
+                                 predecessor_pk: Optional[int]) -> None:
+    """
+    Adds the server's own fields to a record that is about to be inserted.
+
+    Args:
+        req: the :class:`camcops_server.cc_modules.cc_request.CamcopsRequest`
+        batchdetails: the :class:`BatchDetails`
+        valuedict: a dictionary of {colname: value} pairs from the client;
+            will be modified
+        predecessor_pk: an optional server PK of the record's predecessor
     """
     ts = req.tabletsession
     valuedict.update({
@@ -1650,6 +2046,27 @@ def insert_record(req: "CamcopsRequest",
             FN_CURRENT: 0,
             FN_ADDITION_PENDING: 1,
         })
+
+
+def insert_record(req: "CamcopsRequest",
+                  batchdetails: BatchDetails,
+                  table: Table,
+                  valuedict: Dict[str, Any],
+                  predecessor_pk: Optional[int]) -> int:
+    """
+    Inserts a record, or raises an exception if that fails.
+
+    Args:
+        req: the :class:`camcops_server.cc_modules.cc_request.CamcopsRequest`
+        batchdetails: the :class:`BatchDetails`
+        table: an SQLAlchemy :class:`Table`
+        valuedict: a dictionary of {colname: value} pairs from the client
+        predecessor_pk: an optional server PK of the record's predecessor
+
+    Returns:
+        the server PK of the new record
+    """
+    add_server_fields_for_insert(req, batchdetails, valuedict, predecessor_pk)
     rp = req.dbsession.execute(
         table.insert().values(valuedict)
     )  # type: ResultProxy
@@ -1658,6 +2075,77 @@ def insert_record(req: "CamcopsRequest",
     return inserted_pks[0]
 
 
+def insert_multiple_records(req: "CamcopsRequest",
+                            batchdetails: BatchDetails,
+                            table: Table,
+                            clientpk_name: str,
+                            valuedicts: List[Dict[str, Any]],
+                            predecessor_pks: List[Optional[int]],
+                            existing_server_pks: Set[int]) -> List[int]:
+    """
+    Inserts many records into a table, using as few statements as possible,
+    and retrieves their new server PKs. The bulk equivalent of
+    :func:`insert_record`.
+
+    Rows are inserted via ``executemany``, so consecutive records with the same
+    set of columns share a single INSERT statement. We can't rely on the
+    database to tell us the PKs of rows inserted that way, so we then fetch
+    the PKs of all this device's records in the ``NOW`` era and pick out the
+    ones that weren't there before (in PK order, i.e. insertion order).
+
+    Args:
+        req: the :class:`camcops_server.cc_modules.cc_request.CamcopsRequest`
+        batchdetails: the :class:`BatchDetails`
+        table: an SQLAlchemy :class:`Table`
+        clientpk_name: the column name of the client's PK
+        valuedicts: dictionaries of {colname: value} pairs from the client
+        predecessor_pks: optional server PKs of each record's predecessor
+        existing_server_pks: server PKs of all records for this device, in
+            this table, in the ``NOW`` era, before the insertion
+
+    Returns:
+        the server PKs of the new records, in the same order as
+        ``valuedicts``
+    """
+    if not valuedicts:
+        return []
+    dbsession = req.dbsession
+    for valuedict, predecessor_pk in zip(valuedicts, predecessor_pks):
+        add_server_fields_for_insert(req, batchdetails, valuedict,
+                                     predecessor_pk)
+    # executemany needs the same columns for every row, so insert runs of rows
+    # with identical columns (usually, all rows in one run).
+    insert_stmt = table.insert()
+    run = []  # type: List[Dict[str, Any]]
+    for valuedict in valuedicts:
+        if run and valuedict.keys() != run[0].keys():
+            dbsession.execute(insert_stmt, run)
+            run = []
+        run.append(valuedict)
+    dbsession.execute(insert_stmt, run)
+
+    # Retrieve new PKs
+    query = (
+        select([table.c[FN_PK], table.c[clientpk_name]])
+        .where(table.c[FN_DEVICE_ID] == req.tabletsession.device_id)
+        .where(table.c[FN_ERA] == ERA_NOW)
+        .order_by(table.c[FN_PK])
+    )
+    new_pks_by_clientpk = {}  # type: Dict[Any, List[int]]
+    for server_pk, client_pk in dbsession.execute(query):
+        if server_pk not in existing_server_pks:
+            new_pks_by_clientpk.setdefault(client_pk, []).append(server_pk)
+    for pks in new_pks_by_clientpk.values():
+        pks.reverse()  # so we can pop() them in insertion order
+    inserted_pks = []  # type: List[int]
+    for valuedict in valuedicts:
+        pks = new_pks_by_clientpk.get(valuedict[clientpk_name])
+        if not pks:
+            fail_server_error(INSERT_FAILED)
+        inserted_pks.append(pks.pop())
+    return inserted_pks
+
+
 def audit_upload(req: "CamcopsRequest",
                  changes: List[UploadTableChanges]) -> None:
     """
@@ -1933,7 +2421,9 @@ def commit_all(req: "CamcopsRequest", batchdetails: BatchDetails) -> None:
 
     changelist = []  # type: List[UploadTableChanges]
     for table in tables:
-        auditinfo = commit_table(req, batchdetails, table, clear_dirty=False)
+        with client_api_timing_table(table.name):
+            auditinfo = commit_table(req, batchdetails, table,
+                                     clear_dirty=False)
         changelist.append(auditinfo)
 
     if batchdetails.preserving:
@@ -2200,16 +2690,19 @@ def process_table_for_onestep_upload(
         fail_user_error(f"Client-side PK name not specified by client for "
                         f"non-empty table {table.name!r}")
     tablechanges = UploadTableChanges(table)
-    server_pks_uploaded = []  # type: List[int]
-    for row in rows:
-        valuedict = {k: decode_single_value(v) for k, v in row.items()}
-        urr = upload_record_core(req, batchdetails, table,
-                                 clientpk_name, valuedict,
-                                 server_live_current_records=servercurrentrecs)
-        # ... handles addition, modification, preservation, special processing
+    server_pks_uploaded = set()  # type: Set[int]
+    valuedicts = [
+        {k: decode_single_value(v) for k, v in row.items()}
+        for row in rows
+    ]
+    urrs = upload_multiple_records_core(req, batchdetails, table,
+                                        clientpk_name, valuedicts,
+                                        server_live_records=serverrecs)
+    # ... handles addition, modification, preservation, special processing
+    for urr in urrs:
         # But we also make a note of these for indexing:
         if urr.oldserverpk is not None:
-            server_pks_uploaded.append(urr.oldserverpk)
+            server_pks_uploaded.add(urr.oldserverpk)
         tablechanges.note_urr(urr,
                               preserving_new_records=batchdetails.preserving)
     # Which leaves:
@@ -2462,9 +2955,14 @@ def get_task_schedules(req: "CamcopsRequest",
             pts.start_datetime = req.now_utc.replace(second=0, microsecond=0)
             dbsession.add(pts)
 
+    # Find the patient's tasks for all schedules at once
+    task_lists = get_scheduled_tasks_for_patient_task_schedules(
+        req, patient.task_schedules)
+
+    for pts, task_list in zip(patient.task_schedules, task_lists):
         items = []
 
-        for task_info in pts.get_list_of_scheduled_tasks(req):
+        for task_info in task_list:
             due_from = task_info.start_datetime.to_iso8601_string()
             due_by = task_info.end_datetime.to_iso8601_string()
 
@@ -2752,7 +3250,7 @@ def op_upload_table(req: "CamcopsRequest") -> str:
         # either case, the client PK name was (is) always "id".
         clientpk_name = TABLET_ID_FIELD
         ensure_valid_field_name(table, clientpk_name)
-    server_pks_uploaded = []  # type: List[int]
+    server_pks_uploaded = set()  # type: Set[int]
     n_new = 0
     n_modified = 0
     n_identical = 0
@@ -2760,6 +3258,7 @@ def op_upload_table(req: "CamcopsRequest") -> str:
     serverrecs = get_server_live_records(req, ts.device_id, table,
                                          clientpk_name=clientpk_name,
                                          current_only=True)
+    serverrecs_by_clientpk = server_records_by_client_pk(serverrecs)
     for r in range(nrecords):
         recname = TabletParam.RECORD_PREFIX + str(r)
         values = get_values_from_post_var(req, recname)
@@ -2776,9 +3275,9 @@ def op_upload_table(req: "CamcopsRequest") -> str:
         # CORE: CALLS upload_record_core
         urr = upload_record_core(
             req, batchdetails, table, clientpk_name, valuedict,
-            server_live_current_records=serverrecs)
+            server_live_current_records=serverrecs_by_clientpk)
         if urr.oldserverpk is not None:  # was an existing record
-            server_pks_uploaded.append(urr.oldserverpk)
+            server_pks_uploaded.add(urr.oldserverpk)
             if urr.newserverpk is None:
                 n_identical += 1
             else:
@@ -2984,18 +3483,26 @@ def op_which_keys_to_send(req: "CamcopsRequest") -> str:
         )
 
     clientinfo = []  # type: List[WhichKeyToSendInfo]
+    # BLOBs in particular tend to share modification times, so we only parse
+    # each distinct date/time string once.
+    parsed_dates = {}  # type: Dict[Any, Pendulum]
 
     for i in range(npkvalues):
         cpkv = clientpk_values[i]
         if not isinstance(cpkv, int):
             fail_user_error(f"Bad (non-integer) client PK: {cpkv!r}")
-        dt = None  # for type checker
+        client_date = client_dates[i]
         try:
-            dt = coerce_to_pendulum(client_dates[i])
-            if dt is None:
-                fail_user_error(f"Missing date/time for client PK {cpkv}")
-        except ValueError:
-            fail_user_error(f"Bad date/time: {client_dates[i]!r}")
+            dt = parsed_dates[client_date]
+        except KeyError:
+            dt = None  # for type checker
+            try:
+                dt = coerce_to_pendulum(client_date)
+                if dt is None:
+                    fail_user_error(f"Missing date/time for client PK {cpkv}")
+            except ValueError:
+                fail_user_error(f"Bad date/time: {client_date!r}")
+            parsed_dates[client_date] = dt
         clientinfo.append(WhichKeyToSendInfo(
             client_pk=cpkv,
             client_when=dt,
@@ -3014,32 +3521,33 @@ def op_which_keys_to_send(req: "CamcopsRequest") -> str:
     #    list.
     flag_deleted_where_clientpk_not(req, table, clientpk_name, clientpk_values)
 
-    # 2. See which ones are new or updates.
-    client_pks_needed = []  # type: List[int]
-    client_pk_to_serverrec = client_pks_that_exist(
-        req, table, clientpk_name, clientpk_values)
-    for wk in clientinfo:
-        if client_reports_move_off_tablet:
-            if wk.client_pk not in client_pk_to_serverrec:
+    # 2. See which ones are new or updates. We compare against the server's
+    #    records (fetched with a single query) and mark all records needing
+    #    preservation with a single UPDATE at the end.
+    if not client_reports_move_off_tablet:
+        # Client hasn't told us about the _move_off_tablet flag. Always
+        # request the record (workaround potential bug in old clients).
+        client_pks_needed = [wk.client_pk for wk in clientinfo]
+    else:
+        client_pks_needed = []  # type: List[int]
+        server_pks_to_preserve = []  # type: List[int]
+        client_pk_to_serverrec = client_pks_that_exist(
+            req, table, clientpk_name, clientpk_values)
+        for wk in clientinfo:
+            serverrec = client_pk_to_serverrec.get(wk.client_pk)
+            if serverrec is None:
                 # New on the client; we want it
                 client_pks_needed.append(wk.client_pk)
-            else:
-                # We know about some version of this client record.
-                serverrec = client_pk_to_serverrec[wk.client_pk]
-                if serverrec.server_when != wk.client_when:
-                    # Modified on the client; we want it
-                    client_pks_needed.append(wk.client_pk)
-                elif serverrec.move_off_tablet != wk.client_move_off_tablet:
-                    # Not modified on the client. But it is being preserved.
-                    # We don't need to ask the client for it again, but we do
-                    # need to mark the preservation.
-                    flag_record_for_preservation(req, batchdetails, table,
-                                                 serverrec.server_pk)
-
-        else:
-            # Client hasn't told us about the _move_off_tablet flag. Always
-            # request the record (workaround potential bug in old clients).
-            client_pks_needed.append(wk.client_pk)
+            elif serverrec.server_when != wk.client_when:
+                # Modified on the client; we want it
+                client_pks_needed.append(wk.client_pk)
+            elif serverrec.move_off_tablet != wk.client_move_off_tablet:
+                # Not modified on the client. But it is being preserved.
+                # We don't need to ask the client for it again, but we do
+                # need to mark the preservation.
+                server_pks_to_preserve.append(serverrec.server_pk)
+        flag_records_for_preservation(req, batchdetails, table,
+                                      server_pks_to_preserve)
 
     # Success
     pk_csv_list = ",".join([str(x) for x in client_pks_needed if x is not None])  # noqa
@@ -3087,45 +3595,53 @@ def op_upload_entire_database(req: "CamcopsRequest") -> str:
 
     - From v2.3.0.
     - Therefore, we do not have to cope with old-style ID numbers.
+    - From v2.4.7, the data may be streamed as the request body, table by
+      table; see :func:`gen_onestep_upload_tables_from_stream`.
     """
     # Roll back and clear any outstanding changes
     clear_device_upload_batch(req)
 
-    # Fetch the JSON, with sanity checks
+    # Fetch the data, with sanity checks
     preserving = get_bool_int_var(req, TabletParam.FINALIZING)
-    pknameinfo = get_json_from_post_var(
-        req, TabletParam.PKNAMEINFO, decoder=DB_JSON_DECODER, mandatory=True)
-    if not isinstance(pknameinfo, dict):
-        fail_user_error("PK name info JSON is not a dict")
-    dbdata = get_json_from_post_var(
-        req, TabletParam.DBDATA, decoder=DB_JSON_DECODER, mandatory=True)
-    if not isinstance(dbdata, dict):
-        fail_user_error("Database data JSON is not a dict")
-
-    # Sanity checks
-    dbdata_tablenames = sorted(dbdata.keys())
-    pkinfo_tablenames = sorted(pknameinfo.keys())
-    if pkinfo_tablenames != dbdata_tablenames:
-        fail_user_error("Table names don't match from (1) DB data (2) PK info")
-    duff_tablenames = sorted(list(set(dbdata_tablenames) -
-                                  set(CLIENT_TABLE_MAP.keys())))
-    if duff_tablenames:
-        fail_user_error(
-            f"Attempt to upload nonexistent tables: {duff_tablenames!r}")
+    stream_compression = get_str_var(req, TabletParam.DBDATA_STREAM,
+                                     mandatory=False)
+    if stream_compression:
+        tabledata = gen_onestep_upload_tables_from_stream(
+            req, stream_compression)
+    else:
+        tabledata = gen_onestep_upload_tables_from_post_vars(req)
 
     # Perform the upload
     batchdetails = BatchDetails(req.now_utc, preserving=preserving,
                                 onestep=True)  # NB special "onestep" option
-    # Process the tables in a certain order:
+    # Process the tables in a certain order. All tables are processed; those
+    # that the client did not send are treated as empty. Tables sent by the
+    # client must arrive in this order, too, so that we can process each as it
+    # arrives.
     tables = sorted(CLIENT_TABLE_MAP.values(),
                     key=upload_commit_order_sorter)
+    table_order = {t.name: i for i, t in enumerate(tables)}
+    next_table_idx = 0
     changelist = []  # type: List[UploadTableChanges]
-    for table in tables:
-        clientpk_name = pknameinfo.get(table.name, "")
-        rows = dbdata.get(table.name, [])
-        tablechanges = process_table_for_onestep_upload(
-            req, batchdetails, table, clientpk_name, rows)
-        changelist.append(tablechanges)
+    for tablename, clientpk_name, rows in tabledata:
+        if tablename not in table_order:
+            fail_user_error(
+                f"Attempt to upload nonexistent table: {tablename!r}")
+        table_idx = table_order[tablename]
+        if table_idx < next_table_idx:
+            fail_user_error(f"Table {tablename!r} sent twice or out of order")
+        for table in tables[next_table_idx:table_idx]:  # not sent
+            with client_api_timing_table(table.name):
+                changelist.append(process_table_for_onestep_upload(
+                    req, batchdetails, table, "", []))
+        with client_api_timing_table(tablename):
+            changelist.append(process_table_for_onestep_upload(
+                req, batchdetails, tables[table_idx], clientpk_name, rows))
+        next_table_idx = table_idx + 1
+    for table in tables[next_table_idx:]:  # not sent
+        with client_api_timing_table(table.name):
+            changelist.append(process_table_for_onestep_upload(
+                req, batchdetails, table, "", []))
 
     # Audit
     audit_upload(req, changelist)
@@ -3218,7 +3734,14 @@ def main_client_api(req: "CamcopsRequest") -> Dict[str, str]:
 
     if not fn:
         fail_unsupported_operation(ts.operation)
-    result = fn(req)
+    if req.config.client_api_timing:
+        with client_api_timing(
+                operation=ts.operation,
+                device=ts.device_name or "",
+                table=req.params.get(TabletParam.TABLE, "")):
+            result = fn(req)
+    else:
+        result = fn(req)
     if result is None:
         # generic success
         result = {TabletParam.RESULT: ts.operation}
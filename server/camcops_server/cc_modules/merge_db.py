@@ -55,6 +55,7 @@ from camcops_server.cc_modules.cc_device import Device
 from camcops_server.cc_modules.cc_dirtytables import DirtyTable
 from camcops_server.cc_modules.cc_email import Email
 from camcops_server.cc_modules.cc_exportmodels import (
+    ExportedDatabaseWatermark,
     ExportedTask,
     ExportedTaskEmail,
     ExportedTaskFileGroup,
@@ -77,7 +78,10 @@ from camcops_server.cc_modules.cc_serversettings import (
     ServerStoredVarNamesDefunct,
 )
 from camcops_server.cc_modules.cc_sqlalchemy import Base
-from camcops_server.cc_modules.cc_taskindex import reindex_everything
+from camcops_server.cc_modules.cc_taskindex import (
+    reindex_everything,
+    TaskSummaryEntry,
+)
 from camcops_server.cc_modules.cc_user import (
     SecurityAccountLockout,
     SecurityLoginFailure,
@@ -1100,6 +1104,7 @@ def merge_camcops_db(src: str,
             ServerSettings.__tablename__,
             SecurityAccountLockout.__tablename__,
             SecurityLoginFailure.__tablename__,
+            TaskSummaryEntry.__tablename__,  # refers to source task PKs
             UserGroupMembership.__tablename__,
             group_group_table.name,
         ]
@@ -1111,6 +1116,7 @@ def merge_camcops_db(src: str,
             TableIdentity(tablename=x)
             for x in [
                 Email.__tablename__,
+                ExportedDatabaseWatermark.__tablename__,
                 ExportRecipient.__tablename__,
                 ExportedTask.__tablename__,
                 ExportedTaskEmail.__tablename__,
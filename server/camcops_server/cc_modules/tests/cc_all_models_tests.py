@@ -26,9 +26,48 @@ camcops_server/cc_modules/tests/cc_all_models_tests.py
 
 """
 
+import os
+import subprocess
+import sys
+import tempfile
+from typing import Dict
+import unittest
+
+from camcops_server.cc_modules.cc_baseconstants import (
+    CAMCOPS_SERVER_DIRECTORY,
+    ENVVAR_CONFIG_FILE,
+)
+from camcops_server.cc_modules.cc_config import get_demo_config
 from camcops_server.cc_modules.cc_sqlalchemy import log_all_ddl
 from camcops_server.cc_modules.cc_unittest import DemoDatabaseTestCase
 
+# Run in a fresh interpreter, since our own process has imported everything.
+LAZY_TASK_IMPORT_SCRIPT = """
+import sys
+import camcops_server.cc_modules.cc_nontask_models
+from camcops_server.cc_modules.cc_task import Task
+
+def n_task_modules():
+    return sum(1 for m in list(sys.modules)
+               if m.startswith("camcops_server.tasks."))
+
+assert n_task_modules() == 0, "Task modules imported too early"
+tablenames = [cls.__tablename__ for cls in Task.all_subclasses_by_tablename()]
+assert n_task_modules() > 0, "Task modules not imported on demand"
+assert "phq9" in tablenames, "Task not registered"
+"""
+
+
+# Importing the core (e.g. to start the web server) needs a config file.
+CORE_IMPORT_SCRIPT = """
+import sys
+import camcops_server.camcops_server_core
+
+task_modules = sorted(m for m in sys.modules
+                      if m.startswith("camcops_server.tasks."))
+assert not task_modules, f"Task modules imported: {task_modules}"
+"""
+
 
 class ModelTests(DemoDatabaseTestCase):
     """
@@ -36,3 +75,32 @@ class ModelTests(DemoDatabaseTestCase):
     """
     def test_show_ddl(self) -> None:
         log_all_ddl()
+
+
+class LazyTaskImportTests(unittest.TestCase):
+    """
+    Check that task modules are only loaded when first needed.
+    """
+    def run_script(self, script: str, env: Dict[str, str] = None) -> None:
+        # Run from the directory above our package, so that "camcops_server"
+        # isn't taken to mean camcops_server/camcops_server.py.
+        result = subprocess.run(
+            [sys.executable, "-c", script],
+            cwd=os.path.dirname(CAMCOPS_SERVER_DIRECTORY),
+            env=env,
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE
+        )
+        self.assertEqual(result.returncode, 0,
+                         msg=result.stderr.decode("utf8", errors="replace"))
+
+    def test_tasks_loaded_on_demand(self) -> None:
+        self.run_script(LAZY_TASK_IMPORT_SCRIPT)
+
+    def test_core_import_loads_no_tasks(self) -> None:
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            config_filename = os.path.join(tmpdirname, "camcops.conf")
+            with open(config_filename, "w") as f:
+                f.write(get_demo_config())
+            env = dict(os.environ)
+            env[ENVVAR_CONFIG_FILE] = config_filename
+            self.run_script(CORE_IMPORT_SCRIPT, env=env)
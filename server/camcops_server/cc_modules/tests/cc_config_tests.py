@@ -31,6 +31,11 @@ from unittest import TestCase
 from cardinal_pythonlib.sqlalchemy.logs import pre_disable_sqlalchemy_extra_echo_log  # noqa
 
 from camcops_server.cc_modules.cc_config import CamcopsConfig, get_demo_config
+from camcops_server.cc_modules.cc_constants import ConfigDefaults
+from camcops_server.cc_modules.cc_exportrecipientinfo import (
+    ExportRecipientInfo,
+    InvalidExportRecipient,
+)
 
 
 # =============================================================================
@@ -84,3 +89,37 @@ class EmailConfigTests(TestCase):
                          "CamCOPS computer <sender@example.com>")
         self.assertEqual(recipient.email_reply_to,
                          "CamCOPS clinical administrator <admin@example.com>")
+
+
+class DatabaseExportConfigTests(TestCase):
+
+    def get_recipient(self, **settings: str) -> ExportRecipientInfo:
+        from io import StringIO
+
+        parser = configparser.ConfigParser()
+        parser.read_string(get_demo_config())
+        parser.set("export", "RECIPIENTS", "recipient_A")
+        parser.set("recipient:recipient_A", "TRANSMISSION_METHOD", "database")
+        parser.set("recipient:recipient_A", "DB_URL", "sqlite://")
+        parser.set("recipient:recipient_A", "PUSH", "false")
+        for key, value in settings.items():
+            parser.set("recipient:recipient_A", key, value)
+
+        with StringIO() as buffer:
+            parser.write(buffer)
+            config = CamcopsConfig(config_filename="",
+                                   config_text=buffer.getvalue())
+        return config.get_all_export_recipient_info()[0]
+
+    def test_insert_batch_size_default(self) -> None:
+        recipient = self.get_recipient()
+        self.assertEqual(recipient.db_insert_batch_size,
+                         ConfigDefaults.DB_INSERT_BATCH_SIZE)
+
+    def test_insert_batch_size_from_config(self) -> None:
+        recipient = self.get_recipient(DB_INSERT_BATCH_SIZE="250")
+        self.assertEqual(recipient.db_insert_batch_size, 250)
+
+    def test_insert_batch_size_must_be_positive(self) -> None:
+        with self.assertRaises(InvalidExportRecipient):
+            self.get_recipient(DB_INSERT_BATCH_SIZE="0")
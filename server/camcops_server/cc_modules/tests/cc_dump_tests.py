@@ -0,0 +1,309 @@
+#!/usr/bin/env python
+
+"""
+camcops_server/cc_modules/tests/cc_dump_tests.py
+
+===============================================================================
+
+    Copyright (C) 2012-2020 Rudolf Cardinal (rudolf@pobox.com).
+
+    This file is part of CamCOPS.
+
+    CamCOPS is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    CamCOPS is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with CamCOPS. If not, see <http://www.gnu.org/licenses/>.
+
+===============================================================================
+
+"""
+
+import logging
+import os
+import tempfile
+from typing import Any, Dict, List
+
+from cardinal_pythonlib.logs import BraceStyleAdapter
+from sqlalchemy.engine.reflection import Inspector
+from sqlalchemy.orm import Session as SqlASession, sessionmaker
+from sqlalchemy.sql.expression import column, select, table
+
+from camcops_server.cc_modules.cc_dump import copy_tasks_and_summaries
+from camcops_server.cc_modules.cc_export import (
+    create_scratch_sqlite_engine,
+    get_db_export_watermark_candidate,
+)
+from camcops_server.cc_modules.cc_patientidnum import PatientIdNum
+from camcops_server.cc_modules.cc_simpleobjects import TaskExportOptions
+from camcops_server.cc_modules.cc_task import Task
+from camcops_server.cc_modules.cc_unittest import DemoDatabaseTestCase
+from camcops_server.tasks.bmi import Bmi
+from camcops_server.tasks.diagnosis import DiagnosisIcd10, DiagnosisIcd10Item
+
+log = BraceStyleAdapter(logging.getLogger(__name__))
+
+
+# =============================================================================
+# Unit tests
+# =============================================================================
+
+class DumpTests(DemoDatabaseTestCase):
+    """
+    Tests for copying tasks to an SQLite database in batches.
+    """
+    N_TASKS = 5
+
+    def create_tasks(self) -> None:
+        patient = self.create_patient_with_two_idnums()
+        for task_id in range(1, self.N_TASKS + 1):
+            bmi = Bmi()
+            bmi.id = task_id
+            self.apply_standard_task_fields(bmi)
+            bmi.patient_id = patient.id
+            bmi.mass_kg = 60.0 + task_id
+            bmi.height_m = 1.7
+            self.dbsession.add(bmi)
+
+            diagnosis = DiagnosisIcd10()
+            diagnosis.id = task_id
+            self.apply_standard_task_fields(diagnosis)
+            diagnosis.patient_id = patient.id
+            self.dbsession.add(diagnosis)
+            for seqnum in (1, 2):
+                item = DiagnosisIcd10Item()
+                item.id = 10 * task_id + seqnum
+                self._apply_standard_db_fields(item)
+                item.diagnosis_icd10_id = task_id
+                item.seqnum = seqnum
+                item.code = f"F{task_id}{seqnum}"
+                item.description = f"Diagnosis {task_id}.{seqnum}"
+                self.dbsession.add(item)
+        self.dbsession.commit()
+
+    def get_tasks(self) -> List[Task]:
+        return (
+            self.dbsession.query(Bmi).all() +
+            self.dbsession.query(DiagnosisIcd10).all()
+        )
+
+    def dump(self, batch_size: int) -> Dict[str, List[Dict[str, Any]]]:
+        """
+        Copies the tasks to a new SQLite database. Returns the rows of each
+        destination table, in order of their first column.
+        """
+        options = TaskExportOptions(
+            db_patient_id_per_row=True,
+            db_insert_batch_size=batch_size,
+        )
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            engine = create_scratch_sqlite_engine(
+                os.path.join(tmpdirname, "dump.sqlite3"))
+            dst_session = sessionmaker(bind=engine)()
+            copy_tasks_and_summaries(tasks=self.get_tasks(),
+                                     dst_engine=engine,
+                                     dst_session=dst_session,
+                                     export_options=options,
+                                     req=self.req)
+            dst_session.commit()
+            rows = {
+                tablename: [
+                    dict(row) for row in dst_session.execute(
+                        f"SELECT * FROM {tablename} ORDER BY 1"
+                    )
+                ]
+                for tablename in Inspector.from_engine(engine).get_table_names()  # noqa
+            }
+            dst_session.close()
+            engine.dispose()
+        return rows
+
+    def test_batched_dump_matches_rowwise_dump(self) -> None:
+        rowwise = self.dump(batch_size=1)
+        # A batch size that doesn't divide the number of rows exactly, so
+        # that both full and partial batches are written:
+        batched = self.dump(batch_size=2)
+        self.assertEqual(batched, rowwise)
+
+    def test_dumped_rows(self) -> None:
+        rows = self.dump(batch_size=2)
+        task_ids = list(range(1, self.N_TASKS + 1))
+        self.assertEqual(
+            [(r["id"], r["mass_kg"], r["height_m"]) for r in rows["bmi"]],
+            [(i, 60.0 + i, 1.7) for i in task_ids]
+        )
+        self.assertEqual([r["id"] for r in rows["diagnosis_icd10"]],
+                         task_ids)
+        self.assertEqual(
+            [
+                (r["diagnosis_icd10_id"], r["seqnum"], r["code"],
+                 r["_task_tablename"])
+                for r in rows["diagnosis_icd10_item"]
+            ],
+            [
+                (i, seqnum, f"F{i}{seqnum}", "diagnosis_icd10")
+                for i in task_ids
+                for seqnum in (1, 2)
+            ]
+        )
+        # One patient, copied once, with both ID numbers:
+        self.assertEqual(len(rows["patient"]), 1)
+        self.assertEqual(len(rows["patient_idnum"]), 2)
+
+
+class IncrementalDumpTests(DemoDatabaseTestCase):
+    """
+    Tests for incremental updates to a database that already holds a copy.
+    """
+    def create_tasks(self) -> None:
+        self.patient = self.create_patient_with_two_idnums()
+        for task_id in range(1, 4):
+            self.create_bmi(task_id)
+        self.dbsession.commit()
+
+    def create_bmi(self, task_id: int) -> Bmi:
+        task = Bmi()
+        task.id = task_id
+        self.apply_standard_task_fields(task)
+        task.patient_id = self.patient.id
+        self.dbsession.add(task)
+        return task
+
+    @staticmethod
+    def get_column_values(dst_session: SqlASession,
+                          tablename: str, colname: str) -> List:
+        query = select([column(colname)]).select_from(table(tablename))
+        return sorted(row[0] for row in dst_session.execute(query))
+
+    def test_incremental_update_removes_and_replaces_records(self) -> None:
+        self.announce("test_incremental_update_removes_and_replaces_records")
+        engine = create_scratch_sqlite_engine(
+            os.path.join(self.tmpdir_obj.name, "incremental.sqlite3"))
+        dst_session = sessionmaker(bind=engine)()
+        options = TaskExportOptions(
+            db_make_all_tables_even_empty=True,
+            db_incremental=True,
+        )
+
+        # First run: everything
+        watermark = get_db_export_watermark_candidate(self.req)
+        copy_tasks_and_summaries(tasks=self.dbsession.query(Bmi).all(),
+                                 dst_engine=engine,
+                                 dst_session=dst_session,
+                                 export_options=options,
+                                 req=self.req,
+                                 removed_since=None)
+        dst_session.commit()
+        self.assertEqual(
+            len(self.get_column_values(dst_session, "bmi", "_pk")), 3)
+
+        # Delete a task, edit an ID number, and add a task
+        deleted_task = self.dbsession.query(Bmi).filter(Bmi.id == 1).one()
+        deleted_task.mark_as_deleted(self.req)
+        old_idnum = (
+            self.dbsession.query(PatientIdNum)
+            .filter(PatientIdNum.id == 1)
+            .one()
+        )
+        new_idnum = PatientIdNum()
+        new_idnum.id = old_idnum.id
+        new_idnum.patient_id = old_idnum.patient_id
+        new_idnum.which_idnum = old_idnum.which_idnum
+        new_idnum.idnum_value = 999
+        new_idnum.set_predecessor(self.req, old_idnum)
+        new_task = self.create_bmi(4)
+        self.dbsession.commit()
+
+        # Second run: just the changes
+        copy_tasks_and_summaries(tasks=[new_task],
+                                 dst_engine=engine,
+                                 dst_session=dst_session,
+                                 export_options=options,
+                                 req=self.req,
+                                 removed_since=watermark)
+        dst_session.commit()
+        current_bmi_pks = sorted(
+            pk for pk, in self.dbsession.query(Bmi._pk)
+            .filter(Bmi._current == True)  # noqa: E712
+        )
+        self.assertEqual(self.get_column_values(dst_session, "bmi", "_pk"),
+                         current_bmi_pks)
+        self.assertEqual(
+            self.get_column_values(dst_session, "patient", "_pk"),
+            [self.patient.pk])
+        self.assertEqual(
+            self.get_column_values(dst_session, "patient_idnum",
+                                   "idnum_value"),
+            [444, 999])
+        dst_session.close()
+        engine.dispose()
+
+    def run_export(self, tasks: List[Task]) -> None:
+        """
+        Runs an incremental export of the specified tasks to
+        ``self.dst_session``, from the last watermark.
+        """
+        watermark = get_db_export_watermark_candidate(self.req)
+        copy_tasks_and_summaries(tasks=tasks,
+                                 dst_engine=self.dst_engine,
+                                 dst_session=self.dst_session,
+                                 export_options=TaskExportOptions(
+                                     db_make_all_tables_even_empty=True,
+                                     db_incremental=True,
+                                 ),
+                                 req=self.req,
+                                 removed_since=self.watermark)
+        self.dst_session.commit()
+        self.watermark = watermark
+
+    def start_incremental_export(self) -> None:
+        self.dst_engine = create_scratch_sqlite_engine(
+            os.path.join(self.tmpdir_obj.name, "incremental.sqlite3"))
+        self.dst_session = sessionmaker(bind=self.dst_engine)()
+        self.watermark = None
+        self.run_export(self.dbsession.query(Bmi).all())
+        self.assertEqual(
+            self.get_column_values(self.dst_session, "bmi", "id"),
+            [1, 2, 3])
+
+    def finish_incremental_export(self) -> None:
+        self.dst_session.close()
+        self.dst_engine.dispose()
+
+    def test_incremental_update_removes_hard_deleted_tasks(self) -> None:
+        self.announce("test_incremental_update_removes_hard_deleted_tasks")
+        self.start_incremental_export()
+        task = self.dbsession.query(Bmi).filter(Bmi.id == 2).one()
+        task.delete_entirely(self.req)
+        self.dbsession.commit()
+
+        self.run_export([])
+        self.assertEqual(
+            self.get_column_values(self.dst_session, "bmi", "id"), [1, 3])
+        # The patient, still used by other tasks, remains:
+        self.assertEqual(
+            self.get_column_values(self.dst_session, "patient", "_pk"),
+            [self.patient.pk])
+        self.finish_incremental_export()
+
+    def test_incremental_update_removes_erased_records(self) -> None:
+        self.announce("test_incremental_update_removes_erased_records")
+        self.start_incremental_export()
+        task = self.dbsession.query(Bmi).filter(Bmi.id == 2).one()
+        task.manually_erase(self.req)
+        self.patient.manually_erase_with_dependants(self.req)
+        self.dbsession.commit()
+
+        self.run_export([])
+        self.assertEqual(
+            self.get_column_values(self.dst_session, "bmi", "id"), [1, 3])
+        self.assertEqual(
+            self.get_column_values(self.dst_session, "patient", "_pk"), [])
+        self.finish_incremental_export()
@@ -0,0 +1,514 @@
+#!/usr/bin/env python
+
+"""
+camcops_server/cc_modules/tests/cc_export_tests.py
+
+===============================================================================
+
+    Copyright (C) 2012-2020 Rudolf Cardinal (rudolf@pobox.com).
+
+    This file is part of CamCOPS.
+
+    CamCOPS is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    CamCOPS is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with CamCOPS. If not, see <http://www.gnu.org/licenses/>.
+
+===============================================================================
+
+"""
+
+import datetime
+import os
+import tempfile
+from typing import Dict, Generator, List, Tuple
+from unittest import mock
+
+from celery.exceptions import SoftTimeLimitExceeded
+from sqlalchemy.event.api import listen, remove
+from sqlalchemy.orm import sessionmaker
+
+from camcops_server.cc_modules.cc_export import (
+    claim_task_for_export,
+    EXPORT_TASK_CLAIM_EXPIRY,
+    export_task,
+    export_tasks_by_pk,
+    ExportTimeLimitExceeded,
+    release_task_export_claim,
+    schedule_export_tasks_via_backend,
+)
+from camcops_server.cc_modules.cc_exportmodels import (
+    ExportedTask,
+    ExportedTaskFileGroup,
+    ExportTaskClaim,
+)
+from camcops_server.cc_modules.cc_exportrecipient import ExportRecipient
+from camcops_server.cc_modules.cc_exportrecipientinfo import (
+    ExportRecipientInfo,
+)
+from camcops_server.cc_modules.cc_taskfactory import (
+    task_factory_no_security_checks,
+)
+from camcops_server.cc_modules.cc_unittest import (
+    DemoDatabaseTestCase,
+    DemoFileDatabaseTestCase,
+    ExtendedTestCase,
+)
+from camcops_server.cc_modules.celery import (
+    export_tasks_backend,
+    scale_rate_limit,
+)
+from camcops_server.tasks.phq9 import Phq9
+
+
+# =============================================================================
+# Unit tests
+# =============================================================================
+
+class BatchedBackendExportTests(DemoDatabaseTestCase):
+    """
+    Tests for exporting tasks in batches via the back end.
+    """
+    def test_jobs_are_batched(self) -> None:
+        pairs = [("phq9", pk) for pk in range(1, 6)]
+        with mock.patch.object(self.req.config, "celery_export_batch_size",
+                               2):
+            with mock.patch("camcops_server.cc_modules.cc_export."
+                            "export_tasks_backend") as mock_backend:
+                schedule_export_tasks_via_backend(self.req, "recip", pairs)
+        batches = [c[1]["basetable_pk_pairs"]
+                   for c in mock_backend.delay.call_args_list]
+        self.assertEqual(batches, [pairs[0:2], pairs[2:4], pairs[4:5]])
+        for c in mock_backend.delay.call_args_list:
+            self.assertEqual(c[1]["recipient_name"], "recip")
+
+    def test_export_tasks_by_pk(self) -> None:
+        recipient = mock.Mock(recipient_name="recip")
+        pairs = [
+            ("phq9", 1),
+            ("bmi", 2),
+            ("phq9", 2),
+            ("phq9", 99999),  # no such task
+            ("nonexistent_table", 1),
+        ]
+        exported = []
+
+        def fake_export_task(req, recipient_, task) -> bool:
+            exported.append((task.tablename, task.pk))
+            if task.tablename == "bmi":
+                raise RuntimeError("Export failed")
+            return task.pk != 2  # pretend phq9 2 is locked elsewhere
+
+        with mock.patch("camcops_server.cc_modules.cc_export.export_task",
+                        side_effect=fake_export_task):
+            failed = export_tasks_by_pk(self.req, recipient, pairs)
+
+        self.assertEqual(sorted(exported),
+                         [("bmi", 2), ("phq9", 1), ("phq9", 2)])
+        self.assertEqual(sorted(failed), [("bmi", 2), ("phq9", 2)])
+
+    def test_export_tasks_by_pk_time_limit(self) -> None:
+        recipient = mock.Mock(recipient_name="recip")
+        pairs = [("phq9", 1), ("phq9", 2), ("bmi", 1), ("bmi", 2)]
+
+        def fake_export_task(req, recipient_, task) -> bool:
+            if (task.tablename, task.pk) == ("phq9", 2):
+                return False  # locked elsewhere
+            if task.tablename == "bmi":
+                raise SoftTimeLimitExceeded()
+            return True
+
+        with mock.patch("camcops_server.cc_modules.cc_export.export_task",
+                        side_effect=fake_export_task):
+            with self.assertRaises(ExportTimeLimitExceeded) as cm:
+                export_tasks_by_pk(self.req, recipient, pairs)
+        self.assertEqual(sorted(cm.exception.unfinished),
+                         [("bmi", 1), ("bmi", 2), ("phq9", 2)])
+
+    def run_export_tasks_backend(self, pairs: List[Tuple[str, int]],
+                                 unfinished: List[Tuple[str, int]]) \
+            -> Tuple[mock.Mock, mock.Mock]:
+        """
+        Runs the batch export job (synchronously), pretending that it runs
+        out of time with ``unfinished`` tasks. Returns mocks for the job's
+        ``delay()`` and ``retry()`` methods.
+        """
+        request_context = mock.MagicMock()
+        with mock.patch("camcops_server.cc_modules.cc_request."
+                        "command_line_request_context",
+                        return_value=request_context), \
+                mock.patch("camcops_server.cc_modules.cc_export."
+                           "export_tasks_by_pk",
+                           side_effect=ExportTimeLimitExceeded(unfinished)), \
+                mock.patch.object(export_tasks_backend,
+                                  "delay") as mock_delay, \
+                mock.patch.object(export_tasks_backend, "retry",
+                                  side_effect=RuntimeError("retry")) \
+                as mock_retry:
+            try:
+                export_tasks_backend(recipient_name="recip",
+                                     basetable_pk_pairs=pairs)
+            except RuntimeError:
+                pass
+        return mock_delay, mock_retry
+
+    def test_batch_job_out_of_time_resubmits_unfinished(self) -> None:
+        pairs = [("phq9", 1), ("phq9", 2), ("phq9", 3)]
+        mock_delay, mock_retry = self.run_export_tasks_backend(
+            pairs, unfinished=pairs[1:])
+        mock_delay.assert_called_once_with(recipient_name="recip",
+                                           basetable_pk_pairs=pairs[1:])
+        mock_retry.assert_not_called()
+
+    def test_batch_job_out_of_time_without_progress_retries(self) -> None:
+        pairs = [("phq9", 1), ("phq9", 2)]
+        mock_delay, mock_retry = self.run_export_tasks_backend(
+            pairs, unfinished=pairs)
+        mock_delay.assert_not_called()
+        self.assertEqual(mock_retry.call_args[1]["kwargs"],
+                         dict(recipient_name="recip",
+                              basetable_pk_pairs=pairs))
+
+    def test_rate_limit_scaled_per_batch(self) -> None:
+        self.assertEqual(scale_rate_limit("100/m", 100), "1/m")
+        self.assertEqual(scale_rate_limit("10/s", 100), "0.1/s")
+        self.assertEqual(scale_rate_limit("50", 10), "5")
+        self.assertEqual(scale_rate_limit("100/h", 1), "100/h")
+        self.assertIsNone(scale_rate_limit("", 100))
+        self.assertIsNone(scale_rate_limit(None, 100))
+
+    def test_push_exports_are_batched_by_recipient(self) -> None:
+        self.req.add_export_push_request("recip_a", "phq9", 1)
+        self.req.add_export_push_request("recip_b", "phq9", 1)
+        self.req.add_export_push_request("recip_a", "bmi", 1)
+        with mock.patch("camcops_server.cc_modules.cc_export."
+                        "export_tasks_backend") as mock_backend:
+            # noinspection PyProtectedMember
+            self.req._process_pending_export_push_requests()
+        calls = [(c[1]["recipient_name"], c[1]["basetable_pk_pairs"])
+                 for c in mock_backend.delay.call_args_list]
+        self.assertEqual(calls, [
+            ("recip_a", [("phq9", 1), ("bmi", 1)]),
+            ("recip_b", [("phq9", 1)]),
+        ])
+
+
+class AlreadyExportedTests(DemoDatabaseTestCase):
+    """
+    Tests for skipping tasks that have already been exported.
+    """
+    def setUp(self) -> None:
+        super().setUp()
+        self.recipient = ExportRecipient(ExportRecipientInfo())
+        self.recipient.primary_idnum = 1001
+        # auto increment doesn't work for BigInteger with SQLite
+        self.recipient.id = 1
+        self.recipient.recipient_name = "recip"
+        self.dbsession.add(self.recipient)
+        for et_id, task_pk, success, cancelled in [
+            (1, 1, True, False),
+            (2, 2, True, True),  # cancelled, so needs exporting again
+            (3, 3, False, False),  # failed
+        ]:
+            et = ExportedTask(self.recipient, basetable="phq9",
+                              task_server_pk=task_pk)
+            et.id = et_id
+            et.success = success
+            et.cancelled = cancelled
+            self.dbsession.add(et)
+        self.dbsession.commit()
+
+    def test_task_pks_already_exported(self) -> None:
+        self.assertEqual(
+            ExportedTask.task_pks_already_exported(
+                self.dbsession, "recip", "phq9", [1, 2, 3, 4, 1]),
+            {1}
+        )
+        self.assertEqual(
+            ExportedTask.task_pks_already_exported(
+                self.dbsession, "other_recip", "phq9", [1, 2, 3]),
+            set()
+        )
+        self.assertEqual(
+            ExportedTask.task_pks_already_exported(
+                self.dbsession, "recip", "bmi", [1]),
+            set()
+        )
+        for task_pk, expected in [(1, True), (2, False), (3, False)]:
+            self.assertEqual(
+                ExportedTask.task_already_exported(
+                    self.dbsession, "recip", "phq9", task_pk),
+                expected
+            )
+
+    def test_export_tasks_by_pk_skips_exported_tasks(self) -> None:
+        exported = []
+
+        def fake_export_task(req, recipient_, task) -> bool:
+            exported.append(task.pk)
+            return True
+
+        with mock.patch("camcops_server.cc_modules.cc_export.export_task",
+                        side_effect=fake_export_task):
+            failed = export_tasks_by_pk(self.req, self.recipient,
+                                        [("phq9", 1), ("phq9", 2)])
+        self.assertEqual(exported, [2])
+        self.assertEqual(failed, [])
+
+
+class BatchExportQueryTests(DemoDatabaseTestCase):
+    """
+    Tests that exporting a batch of tasks fetches them with one query per
+    task table.
+    """
+    def setUp(self) -> None:
+        super().setUp()
+        self.recipient = ExportRecipient(ExportRecipientInfo())
+        self.recipient.primary_idnum = 1001
+        # auto increment doesn't work for BigInteger with SQLite
+        self.recipient.id = 1
+        self.recipient.recipient_name = "recip"
+        self.dbsession.add(self.recipient)
+        patient_id = (
+            self.dbsession.query(Phq9.patient_id).filter(Phq9.id == 1).scalar()
+        )
+        for task_id in range(3, 7):
+            task = Phq9()
+            task.id = task_id
+            self.apply_standard_task_fields(task)
+            task.patient_id = patient_id
+            self.dbsession.add(task)
+        self.dbsession.commit()
+        self.next_exported_task_id = 1
+
+    def count_task_selects(self, task_pks: List[int]) -> int:
+        """
+        Exports the specified PHQ-9 tasks (pretending to transmit them), and
+        returns the number of SELECT statements that read the PHQ-9 table
+        (including those that eagerly load the tasks' patients).
+        """
+        def fake_export(et: ExportedTask, req) -> None:
+            # auto increment doesn't work for BigInteger with SQLite
+            et.id = self.next_exported_task_id
+            self.next_exported_task_id += 1
+            et.success = True
+
+        statements = []  # type: List[str]
+
+        # noinspection PyUnusedLocal
+        def count_statement(conn, cursor, statement, *args) -> None:
+            statements.append(statement)
+
+        listen(self.engine, "before_cursor_execute", count_statement)
+        try:
+            with mock.patch.object(self.recipient, "is_task_suitable",
+                                   return_value=True):
+                with mock.patch.object(ExportedTask, "export", autospec=True,
+                                       side_effect=fake_export):
+                    failed = export_tasks_by_pk(
+                        self.req, self.recipient,
+                        [("phq9", pk) for pk in task_pks])
+        finally:
+            remove(self.engine, "before_cursor_execute", count_statement)
+        self.assertEqual(failed, [])
+        for task_pk in task_pks:
+            self.assertTrue(ExportedTask.task_already_exported(
+                self.dbsession, "recip", "phq9", task_pk))
+        return len([
+            statement for statement in statements
+            if statement.lstrip().upper().startswith("SELECT") and
+            "FROM phq9" in statement
+        ])
+
+    def test_task_queries_do_not_grow_with_batch_size(self) -> None:
+        self.assertEqual(self.count_task_selects([1]),
+                         self.count_task_selects([2, 3, 4, 5, 6]))
+
+
+class ExportTaskClaimTests(DemoFileDatabaseTestCase):
+    """
+    Tests for claiming tasks for export, with a second database session
+    standing in for a competing process.
+    """
+    def setUp(self) -> None:
+        super().setUp()
+        self.recipients = {}  # type: Dict[str, ExportRecipient]
+        for recipient_id, recipient_name in [(1, "recip_a"), (2, "recip_b")]:
+            recipient = ExportRecipient(ExportRecipientInfo())
+            recipient.primary_idnum = 1001
+            # auto increment doesn't work for BigInteger with SQLite
+            recipient.id = recipient_id
+            recipient.recipient_name = recipient_name
+            self.dbsession.add(recipient)
+            self.recipients[recipient_name] = recipient
+        self.dbsession.commit()
+        self.task = task_factory_no_security_checks(self.dbsession, "phq9", 1)
+        self.other_session = sessionmaker(bind=self.file_engine)()
+
+    def tearDown(self) -> None:
+        self.other_session.close()
+        super().tearDown()
+
+    def other_claim(self, recipient_name: str) -> bool:
+        return claim_task_for_export(self.other_session, recipient_name,
+                                     "phq9", 1)
+
+    def n_claims(self) -> int:
+        return self.other_session.query(ExportTaskClaim).count()
+
+    def test_claims_are_per_recipient(self) -> None:
+        self.assertTrue(claim_task_for_export(self.dbsession, "recip_a",
+                                              "phq9", 1))
+        self.assertFalse(self.other_claim("recip_a"))
+        self.assertTrue(self.other_claim("recip_b"))
+        self.assertTrue(claim_task_for_export(self.dbsession, "recip_a",
+                                              "phq9", 2))
+        release_task_export_claim(self.dbsession, "recip_a", "phq9", 1)
+        self.assertTrue(self.other_claim("recip_a"))
+
+    def test_expired_claim_is_taken_over(self) -> None:
+        self.assertTrue(claim_task_for_export(self.dbsession, "recip_a",
+                                              "phq9", 1))
+        later = (
+            self.other_session.query(ExportTaskClaim.claimed_at_utc).scalar()
+            + EXPORT_TASK_CLAIM_EXPIRY + datetime.timedelta(minutes=1)
+        )
+        with mock.patch("camcops_server.cc_modules.cc_export."
+                        "get_now_utc_datetime", return_value=later):
+            self.assertTrue(self.other_claim("recip_a"))
+            self.assertFalse(claim_task_for_export(self.dbsession, "recip_a",
+                                                   "phq9", 1))
+        self.assertEqual(self.n_claims(), 1)
+
+    def test_claim_committed_before_transmitting(self) -> None:
+        recipient = self.recipients["recip_a"]
+
+        def fake_export(et: ExportedTask, req) -> None:
+            # Another process sees our claim...
+            self.assertFalse(self.other_claim("recip_a"))
+            # ... but can still export the task to another recipient.
+            self.assertTrue(self.other_claim("recip_b"))
+            release_task_export_claim(self.other_session, "recip_b",
+                                      "phq9", 1)
+            et.id = 1  # auto increment doesn't work for BigInteger with SQLite
+            et.success = True
+
+        with mock.patch.object(recipient, "is_task_suitable",
+                               return_value=True):
+            with mock.patch.object(ExportedTask, "export", autospec=True,
+                                   side_effect=fake_export) as mock_export:
+                self.assertTrue(export_task(self.req, recipient, self.task))
+        mock_export.assert_called_once()
+        self.assertEqual(self.n_claims(), 0)
+        self.assertTrue(ExportedTask.task_already_exported(
+            self.other_session, "recip_a", "phq9", 1))
+
+    def test_export_task_skips_claimed_task(self) -> None:
+        recipient = self.recipients["recip_a"]
+        self.assertTrue(self.other_claim("recip_a"))
+        with mock.patch.object(recipient, "is_task_suitable",
+                               return_value=True):
+            with mock.patch.object(ExportedTask, "export") as mock_export:
+                self.assertFalse(export_task(self.req, recipient, self.task))
+        mock_export.assert_not_called()
+        self.assertEqual(self.n_claims(), 1)
+
+    def test_claim_released_if_export_interrupted(self) -> None:
+        recipient = self.recipients["recip_a"]
+        with mock.patch.object(recipient, "is_task_suitable",
+                               return_value=True):
+            with mock.patch.object(ExportedTask, "export",
+                                   side_effect=SoftTimeLimitExceeded()):
+                with self.assertRaises(SoftTimeLimitExceeded):
+                    export_task(self.req, recipient, self.task)
+        self.assertEqual(self.n_claims(), 0)
+        self.assertFalse(ExportedTask.task_already_exported(
+            self.other_session, "recip_a", "phq9", 1))
+
+    def test_claim_released_if_claiming_interrupted(self) -> None:
+        recipient = self.recipients["recip_a"]
+
+        def claim_then_run_out_of_time(*args, **kwargs) -> bool:
+            claim_task_for_export(*args, **kwargs)
+            raise SoftTimeLimitExceeded()
+
+        with mock.patch.object(recipient, "is_task_suitable",
+                               return_value=True):
+            with mock.patch("camcops_server.cc_modules.cc_export."
+                            "claim_task_for_export",
+                            side_effect=claim_then_run_out_of_time):
+                with self.assertRaises(SoftTimeLimitExceeded):
+                    export_task(self.req, recipient, self.task)
+        self.assertEqual(self.n_claims(), 0)
+
+    def test_other_claim_kept_if_claiming_interrupted(self) -> None:
+        recipient = self.recipients["recip_a"]
+        self.assertTrue(claim_task_for_export(
+            self.other_session, "recip_a", "phq9", 1,
+            datetime.datetime(2020, 1, 1, 12, 0, 0)))
+        with mock.patch.object(recipient, "is_task_suitable",
+                               return_value=True):
+            with mock.patch("camcops_server.cc_modules.cc_export."
+                            "claim_task_for_export",
+                            side_effect=SoftTimeLimitExceeded()):
+                with self.assertRaises(SoftTimeLimitExceeded):
+                    export_task(self.req, recipient, self.task)
+        self.assertEqual(self.n_claims(), 1)
+
+
+class ExportedFileTests(ExtendedTestCase):
+    """
+    Tests for exporting tasks to files.
+    """
+    def setUp(self) -> None:
+        super().setUp()
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.tempdir.name, "task.xml")
+        recipient = ExportRecipient(ExportRecipientInfo())
+        recipient.recipient_name = "recip"
+        recipient.file_overwrite_files = True
+        recipient.file_make_directory = False
+        exported_task = ExportedTask(recipient, basetable="phq9",
+                                     task_server_pk=1)
+        self.filegroup = ExportedTaskFileGroup(exported_task)
+
+    def tearDown(self) -> None:
+        self.tempdir.cleanup()
+        super().tearDown()
+
+    def test_text_chunks_written(self) -> None:
+        self.assertTrue(self.filegroup.export_file(
+            self.filename, text_chunks=iter(["<a>", "b", "</a>"])))
+        with open(self.filename) as f:
+            self.assertEqual(f.read(), "<a>b</a>")
+        self.assertEqual(os.stat(self.filename).st_mode & 0o777, 0o644)
+        self.assertEqual(os.listdir(self.tempdir.name), ["task.xml"])
+        self.assertEqual(self.filegroup.filenames, [self.filename])
+
+    def test_text_chunks_failure_leaves_no_partial_file(self) -> None:
+        def gen_chunks() -> Generator[str, None, None]:
+            yield "<a>"
+            raise RuntimeError("Failed part-way through")
+
+        for existing in [None, "<old/>"]:
+            if existing is not None:
+                with open(self.filename, "w") as f:
+                    f.write(existing)
+            self.assertFalse(self.filegroup.export_file(
+                self.filename, text_chunks=gen_chunks()))
+            if existing is None:
+                self.assertEqual(os.listdir(self.tempdir.name), [])
+            else:
+                # Previous file left intact
+                self.assertEqual(os.listdir(self.tempdir.name), ["task.xml"])
+                with open(self.filename) as f:
+                    self.assertEqual(f.read(), existing)
+        self.assertFalse(self.filegroup.exported_task.success)
@@ -25,18 +25,25 @@ camcops_server/cc_modules/tests/cc_hl7_tests.py
 ===============================================================================
 """
 
+import socketserver
+import threading
+from unittest import TestCase
 
 import hl7
 from pendulum import Date, DateTime as Pendulum
 
 from camcops_server.cc_modules.cc_constants import FileType
 from camcops_server.cc_modules.cc_hl7 import (
+    CR,
+    EB,
     escape_hl7_text,
     get_mod11_checkdigit,
     make_msh_segment,
     make_obr_segment,
     make_obx_segment,
     make_pid_segment,
+    MLLPConnectionPool,
+    SB,
 )
 from camcops_server.cc_modules.cc_simpleobjects import (
     HL7PatientIdentifier,
@@ -96,3 +103,73 @@ class HL7CoreTests(DemoDatabaseTestCase):
                     export_options=export_options,
                 ), hl7.Segment)
         self.assertIsInstance(escape_hl7_text("blahblah"), str)
+
+
+class MLLPAckHandler(socketserver.BaseRequestHandler):
+    """
+    Replies to each MLLP message with an HL7 ACK, optionally closing the
+    connection after a certain number of messages.
+    """
+    def handle(self) -> None:
+        server = self.server  # type: MLLPTestServer
+        server.n_connections += 1
+        received = b""
+        n_messages = 0
+        while True:
+            while EB.encode() not in received:
+                chunk = self.request.recv(4096)
+                if not chunk:
+                    return
+                received += chunk
+            end = received.index(EB.encode()) + 2  # <EB><CR>
+            received = received[end:]
+            n_messages += 1
+            ack = "MSH|^~\\&|||||||ACK|1|P|2.3" + CR + "MSA|AA|1"
+            self.request.sendall((SB + ack + CR + EB + CR).encode())
+            if n_messages == server.close_after_n_messages:
+                return
+
+
+class MLLPTestServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, close_after_n_messages: int = None) -> None:
+        super().__init__(("127.0.0.1", 0), MLLPAckHandler)
+        self.close_after_n_messages = close_after_n_messages
+        self.n_connections = 0
+
+
+class MLLPConnectionPoolTests(TestCase):
+    """
+    Tests connection reuse against a local MLLP server.
+    """
+    def run_server(self, close_after_n_messages: int = None) -> MLLPTestServer:
+        server = MLLPTestServer(close_after_n_messages=close_after_n_messages)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        return server
+
+    def send_messages(self, server: MLLPTestServer, n: int) -> None:
+        host, port = server.server_address
+        pool = MLLPConnectionPool()
+        self.addCleanup(pool.close_all)
+        for i in range(n):
+            server_replied, reply = pool.send_message(
+                host, port, f"MSH|^~\\&|||||||ORU^R01|{i}|P|2.3",
+                timeout_ms=5000
+            )
+            self.assertTrue(server_replied)
+            self.assertIn("MSA|AA|1", reply)
+
+    def test_connection_reused(self) -> None:
+        server = self.run_server()
+        self.send_messages(server, 5)
+        self.assertEqual(server.n_connections, 1)
+
+    def test_reconnects_when_server_closes_connection(self) -> None:
+        server = self.run_server(close_after_n_messages=2)
+        self.send_messages(server, 5)
+        self.assertEqual(server.n_connections, 3)
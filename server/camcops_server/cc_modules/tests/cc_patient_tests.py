@@ -26,11 +26,19 @@ camcops_server/cc_modules/tests/cc_patient_tests.py
 
 """
 
+from types import SimpleNamespace
+from typing import List, Optional
+from unittest import TestCase
+
 import hl7
 import pendulum
 
 from camcops_server.cc_modules.cc_simpleobjects import BarePatientInfo
-from camcops_server.cc_modules.cc_patient import Patient
+from camcops_server.cc_modules.cc_patient import (
+    group_by_patient,
+    Patient,
+    PatientIdentityResolver,
+)
 from camcops_server.cc_modules.cc_patientidnum import PatientIdNum
 from camcops_server.cc_modules.cc_simpleobjects import IdNumReference
 from camcops_server.cc_modules.cc_tsv import TsvPage
@@ -157,3 +165,96 @@ class LineageTests(DemoDatabaseTestCase):
         idnums = list(self.patient_1.gen_patient_idnums_even_noncurrent())
 
         self.assertEqual(len(idnums), 2)
+
+
+class GroupByPatientTests(TestCase):
+    """
+    Tests for :class:`PatientIdentityResolver` and :func:`group_by_patient`.
+    """
+    @staticmethod
+    def make_patient(patient_id: Optional[int],
+                     device_id: int = 1,
+                     idnums: List[int] = None) -> SimpleNamespace:
+        return SimpleNamespace(
+            id=patient_id, _device_id=device_id, _era="NOW",
+            idnums=[SimpleNamespace(which_idnum=1, idnum_value=v)
+                    for v in idnums or []]
+        )
+
+    def make_task(self, *args, **kwargs) -> SimpleNamespace:
+        return SimpleNamespace(patient=self.make_patient(*args, **kwargs))
+
+    @staticmethod
+    def group(tasks: List[SimpleNamespace]) -> List[List[SimpleNamespace]]:
+        return group_by_patient(tasks, lambda t: t.patient)
+
+    def test_same_client_patient_grouped(self) -> None:
+        t1 = self.make_task(1)
+        t2 = self.make_task(2)
+        t3 = self.make_task(1)
+        t4 = self.make_task(1, device_id=2)
+
+        self.assertCountEqual(self.group([t1, t2, t3, t4]),
+                              [[t1, t3], [t2], [t4]])
+
+    def test_patients_linked_transitively_by_idnum(self) -> None:
+        t1 = self.make_task(1, device_id=1, idnums=[100])
+        t2 = self.make_task(1, device_id=2, idnums=[200])
+        t3 = self.make_task(1, device_id=3, idnums=[100, 200])
+        t4 = self.make_task(1, device_id=4, idnums=[300])
+
+        self.assertCountEqual(self.group([t1, t2, t3, t4]),
+                              [[t1, t2, t3], [t4]])
+
+    def test_tasks_without_patient_identity_not_grouped(self) -> None:
+        t1 = SimpleNamespace(patient=None)
+        t2 = SimpleNamespace(patient=None)
+        t3 = self.make_task(None)
+        t4 = self.make_task(None)
+
+        self.assertCountEqual(self.group([t1, t2, t3, t4]),
+                              [[t1], [t2], [t3], [t4]])
+
+    def test_resolver_canonical_keys(self) -> None:
+        resolver = PatientIdentityResolver()
+        k1 = resolver.add(self.make_patient(1, device_id=1, idnums=[100]))
+        k2 = resolver.add(self.make_patient(1, device_id=2, idnums=[200]))
+        k3 = resolver.add(self.make_patient(1, device_id=3, idnums=[300]))
+
+        self.assertNotEqual(resolver.canonical_key(k1),
+                            resolver.canonical_key(k2))
+
+        resolver.add(self.make_patient(1, device_id=4, idnums=[100, 200]))
+
+        self.assertEqual(resolver.canonical_key(k1),
+                         resolver.canonical_key(k2))
+        self.assertNotEqual(resolver.canonical_key(k1),
+                            resolver.canonical_key(k3))
+
+    def test_grouping_many_tasks(self) -> None:
+        # 200 patients, each on its own device; each pair of patients is
+        # linked by a shared ID number, and each patient has 3 tasks, which
+        # are interleaved.
+        num_patients = 200
+        tasks_per_patient = 3
+        patients = [
+            self.make_patient(1, device_id=n, idnums=[n // 2])
+            for n in range(num_patients)
+        ]
+        tasks = [
+            SimpleNamespace(patient=patients[n % num_patients])
+            for n in range(num_patients * tasks_per_patient)
+        ]
+
+        groups = self.group(tasks)
+
+        self.assertEqual(len(groups), num_patients // 2)
+        for group in groups:
+            self.assertEqual(len(group), 2 * tasks_per_patient)
+            # All tasks in a group belong to the same pair of patients:
+            self.assertEqual(
+                len(set(task.patient.idnums[0].idnum_value
+                        for task in group)),
+                1
+            )
+            self.assertEqual(len(set(id(task.patient) for task in group)), 2)
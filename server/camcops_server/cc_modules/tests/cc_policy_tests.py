@@ -26,12 +26,14 @@ camcops_server/cc_modules/tests/cc_policy_tests.py
 """
 
 import logging
-from typing import Dict
+import random
+from typing import Dict, List
 
 from cardinal_pythonlib.logs import BraceStyleAdapter
 from pendulum import Date
 
-from camcops_server.cc_modules.cc_policy import TokenizedPolicy
+from camcops_server.cc_modules.cc_group import Group
+from camcops_server.cc_modules.cc_policy import Q_TRUE, TokenizedPolicy
 from camcops_server.cc_modules.cc_simpleobjects import (
     BarePatientInfo,
     IdNumReference,
@@ -319,3 +321,103 @@ class PolicyTests(ExtendedTestCase):
             if tp.ptinfo_satisfies_id_policy is not None:
                 self.assertEqual(x, tp.ptinfo_satisfies_id_policy)
                 log.info(correct_msg)
+
+
+class CompiledPolicyTests(ExtendedTestCase):
+    """
+    Tests that compiled policies agree with the policy interpreter.
+    """
+    POLICY_WORDS = [
+        "sex", "forename", "surname", "dob", "address", "email", "gp",
+        "otherdetails", "anyidnum", "otheridnum", "idnum1", "idnum2", "idnum3",
+    ]
+
+    def setUp(self) -> None:
+        super().setUp()
+        self.rng = random.Random(1234)
+
+    def _random_policy(self, depth: int = 0) -> str:
+        rng = self.rng
+        n_terms = rng.randint(1, 4)
+        terms = []  # type: List[str]
+        for _ in range(n_terms):
+            if depth < 2 and rng.random() < 0.25:
+                term = f"({self._random_policy(depth + 1)})"
+            else:
+                term = rng.choice(self.POLICY_WORDS)
+            if rng.random() < 0.2:
+                term = "NOT " + term
+            terms.append(term)
+        policy = terms[0]
+        for term in terms[1:]:
+            policy += rng.choice([" AND ", " OR "]) + term
+        return policy
+
+    def _random_ptinfo(self) -> BarePatientInfo:
+        rng = self.rng
+
+        def maybe(x: str) -> str:
+            return x if rng.random() < 0.7 else ""
+
+        idnums = [
+            IdNumReference(which_idnum,
+                           rng.randint(1, 10000) if rng.random() < 0.8
+                           else None)
+            for which_idnum in range(1, 6) if rng.random() < 0.5
+        ]
+        return BarePatientInfo(
+            forename=maybe("forename"),
+            surname=maybe("surname"),
+            sex=maybe("F"),
+            dob=Date(2000, 1, 1) if rng.random() < 0.7 else None,
+            address=maybe("address"),
+            email=maybe("patient@example.com"),
+            gp=maybe("gp"),
+            otherdetails=maybe("otherdetails"),
+            idnum_definitions=idnums,
+        )
+
+    def test_compiled_matches_interpreted(self) -> None:
+        policies = [self._random_policy() for _ in range(200)]
+        policies += [
+            "", "sex AND (failure", "sex AND NOT", "OR OR", "sex forename",
+            "(sex))", "()", "NOT", "sex AND OR forename",
+        ]
+        ptinfos = [self._random_ptinfo() for _ in range(50)]
+        for policy_string in policies:
+            p = TokenizedPolicy(policy_string)
+            self.assertEqual(p.compiled_policy() is None,
+                             not p.is_syntactically_valid(),
+                             policy_string)
+            for ptinfo in ptinfos:
+                # noinspection PyProtectedMember
+                expected = p._value_for_ptinfo(ptinfo) is Q_TRUE
+                self.assertEqual(p.satisfies_id_policy(ptinfo), expected,
+                                 f"{policy_string!r}, {ptinfo}")
+
+    def test_typical_policy_compiled_matches_interpreted(self) -> None:
+        ptinfos = [self._random_ptinfo() for _ in range(500)]
+        p = TokenizedPolicy(
+            "sex AND ((forename AND surname AND dob) OR anyidnum) AND "
+            "NOT (idnum3 OR otheridnum)"
+        )
+        # noinspection PyProtectedMember
+        interpreted = [p._value_for_ptinfo(pt) is Q_TRUE for pt in ptinfos]
+        compiled = [p.satisfies_id_policy(pt) for pt in ptinfos]
+        self.assertEqual(compiled, interpreted)
+        # Both outcomes are exercised:
+        self.assertIn(True, compiled)
+        self.assertIn(False, compiled)
+
+    def test_group_caches_policies(self) -> None:
+        group = Group()
+        group.upload_policy = "sex AND idnum1"
+        group.finalize_policy = "sex AND idnum1 AND forename"
+        upload_policy = group.tokenized_upload_policy()
+        self.assertIs(group.tokenized_upload_policy(), upload_policy)
+        self.assertIsNot(group.tokenized_finalize_policy(), upload_policy)
+
+        group.upload_policy = "sex AND idnum2"
+        new_upload_policy = group.tokenized_upload_policy()
+        self.assertIsNot(new_upload_policy, upload_policy)
+        self.assertEqual(str(new_upload_policy), "SEX AND IDNUM2")
@@ -40,6 +40,7 @@ from camcops_server.cc_modules.cc_redcap import (
     RedcapExportException,
     RedcapFieldmap,
     RedcapNewRecordUploader,
+    RedcapRecordCache,
     RedcapRecordStatus,
     RedcapTaskExporter,
 )
@@ -100,9 +101,10 @@ class RedcapExporterTests(TestCase):
 
         })
 
-        next_instance_id = RedcapTaskExporter._get_next_instance_id(
-            records, "bmi", "record_id", "1"
-        )
+        fieldmap = mock.Mock(patient={"redcap_field": "patient_id"},
+                             record={"redcap_field": "record_id"})
+        record_cache = RedcapRecordCache(records, fieldmap)
+        next_instance_id = record_cache.get_next_instance_id("bmi", "1")
 
         self.assertEqual(next_instance_id, 6)
         self.assertEqual(type(next_instance_id), int)
@@ -736,6 +738,77 @@ class BmiRedcapUpdateTests(BmiRedcapValidFieldmapTestCase):
         self.assertEquals(kwargs["return_content"], "count")
         self.assertFalse(kwargs["force_auto_number"])
 
+    def test_existing_records_fetched_once_per_batch(self) -> None:
+        from camcops_server.cc_modules.cc_exportmodels import (
+            ExportedTask,
+            ExportedTaskRedcap,
+        )
+
+        exporter = MockRedcapTaskExporter()
+        project = exporter.get_project()
+        project.export_records.return_value = DataFrame({"patient_id": []})
+        project.import_records.return_value = ["123,0"]
+        project.export_project_info.return_value = {
+            "record_autonumbering_enabled": 1
+        }
+
+        exported_task_redcaps = [
+            ExportedTaskRedcap(ExportedTask(task=task,
+                                            recipient=self.recipient))
+            for task in (self.task1, self.task2)
+        ]
+        for exported_task_redcap in exported_task_redcaps:
+            exporter.export_task(self.req, exported_task_redcap)
+
+        project.export_records.assert_called_once()
+        self.assertEqual(
+            [(e.redcap_record_id, e.redcap_instance_id)
+             for e in exported_task_redcaps],
+            [("123", 1), ("123", 2)]
+        )
+
+    def test_existing_records_refetched_after_error(self) -> None:
+        from camcops_server.cc_modules.cc_exportmodels import (
+            ExportedTask,
+            ExportedTaskRedcap,
+        )
+
+        exporter = MockRedcapTaskExporter()
+        project = exporter.get_project()
+        project.export_records.return_value = DataFrame({"patient_id": []})
+        project.import_records.side_effect = redcap.RedcapError(
+            "Something went wrong"
+        )
+        project.export_project_info.return_value = {
+            "record_autonumbering_enabled": 1
+        }
+
+        exported_task_redcap1 = ExportedTaskRedcap(
+            ExportedTask(task=self.task1, recipient=self.recipient)
+        )
+        with self.assertRaises(RedcapExportException):
+            exporter.export_task(self.req, exported_task_redcap1)
+        self.assertNotIn(self.recipient.recipient_name,
+                         self.req.redcap_record_caches)
+
+        project.export_records.return_value = DataFrame({
+            "record_id": ["123"],
+            "patient_id": [555],
+            "redcap_repeat_instrument": ["bmi"],
+            "redcap_repeat_instance": [1],
+        })
+        project.import_records.side_effect = None
+        project.import_records.return_value = ["1"]
+
+        exported_task_redcap2 = ExportedTaskRedcap(
+            ExportedTask(task=self.task2, recipient=self.recipient)
+        )
+        exporter.export_task(self.req, exported_task_redcap2)
+
+        self.assertEqual(project.export_records.call_count, 2)
+        self.assertEqual(exported_task_redcap2.redcap_record_id, "123")
+        self.assertEqual(exported_task_redcap2.redcap_instance_id, 2)
+
 
 class Phq9RedcapExportTests(RedcapExportTestCase):
     """
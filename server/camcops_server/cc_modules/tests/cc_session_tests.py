@@ -26,9 +26,19 @@ camcops_server/cc_modules/tests/cc_session_tests.py
 
 """
 
+import datetime
+from types import SimpleNamespace
+from typing import Optional
+from unittest import mock, TestCase
+
 from pendulum import DateTime as Pendulum
 
-from camcops_server.cc_modules.cc_session import CamcopsSession, generate_token
+from camcops_server.cc_modules.cc_session import (
+    CamcopsSession,
+    CLIENT_API_LOGIN_CACHE,
+    ClientApiLoginCache,
+    generate_token,
+)
 from camcops_server.cc_modules.cc_taskfilter import TaskFilter
 from camcops_server.cc_modules.cc_unittest import DemoDatabaseTestCase
 from camcops_server.cc_modules.cc_user import User
@@ -74,3 +84,127 @@ class SessionTests(DemoDatabaseTestCase):
         assert numfilters == 0, (
             "TaskFilter count should be 0; cascade delete not working"
         )
+
+
+class SessionActivityTests(DemoDatabaseTestCase):
+    """
+    Unit tests for coalescing writes of ``last_activity_utc``.
+    """
+    def test_activity_recorded_only_after_interval(self) -> None:
+        s = CamcopsSession(ip_addr="127.0.0.1")
+        self.assertTrue(s.activity_needs_recording(self.req))
+
+        now = self.req.now_utc_no_tzinfo
+        with mock.patch.object(self.req.config,
+                               "session_activity_write_interval_s", 60):
+            s.last_activity_utc = now - datetime.timedelta(seconds=10)
+            self.assertFalse(s.activity_needs_recording(self.req))
+            s.last_activity_utc = now - datetime.timedelta(seconds=61)
+            self.assertTrue(s.activity_needs_recording(self.req))
+            s.last_activity_utc = self.req.now_utc  # timezone-aware
+            self.assertFalse(s.activity_needs_recording(self.req))
+
+        with mock.patch.object(self.req.config,
+                               "session_activity_write_interval_s", 0):
+            s.last_activity_utc = now
+            self.assertTrue(s.activity_needs_recording(self.req))
+
+
+class ClientApiLoginCacheTests(TestCase):
+    """
+    Unit tests for :class:`ClientApiLoginCache`.
+    """
+    def setUp(self) -> None:
+        super().setUp()
+        self.cache = ClientApiLoginCache()
+
+    def test_verified_only_for_same_credentials(self) -> None:
+        self.cache.add("alice", "1.2.3.4", "secret", "hash1",
+                       ttl_s=60, max_size=10)
+        self.assertTrue(
+            self.cache.is_verified("alice", "1.2.3.4", "secret", "hash1"))
+        self.assertFalse(
+            self.cache.is_verified("alice", "1.2.3.4", "wrong", "hash1"))
+        self.assertFalse(
+            self.cache.is_verified("alice", "5.6.7.8", "secret", "hash1"))
+        self.assertFalse(
+            self.cache.is_verified("bob", "1.2.3.4", "secret", "hash1"))
+        # Password changed since verification:
+        self.assertFalse(
+            self.cache.is_verified("alice", "1.2.3.4", "secret", "hash2"))
+
+    def test_entries_expire(self) -> None:
+        with mock.patch("camcops_server.cc_modules.cc_session.time."
+                        "monotonic", return_value=1000.0):
+            self.cache.add("alice", "1.2.3.4", "secret", "hash1",
+                           ttl_s=60, max_size=10)
+        with mock.patch("camcops_server.cc_modules.cc_session.time."
+                        "monotonic", return_value=1061.0):
+            self.assertFalse(
+                self.cache.is_verified("alice", "1.2.3.4", "secret", "hash1"))
+
+    def test_size_is_bounded(self) -> None:
+        for i in range(5):
+            self.cache.add(f"user{i}", "1.2.3.4", "secret", "hash",
+                           ttl_s=60, max_size=3)
+        self.assertFalse(
+            self.cache.is_verified("user0", "1.2.3.4", "secret", "hash"))
+        self.assertTrue(
+            self.cache.is_verified("user4", "1.2.3.4", "secret", "hash"))
+
+    def test_disabled_by_zero_size(self) -> None:
+        self.cache.add("alice", "1.2.3.4", "secret", "hash1",
+                       ttl_s=60, max_size=0)
+        self.assertFalse(
+            self.cache.is_verified("alice", "1.2.3.4", "secret", "hash1"))
+
+
+class ClientApiLoginTests(DemoDatabaseTestCase):
+    """
+    Unit tests for client API logins via :class:`ClientApiLoginCache`.
+    """
+    def setUp(self) -> None:
+        super().setUp()
+        CLIENT_API_LOGIN_CACHE.clear()
+        self.user = User()
+        self.user.username = "api_login_test_user"
+        self.user.set_password(self.req, "correct horse")
+        self.dbsession.add(self.user)
+        self.dbsession.flush()
+
+    def tearDown(self) -> None:
+        CLIENT_API_LOGIN_CACHE.clear()
+        super().tearDown()
+
+    def _login(self, password: str) -> Optional[User]:
+        # noinspection PyTypeChecker
+        ts = SimpleNamespace(req=self.req, username=self.user.username,
+                             password=password)
+        # noinspection PyProtectedMember
+        return CamcopsSession._get_user_for_api_login(ts)
+
+    def test_repeated_login_checks_password_once(self) -> None:
+        with mock.patch.object(self.user, "is_password_correct",
+                               wraps=self.user.is_password_correct) as check:
+            for _ in range(3):
+                self.assertIs(self._login("correct horse"), self.user)
+            self.assertEqual(check.call_count, 1)
+
+            self.assertIsNone(self._login("wrong"))
+            self.assertEqual(check.call_count, 2)
+
+    def test_password_change_invalidates(self) -> None:
+        self.assertIs(self._login("correct horse"), self.user)
+        self.user.set_password(self.req, "battery staple")
+        self.assertIsNone(self._login("correct horse"))
+        self.assertIs(self._login("battery staple"), self.user)
+
+    def test_cache_can_be_disabled(self) -> None:
+        with mock.patch.object(self.req.config,
+                               "client_api_login_cache_size", 0):
+            with mock.patch.object(
+                    self.user, "is_password_correct",
+                    wraps=self.user.is_password_correct) as check:
+                self._login("correct horse")
+                self._login("correct horse")
+                self.assertEqual(check.call_count, 2)
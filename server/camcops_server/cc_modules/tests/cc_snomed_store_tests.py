@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+
+"""
+camcops_server/cc_modules/tests/cc_snomed_store_tests.py
+
+===============================================================================
+
+    Copyright (C) 2012-2020 Rudolf Cardinal (rudolf@pobox.com).
+
+    This file is part of CamCOPS.
+
+    CamCOPS is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    CamCOPS is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with CamCOPS. If not, see <http://www.gnu.org/licenses/>.
+
+===============================================================================
+
+"""
+
+import os
+import shutil
+import tempfile
+from unittest import mock
+
+from camcops_server.cc_modules.cc_snomed import (
+    CLIENT_ICD10_CODES,
+    get_all_task_snomed_concepts,
+    get_icd10_snomed_concepts_from_xml,
+    SnomedConcept,
+    VALID_SNOMED_LOOKUPS,
+    write_snomed_concepts_to_xml,
+)
+from camcops_server.cc_modules.cc_snomed_store import (
+    compile_snomed_store,
+    get_snomed_concepts,
+    open_snomed_store,
+    snomed_store_filename,
+    SnomedConceptStore,
+    SnomedStoreKind,
+)
+from camcops_server.cc_modules.cc_unittest import ExtendedTestCase
+
+
+# =============================================================================
+# Unit tests
+# =============================================================================
+
+class SnomedStoreTests(ExtendedTestCase):
+    """
+    Tests for compiling and reading SNOMED-CT stores.
+    """
+    def setUp(self) -> None:
+        super().setUp()
+        self.tempdir = tempfile.mkdtemp()
+
+        self.task_xml = os.path.join(self.tempdir, "tasks.xml")
+        write_snomed_concepts_to_xml(self.task_xml, {
+            lookup: [SnomedConcept(100000 + i, f"Term for {lookup}")]
+            for i, lookup in enumerate(sorted(VALID_SNOMED_LOOKUPS))
+        })
+
+        self.icd10_codes = sorted(CLIENT_ICD10_CODES)[:3]
+        self.icd10_xml = os.path.join(self.tempdir, "icd10.xml")
+        write_snomed_concepts_to_xml(self.icd10_xml, {
+            self.icd10_codes[0]: [SnomedConcept(100001, "one"),
+                                  SnomedConcept(100002, "two")],
+            self.icd10_codes[1]: [SnomedConcept(100003, "three")],
+            self.icd10_codes[2]: [SnomedConcept(100004, "")],
+            "not_a_camcops_code": [SnomedConcept(100005, "five")],
+        })
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.tempdir)
+        super().tearDown()
+
+    def assert_same_concepts(self, a: SnomedConcept,
+                             b: SnomedConcept) -> None:
+        self.assertEqual((a.identifier, a.term), (b.identifier, b.term))
+
+    def test_task_store_matches_xml(self) -> None:
+        self.assertIsNone(open_snomed_store(self.task_xml,
+                                            SnomedStoreKind.TASK))
+        compile_snomed_store(self.task_xml, SnomedStoreKind.TASK)
+        store = open_snomed_store(self.task_xml, SnomedStoreKind.TASK)
+        self.assertIsInstance(store, SnomedConceptStore)
+        xml_concepts = get_all_task_snomed_concepts(self.task_xml)
+        self.assertEqual(len(store), len(xml_concepts))
+        self.assertEqual(sorted(store), sorted(xml_concepts))
+        for lookup, concept in xml_concepts.items():
+            self.assert_same_concepts(store[lookup], concept)
+        with self.assertRaises(KeyError):
+            _ = store["no_such_lookup"]
+
+    def test_icd_store_matches_xml(self) -> None:
+        compile_snomed_store(self.icd10_xml, SnomedStoreKind.ICD10)
+        store = get_snomed_concepts(self.icd10_xml, SnomedStoreKind.ICD10)
+        self.assertIsInstance(store, SnomedConceptStore)
+        xml_concepts = get_icd10_snomed_concepts_from_xml(self.icd10_xml)
+        self.assertEqual(sorted(store), sorted(self.icd10_codes))
+        self.assertEqual(sorted(store), sorted(xml_concepts))
+        for code, concepts in xml_concepts.items():
+            self.assertEqual(len(store[code]), len(concepts))
+            for a, b in zip(store[code], concepts):
+                self.assert_same_concepts(a, b)
+        self.assertNotIn("not_a_camcops_code", store)
+
+    def test_new_connection_after_fork(self) -> None:
+        compile_snomed_store(self.icd10_xml, SnomedStoreKind.ICD10)
+        store = open_snomed_store(self.icd10_xml, SnomedStoreKind.ICD10)
+        # noinspection PyProtectedMember
+        conn = store._connection()
+        with mock.patch("os.getpid", return_value=os.getpid() + 1):
+            # noinspection PyProtectedMember
+            self.assertIsNot(store._connection(), conn)
+            self.assertEqual(store[self.icd10_codes[1]][0].identifier,
+                             100003)
+
+    def test_out_of_date_store_is_ignored(self) -> None:
+        compile_snomed_store(self.icd10_xml, SnomedStoreKind.ICD10)
+        self.assertTrue(os.path.isfile(snomed_store_filename(self.icd10_xml)))
+        # Wrong kind:
+        self.assertIsNone(open_snomed_store(self.icd10_xml,
+                                            SnomedStoreKind.ICD9CM))
+        # XML changed since compilation:
+        with open(self.icd10_xml, "a") as f:
+            f.write("\n")
+        self.assertIsNone(open_snomed_store(self.icd10_xml,
+                                            SnomedStoreKind.ICD10))
+
+    def test_invalid_xml_is_not_compiled(self) -> None:
+        bad_xml = os.path.join(self.tempdir, "bad_tasks.xml")
+        write_snomed_concepts_to_xml(bad_xml, {
+            "phq9_scale": [SnomedConcept(100001, "PHQ-9")],
+        })
+        with self.assertRaises(ValueError):
+            compile_snomed_store(bad_xml, SnomedStoreKind.TASK)
+        self.assertEqual(sorted(os.listdir(self.tempdir)),
+                         ["bad_tasks.xml", "icd10.xml", "tasks.xml"])
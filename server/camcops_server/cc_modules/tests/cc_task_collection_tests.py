@@ -26,14 +26,22 @@ camcops_server/cc_modules/tests/cc_taskcollection_tests.py
 
 """
 
+from typing import List, Tuple
+from unittest import mock
+
 from kombu.serialization import dumps, loads
+from camcops_server.cc_modules import cc_taskcollection
 from camcops_server.cc_modules.cc_taskcollection import (
     TaskCollection,
     TaskSortMethod,
 )
 
 from camcops_server.cc_modules.cc_taskfilter import TaskFilter
-from camcops_server.cc_modules.cc_unittest import DemoDatabaseTestCase
+from camcops_server.cc_modules.cc_unittest import (
+    DemoDatabaseTestCase,
+    DemoFileDatabaseTestCase,
+)
+from camcops_server.tasks.phq9 import Phq9
 
 
 # =============================================================================
@@ -65,3 +73,83 @@ class TaskCollectionTests(DemoDatabaseTestCase):
                          ['task1', 'task2', 'task3'])
         self.assertEqual(new_coll._filter.group_ids,
                          [1, 2, 3])
+
+
+class TaskCollectionParallelFetchTests(DemoDatabaseTestCase):
+    def test_debugging_session_fetches_serially(self) -> None:
+        # Worker sessions could not see the data in our (uncommitted)
+        # debugging session, so we don't use them, even if configured to; see
+        # TaskCollectionWorkerFetchTests for the parallel path.
+        self.announce("test_debugging_session_fetches_serially")
+        self.assertFalse(self.req.may_use_worker_dbsessions)
+        taskfilter = TaskFilter()
+        taskfilter.task_types = ["bmi", "phq9"]
+        coll = TaskCollection(
+            self.req,
+            taskfilter=taskfilter,
+            via_index=False,
+            sort_method_global=TaskSortMethod.CREATION_DATE_ASC,
+        )
+        # The config is cached, so patch it rather than overriding settings.
+        with mock.patch.object(self.req.config, "task_fetch_threads", 4):
+            with mock.patch.object(cc_taskcollection,
+                                   "fetch_tasks_detached") as mock_fetch:
+                tasks = coll.all_tasks
+        mock_fetch.assert_not_called()
+        self.assertEqual(
+            sorted((t.tablename, t.id) for t in tasks),
+            [("bmi", 1), ("bmi", 2), ("phq9", 1), ("phq9", 2)]
+        )
+
+
+class TaskCollectionWorkerFetchTests(DemoFileDatabaseTestCase):
+    """
+    Tests of fetching tasks via worker threads, each with its own database
+    session, which needs a database that those sessions can see.
+    """
+    def fetch_all_tasks(self, n_threads: int) -> List[Tuple[str, int, int]]:
+        taskfilter = TaskFilter()
+        taskfilter.task_types = ["ace3", "bmi", "diagnosis_icd10", "phq9",
+                                 "photo"]
+        coll = TaskCollection(
+            self.req,
+            taskfilter=taskfilter,
+            via_index=False,
+            sort_method_global=TaskSortMethod.CREATION_DATE_ASC,
+        )
+        with mock.patch.object(self.req.config, "task_fetch_threads",
+                               n_threads):
+            tasks = coll.all_tasks
+        for task in tasks:
+            # Merged tasks must be in our session, so that lazy loading works.
+            self.assertIn(task, self.dbsession)
+        return sorted(
+            (task.tablename, task.id,
+             task.patient.id if task.has_patient else None)
+            for task in tasks
+        )
+
+    def test_worker_fetch_matches_serial_fetch(self) -> None:
+        self.assertTrue(self.req.may_use_worker_dbsessions)
+        serial = self.fetch_all_tasks(1)
+        self.dbsession.expunge_all()
+        with mock.patch.object(
+                cc_taskcollection, "fetch_tasks_detached",
+                wraps=cc_taskcollection.fetch_tasks_detached) as mock_fetch:
+            parallel = self.fetch_all_tasks(4)
+        self.assertTrue(mock_fetch.called)
+        self.assertEqual(parallel, serial)
+        self.assertIn(("phq9", 2, 2), parallel)
+
+    def test_no_worker_fetch_with_uncommitted_changes(self) -> None:
+        self.assertTrue(self.req.may_use_worker_dbsessions)
+        task = self.dbsession.query(Phq9).filter(Phq9.id == 1).one()
+        task.q1 = 3
+        self.dbsession.flush()
+        self.assertFalse(self.req.may_use_worker_dbsessions)
+        with mock.patch.object(cc_taskcollection,
+                               "fetch_tasks_detached") as mock_fetch:
+            self.fetch_all_tasks(4)
+        mock_fetch.assert_not_called()
+        self.dbsession.rollback()
+        self.assertTrue(self.req.may_use_worker_dbsessions)
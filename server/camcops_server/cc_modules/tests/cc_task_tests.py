@@ -27,11 +27,16 @@ camcops_server/cc_modules/tests/cc_task_tests.py
 """
 
 import logging
+from unittest import mock
 
 from cardinal_pythonlib.logs import BraceStyleAdapter
 from pendulum import Date, DateTime as Pendulum
 
-from camcops_server.cc_modules.cc_task import Task
+from camcops_server.cc_modules.cc_task import (
+    clear_memoized_task_results,
+    Task,
+    uses_memoized_results,
+)
 from camcops_server.cc_modules.cc_unittest import DemoDatabaseTestCase
 from camcops_server.cc_modules.cc_validators import (
     validate_task_tablename,
@@ -211,3 +216,77 @@ class TaskTests(DemoDatabaseTestCase):
             t.manually_erase(req)
             self.assertTrue(t.is_erased())
             t.delete_entirely(req)
+
+
+class MemoizedTaskResultTests(DemoDatabaseTestCase):
+    """
+    Unit tests for :func:`memoize_task_result`.
+    """
+    def setUp(self) -> None:
+        super().setUp()
+        from camcops_server.tasks.cisr import Cisr
+        self.task = self.dbsession.query(Cisr).first()  # type: Cisr
+        self.next_q = mock.patch.object(Cisr, "next_q", autospec=True,
+                                        side_effect=Cisr.next_q)
+
+    def test_result_computed_once(self) -> None:
+        self.announce("test_result_computed_once")
+        with self.next_q as mock_next_q:
+            complete = self.task.is_complete()
+            n_calls = mock_next_q.call_count
+            self.assertGreater(n_calls, 0)
+
+            self.assertEqual(self.task.is_complete(), complete)
+            self.task.get_summaries(self.req)
+            self.task.get_clinical_text(self.req)
+            self.assertEqual(mock_next_q.call_count, n_calls)
+
+    def test_result_recomputed_after_column_set(self) -> None:
+        self.announce("test_result_recomputed_after_column_set")
+        with self.next_q as mock_next_q:
+            self.task.is_complete()
+            n_calls = mock_next_q.call_count
+
+            self.task.appetite1 = 1
+            self.task.is_complete()
+            self.assertGreater(mock_next_q.call_count, n_calls)
+
+    def test_result_recomputed_after_expiry(self) -> None:
+        self.announce("test_result_recomputed_after_expiry")
+        with self.next_q as mock_next_q:
+            self.task.is_complete()
+            n_calls = mock_next_q.call_count
+
+            self.dbsession.expire(self.task)
+            self.task.is_complete()
+            self.assertGreater(mock_next_q.call_count, n_calls)
+
+    def test_ancillary_changes_need_explicit_clear(self) -> None:
+        self.announce("test_ancillary_changes_need_explicit_clear")
+        from camcops_server.tasks.cardinal_expectationdetection import (
+            CardinalExpectationDetection,
+        )
+        task = self.dbsession.query(CardinalExpectationDetection).first()
+        with mock.patch.object(CardinalExpectationDetection,
+                               "get_p_detected",
+                               return_value=(None, None, None, None, 0)) \
+                as mock_get_p_detected:
+            task.get_overall_p_detect_present()
+            task.get_overall_d()
+            self.assertEqual(mock_get_p_detected.call_count, 1)
+
+            # Ancillary objects (here, trials) are treated as immutable:
+            task.trials = []
+            task.get_overall_p_detect_present()
+            self.assertEqual(mock_get_p_detected.call_count, 1)
+
+            clear_memoized_task_results(task)
+            task.get_overall_p_detect_present()
+            self.assertEqual(mock_get_p_detected.call_count, 2)
+
+    def test_memoization_is_opt_in(self) -> None:
+        self.announce("test_memoization_is_opt_in")
+        from camcops_server.tasks.cisr import Cisr
+        from camcops_server.tasks.phq9 import Phq9
+        self.assertTrue(uses_memoized_results(Cisr))
+        self.assertFalse(uses_memoized_results(Phq9))
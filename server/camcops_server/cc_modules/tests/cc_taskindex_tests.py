@@ -0,0 +1,347 @@
+#!/usr/bin/env python
+
+"""
+camcops_server/cc_modules/tests/cc_taskindex_tests.py
+
+===============================================================================
+
+    Copyright (C) 2012-2020 Rudolf Cardinal (rudolf@pobox.com).
+
+    This file is part of CamCOPS.
+
+    CamCOPS is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    CamCOPS is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with CamCOPS. If not, see <http://www.gnu.org/licenses/>.
+
+===============================================================================
+
+"""
+
+from typing import Dict, List, Tuple
+from unittest import mock
+
+from pendulum import DateTime as Pendulum
+from semantic_version import Version
+from sqlalchemy.orm import Session as SqlASession, sessionmaker
+
+from camcops_server.cc_modules import cc_taskindex
+from camcops_server.cc_modules.cc_task import Task
+from camcops_server.cc_modules.cc_taskindex import (
+    TaskIndexEntry,
+    TaskSummaryEntry,
+)
+from camcops_server.cc_modules.cc_unittest import (
+    DemoDatabaseTestCase,
+    DemoFileDatabaseTestCase,
+)
+
+
+# =============================================================================
+# Unit tests
+# =============================================================================
+
+class TaskIndexRebuildTests(DemoDatabaseTestCase):
+    """
+    Unit tests.
+
+    (:func:`camcops_server.cc_modules.cc_taskindex.reindex_everything` needs
+    a session bound to an engine, which the test session isn't, so we rebuild
+    one task type at a time.)
+    """
+    def rebuild_all_task_types(self) -> None:
+        now = Pendulum.utcnow()
+        for taskclass in Task.all_subclasses_by_tablename():
+            TaskIndexEntry.rebuild_index_for_task_type(
+                self.dbsession, taskclass, now)
+
+    def test_rebuilt_index_matches_tasks(self) -> None:
+        self.announce("test_rebuilt_index_matches_tasks")
+        # Small batches, so we exercise the batching:
+        with mock.patch("camcops_server.cc_modules.cc_taskindex."
+                        "REINDEX_BATCH_SIZE", 1):
+            self.rebuild_all_task_types()
+        self.assertTrue(TaskIndexEntry.check_index(self.dbsession))
+
+        columns = [
+            "patient_pk", "device_id", "era", "when_created_iso",
+            "when_added_batch_utc", "adding_user_id", "group_id",
+            "task_is_complete",
+        ]
+        now = Pendulum.utcnow()
+        n_tasks = 0
+        for taskclass in Task.all_subclasses_by_tablename():
+            # noinspection PyProtectedMember
+            for task in self.dbsession.query(taskclass).filter(
+                    taskclass._current == True):  # noqa: E712
+                n_tasks += 1
+                expected = TaskIndexEntry.make_from_task(task, now)
+                actual = (
+                    self.dbsession.query(TaskIndexEntry)
+                    .filter(TaskIndexEntry.task_table_name ==
+                            task.tablename)
+                    .filter(TaskIndexEntry.task_pk == task.pk)
+                    .one()
+                )
+                for column in columns:
+                    self.assertEqual(getattr(actual, column),
+                                     getattr(expected, column),
+                                     f"{task.tablename}.{column}")
+        self.assertGreater(n_tasks, 0)
+        self.assertEqual(self.dbsession.query(TaskIndexEntry).count(),
+                         n_tasks)
+
+    def test_rebuild_for_task_type_replaces_entries(self) -> None:
+        self.announce("test_rebuild_for_task_type_replaces_entries")
+        from camcops_server.tasks.phq9 import Phq9
+        self.rebuild_all_task_types()
+        n_entries = self.dbsession.query(TaskIndexEntry).count()
+
+        n_indexed = TaskIndexEntry.rebuild_index_for_task_type(
+            self.dbsession, Phq9, Pendulum.utcnow(), delete_first=True)
+
+        self.assertGreater(n_indexed, 0)
+        self.assertEqual(self.dbsession.query(TaskIndexEntry).count(),
+                         n_entries)
+        self.assertTrue(TaskIndexEntry.check_index(self.dbsession))
+
+
+class TaskIndexParallelRebuildTests(DemoFileDatabaseTestCase):
+    """
+    Tests of rebuilding the task index with worker threads, each with its own
+    database session, which needs a database that those sessions can see.
+    """
+    def setUp(self) -> None:
+        super().setUp()
+        from camcops_server.tasks.bmi import Bmi
+        from camcops_server.tasks.diagnosis import DiagnosisIcd10
+        from camcops_server.tasks.phq9 import Phq9
+        self.taskclasses = [Bmi, DiagnosisIcd10, Phq9]
+
+    def rebuild(self, jobs: int) -> Pendulum:
+        now = Pendulum.utcnow()
+        with mock.patch.object(Task, "all_subclasses_by_tablename",
+                               return_value=self.taskclasses):
+            TaskIndexEntry.rebuild_entire_task_index(self.dbsession, now,
+                                                     jobs=jobs)
+        return now
+
+    def get_index(self, session: SqlASession = None) -> List[Tuple]:
+        session = session or self.dbsession
+        return sorted(
+            (e.task_table_name, e.task_pk, e.patient_pk, e.task_is_complete)
+            for e in session.query(TaskIndexEntry)
+        )
+
+    def test_parallel_rebuild_matches_serial(self) -> None:
+        self.rebuild(jobs=1)
+        self.dbsession.commit()
+        serial = self.get_index()
+        self.assertEqual(len(serial), 2 * len(self.taskclasses))
+
+        # Small batches and a short queue, so the workers have to wait:
+        with mock.patch.multiple(cc_taskindex,
+                                 REINDEX_BATCH_SIZE=1,
+                                 REINDEX_QUEUE_SIZE_PER_JOB=1):
+            now = self.rebuild(jobs=3)
+        self.assertEqual(self.get_index(), serial)
+
+        # Until we commit, other sessions see the old index:
+        other_session = sessionmaker(bind=self.file_engine)()
+        try:
+            self.assertEqual(self.get_index(other_session), serial)
+            self.assertEqual(
+                other_session.query(TaskIndexEntry)
+                .filter(TaskIndexEntry.indexed_at_utc == now)
+                .count(),
+                0
+            )
+        finally:
+            other_session.close()
+        self.dbsession.commit()
+        self.assertEqual(
+            self.dbsession.query(TaskIndexEntry)
+            .filter(TaskIndexEntry.indexed_at_utc == now)
+            .count(),
+            len(serial)
+        )
+
+    def test_failed_parallel_rebuild_leaves_index_intact(self) -> None:
+        self.rebuild(jobs=1)
+        self.dbsession.commit()
+        before = self.get_index()
+        failing_class = self.taskclasses[-1]
+        index_values_from_task = TaskIndexEntry.index_values_from_task
+
+        def fail_for_one_task_type(task: Task,
+                                   indexed_at_utc: Pendulum) -> Dict:
+            if isinstance(task, failing_class):
+                raise ValueError("Bad task")
+            return index_values_from_task(task, indexed_at_utc)
+
+        with mock.patch.object(TaskIndexEntry, "index_values_from_task",
+                               side_effect=fail_for_one_task_type):
+            with self.assertRaises(ValueError):
+                self.rebuild(jobs=3)
+        self.dbsession.rollback()
+        self.assertEqual(self.get_index(), before)
+
+
+class TaskSummaryStoreTests(DemoDatabaseTestCase):
+    """
+    Unit tests for :class:`TaskSummaryEntry`.
+    """
+    def setUp(self) -> None:
+        super().setUp()
+        from camcops_server.tasks.phq9 import Phq9
+        # noinspection PyProtectedMember
+        self.tasks = (
+            self.dbsession.query(Phq9)
+            .filter(Phq9._current == True)  # noqa: E712
+            .order_by(Phq9._pk)
+            .all()
+        )
+        self.assertGreater(len(self.tasks), 0)
+        self.store_summaries = mock.patch.object(
+            self.req.config, "store_task_summaries", True)
+
+    def test_stored_summaries_match_calculated(self) -> None:
+        self.announce("test_stored_summaries_match_calculated")
+        n_stored = TaskSummaryEntry.store_summaries_for_tasks(
+            self.req, self.tasks, Pendulum.utcnow())
+        self.assertEqual(n_stored, len(self.tasks))
+
+        stored = TaskSummaryEntry.get_stored_summaries(
+            self.dbsession, "phq9", [t.pk for t in self.tasks],
+            language=self.req.language)
+
+        for task in self.tasks:
+            expected = task.get_summary_values(self.req)
+            self.assertEqual(list(stored[task.pk].items()),
+                             list(expected.items()))
+            self.assertIsInstance(
+                stored[task.pk]["camcops_server_version"], Version)
+
+    def test_preloaded_summaries_used(self) -> None:
+        self.announce("test_preloaded_summaries_used")
+        from camcops_server.tasks.phq9 import Phq9
+        task = self.tasks[0]
+        expected = task.get_summary_values(self.req)
+        TaskSummaryEntry.store_summaries_for_tasks(
+            self.req, [task], Pendulum.utcnow())
+
+        with self.store_summaries:
+            TaskSummaryEntry.preload_for_tasks(self.req, [task])
+
+        with mock.patch.object(Phq9, "get_summaries") as mock_get_summaries:
+            self.assertEqual(task.get_summary_values(self.req), expected)
+            page = task.get_tsv_pages(self.req)[0]
+            self.assertEqual(page.rows[0]["total"], expected["total"])
+            mock_get_summaries.assert_not_called()
+
+    def test_preload_does_nothing_if_disabled(self) -> None:
+        self.announce("test_preload_does_nothing_if_disabled")
+        TaskSummaryEntry.store_summaries_for_tasks(
+            self.req, self.tasks, Pendulum.utcnow())
+
+        with mock.patch.object(self.req.config, "store_task_summaries",
+                               False):
+            TaskSummaryEntry.preload_for_tasks(self.req, self.tasks)
+
+        self.assertEqual(self.req.stored_task_summaries, {})
+
+    def test_summaries_from_other_server_version_ignored(self) -> None:
+        self.announce("test_summaries_from_other_server_version_ignored")
+        TaskSummaryEntry.store_summaries_for_tasks(
+            self.req, self.tasks, Pendulum.utcnow())
+        # noinspection PyUnresolvedReferences
+        self.dbsession.execute(
+            TaskSummaryEntry.__table__.update()
+            .values(camcops_server_version=Version("0.0.1"))
+        )
+
+        stored = TaskSummaryEntry.get_stored_summaries(
+            self.dbsession, "phq9", [t.pk for t in self.tasks],
+            language=self.req.language)
+
+        self.assertEqual(stored, {})
+
+    def test_text_summaries_tagged_with_language(self) -> None:
+        self.announce("test_text_summaries_tagged_with_language")
+        TaskSummaryEntry.store_summaries_for_tasks(
+            self.req, self.tasks, Pendulum.utcnow())
+
+        languages = {
+            entry.language
+            for entry in self.dbsession.query(TaskSummaryEntry)
+        }
+        self.assertEqual(languages, {self.req.language})
+
+    def test_summaries_in_other_language_ignored(self) -> None:
+        self.announce("test_summaries_in_other_language_ignored")
+        TaskSummaryEntry.store_summaries_for_tasks(
+            self.req, self.tasks, Pendulum.utcnow())
+        other_language = "da-DK"
+        self.assertNotEqual(other_language, self.req.language)
+
+        stored = TaskSummaryEntry.get_stored_summaries(
+            self.dbsession, "phq9", [t.pk for t in self.tasks],
+            language=other_language)
+
+        self.assertEqual(stored, {})
+
+    def test_summaries_without_text_used_in_any_language(self) -> None:
+        self.announce("test_summaries_without_text_used_in_any_language")
+        from camcops_server.tasks.phq9 import Phq9
+        task = self.tasks[0]
+        summaries = [
+            s for s in task.get_summaries(self.req)
+            if not isinstance(s.value, str)
+        ]
+        with mock.patch.object(Phq9, "get_summaries",
+                               return_value=summaries):
+            TaskSummaryEntry.store_summaries_for_tasks(
+                self.req, [task], Pendulum.utcnow())
+
+        stored = TaskSummaryEntry.get_stored_summaries(
+            self.dbsession, "phq9", [task.pk], language="da-DK")
+
+        self.assertEqual(list(stored[task.pk].keys()),
+                         [s.name for s in summaries])
+
+    def test_delete_summaries_for_task(self) -> None:
+        self.announce("test_delete_summaries_for_task")
+        TaskSummaryEntry.store_summaries_for_tasks(
+            self.req, self.tasks, Pendulum.utcnow())
+
+        TaskSummaryEntry.delete_summaries_for_task(self.tasks[0],
+                                                   self.dbsession)
+
+        stored = TaskSummaryEntry.get_stored_summaries(
+            self.dbsession, "phq9", [t.pk for t in self.tasks],
+            language=self.req.language)
+        self.assertNotIn(self.tasks[0].pk, stored)
+        self.assertEqual(len(stored), len(self.tasks) - 1)
+
+    def test_rebuild_summary_store(self) -> None:
+        self.announce("test_rebuild_summary_store")
+        TaskSummaryEntry.rebuild_summary_store(self.req)
+
+        n_tasks = 0
+        for taskclass in Task.all_subclasses_by_tablename():
+            # noinspection PyProtectedMember
+            n_tasks += (
+                self.dbsession.query(taskclass)
+                .filter(taskclass._current == True)  # noqa: E712
+                .count()
+            )
+        self.assertEqual(self.dbsession.query(TaskSummaryEntry).count(),
+                         n_tasks)
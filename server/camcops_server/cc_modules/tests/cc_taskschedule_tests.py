@@ -26,12 +26,20 @@ camcops_server/cc_modules/tests/cc_taskschedule_tests.py
 
 """
 
+from typing import List, Tuple, TYPE_CHECKING
+from unittest import mock
 from urllib.parse import urlencode
 
-from pendulum import Duration
+from pendulum import DateTime as Pendulum, Duration, local
 
 from camcops_server.cc_modules.cc_pyramid import Routes
+from camcops_server.cc_modules.cc_taskcollection import TaskCollection
+from camcops_server.cc_modules.cc_taskindex import (
+    PatientIdNumIndexEntry,
+    TaskIndexEntry,
+)
 from camcops_server.cc_modules.cc_taskschedule import (
+    get_scheduled_tasks_for_patient_task_schedules,
     PatientTaskSchedule,
     TaskSchedule,
     TaskScheduleItem,
@@ -40,6 +48,10 @@ from camcops_server.cc_modules.cc_unittest import (
     DemoDatabaseTestCase,
     DemoRequestTestCase,
 )
+from camcops_server.cc_modules.client_api import TEST_NHS_NUMBER
+
+if TYPE_CHECKING:
+    from camcops_server.tasks.bmi import Bmi
 
 
 # =============================================================================
@@ -147,3 +159,109 @@ class PatientTaskScheduleTests(DemoDatabaseTestCase):
 
         with self.assertRaises(KeyError):
             self.pts.mailto_url(self.req)
+
+
+class ScheduledTaskResolutionTests(DemoDatabaseTestCase):
+    def create_tasks(self) -> None:
+        # Speed things up a bit
+        pass
+
+    def create_schedule(self, items: List[Tuple[str, int, int]]) \
+            -> TaskSchedule:
+        schedule = TaskSchedule()
+        schedule.group_id = self.group.id
+        self.dbsession.add(schedule)
+        self.dbsession.flush()
+        for tablename, due_from_days, due_by_days in items:
+            item = TaskScheduleItem()
+            item.schedule_id = schedule.id
+            item.task_table_name = tablename
+            item.due_from = Duration(days=due_from_days)
+            item.due_by = Duration(days=due_by_days)
+            self.dbsession.add(item)
+        self.dbsession.flush()
+        return schedule
+
+    def create_bmi(self, bmi_id: int, patient_id: int,
+                   when_created: Pendulum) -> "Bmi":
+        from camcops_server.tasks.bmi import Bmi
+        bmi = Bmi()
+        self.apply_standard_task_fields(bmi)
+        bmi.id = bmi_id
+        bmi.patient_id = patient_id
+        bmi.when_created = when_created
+        self.dbsession.add(bmi)
+        self.dbsession.flush()
+        TaskIndexEntry.index_task(bmi, self.dbsession,
+                                  indexed_at_utc=Pendulum.utcnow())
+        return bmi
+
+    def test_tasks_assigned_to_schedule_windows(self) -> None:
+        patient = self.create_patient()
+        idnum = self.create_patient_idnum(
+            patient_id=patient.id,
+            which_idnum=self.nhs_iddef.which_idnum,
+            idnum_value=TEST_NHS_NUMBER
+        )
+        PatientIdNumIndexEntry.index_idnum(idnum, self.dbsession)
+        server_patient = self.create_patient(as_server_patient=True)
+        self.create_patient_idnum(
+            patient_id=server_patient.id,
+            which_idnum=self.nhs_iddef.which_idnum,
+            idnum_value=TEST_NHS_NUMBER,
+            as_server_patient=True
+        )
+
+        schedule1 = self.create_schedule([
+            ("bmi", 0, 7),
+            ("phq9", 0, 7),
+            ("bmi", 30, 37),
+            ("bmi", 60, 67),
+        ])
+        schedule2 = self.create_schedule([
+            ("bmi", 0, 100),
+        ])
+        pts_list = []
+        for schedule in (schedule1, schedule2):
+            pts = PatientTaskSchedule()
+            pts.patient_pk = server_patient.pk
+            pts.schedule_id = schedule.id
+            pts.start_datetime = local(2020, 7, 31)
+            self.dbsession.add(pts)
+            pts_list.append(pts)
+        unstarted_pts = PatientTaskSchedule()
+        unstarted_pts.patient_pk = server_patient.pk
+        unstarted_pts.schedule_id = schedule1.id
+        self.dbsession.add(unstarted_pts)
+        pts_list.append(unstarted_pts)
+        self.dbsession.flush()
+
+        self.create_bmi(1, patient.id, local(2020, 8, 1))
+        bmi_week_1 = self.create_bmi(2, patient.id, local(2020, 8, 2))
+        bmi_week_5 = self.create_bmi(3, patient.id, local(2020, 8, 31))
+        self.create_bmi(4, patient.id, local(2020, 12, 25))  # too late
+        self.dbsession.commit()
+
+        with mock.patch(
+                "camcops_server.cc_modules.cc_taskschedule.TaskCollection",
+                wraps=TaskCollection) as mock_collection:
+            results = get_scheduled_tasks_for_patient_task_schedules(
+                self.req, pts_list)
+
+        # One task collection for the patient, not one per scheduled task
+        mock_collection.assert_called_once()
+
+        self.assertEqual(len(results), 3)
+        self.assertEqual([info.task for info in results[0]],
+                         [bmi_week_1, None, bmi_week_5, None])
+        self.assertEqual([info.shortname for info in results[0]],
+                         ["BMI", "PHQ-9", "BMI", "BMI"])
+        self.assertEqual(results[0][2].start_datetime, local(2020, 8, 30))
+        self.assertEqual(results[0][2].end_datetime, local(2020, 9, 6))
+        self.assertEqual([info.task for info in results[1]], [bmi_week_5])
+        self.assertEqual([info.task for info in results[2]],
+                         [None, None, None, None])
+        self.assertIsNone(results[2][0].start_datetime)
+
+        self.assertEqual(pts_list[0].get_list_of_scheduled_tasks(self.req)[0]
+                         .task, bmi_week_1)
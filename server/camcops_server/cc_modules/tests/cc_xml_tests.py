@@ -0,0 +1,245 @@
+#!/usr/bin/env python
+
+"""
+camcops_server/cc_modules/tests/cc_xml_tests.py
+
+===============================================================================
+
+    Copyright (C) 2012-2020 Rudolf Cardinal (rudolf@pobox.com).
+
+    This file is part of CamCOPS.
+
+    CamCOPS is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    CamCOPS is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with CamCOPS. If not, see <http://www.gnu.org/licenses/>.
+
+===============================================================================
+
+"""
+
+from typing import List, Union
+
+from camcops_server.cc_modules.cc_simpleobjects import (
+    TaskExportOptions,
+    XmlSimpleValue,
+)
+from camcops_server.cc_modules.cc_task import Task
+from camcops_server.cc_modules.cc_unittest import (
+    DemoDatabaseTestCase,
+    ExtendedTestCase,
+)
+from camcops_server.cc_modules.cc_xml import (
+    gen_encoded_chunks,
+    gen_xml_tree,
+    get_xml_blob_element,
+    get_xml_document,
+    get_xml_tree,
+    xml_escape_value,
+    xml_header,
+    xml_quote_attribute,
+    XML_IGNORE_NAMESPACES,
+    XML_NAMESPACES,
+    XmlDataTypes,
+    XmlElement,
+    XmlLiteral,
+)
+
+
+# =============================================================================
+# Reference implementation
+# =============================================================================
+
+def legacy_get_xml_tree(
+        element: Union[XmlElement, XmlSimpleValue,
+                       List[Union[XmlElement, XmlSimpleValue]]],
+        level: int = 0,
+        indent_spaces: int = 4,
+        eol: str = '\n',
+        include_comments: bool = False) -> str:
+    """
+    The original (recursive string concatenation) version of
+    :func:`get_xml_tree`, as a reference.
+    """
+    xmltext = ""
+    prefix = ' ' * level * indent_spaces
+
+    if isinstance(element, XmlElement):
+
+        if element.literal:
+            # A user-inserted piece of XML. Insert, but indent.
+            xmltext += prefix + element.literal + eol
+
+        else:
+
+            # Attributes
+            namespaces = []
+            if level == 0:  # root
+                # Apply namespace to root element (will inherit):
+                namespaces.extend(XML_NAMESPACES)
+                if include_comments:
+                    namespaces.extend(XML_IGNORE_NAMESPACES)
+            namespace = " ".join(namespaces)
+            if element.datatype:
+                dt = f' xsi:type="{element.datatype}"'
+            else:
+                # log.warning("XmlElement has no datatype: {!r}", element)
+                dt = ""
+            cmt = ""
+            if include_comments and element.comment:
+                cmt = f' ignore:comment={xml_quote_attribute(element.comment)}'
+            attributes = f"{namespace}{dt}{cmt}"
+
+            # Assemble
+            if element.value is None:
+                # NULL handling
+                xmltext += (
+                    f'{prefix}<{element.name}{attributes} '
+                    f'xsi:nil="true"/>{eol}'
+                )
+            else:
+                complex_value = isinstance(element.value, XmlElement) \
+                    or isinstance(element.value, list)
+                value_to_recurse = element.value if complex_value else \
+                    XmlSimpleValue(element.value)
+                # ... XmlSimpleValue is a marker that subsequently
+                # distinguishes things that were part of an XmlElement from
+                # user-inserted raw XML.
+                nl = eol if complex_value else ""
+                pr2 = prefix if complex_value else ""
+                v = legacy_get_xml_tree(
+                    value_to_recurse,
+                    level=level + 1,
+                    indent_spaces=indent_spaces,
+                    eol=eol,
+                    include_comments=include_comments
+                )
+                xmltext += (
+                    f'{prefix}<{element.name}{attributes}>{nl}'
+                    f'{v}{pr2}</{element.name}>{eol}'
+                )
+
+    elif isinstance(element, list):
+        for subelement in element:
+            xmltext += legacy_get_xml_tree(subelement, level,
+                                           indent_spaces=indent_spaces,
+                                           eol=eol,
+                                           include_comments=include_comments)
+        # recursive
+
+    elif isinstance(element, XmlSimpleValue):
+        # The lowest-level thing a value. No extra indent.
+        xmltext += xml_escape_value(str(element.value))
+
+    else:
+        raise ValueError(f"Bad value to get_xml_tree: {element!r}")
+
+    return xmltext
+
+
+# =============================================================================
+# Unit tests
+# =============================================================================
+
+class XmlTreeTests(ExtendedTestCase):
+    """
+    Tests that the chunked XML writer produces exactly what the original
+    implementation did.
+    """
+    @staticmethod
+    def make_tree() -> XmlElement:
+        return XmlElement(
+            name="root",
+            comment="Root & <comment>",
+            value=[
+                XmlElement(name="a", value=1, datatype=XmlDataTypes.INTEGER,
+                           comment='A "quoted" comment'),
+                XmlElement(name="b", value="x < y & z > 'w'",
+                           datatype=XmlDataTypes.STRING),
+                XmlElement(name="c", value=None, comment="null"),
+                XmlElement(name="d", value=XmlElement(
+                    name="e",
+                    value=[
+                        XmlElement(name="f", value=True,
+                                   datatype=XmlDataTypes.BOOLEAN),
+                        XmlElement(name="g", value=[]),
+                    ]
+                )),
+                XmlLiteral("<literal>raw &amp; indented</literal>"),
+                get_xml_blob_element("blob", b"\x00\x01binary\xff" * 100,
+                                     comment="BLOB"),
+                get_xml_blob_element("empty_blob", None),
+                XmlElement(name="unicode", value="\u00e9\u2603"),
+            ]
+        )
+
+    def test_matches_original(self) -> None:
+        tree = self.make_tree()
+        for include_comments in (False, True):
+            for indent_spaces, eol in ((4, "\n"), (0, ""), (2, "\r\n")):
+                expected = legacy_get_xml_tree(
+                    tree, indent_spaces=indent_spaces, eol=eol,
+                    include_comments=include_comments)
+                kwargs = dict(indent_spaces=indent_spaces, eol=eol,
+                              include_comments=include_comments)
+                self.assertEqual(get_xml_tree(tree, **kwargs), expected)
+                self.assertEqual("".join(gen_xml_tree(tree, **kwargs)),
+                                 expected)
+                self.assertEqual(get_xml_document(tree, **kwargs),
+                                 xml_header(eol) + expected)
+
+    def test_writes_in_chunks(self) -> None:
+        chunks = list(gen_xml_tree(self.make_tree()))
+        self.assertGreater(len(chunks), 10)
+
+    def test_bad_value(self) -> None:
+        with self.assertRaises(ValueError):
+            get_xml_tree(XmlElement(name="x", value=[object()]))
+
+    def test_gen_encoded_chunks(self) -> None:
+        chunks = ["a" * 10, "\u00e9" * 10, "b" * 5, "c"]
+        encoded = list(gen_encoded_chunks(chunks, min_chunk_size=20))
+        self.assertEqual(encoded, [
+            ("a" * 10 + "\u00e9" * 10).encode("utf-8"),
+            ("b" * 5 + "c").encode("utf-8"),
+        ])
+        self.assertEqual(list(gen_encoded_chunks([])), [])
+
+
+class TaskXmlTests(DemoDatabaseTestCase):
+    """
+    Tests that task XML is unchanged by the chunked XML writer.
+    """
+    def test_task_xml_matches_original(self) -> None:
+        options = TaskExportOptions(
+            xml_include_ancillary=True,
+            include_blobs=True,
+            xml_include_comments=True,
+            xml_include_calculated=True,
+            xml_include_patient=True,
+            xml_include_plain_columns=True,
+            xml_include_snomed=True,
+            xml_with_header_comments=True,
+        )
+        n_tested = 0
+        for cls in Task.all_subclasses_by_tablename():
+            task = self.dbsession.query(cls).first()  # type: Task
+            if task is None:
+                continue
+            n_tested += 1
+            with self.subTest(task=cls.tablename):
+                expected = xml_header() + legacy_get_xml_tree(
+                    task.get_xml_root(self.req, options),
+                    include_comments=True)
+                self.assertEqual(task.get_xml(self.req, options), expected)
+                self.assertEqual(
+                    "".join(task.gen_xml(self.req, options)), expected)
+        self.assertGreater(n_tested, 0)
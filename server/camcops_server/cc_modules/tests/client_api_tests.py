@@ -26,9 +26,13 @@ camcops_server/cc_modules/tests/client_api_tests.py
 
 """
 
+import gzip
 import json
+import logging
 # from pprint import pformat
 import string
+from typing import Dict, List
+from unittest import mock
 
 from cardinal_pythonlib.convert import (
     base64_64format_encode,
@@ -36,6 +40,8 @@ from cardinal_pythonlib.convert import (
 )
 from cardinal_pythonlib.sql.literals import sql_quote_string
 from cardinal_pythonlib.text import escape_newlines, unescape_newlines
+from sqlalchemy.event.api import listen, remove
+from sqlalchemy.sql.sqltypes import Integer
 
 from camcops_server.cc_modules.cc_client_api_core import (
     fail_server_error,
@@ -45,18 +51,32 @@ from camcops_server.cc_modules.cc_client_api_core import (
     TabletParam,
     UserErrorException,
 )
+from camcops_server.cc_modules.cc_client_api_timing import (
+    CLIENT_API_TIMING_LOG_PREFIX,
+    summarize_client_api_timing,
+)
 from camcops_server.cc_modules.cc_convert import (
     decode_values,
 )
+from camcops_server.cc_modules.cc_blob import Blob
+from camcops_server.cc_modules.cc_constants import ERA_NOW
 from camcops_server.cc_modules.cc_ipuse import IpUse
+from camcops_server.cc_modules.cc_patient import Patient
 from camcops_server.cc_modules.cc_proquint import (
     uuid_from_proquint,
 )
+from camcops_server.cc_modules.cc_request import get_unittest_request
+from camcops_server.cc_modules.cc_summaryelement import SummaryElement
+from camcops_server.cc_modules.cc_taskindex import (
+    TaskIndexEntry,
+    TaskSummaryEntry,
+)
 from camcops_server.cc_modules.cc_taskindex import update_indexes_and_push_exports  # noqa
 from camcops_server.cc_modules.cc_testhelpers import class_attribute_names
 from camcops_server.cc_modules.cc_unittest import DemoDatabaseTestCase
 from camcops_server.cc_modules.cc_user import User
 from camcops_server.cc_modules.cc_version import (
+    CAMCOPS_SERVER_VERSION,
     MINIMUM_TABLET_VERSION,
 )
 from camcops_server.cc_modules.cc_validators import (
@@ -648,3 +668,435 @@ class GetTaskSchedulesTests(DemoDatabaseTestCase):
         # GMCPQ
         gmcpq_sched = schedule_items[3]
         self.assertTrue(gmcpq_sched[TabletParam.ANONYMOUS])
+
+
+class UploadTableTests(DemoDatabaseTestCase):
+    """
+    Tests (and simple benchmarks) for table upload, recordwise and one-step.
+    """
+    BLOB_FIELDS = ["id", "when_last_modified", "_move_off_tablet",
+                   "tablename", "tablepk", "fieldname"]
+
+    def create_tasks(self) -> None:
+        # Speed things up a bit
+        pass
+
+    def call_api(self, d: Dict[str, str], body: bytes = None,
+                 expect_success: bool = True) -> Dict[str, str]:
+        # Each tablet call is a separate HTTP request. If a body is given, the
+        # parameters go in the URL instead.
+        req = get_unittest_request(self.dbsession)
+        req._debugging_user = self.user
+        d.update({
+            TabletParam.CAMCOPS_VERSION: str(CAMCOPS_SERVER_VERSION),
+            TabletParam.DEVICE: self.other_device.name,
+        })
+        if body is None:
+            req.fake_request_post_from_dict(d)
+        else:
+            req.add_get_params(d, set_method_get=False)
+            req.content_type = "application/octet-stream"
+            req.set_post_body(body)
+        reply_dict = get_reply_dict_from_response(client_api(req))
+        self.assertEqual(reply_dict[TabletParam.SUCCESS],
+                         SUCCESS_CODE if expect_success else FAILURE_CODE,
+                         msg=reply_dict)
+        return reply_dict
+
+    def blob_rows(self, when_last_modified: Dict[int, str],
+                  move_off_tablet: bool = False) -> List[Dict[str, str]]:
+        return [
+            {
+                "id": str(client_pk),
+                "when_last_modified": f"'{when}'",
+                "_move_off_tablet": str(int(move_off_tablet)),
+                "tablename": "'photo'",
+                "tablepk": str(client_pk),
+                "fieldname": "'photo_blobid'",
+            }
+            for client_pk, when in when_last_modified.items()
+        ]
+
+    def upload_blob_table(self, n: int) -> int:
+        """
+        Uploads ``n`` BLOB placeholder records and commits them. Returns the
+        number of SQL statements executed by the ``upload_table`` call.
+        """
+        d = {
+            TabletParam.OPERATION: Operations.UPLOAD_TABLE,
+            TabletParam.TABLE: Blob.__tablename__,
+            TabletParam.PKNAME: "id",
+            TabletParam.FIELDS: ",".join(self.BLOB_FIELDS),
+            TabletParam.NRECORDS: str(n),
+        }
+        for i in range(n):
+            d[f"{TabletParam.RECORD_PREFIX}{i}"] = (
+                f"{i + 1},'2020-07-31T12:00:00.000+01:00',0,"
+                f"'photo',{i + 1},'photo_blobid'"
+            )
+        self.call_api({TabletParam.OPERATION: Operations.START_UPLOAD})
+        statements = []  # type: List[str]
+
+        # noinspection PyUnusedLocal
+        def count_statement(conn, cursor, statement, *args) -> None:
+            statements.append(statement)
+
+        listen(self.engine, "before_cursor_execute", count_statement)
+        try:
+            self.call_api(d)
+        finally:
+            remove(self.engine, "before_cursor_execute", count_statement)
+        self.call_api({TabletParam.OPERATION: Operations.END_UPLOAD})
+        return len(statements)
+
+    def upload_entire_database_blobs(
+            self, when_last_modified: Dict[int, str],
+            move_off_tablet: bool = False) -> int:
+        """
+        One-step upload of a database containing only BLOB placeholder
+        records, with the specified client PKs and modification times.
+        Returns the number of SQL statements executed.
+        """
+        rows = self.blob_rows(when_last_modified,
+                              move_off_tablet=move_off_tablet)
+        statements = []  # type: List[str]
+
+        # noinspection PyUnusedLocal
+        def count_statement(conn, cursor, statement, *args) -> None:
+            statements.append(statement)
+
+        listen(self.engine, "before_cursor_execute", count_statement)
+        try:
+            self.call_api({
+                TabletParam.OPERATION: Operations.UPLOAD_ENTIRE_DATABASE,
+                TabletParam.FINALIZING: "0",
+                TabletParam.PKNAMEINFO: json.dumps({Blob.__tablename__: "id"}),
+                TabletParam.DBDATA: json.dumps({Blob.__tablename__: rows}),
+            })
+        finally:
+            remove(self.engine, "before_cursor_execute", count_statement)
+        return len(statements)
+
+    def current_blob_pks(self) -> List[int]:
+        # noinspection PyProtectedMember
+        return [
+            pk for pk, in (
+                self.dbsession.query(Blob._pk)
+                .filter(Blob._device_id == self.other_device.id)
+                .filter(Blob._current == True)  # noqa: E712
+            )
+        ]
+
+    def test_identical_reupload_adds_nothing(self) -> None:
+        self.upload_blob_table(10)
+        first_pks = self.current_blob_pks()
+        self.assertEqual(len(first_pks), 10)
+
+        self.upload_blob_table(10)
+        self.assertEqual(sorted(self.current_blob_pks()), sorted(first_pks))
+
+        self.upload_blob_table(15)
+        pks = self.current_blob_pks()
+        self.assertEqual(len(pks), 15)
+        self.assertTrue(set(first_pks).issubset(pks))
+
+    def test_identical_reupload_statement_count_is_constant(self) -> None:
+        # Re-uploading identical records matches each incoming record against
+        # the server's existing records, which are fetched once for the whole
+        # table; no record should need its own SQL statement.
+        n_small = 20
+        n_large = 4 * n_small
+        self.upload_blob_table(n_small)
+        statements_small = self.upload_blob_table(n_small)
+        self.upload_blob_table(n_large)
+        statements_large = self.upload_blob_table(n_large)
+        self.assertEqual(statements_large, statements_small)
+
+    def test_onestep_upload_preserves_history(self) -> None:
+        t1 = "2020-07-31T12:00:00.000+01:00"
+        t2 = "2020-08-01T12:00:00.000+01:00"
+        self.upload_entire_database_blobs({1: t1, 2: t1, 3: t1})
+        first_pks = self.current_blob_pks()
+        self.assertEqual(len(first_pks), 3)
+
+        # Record 1 identical, record 2 modified, record 3 deleted, record 4
+        # new.
+        self.upload_entire_database_blobs({1: t1, 2: t2, 4: t2})
+
+        blobs = {
+            (b.id, b._current): b
+            for b in (
+                self.dbsession.query(Blob)
+                .filter(Blob._device_id == self.other_device.id)
+            )
+        }
+        self.assertEqual(len(blobs), 5)
+        self.assertIn(blobs[(1, True)]._pk, first_pks)
+
+        old_2 = blobs[(2, False)]
+        new_2 = blobs[(2, True)]
+        self.assertEqual(old_2._successor_pk, new_2._pk)
+        self.assertEqual(new_2._predecessor_pk, old_2._pk)
+        self.assertIsNotNone(old_2._when_removed_exact)
+
+        deleted_3 = blobs[(3, False)]
+        self.assertIsNone(deleted_3._successor_pk)
+        self.assertIsNotNone(deleted_3._when_removed_exact)
+
+        new_4 = blobs[(4, True)]
+        self.assertIsNone(new_4._predecessor_pk)
+        self.assertNotIn(new_4._pk, first_pks)
+
+    def test_onestep_preservation_statement_count_is_constant(self) -> None:
+        # Records marked for preservation are flagged (with their
+        # predecessors) together, not one at a time.
+        t1 = "2020-07-31T12:00:00.000+01:00"
+        t2 = "2020-08-01T12:00:00.000+01:00"
+        statement_counts = []  # type: List[int]
+        for n in (5, 20):
+            client_pks = range(1, n + 1)
+            self.upload_entire_database_blobs({pk: t1 for pk in client_pks})
+            statement_counts.append(self.upload_entire_database_blobs(
+                {pk: t2 for pk in client_pks}, move_off_tablet=True))
+        self.assertEqual(statement_counts[0], statement_counts[1])
+
+    def test_onestep_preservation_includes_predecessors(self) -> None:
+        t1 = "2020-07-31T12:00:00.000+01:00"
+        t2 = "2020-08-01T12:00:00.000+01:00"
+        self.upload_entire_database_blobs({1: t1, 2: t1, 3: t1})
+        self.upload_entire_database_blobs({1: t2, 2: t1, 3: t1})
+        # All to be preserved, including record 1's predecessor:
+        self.upload_entire_database_blobs({1: t2, 2: t1, 3: t1},
+                                          move_off_tablet=True)
+        # noinspection PyProtectedMember
+        preserved = sorted(
+            (b.id, b._current) for b in (
+                self.dbsession.query(Blob)
+                .filter(Blob._device_id == self.other_device.id)
+                .filter(Blob._era != ERA_NOW)
+            )
+        )
+        self.assertEqual(preserved,
+                         [(1, False), (1, True), (2, True), (3, True)])
+
+    def test_which_keys_to_send(self) -> None:
+        t1 = "2020-07-31T12:00:00.000+01:00"
+        t2 = "2020-08-01T12:00:00.000+01:00"
+        self.upload_entire_database_blobs({1: t1, 2: t1, 3: t1})
+        # Give record 1 a predecessor:
+        self.upload_entire_database_blobs({1: t2, 2: t1, 3: t1})
+
+        # Record 1 unchanged but being moved off the tablet, record 2
+        # unchanged, record 3 modified, record 4 new.
+        client_info = [(1, t2, 1), (2, t1, 0), (3, t2, 0), (4, t1, 0)]
+        self.call_api({TabletParam.OPERATION: Operations.START_UPLOAD})
+        reply = self.call_api({
+            TabletParam.OPERATION: Operations.WHICH_KEYS_TO_SEND,
+            TabletParam.TABLE: Blob.__tablename__,
+            TabletParam.PKNAME: "id",
+            TabletParam.PKVALUES: ",".join(
+                str(pk) for pk, _, _ in client_info),
+            TabletParam.DATEVALUES: ",".join(
+                f"'{when}'" for _, when, _ in client_info),
+            TabletParam.MOVE_OFF_TABLET_VALUES: ",".join(
+                str(motv) for _, _, motv in client_info),
+        })
+        self.assertEqual(reply[TabletParam.RESULT], "3,4")
+
+        # noinspection PyProtectedMember
+        preserved = sorted(
+            (b.id, b._current)
+            for b in (
+                self.dbsession.query(Blob)
+                .filter(Blob._device_id == self.other_device.id)
+                .filter(Blob._move_off_tablet == True)  # noqa: E712
+            )
+        )
+        self.assertEqual(preserved, [(1, False), (1, True)])
+
+    def test_which_keys_to_send_preserves_in_chunks(self) -> None:
+        t1 = "2020-07-31T12:00:00.000+01:00"
+        t2 = "2020-08-01T12:00:00.000+01:00"
+        client_pks = list(range(1, 6))
+        self.upload_entire_database_blobs({pk: t1 for pk in client_pks})
+        # Give every record a predecessor:
+        self.upload_entire_database_blobs({pk: t2 for pk in client_pks})
+
+        # All unchanged, but being moved off the tablet. Use small chunks,
+        # so both the predecessor search and the UPDATE need several:
+        self.call_api({TabletParam.OPERATION: Operations.START_UPLOAD})
+        with mock.patch("camcops_server.cc_modules.client_api."
+                        "MAX_PKS_PER_IN_CLAUSE", 2):
+            reply = self.call_api({
+                TabletParam.OPERATION: Operations.WHICH_KEYS_TO_SEND,
+                TabletParam.TABLE: Blob.__tablename__,
+                TabletParam.PKNAME: "id",
+                TabletParam.PKVALUES: ",".join(str(pk) for pk in client_pks),
+                TabletParam.DATEVALUES: ",".join(
+                    f"'{t2}'" for _ in client_pks),
+                TabletParam.MOVE_OFF_TABLET_VALUES: ",".join(
+                    "1" for _ in client_pks),
+            })
+        self.assertEqual(reply[TabletParam.RESULT], "")
+
+        # noinspection PyProtectedMember
+        preserved = sorted(
+            (b.id, b._current)
+            for b in (
+                self.dbsession.query(Blob)
+                .filter(Blob._device_id == self.other_device.id)
+                .filter(Blob._move_off_tablet == True)  # noqa: E712
+            )
+        )
+        self.assertEqual(preserved, [
+            (pk, current) for pk in client_pks for current in (False, True)
+        ])
+
+    def test_client_api_timing(self) -> None:
+        t1 = "2020-07-31T12:00:00.000+01:00"
+        with mock.patch.object(self.req.config, "client_api_timing", True):
+            with self.assertLogs(
+                    "camcops_server.cc_modules.cc_client_api_timing",
+                    level=logging.INFO) as logcm:
+                self.upload_entire_database_blobs({1: t1, 2: t1})
+        self.assertEqual(len(logcm.records), 1)
+        message = logcm.records[0].getMessage()
+        self.assertTrue(message.startswith(CLIENT_API_TIMING_LOG_PREFIX))
+        timing = json.loads(message[len(CLIENT_API_TIMING_LOG_PREFIX):])
+        self.assertEqual(timing["operation"],
+                         Operations.UPLOAD_ENTIRE_DATABASE)
+        self.assertTrue(timing["success"])
+        self.assertGreater(timing["sql_statements"], 0)
+        blob_timing = timing["tables"][Blob.__tablename__]
+        self.assertGreaterEqual(blob_timing["sql_rows"], 2)
+        self.assertLessEqual(blob_timing["wall_s"], timing["wall_s"])
+
+        summary = summarize_client_api_timing(["junk", message])
+        self.assertIn(Operations.UPLOAD_ENTIRE_DATABASE, summary)
+        self.assertIn(Blob.__tablename__, summary)
+
+    def upload_entire_database_gmcpq(self) -> List[int]:
+        """
+        One-step upload of a database containing one (anonymous) GMC-PQ task.
+        Returns the server PKs of the current GMC-PQ tasks for our device.
+        """
+        from camcops_server.tasks.gmcpq import GMCPQ
+        t1 = "'2020-07-31T12:00:00.000+01:00'"
+        rows = [{
+            "id": "1",
+            "when_created": t1,
+            "when_last_modified": t1,
+            "_move_off_tablet": "0",
+            "q1": "1",
+        }]
+        self.call_api({
+            TabletParam.OPERATION: Operations.UPLOAD_ENTIRE_DATABASE,
+            TabletParam.FINALIZING: "0",
+            TabletParam.PKNAMEINFO: json.dumps({GMCPQ.__tablename__: "id"}),
+            TabletParam.DBDATA: json.dumps({GMCPQ.__tablename__: rows}),
+        })
+        # noinspection PyProtectedMember
+        return [
+            pk for pk, in (
+                self.dbsession.query(GMCPQ._pk)
+                .filter(GMCPQ._device_id == self.other_device.id)
+                .filter(GMCPQ._current == True)  # noqa: E712
+            )
+        ]
+
+    def get_summary_entries(self, task_pks: List[int]) \
+            -> List[TaskSummaryEntry]:
+        return (
+            self.dbsession.query(TaskSummaryEntry)
+            .filter(TaskSummaryEntry.task_table_name == "gmcpq")
+            .filter(TaskSummaryEntry.task_pk.in_(task_pks))
+            .all()
+        )
+
+    def test_upload_stores_task_summaries(self) -> None:
+        from camcops_server.tasks.gmcpq import GMCPQ
+        summaries = [SummaryElement(name="total", coltype=Integer(), value=3)]
+        with mock.patch.object(self.req.config, "store_task_summaries", True):
+            with mock.patch.object(GMCPQ, "get_summaries",
+                                   return_value=summaries):
+                task_pks = self.upload_entire_database_gmcpq()
+        self.assertEqual(len(task_pks), 1)
+        entries = self.get_summary_entries(task_pks)
+        self.assertEqual(len(entries), 1)
+        self.assertEqual(json.loads(entries[0].summaries_json),
+                         [["total", 3]])
+
+    def test_upload_succeeds_if_task_summaries_fail(self) -> None:
+        from camcops_server.tasks.gmcpq import GMCPQ
+        with mock.patch.object(self.req.config, "store_task_summaries", True):
+            with mock.patch.object(GMCPQ, "get_summaries",
+                                   side_effect=RuntimeError("Bug")):
+                task_pks = self.upload_entire_database_gmcpq()
+        self.assertEqual(len(task_pks), 1)
+        self.assertEqual(self.get_summary_entries(task_pks), [])
+        # The task is still indexed:
+        self.assertEqual(
+            self.dbsession.query(TaskIndexEntry)
+            .filter(TaskIndexEntry.task_table_name == "gmcpq")
+            .filter(TaskIndexEntry.task_pk.in_(task_pks))
+            .count(),
+            1
+        )
+
+    def test_streamed_onestep_upload(self) -> None:
+        t1 = "2020-07-31T12:00:00.000+01:00"
+        frame = {
+            TabletParam.TABLE: Blob.__tablename__,
+            TabletParam.PKNAME: "id",
+            TabletParam.ROWS: self.blob_rows({1: t1, 2: t1, 3: t1}),
+        }
+        body = gzip.compress((json.dumps(frame) + "\n").encode("utf-8"))
+        self.call_api({
+            TabletParam.OPERATION: Operations.UPLOAD_ENTIRE_DATABASE,
+            TabletParam.FINALIZING: "0",
+            TabletParam.DBDATA_STREAM: "gzip",
+        }, body=body)
+        self.assertEqual(len(self.current_blob_pks()), 3)
+
+    def test_streamed_onestep_upload_rejects_oversized_data(self) -> None:
+        t1 = "2020-07-31T12:00:00.000+01:00"
+        frame = {
+            TabletParam.TABLE: Blob.__tablename__,
+            TabletParam.PKNAME: "id",
+            TabletParam.ROWS: self.blob_rows({1: t1}),
+        }
+        # Highly compressible: about 2 MB of whitespace compresses to a few
+        # kilobytes.
+        data = (json.dumps(frame) + "\n" + " " * (2 * 1024 * 1024))
+        body = gzip.compress(data.encode("utf-8"))
+        self.assertLess(len(body), 1024 * 1024)
+        with mock.patch.object(self.req.config,
+                               "client_api_max_upload_size_mb", 1):
+            reply_dict = self.call_api({
+                TabletParam.OPERATION: Operations.UPLOAD_ENTIRE_DATABASE,
+                TabletParam.FINALIZING: "0",
+                TabletParam.DBDATA_STREAM: "gzip",
+            }, body=body, expect_success=False)
+        self.assertIn("exceeds the maximum upload size",
+                      reply_dict[TabletParam.ERROR])
+        self.assertEqual(self.current_blob_pks(), [])
+
+    def test_streamed_onestep_upload_rejects_bad_order(self) -> None:
+        frames = [
+            {
+                TabletParam.TABLE: Blob.__tablename__,
+                TabletParam.PKNAME: "id",
+                TabletParam.ROWS: [],
+            },
+            {
+                TabletParam.TABLE: Patient.__tablename__,
+                TabletParam.PKNAME: "id",
+                TabletParam.ROWS: [],
+            },
+        ]
+        body = "\n".join(json.dumps(f) for f in frames).encode("utf-8")
+        self.call_api({
+            TabletParam.OPERATION: Operations.UPLOAD_ENTIRE_DATABASE,
+            TabletParam.FINALIZING: "0",
+            TabletParam.DBDATA_STREAM: "none",
+        }, body=body, expect_success=False)
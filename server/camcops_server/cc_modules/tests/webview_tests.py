@@ -31,6 +31,7 @@ import json
 from typing import cast
 import unittest
 from unittest import mock
+from urllib.parse import parse_qs, urlparse
 
 from pendulum import local
 from pyramid.httpexceptions import HTTPBadRequest, HTTPFound
@@ -46,7 +47,11 @@ from camcops_server.cc_modules.cc_pyramid import (
     ViewArg,
     ViewParam,
 )
-from camcops_server.cc_modules.cc_taskindex import PatientIdNumIndexEntry
+from camcops_server.cc_modules.cc_taskindex import (
+    PatientIdNumIndexEntry,
+    TaskIndexEntry,
+    TaskSummaryEntry,
+)
 from camcops_server.cc_modules.cc_taskschedule import (
     PatientTaskSchedule,
     TaskSchedule,
@@ -78,6 +83,7 @@ from camcops_server.cc_modules.webview import (
     edit_group,
     edit_finalized_patient,
     edit_server_created_patient,
+    view_tasks,
 )
 
 
@@ -122,6 +128,56 @@ class WebviewTests(DemoDatabaseTestCase):
                 self.fail(f"Operations.{x} fails validate_alphanum_underscore")
 
 
+class ViewTasksTests(DemoDatabaseTestCase):
+    """
+    Unit tests.
+    """
+    def create_tasks(self) -> None:
+        from camcops_server.tasks.bmi import Bmi
+
+        patient = self.create_patient_with_one_idnum()
+        for task_id in range(1, 8):
+            task = Bmi()
+            task.id = task_id
+            self.apply_standard_task_fields(task)
+            task.patient_id = patient.id
+            self.dbsession.add(task)
+        self.dbsession.commit()
+        TaskIndexEntry.rebuild_index_for_task_type(
+            self.dbsession, Bmi, indexed_at_utc=self.era_time_utc,
+            delete_first=False)
+        self.dbsession.commit()
+
+    def get_task_pks(self, params: dict) -> list:
+        self.req.set_get_params(params)
+        page = view_tasks(self.req)["page"]
+        self.assertEqual(page.item_count, 7)
+        return [item.task_pk for item in page]
+
+    def test_keyset_pages_match_numbered_pages(self) -> None:
+        self.announce("test_keyset_pages_match_numbered_pages")
+        rows = {ViewParam.ROWS_PER_PAGE: "3"}
+        numbered = [
+            self.get_task_pks(dict(rows, **{ViewParam.PAGE: str(n)}))
+            for n in (1, 2, 3)
+        ]
+        self.assertEqual(sum(len(pks) for pks in numbered), 7)
+
+        # Step forwards, then back, using the pager's own links.
+        self.req.set_get_params(dict(rows, **{ViewParam.PAGE: "1"}))
+        page = view_tasks(self.req)["page"]
+        for n, direction in ((2, +1), (3, +1), (2, -1), (1, -1)):
+            url = page.url_maker(page.page + direction)
+            params = {k: v[0]
+                      for k, v in parse_qs(urlparse(url).query).items()}
+            keyset_param = (ViewParam.PAGE_AFTER if direction > 0
+                            else ViewParam.PAGE_BEFORE)
+            self.assertIn(keyset_param, params)
+            self.req.set_get_params(params)
+            page = view_tasks(self.req)["page"]
+            self.assertEqual([item.task_pk for item in page], numbered[n - 1])
+
+
 class AddTaskScheduleViewTests(DemoDatabaseTestCase):
     """
     Unit tests.
@@ -1101,6 +1157,61 @@ class EditFinalizedPatientViewTests(DemoDatabaseTestCase):
         self.assertEqual(changes["idnum2 (RiO number)"],
                          (None, 456))
 
+    def test_patient_and_tasks_reindexed(self) -> None:
+        from camcops_server.tasks.phq9 import Phq9
+        patient = self.create_patient(id=1)
+        idnum = self.create_patient_idnum(
+            patient_id=patient.id,
+            which_idnum=self.nhs_iddef.which_idnum,
+            idnum_value=TEST_NHS_NUMBER_1
+        )
+        PatientIdNumIndexEntry.index_idnum(idnum, self.dbsession)
+        task = Phq9()
+        task.id = 1
+        self.apply_standard_task_fields(task)
+        task.patient_id = patient.id
+        self.dbsession.add(task)
+        self.dbsession.commit()
+        TaskIndexEntry.index_task(task, self.dbsession, self.era_time_utc)
+        TaskSummaryEntry.store_summaries_for_tasks(
+            self.req, [task], self.era_time_utc)
+        # noinspection PyUnresolvedReferences
+        self.dbsession.execute(
+            TaskSummaryEntry.__table__.update()
+            .values(summaries_json="[]")
+        )
+
+        view = EditFinalizedPatientView(self.req)
+        view.object = patient
+        appstruct = {
+            ViewParam.ID_REFERENCES: [
+                {
+                    ViewParam.WHICH_IDNUM: self.nhs_iddef.which_idnum,
+                    ViewParam.IDNUM_VALUE: TEST_NHS_NUMBER_2,
+                },
+            ]
+        }
+        with mock.patch.object(self.req.config, "store_task_summaries",
+                               True):
+            view.save_object(appstruct)
+
+        idnum_index = self.dbsession.query(PatientIdNumIndexEntry).filter(
+            PatientIdNumIndexEntry.patient_pk == patient.pk
+        ).all()
+        self.assertEqual([e.idnum_value for e in idnum_index],
+                         [TEST_NHS_NUMBER_2])
+        self.assertEqual(
+            self.dbsession.query(TaskIndexEntry)
+            .filter(TaskIndexEntry.task_table_name == task.tablename)
+            .filter(TaskIndexEntry.task_pk == task.pk)
+            .count(),
+            1
+        )
+        stored = TaskSummaryEntry.get_stored_summaries(
+            self.dbsession, task.tablename, [task.pk],
+            language=self.req.language)
+        self.assertEqual(stored[task.pk], task.get_summary_values(self.req))
+
 
 class EditServerCreatedPatientViewTests(DemoDatabaseTestCase):
     """
@@ -129,6 +129,7 @@ from typing import (
     Any,
     cast,
     Dict,
+    Iterable,
     List,
     Optional,
     Type,
@@ -142,7 +143,6 @@ from cardinal_pythonlib.logs import BraceStyleAdapter
 from cardinal_pythonlib.pyramid.responses import (
     BinaryResponse,
     PdfResponse,
-    XmlResponse,
 )
 from cardinal_pythonlib.sqlalchemy.dialect import (
     get_dialect_name,
@@ -168,7 +168,7 @@ import pygments.lexers
 import pygments.lexers.sql
 import pygments.lexers.web
 import pygments.formatters
-from sqlalchemy.orm import joinedload, Query
+from sqlalchemy.orm import joinedload, Query, selectinload
 from sqlalchemy.sql.functions import func
 from sqlalchemy.sql.expression import desc, or_, select, update
 
@@ -273,6 +273,7 @@ from camcops_server.cc_modules.cc_pyramid import (
     PageUrl,
     Permission,
     Routes,
+    SqlalchemyOrmKeysetPage,
     SqlalchemyOrmPage,
     ViewArg,
     ViewParam,
@@ -300,6 +301,8 @@ from camcops_server.cc_modules.cc_taskfilter import (
 from camcops_server.cc_modules.cc_taskindex import (
     PatientIdNumIndexEntry,
     TaskIndexEntry,
+    reindex_patient,
+    TaskSummaryEntry,
     update_indexes_and_push_exports
 )
 from camcops_server.cc_modules.cc_taskschedule import (
@@ -322,6 +325,7 @@ from camcops_server.cc_modules.cc_validators import (
     validate_username,
 )
 from camcops_server.cc_modules.cc_version import CAMCOPS_SERVER_VERSION
+from camcops_server.cc_modules.cc_xml import gen_encoded_chunks
 from camcops_server.cc_modules.cc_view_classes import (
     CreateView,
     DeleteView,
@@ -384,6 +388,29 @@ def errormsg_task_live(req: "CamcopsRequest") -> str:
     return _("Task is live on tablet; finalize (or force-finalize) first.")
 
 
+# =============================================================================
+# Responses
+# =============================================================================
+
+def xml_streaming_response(xml_chunks: Iterable[str]) -> Response:
+    """
+    Returns an XML response whose body is sent as it is generated, rather
+    than being assembled into one large string first.
+
+    The chunks are generated after the view has returned (and the database
+    session has closed), so they must not require database access; see e.g.
+    :meth:`camcops_server.cc_modules.cc_task.Task.gen_xml`.
+
+    Args:
+        xml_chunks: chunks of an XML document
+    """
+    return Response(
+        content_type=MimeType.XML,
+        charset="utf-8",
+        app_iter=gen_encoded_chunks(xml_chunks, encoding="utf-8"),
+    )
+
+
 # =============================================================================
 # Unused
 # =============================================================================
@@ -1059,11 +1086,11 @@ def view_tasks(req: "CamcopsRequest") -> Dict[str, Any]:
     rendered_refresh_form = refresh_form.render()
 
     # Get tasks, unless there have been form errors.
-    # In principle, for some filter settings (single task, no "complete"
-    # preference...) we could produce an ORM query and use SqlalchemyOrmPage,
-    # which would apply LIMIT/OFFSET (or equivalent) to the query, and be
-    # very nippy. In practice, this is probably an unusual setting, so we'll
-    # simplify things here with a Python list regardless of the settings.
+    # Usually (via the index, and without a text filter) we get a query on
+    # TaskIndexEntry, which we paginate in the database using keyset
+    # pagination: we fetch only the index entries for this page (plus a
+    # count), and the template displays index entries directly, so no Task
+    # objects need be loaded at all. Otherwise, we get a Python list.
     if errors:
         collection = []
     else:
@@ -1073,12 +1100,26 @@ def view_tasks(req: "CamcopsRequest") -> Dict[str, Any]:
             sort_method_global=TaskSortMethod.CREATION_DATE_DESC,
             via_index=via_index
         ).all_tasks_or_indexes_or_query or []
-    paginator = SqlalchemyOrmPage if isinstance(collection, Query) else CamcopsPage  # noqa
-    page = paginator(collection,
-                     page=page_num,
-                     items_per_page=rows_per_page,
-                     url_maker=PageUrl(req),
-                     request=req)
+    if isinstance(collection, Query):
+        # noinspection PyProtectedMember
+        page = SqlalchemyOrmKeysetPage(
+            query=collection.options(
+                selectinload(TaskIndexEntry.patient),
+                selectinload(TaskIndexEntry._adding_user),
+            ),
+            request=req,
+            sort_column=TaskIndexEntry.when_created_utc,
+            pk_column=TaskIndexEntry.index_entry_pk,
+            descending=True,
+            page=page_num,
+            items_per_page=rows_per_page,
+        )
+    else:
+        page = CamcopsPage(collection,
+                           page=page_num,
+                           items_per_page=rows_per_page,
+                           url_maker=PageUrl(req),
+                           request=req)
     return dict(
         page=page,
         head_form_html=get_head_form_html(req, [tpp_form,
@@ -1144,7 +1185,7 @@ def serve_task(req: "CamcopsRequest") -> Response:
                 ViewParam.INCLUDE_SNOMED, True),
             xml_with_header_comments=True,
         )
-        return XmlResponse(task.get_xml(req=req, options=options))
+        return xml_streaming_response(task.gen_xml(req=req, options=options))
     else:
         permissible = [ViewArg.HTML, ViewArg.PDF, ViewArg.PDFHTML, ViewArg.XML]
         raise HTTPBadRequest(
@@ -1293,8 +1334,8 @@ def serve_tracker_or_ctv(req: "CamcopsRequest",
         )
     elif viewtype == ViewArg.XML:
         include_comments = req.get_bool_param(ViewParam.INCLUDE_COMMENTS, True)
-        return XmlResponse(
-            tracker.get_xml(include_comments=include_comments)
+        return xml_streaming_response(
+            tracker.gen_xml(include_comments=include_comments)
         )
     else:
         permissible = [ViewArg.HTML, ViewArg.PDF, ViewArg.PDFHTML, ViewArg.XML]
@@ -3257,6 +3298,8 @@ class EraseTaskLeavingPlaceholderView(EraseTaskBaseView):
     def delete(self) -> None:
         task = cast(Task, self.object)
 
+        TaskSummaryEntry.delete_summaries_for_task(task,
+                                                   self.request.dbsession)
         task.manually_erase(self.request)
 
     def get_success_url(self) -> str:
@@ -3280,6 +3323,8 @@ class EraseTaskEntirelyView(EraseTaskBaseView):
         task = cast(Task, self.object)
 
         TaskIndexEntry.unindex_task(task, self.request.dbsession)
+        TaskSummaryEntry.delete_summaries_for_task(task,
+                                                   self.request.dbsession)
         task.delete_entirely(self.request)
 
         _ = self.request.gettext
@@ -3405,6 +3450,7 @@ def delete_patient(req: "CamcopsRequest") -> Response:
             # -----------------------------------------------------------------
             for task in tasks:
                 TaskIndexEntry.unindex_task(task, req.dbsession)
+                TaskSummaryEntry.delete_summaries_for_task(task, req.dbsession)
                 task.delete_entirely(req)
             # Then patients:
             for p in patient_lineage_instances:
@@ -3672,8 +3718,11 @@ class EditPatientBaseView(PatientMixin, UpdateView):
         patient.apply_special_note(self.request, change_msg,
                                    "Patient edited")
 
-        # Patient details changed, so resend any tasks via HL7
-        for task in self.get_affected_tasks():
+        # Patient details changed, so re-index the patient and their tasks,
+        # and resend any tasks via HL7
+        tasks = self.get_affected_tasks()
+        reindex_patient(self.request, patient, tasks)
+        for task in tasks:
             task.cancel_from_export_log(self.request)
 
         # Done
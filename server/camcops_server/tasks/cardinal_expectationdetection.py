@@ -65,7 +65,11 @@ from camcops_server.cc_modules.cc_summaryelement import (
     ExtraSummaryTable,
     SummaryElement,
 )
-from camcops_server.cc_modules.cc_task import Task, TaskHasPatientMixin
+from camcops_server.cc_modules.cc_task import (
+    memoize_task_result,
+    Task,
+    TaskHasPatientMixin,
+)
 
 log = BraceStyleAdapter(logging.getLogger(__name__))
 
@@ -1342,38 +1346,47 @@ class CardinalExpectationDetection(TaskHasPatientMixin, Task):
                    comment="AUDITORY d'"),
         ]
 
+    @memoize_task_result
+    def get_overall_p_detected(self) -> \
+            Tuple[Optional[float], Optional[float],
+                  Optional[float], Optional[float],
+                  int]:
+        """
+        :meth:`get_p_detected` across all trials; memoized, since the summary
+        values below all use it. (The trials are therefore treated as
+        immutable for the lifetime of this task instance; see
+        :func:`camcops_server.cc_modules.cc_task.memoize_task_result`.)
+        """
+        return self.get_p_detected(self.trials, None, None)
+
     def get_overall_p_detect_present(self) -> Optional[float]:
-        trialarray = self.trials
         (p_detected_given_present,
          p_detected_given_absent,
          c,
          dprime,
-         n_trials) = self.get_p_detected(trialarray, None, None)
+         n_trials) = self.get_overall_p_detected()
         return p_detected_given_present
 
     def get_overall_p_detect_absent(self) -> Optional[float]:
-        trialarray = self.trials
         (p_detected_given_present,
          p_detected_given_absent,
          c,
          dprime,
-         n_trials) = self.get_p_detected(trialarray, None, None)
+         n_trials) = self.get_overall_p_detected()
         return p_detected_given_absent
 
     def get_overall_c(self) -> Optional[float]:
-        trialarray = self.trials
         (p_detected_given_present,
          p_detected_given_absent,
          c,
          dprime,
-         n_trials) = self.get_p_detected(trialarray, None, None)
+         n_trials) = self.get_overall_p_detected()
         return c
 
     def get_overall_d(self) -> Optional[float]:
-        trialarray = self.trials
         (p_detected_given_present,
          p_detected_given_absent,
          c,
          dprime,
-         n_trials) = self.get_p_detected(trialarray, None, None)
+         n_trials) = self.get_overall_p_detected()
         return dprime
@@ -63,6 +63,7 @@ from camcops_server.cc_modules.cc_sqla_coltypes import (
 )
 from camcops_server.cc_modules.cc_summaryelement import SummaryElement
 from camcops_server.cc_modules.cc_task import (
+    memoize_task_result,
     Task,
     TaskHasPatientMixin,
 )
@@ -4027,7 +4028,11 @@ class Cisr(TaskHasPatientMixin, Task):
 
         return int_to_enum(next_q)
 
+    @memoize_task_result
     def get_result(self, record_decisions: bool = False) -> CisrResult:
+        # Memoized: is_complete(), get_summaries() and get_clinical_text() all
+        # use this, so the question walk happens once per task instance.
+        # Callers must not modify the result.
         # internal_q = CQ.START_MARKER
         internal_q = CQ.APPETITE1_LOSS_PAST_MONTH  # skip the preamble etc.
         result = CisrResult(record_decisions)